@@ -1,81 +1,87 @@
-import requests
-import time
-import psutil
-
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from .external_ip import get_resolver
+from .inventory import default_interface, get_inventory
+from .sampler import TrafficSampler, get_sampler
 
 
 async def get_interfaces() -> Dict[str, Any]:
     """
-    Asynchronously retrieves a dictionary of network interfaces and their associated addresses.
+    Asynchronously retrieves the names of the network interfaces from the cached inventory.
 
-    :return: A dictionary with a single key, 'interfaces', that maps to a list of strings representing the names of 
-             network interfaces.
+    :return: A dictionary with the key 'interfaces', that maps to a list of strings representing the names of
+             network interfaces, and the key 'default', the interface used when a request does not name one.
     :rtype: dict
     """
-    return {'interfaces': list(psutil.net_if_addrs().keys())}
+    inventory = get_inventory()
+    return {'interfaces': list(inventory.interfaces), 'default': default_interface()}
 
 
 async def get_my_ip_addr() -> Dict[str, Any]:
     """
-    Asynchronously retrieves the external IP address of the machine by making a GET request to https://ident.me.
+    Asynchronously retrieves the external IP address of the machine through the shared cached resolver
+    (https://ident.me and fallbacks, see ExternalIpResolver).
 
     :return: 
         - A dictionary containing the external IP address under the key 'external_ip' if the request is successful.
-        - A dictionary containing the error message under the key 'error' if the request fails due to an exception or invalid response.
+        - A dictionary containing the error message under the key 'error' if every resolver fails.
     :rtype: dict
     """
-    try:
-        response = requests.get('https://ident.me', timeout=5)
-        response.raise_for_status()
-        return {'external_ip': response.text.strip()}
-    except (requests.exceptions.RequestException, ValueError):
-        return {'error': 'Unable to retrieve external IP address'}
+    return await get_resolver().get()
 
 
 class Traffic:
     """
     The Traffic class is designed to monitor the amount of sent and received traffic through a specified network interface.
+    The counters are read from the time series of the shared background sampler.
     """
     strg_unit_dict = {
         'B': 1, 'kB': 10**3, 'MB': 10**6,
         'GB': 10**9, 'TB': 10**12, 'PB': 10**15,
     }
-    start_time = time.time()
-    begin_time = datetime.now()
 
-    def __init__(self, interface: str = 'wlp4s0') -> None:
+    def __init__(self, interface: str = 'wlp4s0', sampler: Optional[TrafficSampler] = None) -> None:
         """
-        Initializes a new instance of the class with the specified network interface and retrieves the number of bytes sent and received through it.
+        Initializes a new instance of the class with the specified network interface.
 
         :param interface: The name of the network interface to use (default: 'wlp4s0')
         :type interface: str
+        :param sampler: The traffic sampler to read the counters from (default: the shared sampler)
+        :type sampler: TrafficSampler
 
         :return: None
         :rtype: None
         """
-        io_counters = psutil.net_io_counters()
         self.interface = interface
-        self.bytes_sent = io_counters.bytes_sent
-        self.bytes_recv = io_counters.bytes_recv
+        self.sampler = sampler or get_sampler()
 
-    async def get_traffic(self, strg_unit: str = 'B') -> Dict[str, Any]:
+    async def get_traffic(self, strg_unit: str = 'B', window: Optional[float] = None) -> Dict[str, Any]:
         """
         Asynchronously gets the amount of traffic sent and received by the network interface monitored by the current instance.
 
         :param strg_unit: A string indicating the unit of measurement to use for the traffic amount (default: 'B')
         :type strg_unit: str
+        :param window: The length of the time window in seconds, or None for the whole time since monitoring started (default: None)
+        :type window: float
 
-        :return: A dictionary containing the amount of bytes sent and received, the start time of the monitoring, and the end time of the monitoring.
+        :return: A dictionary containing the amount of bytes sent and received, the packet, error and drop counts,
+                 the byte and packet rates per second, the start time of the monitoring, and the end time of the monitoring.
         :rtype: dict
         """
-        net_io_counters = psutil.net_io_counters(pernic=True)[self.interface]
-        sent = self.bytes_sent - net_io_counters.bytes_sent
-        recv = self.bytes_recv - net_io_counters.bytes_recv
-        return {
-            'bytes_sent': round(sent / self.strg_unit_dict.get(strg_unit, 1), 1),
-            'bytes_recv': round(recv / self.strg_unit_dict.get(strg_unit, 1), 1),
-            'begin_time': self.begin_time,
-            'end_time': datetime.now()
+        delta = self.sampler.window(self.interface, window)
+        if delta is None:
+            return {'error': f'Unknown network interface: {self.interface}'}
+        unit = self.strg_unit_dict.get(strg_unit, 1)
+        seconds = delta['seconds']
+        result = {
+            'bytes_sent': round(delta['bytes_sent'] / unit, 1),
+            'bytes_recv': round(delta['bytes_recv'] / unit, 1),
         }
+        for field in ('packets_sent', 'packets_recv', 'errin', 'errout', 'dropin', 'dropout'):
+            result[field] = int(delta[field])
+        for field in ('bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv'):
+            result[f'{field}_per_s'] = round(delta[field] / seconds / (unit if field.startswith('bytes') else 1), 1) if seconds else 0.0
+        result['begin_time'] = datetime.fromtimestamp(delta['ts'])
+        result['end_time'] = datetime.fromtimestamp(delta['ts'] + seconds)
+        return result
@@ -0,0 +1,583 @@
+import heapq
+import os
+import socket
+import threading
+import time
+
+from collections import deque
+from typing import Any, Callable, Deque, Dict, FrozenSet, List, Optional, Set, Tuple, Union
+
+import psutil
+
+from collector.client import get_client
+from eth_dump.decoder import Packet
+from eth_dump.engine import CaptureEngine, get_engine
+
+from .connections import PROC_FILES, raw_address, read_sockets
+
+
+EndpointKey = Tuple[int, Optional[bytes], int]
+ConnectionKey = Tuple[int, bytes, int, bytes, int]
+
+_PROTOCOLS = {'tcp': 6, 'udp': 17}
+_WILDCARDS = (bytes(4), bytes(16))
+_V4_MAPPED = bytes(10) + b'\xff\xff'
+
+
+def _unmap(raw: bytes) -> bytes:
+    return raw[12:] if raw[:12] == _V4_MAPPED else raw
+
+
+def read_cgroup(pid: int, proc: str = '/proc') -> Optional[str]:
+    """
+    Reads the control group of a process: the unified (cgroup v2) hierarchy if it is mounted,
+    else the systemd or the first v1 hierarchy.
+
+    :param pid: The process ID
+    :type pid: int
+    :param proc: The proc filesystem mount point (default: '/proc')
+    :type proc: str
+
+    :return: The path of the control group, or None if the process cannot be inspected.
+    :rtype: str
+    """
+    try:
+        with open(os.path.join(proc, str(pid), 'cgroup')) as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return None
+    paths = {}
+    for line in lines:
+        hierarchy, controllers, path = line.split(':', 2)
+        paths.setdefault('unified' if hierarchy == '0' and not controllers else controllers, path)
+    return paths.get('unified') or paths.get('name=systemd') or next(iter(paths.values()), None)
+
+
+def _read_name(pid: int, proc: str) -> Optional[str]:
+    try:
+        with open(os.path.join(proc, str(pid), 'comm')) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def _local_addresses() -> Set[bytes]:
+    addresses = set()
+    for entries in psutil.net_if_addrs().values():
+        for entry in entries:
+            if entry.family in (socket.AF_INET, socket.AF_INET6):
+                try:
+                    addresses.add(socket.inet_pton(entry.family, entry.address.split('%')[0]))
+                except OSError:
+                    continue
+    return addresses
+
+
+class SocketOwners:
+    """
+    The SocketOwners class maps the endpoints of captured packets to the processes owning their sockets.
+    The socket tables are read at most once per `min_interval` seconds, and the inode to process index is refreshed
+    incrementally: new processes are scanned once, and known processes are rescanned only while sockets without
+    an owner remain, the processes already owning sockets first. The other processes are rescanned at most once
+    per `full_interval` seconds. Lookups read an index that refreshes replace as a whole, so they never wait for /proc.
+    """
+
+    def __init__(self, root: str = '/proc/net', proc: str = '/proc', min_interval: float = 1.0,
+                 full_interval: float = 30.0) -> None:
+        """
+        :param root: The directory holding the socket tables (default: '/proc/net')
+        :type root: str
+        :param proc: The proc filesystem mount point (default: '/proc')
+        :type proc: str
+        :param min_interval: The minimum time between two refreshes in seconds (default: 1.0)
+        :type min_interval: float
+        :param full_interval: The minimum time between two rescans of every process in seconds (default: 30.0)
+        :type full_interval: float
+
+        :return: None
+        :rtype: None
+        """
+        self.root = root
+        self.proc = proc
+        self.min_interval = min_interval
+        self.full_interval = full_interval
+        self.fds: Dict[int, FrozenSet[str]] = {}
+        self.unowned: Set[str] = set()
+        self.generation = 0
+        self.scans = 0
+        self.refreshed_at = 0.0
+        self.full_scan_at = 0.0
+        self._index: Tuple[Dict[ConnectionKey, str], Dict[EndpointKey, str], FrozenSet[bytes], Dict[str, int]] = (
+            {}, {}, frozenset(), {}
+        )
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _scan(self, pid: int) -> FrozenSet[str]:
+        self.scans += 1
+        directory = os.path.join(self.proc, str(pid), 'fd')
+        inodes = set()
+        try:
+            descriptors = os.listdir(directory)
+        except OSError:
+            return frozenset()
+        for descriptor in descriptors:
+            try:
+                target = os.readlink(os.path.join(directory, descriptor))
+            except OSError:
+                continue
+            if target.startswith('socket:['):
+                inodes.add(target[8:-1])
+        return frozenset(inodes)
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        Reads the socket tables and updates the index unless the latest refresh is recent enough.
+
+        :param force: Whether to refresh even if the latest refresh is recent (default: False)
+        :type force: bool
+
+        :return: The generation of the index, incremented by every refresh.
+        :rtype: int
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self.generation and now - self.refreshed_at < self.min_interval:
+                return self.generation
+            connected: Dict[ConnectionKey, str] = {}
+            bound: Dict[EndpointKey, str] = {}
+            local = _local_addresses()
+            inodes = set()
+            for (name, local_hex, remote_hex), (state, uid, inode) in read_sockets(self.root).items():
+                if inode == '0':
+                    continue
+                proto = _PROTOCOLS[PROC_FILES[name][0]]
+                local_raw, local_port = raw_address(local_hex)
+                remote_raw, remote_port = raw_address(remote_hex)
+                if local_raw in _WILDCARDS:
+                    local_raw = None
+                else:
+                    local_raw = _unmap(local_raw)
+                    local.add(local_raw)
+                if remote_port:
+                    connected[(proto, local_raw, local_port, _unmap(remote_raw), remote_port)] = inode
+                else:
+                    bound.setdefault((proto, local_raw, local_port), inode)
+                inodes.add(inode)
+
+            fds = self.fds
+            pids = {int(x) for x in os.listdir(self.proc) if x.isdigit()}
+            for pid in fds.keys() - pids:
+                del fds[pid]
+            known = fds.keys() & pids
+            for pid in pids - known:
+                fds[pid] = self._scan(pid)
+            owned = {inode for x in fds.values() for inode in x}
+            full = now - self.full_scan_at >= self.full_interval
+            if full:
+                self.full_scan_at = now
+                self.unowned = set()
+            missing = inodes - owned - self.unowned
+            if missing:
+                candidates = sorted(known, key=lambda x: not fds[x])
+                for pid in candidates:
+                    if not missing or not (full or fds[pid]):
+                        break
+                    fds[pid] = self._scan(pid)
+                    missing -= fds[pid]
+                self.unowned |= missing
+            self.unowned &= inodes
+
+            owners = {inode: pid for pid, x in fds.items() for inode in x if inode in inodes}
+            self._index = (connected, bound, frozenset(local), owners)
+            self.generation += 1
+            self.refreshed_at = time.monotonic()
+            return self.generation
+
+    def lookup(self, proto: int, src: bytes, sport: int, dst: bytes, dport: int) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Finds the processes owning the local ends of a packet: the connected socket matching the packet exactly,
+        else the socket bound to the address and port, else the socket bound to the port on every address.
+
+        :param proto: The IP protocol number of the packet
+        :type proto: int
+        :param src: The packed source address
+        :type src: bytes
+        :param sport: The source port
+        :type sport: int
+        :param dst: The packed destination address
+        :type dst: bytes
+        :param dport: The destination port
+        :type dport: int
+
+        :return: The IDs of the processes that sent and received the packet, None for remote or unknown ends.
+        :rtype: tuple
+        """
+        connected, bound, local, owners = self._index
+        sender = receiver = None
+        if src in local:
+            sender = connected.get((proto, src, sport, dst, dport)) or bound.get((proto, src, sport)) or bound.get((proto, None, sport))
+        if dst in local:
+            receiver = connected.get((proto, dst, dport, src, sport)) or bound.get((proto, dst, dport)) or bound.get((proto, None, dport))
+        return owners.get(sender), owners.get(receiver)
+
+    def describe(self, pid: int) -> Tuple[Optional[str], Optional[str]]:
+        """
+        :param pid: The process ID
+        :type pid: int
+
+        :return: The name and the control group of the process, None if it cannot be inspected.
+        :rtype: tuple
+        """
+        return _read_name(pid, self.proc), read_cgroup(pid, self.proc)
+
+    def start(self) -> 'SocketOwners':
+        """
+        Starts refreshing the index every `min_interval` seconds in a background thread if it is not running yet.
+
+        :return: The index itself.
+        :rtype: SocketOwners
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='socket-owners', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the background thread.
+
+        :return: None
+        :rtype: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        deadline = time.monotonic()
+        while True:
+            self.refresh(force=True)
+            deadline += self.min_interval
+            if self._stop.wait(max(0.0, deadline - time.monotonic())):
+                return
+
+
+def _totals(buckets: List[Tuple[int, Dict[Optional[int], List[int]]]], start: float) -> Dict[Optional[int], List[int]]:
+    totals: Dict[Optional[int], List[int]] = {}
+    for second, counters in reversed(buckets):
+        if second < start:
+            break
+        for pid, (sent, received, packets) in counters.items():
+            total = totals.get(pid)
+            if total is None:
+                total = totals[pid] = [0, 0, 0]
+            total[0] += sent
+            total[1] += received
+            total[2] += packets
+    return totals
+
+
+def _top(totals: Dict[Optional[int], List[int]], describe: Callable[[int], Tuple[Optional[str], Optional[str]]],
+         n: int, window: float, by: str) -> Dict[str, Any]:
+    unattributed = totals.pop(None, [0, 0, 0])
+    groups: Dict[Any, Dict[str, Any]] = {}
+    for pid, (sent, received, packets) in totals.items():
+        name, cgroup = describe(pid)
+        if by == 'cgroup':
+            group = groups.get(cgroup)
+            if group is None:
+                group = groups[cgroup] = {'cgroup': cgroup, 'pids': [], 'bytes_sent': 0, 'bytes_recv': 0, 'packets': 0}
+            group['pids'].append(pid)
+        else:
+            group = groups[pid] = {'pid': pid, 'name': name, 'cgroup': cgroup, 'bytes_sent': 0, 'bytes_recv': 0, 'packets': 0}
+        group['bytes_sent'] += sent
+        group['bytes_recv'] += received
+        group['packets'] += packets
+    top = heapq.nlargest(n, groups.values(), key=lambda x: x['bytes_sent'] + x['bytes_recv'])
+    for group in top:
+        group['bytes_sent_per_s'] = round(group['bytes_sent'] / window, 1)
+        group['bytes_recv_per_s'] = round(group['bytes_recv'] / window, 1)
+        if 'pids' in group:
+            group['pids'].sort()
+    return {
+        'window': window,
+        'by': by,
+        'top': top,
+        'unattributed': {'bytes': unattributed[0], 'packets': unattributed[2]},
+    }
+
+
+class BandwidthMeter:
+    """
+    The BandwidthMeter class attributes captured packets to the processes owning their sockets and keeps per-second
+    byte and packet counters of every process for the last `horizon` seconds, from which the rates over sliding
+    windows are computed. The owners of every connection are memoized until the socket owner index changes,
+    so most packets cost a single dictionary lookup.
+    """
+
+    def __init__(self, owners: Optional[SocketOwners] = None, horizon: int = 300, max_memo: int = 65536) -> None:
+        """
+        :param owners: The socket owner index (default: a new index reading /proc)
+        :type owners: SocketOwners
+        :param horizon: The number of seconds of counters kept, the longest window that can be queried (default: 300)
+        :type horizon: int
+        :param max_memo: The number of connections whose owners are memoized (default: 65536)
+        :type max_memo: int
+
+        :return: None
+        :rtype: None
+        """
+        self.owners = owners or SocketOwners()
+        self.horizon = horizon
+        self.max_memo = max_memo
+        self.buckets: Deque[Tuple[int, Dict[Optional[int], List[int]]]] = deque(maxlen=horizon)
+        self.processes: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self.packets = 0
+        self.engine: Optional[CaptureEngine] = None
+        self._memo: Dict[ConnectionKey, Tuple[Optional[int], Optional[int]]] = {}
+        self._generation = -1
+
+    def update(self, packet: Packet) -> None:
+        """
+        Accounts a captured packet to the process that sent it and to the process that received it.
+        Packets without a known local owner, including non-IP packets, are accounted as unattributed.
+
+        :param packet: The captured packet
+        :type packet: Packet
+
+        :return: None
+        :rtype: None
+        """
+        owners = self.owners
+        memo = self._memo
+        if owners.generation != self._generation:
+            memo.clear()
+            self._generation = owners.generation
+        proto = packet.proto
+        if proto is None:
+            pids = (None, None)
+        else:
+            key = (proto, packet.src_raw, packet.sport or 0, packet.dst_raw, packet.dport or 0)
+            pids = memo.get(key)
+            if pids is None:
+                if len(memo) >= self.max_memo:
+                    memo.clear()
+                pids = memo[key] = owners.lookup(*key)
+        second = int(packet.ts)
+        buckets = self.buckets
+        if not buckets or buckets[-1][0] < second:
+            buckets.append((second, {}))
+        counters = buckets[-1][1]
+        length = packet.length
+        sender, receiver = pids
+        if sender is None and receiver is None:
+            self._add(counters, None, 0, length)
+        else:
+            if sender is not None:
+                self._add(counters, sender, 0, length)
+            if receiver is not None:
+                self._add(counters, receiver, 1, length)
+        self.packets += 1
+
+    @staticmethod
+    def _add(counters: Dict[Optional[int], List[int]], pid: Optional[int], index: int, length: int) -> None:
+        counter = counters.get(pid)
+        if counter is None:
+            counter = counters[pid] = [0, 0, 0]
+        counter[index] += length
+        counter[2] += 1
+
+    def describe(self, pid: int) -> Tuple[Optional[str], Optional[str]]:
+        """
+        :param pid: The process ID
+        :type pid: int
+
+        :return: The name and the control group of the process, remembered while the process has counters.
+        :rtype: tuple
+        """
+        info = self.processes.get(pid)
+        if info is None:
+            info = self.processes[pid] = self.owners.describe(pid)
+        return info
+
+    def top(self, n: int = 10, window: float = 10.0, by: str = 'process', now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Computes the heaviest processes or control groups over a sliding window.
+
+        :param n: The number of processes or control groups to return (default: 10)
+        :type n: int
+        :param window: The length of the window in seconds, at most `horizon` (default: 10)
+        :type window: float
+        :param by: 'process' or 'cgroup' (default: 'process')
+        :type by: str
+        :param now: The end of the window (default: the current time)
+        :type now: float
+
+        :return: A dictionary with the window, the top list with the bytes sent and received, the packet count
+                 and the rates in bytes per second of every entry, and the unattributed traffic.
+        :rtype: dict
+        """
+        now = time.time() if now is None else now
+        window = min(window, self.horizon)
+        totals = _totals(list(self.buckets), now - window)
+        self.processes = {pid: self.processes[pid] for pid in totals if pid in self.processes}
+        return _top(totals, self.describe, n, window, by)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: A dictionary with the number of packets accounted, the generation of the socket owner index
+                 and the number of process scans it took so far.
+        :rtype: dict
+        """
+        return {'packets': self.packets, 'generation': self.owners.generation, 'scans': self.owners.scans}
+
+
+class BandwidthSummary:
+    """
+    The BandwidthSummary class is a copy of a BandwidthMeter: its per-second counters over the horizon, the names
+    and control groups of the processes they account and its statistics. It answers the queries of the meter.
+    The buckets of the meter are copied before they are scanned, and the processes the meter has not described
+    yet are read without updating the meter, so a summary can be taken in another thread while packets are accounted.
+    """
+
+    def __init__(self, meter: Optional[BandwidthMeter] = None) -> None:
+        """
+        :param meter: The bandwidth meter to summarize (default: an empty summary)
+        :type meter: BandwidthMeter
+
+        :return: None
+        :rtype: None
+        """
+        self.horizon = 300
+        self.buckets: List[Tuple[int, Dict[Optional[int], List[int]]]] = []
+        self.processes: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self.counters = {'packets': 0, 'generation': 0, 'scans': 0}
+        if meter is None:
+            return
+        self.horizon = meter.horizon
+        self.buckets = [
+            (second, {k: list(v) for k, v in dict(counters).items()}) for second, counters in list(meter.buckets)
+        ]
+        known = dict(meter.processes)
+        for second, counters in self.buckets:
+            for pid in counters:
+                if pid is not None and pid not in self.processes:
+                    self.processes[pid] = known.get(pid) or meter.owners.describe(pid)
+        self.counters = meter.stats()
+
+    def top(self, n: int = 10, window: float = 10.0, by: str = 'process', now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Computes the heaviest processes or control groups over a sliding window (see `BandwidthMeter.top`).
+
+        :param n: The number of processes or control groups to return (default: 10)
+        :type n: int
+        :param window: The length of the window in seconds, at most `horizon` (default: 10)
+        :type window: float
+        :param by: 'process' or 'cgroup' (default: 'process')
+        :type by: str
+        :param now: The end of the window (default: the current time)
+        :type now: float
+
+        :return: The top list of the meter when it was summarized.
+        :rtype: dict
+        """
+        now = time.time() if now is None else now
+        window = min(window, self.horizon)
+        totals = _totals(self.buckets, now - window)
+        return _top(totals, lambda pid: self.processes.get(pid, (None, None)), n, window, by)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: The statistics of the meter when it was summarized (see `BandwidthMeter.stats`).
+        :rtype: dict
+        """
+        return dict(self.counters)
+
+
+_owners: Optional[SocketOwners] = None
+_meters: Dict[str, BandwidthMeter] = {}
+
+
+def get_socket_owners() -> SocketOwners:
+    """
+    Returns the shared socket owner index, refreshed in the background. The refresh interval and the interval
+    between two rescans of every process are read from the BANDWIDTH_REFRESH_INTERVAL and BANDWIDTH_FULL_SCAN_INTERVAL
+    environment variables.
+
+    :return: The socket owner index.
+    :rtype: SocketOwners
+    """
+    global _owners
+    if _owners is None:
+        _owners = SocketOwners(
+            min_interval=float(os.environ.get('BANDWIDTH_REFRESH_INTERVAL', 1.0)),
+            full_interval=float(os.environ.get('BANDWIDTH_FULL_SCAN_INTERVAL', 30.0)),
+        )
+    return _owners
+
+
+def get_bandwidth_meter(interface: str = 'wlp4s0') -> BandwidthMeter:
+    """
+    Returns the bandwidth meter of a network interface, attaching it to the capture engine of the interface
+    on first use so that every captured packet is accounted from then on.
+
+    :param interface: The network interface (default: 'wlp4s0')
+    :type interface: str
+
+    :return: The bandwidth meter of the interface.
+    :rtype: BandwidthMeter
+    """
+    meter = _meters.get(interface)
+    if meter is None:
+        meter = _meters[interface] = BandwidthMeter(get_socket_owners().start())
+    engine = get_engine(interface)
+    if meter.engine is not engine:
+        engine.attach(meter.update)
+        meter.engine = engine
+    return meter
+
+
+async def load_bandwidth_meter(interface: str = 'wlp4s0') -> Union[BandwidthMeter, BandwidthSummary]:
+    """
+    Asynchronously returns the bandwidth meter of a network interface. In multi-worker mode the meters are kept
+    by the collector process, and this returns the latest published summary of the meter.
+
+    :param interface: The network interface (default: 'wlp4s0')
+    :type interface: str
+
+    :return: The bandwidth meter of the interface, or its summary.
+    :rtype: BandwidthMeter or BandwidthSummary
+    """
+    client = get_client()
+    if client is None:
+        return get_bandwidth_meter(interface)
+    return client.snapshot(await client.acall('bandwidth', interface), BandwidthSummary())
+
+
+def stop_bandwidth_meter(interface: str = 'wlp4s0') -> bool:
+    """
+    Detaches the bandwidth meter of a network interface from its capture engine and drops it. The socket owner
+    index stops refreshing when no meter is left.
+
+    :param interface: The network interface (default: 'wlp4s0')
+    :type interface: str
+
+    :return: True if the interface had a bandwidth meter.
+    :rtype: bool
+    """
+    client = get_client()
+    if client is not None:
+        return client.call('stop_bandwidth', interface)
+    meter = _meters.pop(interface, None)
+    if meter is None:
+        return False
+    if meter.engine is not None:
+        meter.engine.detach(meter.update)
+    if not _meters and _owners is not None:
+        _owners.stop()
+    return True
@@ -0,0 +1,365 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+PROC_FILES = {'tcp': ('tcp', 'ipv4'), 'tcp6': ('tcp', 'ipv6'), 'udp': ('udp', 'ipv4'), 'udp6': ('udp', 'ipv6')}
+
+TCP_STATES = {
+    '01': 'ESTABLISHED', '02': 'SYN_SENT', '03': 'SYN_RECV', '04': 'FIN_WAIT1', '05': 'FIN_WAIT2',
+    '06': 'TIME_WAIT', '07': 'CLOSE', '08': 'CLOSE_WAIT', '09': 'LAST_ACK', '0A': 'LISTEN', '0B': 'CLOSING',
+    '0C': 'NEW_SYN_RECV',
+}
+
+SocketKey = Tuple[str, str, str]
+SocketEntry = Tuple[str, str, str]
+
+
+def read_sockets(root: str = '/proc/net') -> Dict[SocketKey, SocketEntry]:
+    """
+    Reads the TCP and UDP socket tables of the kernel in bulk. Only the fields are split, addresses are decoded
+    later for the sockets actually returned.
+
+    :param root: The directory holding the tcp, tcp6, udp and udp6 tables (default: '/proc/net')
+    :type root: str
+
+    :return: A dictionary mapping (table, local address, remote address) in kernel hex notation
+             to (state, uid, inode).
+    :rtype: dict
+    """
+    sockets = {}
+    for name in PROC_FILES:
+        try:
+            with open(os.path.join(root, name)) as file:
+                data = file.read()
+        except OSError:
+            continue
+        for line in data.splitlines()[1:]:
+            fields = line.split(None, 10)
+            if len(fields) >= 10:
+                sockets[(name, fields[1], fields[2])] = (fields[3], fields[7], fields[9])
+    return sockets
+
+
+def raw_address(value: str) -> Tuple[bytes, int]:
+    """
+    Decodes an address of the kernel socket tables to packed bytes.
+
+    :param value: The address and port in kernel hex notation, e.g. '0100007F:1F90'
+    :type value: str
+
+    :return: The address in network byte order (4 or 16 bytes) and the port.
+    :rtype: tuple
+    """
+    address, port = value.split(':')
+    raw = bytes.fromhex(address)
+    if sys.byteorder == 'little':
+        raw = b''.join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4))
+    return raw, int(port, 16)
+
+
+def _address(value: str) -> Tuple[str, int]:
+    raw, port = raw_address(value)
+    return socket.inet_ntop(socket.AF_INET if len(raw) == 4 else socket.AF_INET6, raw), port
+
+
+def socket_pids(proc: str = '/proc') -> Dict[str, int]:
+    """
+    Maps socket inodes to the processes holding them by reading the file descriptors of every process.
+    Processes that cannot be inspected are skipped.
+
+    :param proc: The proc filesystem mount point (default: '/proc')
+    :type proc: str
+
+    :return: A dictionary mapping inode numbers (as strings) to process IDs.
+    :rtype: dict
+    """
+    pids = {}
+    for pid in os.listdir(proc):
+        if not pid.isdigit():
+            continue
+        directory = os.path.join(proc, pid, 'fd')
+        try:
+            descriptors = os.listdir(directory)
+        except OSError:
+            continue
+        for descriptor in descriptors:
+            try:
+                target = os.readlink(os.path.join(directory, descriptor))
+            except OSError:
+                continue
+            if target.startswith('socket:['):
+                pids[target[8:-1]] = int(pid)
+    return pids
+
+
+def socket_record(key: SocketKey, entry: SocketEntry, pids: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """
+    Decodes a socket read by `read_sockets`.
+
+    :param key: The (table, local address, remote address) key of the socket
+    :type key: tuple
+    :param entry: The (state, uid, inode) fields of the socket
+    :type entry: tuple
+    :param pids: The inode to process ID map, see `socket_pids` (default: do not resolve the process)
+    :type pids: dict
+
+    :return: A dictionary with the protocol, the address family, the local and remote addresses and ports,
+             the state, the owner uid, the inode and the process ID (None if unknown).
+    :rtype: dict
+    """
+    name, local, remote = key
+    state, uid, inode = entry
+    proto, family = PROC_FILES[name]
+    local_address, local_port = _address(local)
+    remote_address, remote_port = _address(remote)
+    if proto == 'tcp':
+        state = TCP_STATES.get(state, state)
+    else:
+        state = 'ESTABLISHED' if state == '01' else 'NONE'
+    return {
+        'proto': proto,
+        'family': family,
+        'local_address': local_address,
+        'local_port': local_port,
+        'remote_address': remote_address,
+        'remote_port': remote_port,
+        'state': state,
+        'uid': int(uid),
+        'inode': int(inode),
+        'pid': pids.get(inode) if pids is not None else None,
+    }
+
+
+class ConnectionFilter:
+    """
+    The ConnectionFilter class selects sockets by protocol, address family, state, process and ports.
+    Every criterion that is None matches any socket.
+    """
+    __slots__ = ('proto', 'family', 'state', 'pid', 'local_port', 'remote_port')
+
+    def __init__(self, proto: Optional[str] = None, family: Optional[str] = None, state: Optional[str] = None,
+                 pid: Optional[int] = None, local_port: Optional[int] = None, remote_port: Optional[int] = None) -> None:
+        self.proto = proto
+        self.family = family
+        self.state = state.upper() if state else None
+        self.pid = pid
+        self.local_port = local_port
+        self.remote_port = remote_port
+
+    def match_key(self, key: SocketKey) -> bool:
+        """
+        Checks the criteria that can be decided without decoding the socket.
+
+        :param key: The (table, local address, remote address) key of the socket
+        :type key: tuple
+
+        :return: True if the socket may match the filter.
+        :rtype: bool
+        """
+        proto, family = PROC_FILES[key[0]]
+        if self.proto is not None and proto != self.proto:
+            return False
+        if self.family is not None and family != self.family:
+            return False
+        if self.local_port is not None and int(key[1][-4:], 16) != self.local_port:
+            return False
+        if self.remote_port is not None and int(key[2][-4:], 16) != self.remote_port:
+            return False
+        return True
+
+    def match(self, record: Dict[str, Any]) -> bool:
+        """
+        :param record: A socket decoded by `socket_record`
+        :type record: dict
+
+        :return: True if the socket satisfies the filter.
+        :rtype: bool
+        """
+        if self.state is not None and record['state'] != self.state:
+            return False
+        if self.pid is not None and record['pid'] != self.pid:
+            return False
+        return True
+
+
+class ConnectionTable:
+    """
+    The ConnectionTable class keeps the latest snapshot of the socket tables together with a bounded log of
+    the sockets opened, closed or changing state between snapshots. Every snapshot gets a new generation number
+    that clients send back as a cursor to receive only the changes since their previous request.
+    Snapshots are taken at most once per `min_interval` seconds, so concurrent pollers share them.
+    """
+
+    def __init__(self, root: str = '/proc/net', proc: str = '/proc', min_interval: float = 1.0,
+                 max_events: int = 100000) -> None:
+        """
+        :param root: The directory holding the socket tables (default: '/proc/net')
+        :type root: str
+        :param proc: The proc filesystem mount point, used to find the processes of the sockets (default: '/proc')
+        :type proc: str
+        :param min_interval: The minimum time between two snapshots in seconds (default: 1.0)
+        :type min_interval: float
+        :param max_events: The number of changes kept for the delta queries (default: 100000)
+        :type max_events: int
+
+        :return: None
+        :rtype: None
+        """
+        self.root = root
+        self.proc = proc
+        self.min_interval = min_interval
+        self.sockets: Dict[SocketKey, SocketEntry] = {}
+        self.generation = 0
+        self.events: Deque[Tuple[int, str, SocketKey, SocketEntry]] = deque(maxlen=max_events)
+        self.complete_since = 0
+        self.refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        Takes a new snapshot of the socket tables unless the latest one is recent enough, and logs the differences.
+
+        :param force: Whether to take a snapshot even if the latest one is recent (default: False)
+        :type force: bool
+
+        :return: The generation of the latest snapshot.
+        :rtype: int
+        """
+        with self._lock:
+            if not force and self.generation and time.monotonic() - self.refreshed_at < self.min_interval:
+                return self.generation
+            sockets = read_sockets(self.root)
+            old = self.sockets
+            generation = self.generation + 1
+            if self.generation:
+                events = self.events
+                for key, entry in sockets.items():
+                    previous = old.get(key)
+                    if previous is None:
+                        events.append((generation, 'opened', key, entry))
+                    elif previous[0] != entry[0]:
+                        events.append((generation, 'changed', key, entry))
+                for key in old.keys() - sockets.keys():
+                    events.append((generation, 'closed', key, old[key]))
+                if len(events) == events.maxlen:
+                    self.complete_since = events[0][0]
+            self.sockets = sockets
+            self.generation = generation
+            self.refreshed_at = time.monotonic()
+            return generation
+
+    def _records(self, items, connection_filter: ConnectionFilter, with_pid: bool) -> List[Dict[str, Any]]:
+        pids = socket_pids(self.proc) if with_pid or connection_filter.pid is not None else None
+        records = (socket_record(key, entry, pids) for key, entry in items if connection_filter.match_key(key))
+        return [x for x in records if connection_filter.match(x)]
+
+    def snapshot(self, connection_filter: Optional[ConnectionFilter] = None, with_pid: bool = False) -> Dict[str, Any]:
+        """
+        Returns the sockets of the latest snapshot.
+
+        :param connection_filter: The filter that sockets must match (default: match everything)
+        :type connection_filter: ConnectionFilter
+        :param with_pid: Whether to find the process of every socket (default: False)
+        :type with_pid: bool
+
+        :return: A dictionary with the generation of the snapshot under 'cursor' and the sockets under 'connections'.
+        :rtype: dict
+        """
+        self.refresh()
+        with self._lock:
+            generation = self.generation
+            items = list(self.sockets.items())
+        return {'cursor': generation, 'connections': self._records(items, connection_filter or ConnectionFilter(), with_pid)}
+
+    def delta(self, cursor: int, connection_filter: Optional[ConnectionFilter] = None, with_pid: bool = False) -> Dict[str, Any]:
+        """
+        Returns the sockets opened, closed or changing state since the snapshot of a cursor. A socket opened and
+        closed again in between is left out. If the changes since the cursor are no longer logged, the whole table
+        is returned with 'reset' set to True.
+
+        :param cursor: The generation returned by a previous call
+        :type cursor: int
+        :param connection_filter: The filter that sockets must match (default: match everything)
+        :type connection_filter: ConnectionFilter
+        :param with_pid: Whether to find the process of every socket (default: False)
+        :type with_pid: bool
+
+        :return: A dictionary with the new cursor under 'cursor' and the sockets under 'opened', 'closed' and 'changed'.
+        :rtype: dict
+        """
+        connection_filter = connection_filter or ConnectionFilter()
+        self.refresh()
+        with self._lock:
+            generation = self.generation
+            events = list(self.events)
+            complete_since = self.complete_since
+        if cursor > generation or cursor < complete_since:
+            result = self.snapshot(connection_filter, with_pid)
+            return {'cursor': result['cursor'], 'reset': True, 'opened': result['connections'], 'closed': [], 'changed': []}
+        changes: Dict[SocketKey, Tuple[str, str, SocketEntry]] = {}
+        for event_generation, kind, key, entry in events:
+            if event_generation <= cursor:
+                continue
+            first = changes[key][0] if key in changes else kind
+            changes[key] = (first, kind, entry)
+        grouped: Dict[str, list] = {'opened': [], 'closed': [], 'changed': []}
+        for key, (first, last, entry) in changes.items():
+            if first == 'opened' and last == 'closed':
+                continue
+            if first == 'opened':
+                kind = 'opened'
+            elif last == 'closed':
+                kind = 'closed'
+            else:
+                kind = 'changed'
+            grouped[kind].append((key, entry))
+        result = {'cursor': generation, 'reset': False}
+        for kind, items in grouped.items():
+            result[kind] = self._records(items, connection_filter, with_pid)
+        return result
+
+
+_table: Optional[ConnectionTable] = None
+
+
+def get_connection_table() -> ConnectionTable:
+    """
+    Returns the shared connection table. The minimum time between two snapshots is read from the
+    CONNECTIONS_MIN_INTERVAL environment variable.
+
+    :return: The connection table.
+    :rtype: ConnectionTable
+    """
+    global _table
+    if _table is None:
+        _table = ConnectionTable(min_interval=float(os.environ.get('CONNECTIONS_MIN_INTERVAL', 1.0)))
+    return _table
+
+
+async def get_connections(connection_filter: Optional[ConnectionFilter] = None, cursor: Optional[int] = None,
+                          with_pid: bool = False) -> Dict[str, Any]:
+    """
+    Asynchronously reads the socket tables in the default executor.
+
+    :param connection_filter: The filter that sockets must match (default: match everything)
+    :type connection_filter: ConnectionFilter
+    :param cursor: The cursor of a previous call to receive only the changes since then (default: the whole table)
+    :type cursor: int
+    :param with_pid: Whether to find the process of every socket (default: False)
+    :type with_pid: bool
+
+    :return: The result of `ConnectionTable.snapshot` or, with a cursor, of `ConnectionTable.delta`.
+    :rtype: dict
+    """
+    table = get_connection_table()
+    loop = asyncio.get_running_loop()
+    if cursor is None:
+        return await loop.run_in_executor(None, table.snapshot, connection_filter, with_pid)
+    return await loop.run_in_executor(None, table.delta, cursor, connection_filter, with_pid)
@@ -0,0 +1,139 @@
+import asyncio
+import ipaddress
+import os
+import time
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+if TYPE_CHECKING:
+    import httpx
+
+
+DEFAULT_URLS = ('https://ident.me', 'https://api.ipify.org', 'https://ifconfig.me/ip')
+
+
+class ExternalIpResolver:
+    """
+    The ExternalIpResolver class looks up the external IP address of the machine through a pooled asynchronous
+    HTTP client. Results are cached for `ttl` seconds and served stale for up to `stale_ttl` more seconds while
+    a refresh runs in the background. Concurrent callers share a single upstream request.
+    """
+
+    def __init__(self, urls: Optional[List[str]] = None, ttl: float = 300.0, stale_ttl: float = 3600.0,
+                 timeout: float = 5.0, race: bool = True) -> None:
+        """
+        :param urls: The resolver URLs returning the caller's IP address as plain text (default: DEFAULT_URLS)
+        :type urls: list
+        :param ttl: The time in seconds during which a cached address is fresh (default: 300)
+        :type ttl: float
+        :param stale_ttl: The time in seconds after `ttl` during which a stale address is still served (default: 3600)
+        :type stale_ttl: float
+        :param timeout: The timeout of an upstream request in seconds (default: 5)
+        :type timeout: float
+        :param race: Whether to query all URLs at once and take the first answer, or to try them in order (default: True)
+        :type race: bool
+
+        :return: None
+        :rtype: None
+        """
+        self.urls = list(urls or DEFAULT_URLS)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.race = race
+        self.address: Optional[str] = None
+        self.fetched_at = 0.0
+        self._client: Optional['httpx.AsyncClient'] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._refresh: Optional[asyncio.Task] = None
+
+    def _bind(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # httpx (with httpcore and its backends) takes longer to import than the rest of the service,
+            # so it is imported on the first lookup rather than at startup
+            import httpx
+
+            self._loop = loop
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+            self._refresh = None
+
+    async def _fetch_one(self, url: str) -> str:
+        response = await self._client.get(url)
+        response.raise_for_status()
+        address = response.text.strip()
+        ipaddress.ip_address(address)
+        return address
+
+    async def _fetch(self) -> Optional[str]:
+        if not self.race:
+            import httpx
+
+            for url in self.urls:
+                try:
+                    return await self._fetch_one(url)
+                except (httpx.HTTPError, ValueError):
+                    continue
+            return None
+        pending = {asyncio.ensure_future(self._fetch_one(x)) for x in self.urls}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None:
+                        return task.result()
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _update(self) -> Optional[str]:
+        address = await self._fetch()
+        if address is not None:
+            self.address = address
+            self.fetched_at = time.monotonic()
+        return address
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.ensure_future(self._update())
+        return self._refresh
+
+    async def get(self) -> Dict[str, Any]:
+        """
+        Asynchronously retrieves the external IP address, from the cache when possible.
+
+        :return:
+            - A dictionary containing the external IP address under the key 'external_ip' if the lookup is successful.
+            - A dictionary containing the error message under the key 'error' if every resolver fails.
+        :rtype: dict
+        """
+        self._bind()
+        age = time.monotonic() - self.fetched_at
+        if self.address is not None and age < self.ttl:
+            return {'external_ip': self.address}
+        if self.address is not None and age < self.ttl + self.stale_ttl:
+            self._start_refresh()
+            return {'external_ip': self.address}
+        await asyncio.shield(self._start_refresh())
+        if self.address is None or time.monotonic() - self.fetched_at >= self.ttl + self.stale_ttl:
+            return {'error': 'Unable to retrieve external IP address'}
+        return {'external_ip': self.address}
+
+
+_resolver: Optional[ExternalIpResolver] = None
+
+
+def get_resolver() -> ExternalIpResolver:
+    """
+    Returns the shared external IP resolver. The resolver URLs are read from the comma-separated
+    EXTERNAL_IP_URLS environment variable and the cache lifetime from EXTERNAL_IP_TTL.
+
+    :return: The external IP resolver.
+    :rtype: ExternalIpResolver
+    """
+    global _resolver
+    if _resolver is None:
+        urls = [x.strip() for x in os.environ.get('EXTERNAL_IP_URLS', '').split(',') if x.strip()]
+        _resolver = ExternalIpResolver(urls or None, ttl=float(os.environ.get('EXTERNAL_IP_TTL', 300.0)))
+    return _resolver
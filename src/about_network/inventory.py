@@ -0,0 +1,446 @@
+import asyncio
+import errno
+import os
+import select
+import socket
+import threading
+import time
+
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import psutil
+
+from fastapi import Query
+
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+GROUPS = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE
+
+FAMILIES = {socket.AF_INET: 'ipv4', socket.AF_INET6: 'ipv6', psutil.AF_LINK: 'link'}
+DUPLEX = {psutil.NIC_DUPLEX_FULL: 'full', psutil.NIC_DUPLEX_HALF: 'half', psutil.NIC_DUPLEX_UNKNOWN: 'unknown'}
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def _read_int(path: str) -> Optional[int]:
+    value = _read(path)
+    try:
+        return int(value, 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_sysfs(name: str, sysfs: str = '/sys/class/net') -> Dict[str, Any]:
+    """
+    Reads the attributes of a network interface that psutil does not report from sysfs.
+    Attributes that cannot be read (virtual devices, interfaces gone meanwhile) are None.
+
+    :param name: The name of the network interface
+    :type name: str
+    :param sysfs: The directory of the network interfaces in sysfs (default: '/sys/class/net')
+    :type sysfs: str
+
+    :return: A dictionary with the index, the MAC address, the ARP hardware type, the operational state,
+             the carrier, the transmit queue length, the driver and the number of receive and transmit queues.
+    :rtype: dict
+    """
+    path = os.path.join(sysfs, name)
+    try:
+        driver = os.path.basename(os.readlink(os.path.join(path, 'device', 'driver')))
+    except OSError:
+        driver = None
+    try:
+        queues = os.listdir(os.path.join(path, 'queues'))
+    except OSError:
+        queues = []
+    return {
+        'index': _read_int(os.path.join(path, 'ifindex')),
+        'mac': _read(os.path.join(path, 'address')),
+        'type': _read_int(os.path.join(path, 'type')),
+        'operstate': _read(os.path.join(path, 'operstate')),
+        'carrier': _read_int(os.path.join(path, 'carrier')),
+        'tx_queue_len': _read_int(os.path.join(path, 'tx_queue_len')),
+        'driver': driver,
+        'rx_queues': sum(x.startswith('rx-') for x in queues),
+        'tx_queues': sum(x.startswith('tx-') for x in queues),
+    }
+
+
+def read_default_routes(proc: str = '/proc') -> List[Tuple[int, str]]:
+    """
+    Reads the default routes of the IPv4 and IPv6 routing tables.
+
+    :param proc: The mount point of procfs (default: '/proc')
+    :type proc: str
+
+    :return: The metric and the interface of every default route that is up, best first.
+    :rtype: list
+    """
+    routes = []
+    try:
+        with open(os.path.join(proc, 'net', 'route')) as file:
+            next(file, None)
+            for line in file:
+                fields = line.split()
+                if len(fields) >= 8 and fields[1] == fields[7] == '00000000' and int(fields[3], 16) & 1:
+                    routes.append((int(fields[6]), fields[0]))
+    except OSError:
+        pass
+    try:
+        with open(os.path.join(proc, 'net', 'ipv6_route')) as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) == 10 and fields[0] == '0' * 32 and fields[1] == '00' and fields[9] != 'lo' \
+                        and int(fields[8], 16) & 1:
+                    routes.append((int(fields[5], 16), fields[9]))
+    except OSError:
+        pass
+    return sorted(routes)
+
+
+def diff(old: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Compares two inventories of network interfaces.
+
+    :param old: The previous inventory, by interface name
+    :type old: dict
+    :param new: The current inventory, by interface name
+    :type new: dict
+
+    :return: One event per interface that was added, removed or changed; a changed interface lists
+             the previous and current value of every attribute that differs.
+    :rtype: list
+    """
+    events = []
+    for name in old.keys() - new.keys():
+        events.append({'event': 'removed', 'interface': name, 'info': old[name]})
+    for name, info in new.items():
+        previous = old.get(name)
+        if previous is None:
+            events.append({'event': 'added', 'interface': name, 'info': info})
+        elif previous != info:
+            changes = {x: [previous.get(x), info.get(x)] for x in info.keys() | previous.keys()
+                       if previous.get(x) != info.get(x)}
+            events.append({'event': 'changed', 'interface': name, 'changes': changes, 'info': info})
+    return sorted(events, key=lambda x: x['interface'])
+
+
+class InterfaceInventory:
+    """
+    The InterfaceInventory class keeps a snapshot of the network interfaces: addresses, status, MTU, speed
+    and duplex from psutil, driver and queues from sysfs. A background thread listens to the RTNETLINK
+    link, address and route notifications and rebuilds the snapshot when one arrives, so requests read
+    the snapshot instead of querying the kernel. Where netlink is not available it polls instead.
+    Every change is pushed to the asyncio subscribers.
+    """
+
+    def __init__(self, sysfs: str = '/sys/class/net', proc: str = '/proc', debounce: float = 0.05,
+                 poll_interval: float = 30.0, max_queue: int = 1024) -> None:
+        """
+        :param sysfs: The directory of the network interfaces in sysfs (default: '/sys/class/net')
+        :type sysfs: str
+        :param proc: The mount point of procfs (default: '/proc')
+        :type proc: str
+        :param debounce: The time in seconds to wait for further notifications before rebuilding (default: 0.05)
+        :type debounce: float
+        :param poll_interval: The time between two rebuilds when netlink is not available (default: 30.0)
+        :type poll_interval: float
+        :param max_queue: The number of events kept for a subscriber that does not read them (default: 1024)
+        :type max_queue: int
+
+        :return: None
+        :rtype: None
+        """
+        self.sysfs = sysfs
+        self.proc = proc
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.max_queue = max_queue
+        self.interfaces: Dict[str, Dict[str, Any]] = {}
+        self.default: Optional[str] = None
+        self.version = 0
+        self.updated: Optional[float] = None
+        self.source = 'poll'
+        self.notifications = 0
+        self._subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def read(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Reads the current state of every network interface.
+
+        :return: The description of every network interface, by name.
+        :rtype: dict
+        """
+        addresses = psutil.net_if_addrs()
+        stats = psutil.net_if_stats()
+        result = {}
+        for name in sorted(addresses.keys() | stats.keys()):
+            info: Dict[str, Any] = {'name': name}
+            stat = stats.get(name)
+            if stat is not None:
+                info.update({
+                    'up': stat.isup,
+                    'mtu': stat.mtu,
+                    'speed': stat.speed or None,
+                    'duplex': DUPLEX.get(stat.duplex, 'unknown'),
+                    'flags': getattr(stat, 'flags', '').split(',') if getattr(stat, 'flags', '') else [],
+                })
+            info.update(read_sysfs(name, self.sysfs))
+            info['addresses'] = [
+                {'family': FAMILIES.get(x.family, str(int(x.family))), 'address': x.address,
+                 'netmask': x.netmask, 'broadcast': x.broadcast}
+                for x in addresses.get(name, ())
+            ]
+            result[name] = info
+        return result
+
+    def pick_default(self, interfaces: Dict[str, Dict[str, Any]]) -> Optional[str]:
+        """
+        Picks the interface most likely wanted when a request does not name one: the interface of the best
+        default route, else the first interface that is up with an IP address and is not a loopback,
+        else the first one that is up.
+
+        :param interfaces: The description of every network interface, by name
+        :type interfaces: dict
+
+        :return: The name of the interface, or None if there is no interface.
+        :rtype: str
+        """
+        for _, name in read_default_routes(self.proc):
+            if name in interfaces:
+                return name
+        up = [x for x in interfaces.values() if x.get('up')]
+        for info in up:
+            if 'loopback' not in info.get('flags', ()) and info['name'] != 'lo' \
+                    and any(x['family'] in ('ipv4', 'ipv6') for x in info['addresses']):
+                return info['name']
+        if up:
+            return up[0]['name']
+        return next(iter(interfaces), None)
+
+    def refresh(self) -> List[Dict[str, Any]]:
+        """
+        Rebuilds the snapshot and notifies the subscribers of what changed.
+
+        :return: The events describing the changes, empty if nothing changed.
+        :rtype: list
+        """
+        interfaces = self.read()
+        default = self.pick_default(interfaces)
+        with self._lock:
+            events = diff(self.interfaces, interfaces)
+            if default != self.default:
+                events.append({'event': 'default', 'interface': default, 'previous': self.default})
+            self.interfaces, self.default = interfaces, default
+            self.updated = time.time()
+            if events:
+                self.version += 1
+                for event in events:
+                    event.update(version=self.version, ts=self.updated)
+                self._publish(events)
+        return events
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        :return: The inventory: its version, the time of the last rebuild, the default interface,
+                 how changes are detected ('netlink' or 'poll') and the list of interfaces.
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'version': self.version,
+                'updated': self.updated,
+                'default': self.default,
+                'source': self.source,
+                'interfaces': list(self.interfaces.values()),
+            }
+
+    def _publish(self, events: List[Dict[str, Any]]) -> None:
+        for loop, queue in self._subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, events)
+            except RuntimeError:
+                pass
+
+    @staticmethod
+    def _deliver(queue: asyncio.Queue, events: List[Dict[str, Any]]) -> None:
+        for event in events:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Registers a subscriber on the running event loop.
+
+        :return: The queue receiving the change events.
+        :rtype: asyncio.Queue
+        """
+        queue: asyncio.Queue = asyncio.Queue(self.max_queue)
+        with self._lock:
+            self._subscribers = [*self._subscribers, (asyncio.get_running_loop(), queue)]
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """
+        :param queue: A queue returned by `subscribe`
+        :type queue: asyncio.Queue
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self._subscribers = [x for x in self._subscribers if x[1] is not queue]
+
+    async def watch(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yields the current inventory as a 'snapshot' event, then every change event until the consumer stops.
+
+        :return: An asynchronous iterator over the events.
+        :rtype: AsyncIterator
+        """
+        queue = self.subscribe()
+        try:
+            yield {'event': 'snapshot', **self.snapshot()}
+            while True:
+                yield await queue.get()
+        finally:
+            self.unsubscribe(queue)
+
+    def open_netlink(self) -> socket.socket:
+        """
+        :return: A socket subscribed to the RTNETLINK link, address and route notifications.
+        :rtype: socket.socket
+        """
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        try:
+            sock.bind((0, GROUPS))
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _drain(self, sock: socket.socket) -> None:
+        while True:
+            try:
+                sock.recv(65536)
+            except BlockingIOError:
+                return
+            except OSError as error:
+                if error.errno != errno.ENOBUFS:
+                    raise
+            self.notifications += 1
+
+    def start(self) -> 'InterfaceInventory':
+        """
+        Builds a first snapshot and starts the background thread if it is not running yet.
+
+        :return: The inventory itself.
+        :rtype: InterfaceInventory
+        """
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                try:
+                    sock: Optional[socket.socket] = self.open_netlink()
+                except (OSError, AttributeError):
+                    sock = None
+                self.source = 'poll' if sock is None else 'netlink'
+                self.refresh()
+                self._thread = threading.Thread(target=self._run, args=(sock,), name='interface-inventory', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the background thread.
+
+        :return: None
+        :rtype: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, sock: Optional[socket.socket]) -> None:
+        if sock is None:
+            deadline = time.monotonic()
+            while True:
+                deadline += self.poll_interval
+                if self._stop.wait(max(0.0, deadline - time.monotonic())):
+                    return
+                self.refresh()
+        try:
+            while not self._stop.is_set():
+                if not select.select([sock], [], [], 0.5)[0]:
+                    continue
+                self._drain(sock)
+                # Notifications come in bursts (an interface going up adds its addresses and routes)
+                while select.select([sock], [], [], self.debounce)[0]:
+                    self._drain(sock)
+                self.refresh()
+        finally:
+            sock.close()
+
+
+_inventory: Optional[InterfaceInventory] = None
+
+
+def get_inventory() -> InterfaceInventory:
+    """
+    Returns the shared inventory of the network interfaces, starting it on first use. Every worker process
+    keeps its own, since every process receives the netlink notifications. The polling interval used
+    without netlink is read from the INVENTORY_POLL_INTERVAL environment variable.
+
+    :return: The running inventory.
+    :rtype: InterfaceInventory
+    """
+    global _inventory
+    if _inventory is None:
+        _inventory = InterfaceInventory(poll_interval=float(os.environ.get('INVENTORY_POLL_INTERVAL', 30.0)))
+    return _inventory.start()
+
+
+def default_interface() -> str:
+    """
+    :return: The name of the interface used when a request does not name one, see `InterfaceInventory.pick_default`.
+             The DEFAULT_INTERFACE environment variable takes precedence.
+    :rtype: str
+    """
+    return os.environ.get('DEFAULT_INTERFACE') or get_inventory().default or 'lo'
+
+
+def interface_query(
+    interface: Optional[str] = Query(
+        description="Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)",
+        default=None,
+    ),
+) -> str:
+    """
+    Resolves the 'interface' query parameter of a route, defaulting to `default_interface`.
+    Use it as a dependency: interface: str = Depends(interface_query).
+
+    :param interface: The name of the network interface given in the request, if any
+    :type interface: str
+
+    :return: The name of the network interface.
+    :rtype: str
+    """
+    return interface or default_interface()
@@ -1,7 +1,13 @@
 from typing import Dict, Any
 
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 
+from serialization.serialization import FastJSONRoute, stream_response
+
+from .connections import ConnectionFilter, get_connections
+from .inventory import get_inventory, interface_query
+from .sampler import load_sampler
 from .about_network import (
     Traffic,
     get_my_ip_addr,
@@ -14,9 +20,19 @@ router = APIRouter(
     tags=["About Network"],
     dependencies=[],
     responses={404: {"description": "Not found"}},
+    route_class=FastJSONRoute,
 )
 
 
+@router.on_event("startup")
+async def start_sampler() -> None:
+    """
+    Запустить фоновый сбор счетчиков сетевых интерфейсов при старте приложения.
+    Описание интерфейсов и учет трафика процессов запускаются при первом обращении к ним.
+    """
+    await load_sampler()
+
+
 @router.get("/myip")
 async def my_ip() -> Dict[str, Any]:
     """
@@ -40,30 +56,212 @@ async def get_interfaces() -> Dict[str, Any]:
     return await a_get_interfaces()
 
 
+@router.get("/interfaces")
+async def get_interface_inventory(
+    name: str = Query(
+        description="Название сетевого интерфейса (по умолчанию: все)",
+        default=None,
+    ),
+) -> Dict[str, Any]:
+    """
+    Получить описание сетевых интерфейсов: адреса, состояние, MTU, скорость, дуплекс, драйвер и очереди.
+    Описание обновляется по уведомлениям ядра (RTNETLINK), а не при каждом запросе.
+
+    :param name: Название сетевого интерфейса (по умолчанию: все)
+    :type name: str
+
+    :return: Словарь с версией описания, временем его обновления, интерфейсом по умолчанию
+             и списком интерфейсов, либо с ошибкой, если интерфейс не найден
+    :rtype: dict
+    """
+    snapshot = get_inventory().snapshot()
+    if name is not None:
+        snapshot['interfaces'] = [x for x in snapshot['interfaces'] if x['name'] == name]
+        if not snapshot['interfaces']:
+            return {'error': f'Интерфейс {name} не найден'}
+    return snapshot
+
+
+@router.get("/interfaces/watch")
+async def watch_interfaces(
+    format: str = Query(
+        description="Формат потока: ndjson или sse",
+        default="ndjson",
+        regex=r"^(ndjson|sse)$",
+    ),
+) -> StreamingResponse:
+    """
+    Подписаться на изменения сетевых интерфейсов. Первым отправляется текущее описание (событие snapshot),
+    затем события added, removed и changed для каждого изменившегося интерфейса
+    и событие default при смене интерфейса по умолчанию.
+
+    :param format: Формат потока: ndjson или sse (по умолчанию: 'ndjson')
+    :type format: str
+
+    :return: Потоковый ответ, отправляющий каждое изменение сразу после уведомления ядра
+    :rtype: StreamingResponse
+    """
+    return stream_response(get_inventory().watch(), format)
+
+
 @router.get("/get_traffic")
 async def get_traffic(
-    interface: str = Query(
-        description="Название сетевого интерфейса, откуда получить трафик (по умолчанию: 'wlp4s0')",
-        default="wlp4s0",
-    ),
+    interface: str = Depends(interface_query),
     strg_unit: str = Query(
         description="Единица хранения (B, kB, MB, GB, TB, PB) (по умолчанию: 'B')",
         default="B",
         regex=r"^(B|kB|MB|GB|TB|PB)",
     ),
+    window: float = Query(
+        description="Окно в секундах для расчета скорости (по умолчанию: все время мониторинга)",
+        default=None,
+        gt=0,
+    ),
 ) -> Dict[str, Any]:
     """
     Возвращает количество загруженного и отправленного трафика на выбранном интерфейсе.
 
-    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: 'wlp4s0')
+    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: интерфейс маршрута по умолчанию)
     :type interface: str
     :param strg_unit: Единица хранения (B, kB, MB, GB, TB, PB) (по умолчанию: 'B')
     :type strg_unit: str
+    :param window: Окно в секундах для расчета скорости (по умолчанию: все время мониторинга)
+    :type window: float
 
-    :return: Словарь, содержащий количество загруженного и отправленного трафика
+    :return: Словарь, содержащий количество загруженного и отправленного трафика, пакетов, ошибок и отбрасываний,
+             а также скорость передачи за выбранное окно
     :rtype: dict
     """
-    traffic = Traffic(interface)
+    traffic = Traffic(interface, await load_sampler())
     if strg_unit in Traffic.strg_unit_dict:
-        return await traffic.get_traffic(strg_unit)
+        return await traffic.get_traffic(strg_unit, window)
     return {"error": "Недопустимая единица хранения"}
+
+
+@router.get("/connections")
+async def get_connections_table(
+    proto: str = Query(
+        description="Протокол: tcp или udp (по умолчанию: все)",
+        default=None,
+        regex=r"^(tcp|udp)$",
+    ),
+    family: str = Query(
+        description="Семейство адресов: ipv4 или ipv6 (по умолчанию: все)",
+        default=None,
+        regex=r"^(ipv4|ipv6)$",
+    ),
+    state: str = Query(
+        description="Состояние сокета, например ESTABLISHED, LISTEN, TIME_WAIT (по умолчанию: все)",
+        default=None,
+    ),
+    pid: int = Query(
+        description="Идентификатор процесса, владеющего сокетом (по умолчанию: все)",
+        default=None,
+    ),
+    local_port: int = Query(
+        description="Локальный порт (по умолчанию: все)",
+        default=None,
+    ),
+    remote_port: int = Query(
+        description="Удаленный порт (по умолчанию: все)",
+        default=None,
+    ),
+    with_pid: bool = Query(
+        description="Определить процесс каждого сокета",
+        default=False,
+    ),
+    cursor: int = Query(
+        description="Курсор из предыдущего ответа: вернуть только открытые, закрытые и изменившиеся с тех пор сокеты",
+        default=None,
+        ge=0,
+    ),
+) -> Dict[str, Any]:
+    """
+    Получить таблицу TCP/UDP-соединений локального компьютера.
+    С курсором возвращаются только изменения с момента предыдущего запроса.
+
+    :param proto: Протокол: tcp или udp (по умолчанию: все)
+    :type proto: str
+    :param family: Семейство адресов: ipv4 или ipv6 (по умолчанию: все)
+    :type family: str
+    :param state: Состояние сокета (по умолчанию: все)
+    :type state: str
+    :param pid: Идентификатор процесса (по умолчанию: все)
+    :type pid: int
+    :param local_port: Локальный порт (по умолчанию: все)
+    :type local_port: int
+    :param remote_port: Удаленный порт (по умолчанию: все)
+    :type remote_port: int
+    :param with_pid: Определить процесс каждого сокета (по умолчанию: False)
+    :type with_pid: bool
+    :param cursor: Курсор из предыдущего ответа (по умолчанию: вся таблица)
+    :type cursor: int
+
+    :return: Словарь с курсором и списком соединений, либо с курсором и списками открытых (opened),
+             закрытых (closed) и изменивших состояние (changed) сокетов
+    :rtype: dict
+    """
+    connection_filter = ConnectionFilter(proto, family, state, pid, local_port, remote_port)
+    return await get_connections(connection_filter, cursor, with_pid)
+
+
+@router.get("/bandwidth")
+async def get_bandwidth(
+    interface: str = Depends(interface_query),
+    window: float = Query(
+        description="Окно в секундах для расчета скорости (не более 300)",
+        default=10,
+        gt=0,
+        le=300,
+    ),
+    limit: int = Query(
+        description="Количество процессов или контрольных групп в ответе",
+        default=10,
+        ge=1,
+    ),
+    by: str = Query(
+        description="Группировка: process (по процессам) или cgroup (по контрольным группам)",
+        default="process",
+        regex=r"^(process|cgroup)$",
+    ),
+) -> Dict[str, Any]:
+    """
+    Получить процессы или контрольные группы с наибольшим трафиком на указанном интерфейсе.
+    Пакеты сопоставляются с сокетами и их владельцами. Первый запрос включает учет на интерфейсе,
+    он продолжается до вызова DELETE /about_network/bandwidth.
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param window: Окно в секундах для расчета скорости (по умолчанию: 10)
+    :type window: float
+    :param limit: Количество процессов или контрольных групп в ответе (по умолчанию: 10)
+    :type limit: int
+    :param by: Группировка: process или cgroup (по умолчанию: 'process')
+    :type by: str
+
+    :return: Словарь, содержащий объем отправленного и полученного трафика, количество пакетов и скорость
+             для каждого процесса или контрольной группы, а также объем трафика без известного владельца
+    :rtype: dict
+    """
+    from .bandwidth import load_bandwidth_meter
+
+    meter = await load_bandwidth_meter(interface)
+    return {'interface': interface, 'stats': meter.stats(), **meter.top(limit, window, by)}
+
+
+@router.delete("/bandwidth")
+async def delete_bandwidth(
+    interface: str = Depends(interface_query),
+) -> Dict[str, Any]:
+    """
+    Остановить учет трафика процессов на указанном интерфейсе и удалить накопленную статистику.
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+
+    :return: Словарь с признаком того, что учет был остановлен
+    :rtype: dict
+    """
+    from .bandwidth import stop_bandwidth_meter
+
+    return {'interface': interface, 'stopped': stop_bandwidth_meter(interface)}
@@ -0,0 +1,294 @@
+import math
+import os
+import threading
+import time
+
+from array import array
+from datetime import datetime
+from typing import Any, Dict, Optional, Union
+
+import psutil
+
+from collector.client import get_client
+
+
+FIELDS = ('bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv', 'errin', 'errout', 'dropin', 'dropout')
+
+
+class TrafficSeries:
+    """
+    The TrafficSeries class keeps the last `capacity` samples of the counters of one network interface
+    in fixed-size array-backed ring buffers.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        """
+        :param capacity: The number of samples kept in the ring buffers
+        :type capacity: int
+
+        :return: None
+        :rtype: None
+        """
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = {x: array('d', bytes(8 * capacity)) for x in FIELDS}
+        self.baseline: Optional[Dict[str, float]] = None
+        self.count = 0
+        self.head = -1
+
+    def append(self, ts: float, counters: Dict[str, float]) -> None:
+        """
+        Stores a sample, overwriting the oldest one when the buffers are full.
+
+        :param ts: The time of the sample
+        :type ts: float
+        :param counters: The values of the interface counters
+        :type counters: dict
+
+        :return: None
+        :rtype: None
+        """
+        head = (self.head + 1) % self.capacity
+        self.times[head] = ts
+        for field in FIELDS:
+            self.values[field][head] = counters[field]
+        if self.baseline is None:
+            self.baseline = {'ts': ts, **counters}
+        self.count = min(self.count + 1, self.capacity)
+        self.head = head
+
+    def latest(self) -> Optional[Dict[str, float]]:
+        """
+        :return: The time and the values of the counters of the latest sample, or None if there is no sample yet.
+        :rtype: dict
+        """
+        head = self.head
+        if head < 0:
+            return None
+        return {'ts': self.times[head], **{x: self.values[x][head] for x in FIELDS}}
+
+    def tail(self, size: int) -> 'TrafficSeries':
+        """
+        Copies the latest samples, for instance to publish them while this series keeps receiving samples.
+
+        :param size: The maximum number of samples copied
+        :type size: int
+
+        :return: A series of at most `size` samples holding the latest samples and the baseline of this one.
+        :rtype: TrafficSeries
+        """
+        head, count = self.head, self.count
+        # the oldest slot of a full ring may be the one being overwritten by the next sample
+        count = min(count, self.capacity - 1)
+        series = TrafficSeries(max(1, min(size, count)))
+        series.baseline = self.baseline
+        for back in range(min(size, count) - 1, -1, -1):
+            index = (head - back) % self.capacity
+            series.append(self.times[index], {x: self.values[x][index] for x in FIELDS})
+        return series
+
+    def delta(self, back: Optional[int] = None) -> Dict[str, float]:
+        """
+        Computes the change of every counter between the latest sample and an earlier one.
+
+        :param back: The number of samples to go back, or None to compare with the first sample ever taken
+        :type back: int
+
+        :return: A dictionary with the elapsed time under 'seconds', the start time under 'ts'
+                 and the change of every counter.
+        :rtype: dict
+        """
+        head = self.head
+        if back is None:
+            start = self.baseline
+        else:
+            index = (head - min(back, self.count - 1)) % self.capacity
+            start = {'ts': self.times[index], **{x: self.values[x][index] for x in FIELDS}}
+        result = {'ts': start['ts'], 'seconds': self.times[head] - start['ts']}
+        for field in FIELDS:
+            result[field] = max(0.0, self.values[field][head] - start[field])
+        return result
+
+
+class TrafficSampler:
+    """
+    The TrafficSampler class polls the per-interface counters in a background thread at a fixed interval,
+    so requests read precomputed time series instead of scanning the counters of every interface.
+    """
+
+    def __init__(self, interval: float = 1.0, capacity: int = 3600) -> None:
+        """
+        :param interval: The time between two samples in seconds (default: 1.0)
+        :type interval: float
+        :param capacity: The number of samples kept per interface (default: 3600)
+        :type capacity: int
+
+        :return: None
+        :rtype: None
+        """
+        self.interval = interval
+        self.capacity = capacity
+        self.series: Dict[str, TrafficSeries] = {}
+        self.begin_time: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sample(self) -> None:
+        """
+        Takes one sample of the counters of every network interface.
+
+        :return: None
+        :rtype: None
+        """
+        now = time.time()
+        for name, counters in psutil.net_io_counters(pernic=True).items():
+            series = self.series.get(name)
+            if series is None:
+                series = self.series[name] = TrafficSeries(self.capacity)
+            series.append(now, counters._asdict())
+        if self.begin_time is None:
+            self.begin_time = datetime.fromtimestamp(now)
+
+    def start(self) -> 'TrafficSampler':
+        """
+        Takes a first sample and starts the background thread if it is not running yet.
+
+        :return: The sampler itself.
+        :rtype: TrafficSampler
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self.sample()
+                self._thread = threading.Thread(target=self._run, name='traffic-sampler', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the background thread.
+
+        :return: None
+        :rtype: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        deadline = time.monotonic()
+        while True:
+            deadline += self.interval
+            if self._stop.wait(max(0.0, deadline - time.monotonic())):
+                return
+            self.sample()
+
+    def window(self, interface: str, seconds: Optional[float] = None) -> Optional[Dict[str, float]]:
+        """
+        Computes the change of the counters of an interface over a time window.
+
+        :param interface: The name of the network interface
+        :type interface: str
+        :param seconds: The length of the window, or None for the whole time since the sampler started
+        :type seconds: float
+
+        :return: The result of `TrafficSeries.delta`, or None if the interface is unknown.
+        :rtype: dict
+        """
+        return _window(self.series.get(interface), self.interval, seconds)
+
+
+class TrafficSummary:
+    """
+    The TrafficSummary class is a copy of the samples of the last `window` seconds of a TrafficSampler, which the
+    collector process publishes instead of the whole sampler. It answers the queries of the sampler for windows up
+    to `window` seconds, longer windows being cut to it; the whole time since the sampler started is still answered
+    from the first sample ever taken.
+    """
+
+    def __init__(self, sampler: Optional[TrafficSampler] = None, window: float = 300.0) -> None:
+        """
+        :param sampler: The traffic sampler to summarize (default: an empty summary)
+        :type sampler: TrafficSampler
+        :param window: The time in seconds covered by the copied samples (default: 300)
+        :type window: float
+
+        :return: None
+        :rtype: None
+        """
+        self.interval = 1.0
+        self.capacity = 0
+        self.series: Dict[str, TrafficSeries] = {}
+        self.begin_time: Optional[datetime] = None
+        if sampler is None:
+            return
+        self.interval = sampler.interval
+        self.capacity = math.ceil(window / sampler.interval) + 1
+        self.series = {name: x.tail(self.capacity) for name, x in list(sampler.series.items())}
+        self.begin_time = sampler.begin_time
+
+    def window(self, interface: str, seconds: Optional[float] = None) -> Optional[Dict[str, float]]:
+        """
+        Computes the change of the counters of an interface over a time window (see `TrafficSampler.window`).
+
+        :param interface: The name of the network interface
+        :type interface: str
+        :param seconds: The length of the window, or None for the whole time since the sampler started
+        :type seconds: float
+
+        :return: The result of `TrafficSeries.delta`, or None if the interface is unknown.
+        :rtype: dict
+        """
+        return _window(self.series.get(interface), self.interval, seconds)
+
+
+def _window(series: Optional[TrafficSeries], interval: float, seconds: Optional[float]) -> Optional[Dict[str, float]]:
+    if series is None:
+        return None
+    back = None if seconds is None else max(1, round(seconds / interval))
+    return series.delta(back)
+
+
+_sampler: Optional[TrafficSampler] = None
+_snapshot: Optional[str] = None
+
+
+def get_sampler() -> Union[TrafficSampler, TrafficSummary]:
+    """
+    Returns the shared traffic sampler, starting it on first use. The interval and the number of samples kept
+    are read from the TRAFFIC_SAMPLE_INTERVAL and TRAFFIC_SAMPLE_CAPACITY environment variables.
+    In multi-worker mode the sampler runs in the collector process, and this returns its latest published summary;
+    the first call then waits for the collector, so request handlers use `load_sampler` instead.
+
+    :return: The running traffic sampler, or its latest published summary.
+    :rtype: TrafficSampler or TrafficSummary
+    """
+    global _sampler, _snapshot
+    client = get_client()
+    if client is not None:
+        if _snapshot is None:
+            _snapshot = client.call('sampler')
+        return client.snapshot(_snapshot, TrafficSummary())
+    if _sampler is None:
+        _sampler = TrafficSampler(
+            float(os.environ.get('TRAFFIC_SAMPLE_INTERVAL', 1.0)),
+            int(os.environ.get('TRAFFIC_SAMPLE_CAPACITY', 3600)),
+        )
+    return _sampler.start()
+
+
+async def load_sampler() -> Union[TrafficSampler, TrafficSummary]:
+    """
+    Asynchronously returns the shared traffic sampler (see `get_sampler`) without blocking the event loop
+    while the collector process is asked for its snapshot.
+
+    :return: The running traffic sampler, or its latest published summary in multi-worker mode.
+    :rtype: TrafficSampler or TrafficSummary
+    """
+    global _snapshot
+    client = get_client()
+    if client is not None and _snapshot is None:
+        _snapshot = await client.acall('sampler')
+    return get_sampler()
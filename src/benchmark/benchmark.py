@@ -0,0 +1,535 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from fastapi.encoders import jsonable_encoder
+
+from eth_dump import engine as engine_module
+from eth_dump.backends import AfPacketBackend, BackendUnavailable, CaptureBackend, TcpdumpBackend
+from eth_dump.decoder import Packet, decode_pcap
+from eth_dump.engine import PacketFilter
+from eth_dump.flows import FlowTable, stop_flow_table
+from eth_dump.pcap import PcapStream
+from eth_dump.tcp import TcpAnalyzer
+from ping.ping import parse_ping_output
+from serialization.serialization import columnar, compress, dumps
+
+from .fixtures import PING_OUTPUT, ReplayEngine, fake_ping, stub_external_ip, synthetic_frames, synthetic_pcap
+
+
+INTERFACE = 'bench0'
+OFFLINE_FILE = 'bench.pcap'
+PING_HOSTS = [f'192.0.2.{x}' for x in range(1, 9)]
+
+ENDPOINTS: Dict[str, Tuple[str, str, Dict[str, Any]]] = {
+    'eth_dump': ('GET', '/eth_dump/', {'params': {'interface': INTERFACE, 'count_pkt': 10, 'type': 'tcp'}}),
+    'eth_dump_port': ('GET', '/eth_dump/port', {'params': {'interface': INTERFACE, 'count_pkt': 10, 'port': 443}}),
+    'eth_dump_stream': ('GET', '/eth_dump/stream', {'params': {'interface': INTERFACE, 'count_pkt': 100}}),
+    'flows': ('GET', '/eth_dump/flows', {'params': {'interface': INTERFACE}}),
+    'offline': ('GET', '/eth_dump/offline', {'params': {'file': OFFLINE_FILE, 'count_pkt': 100, 'type': 'tcp'}}),
+    'offline_columns': ('GET', '/eth_dump/offline', {'params': {'file': OFFLINE_FILE, 'count_pkt': 1000, 'layout': 'columns'}}),
+    'get_interfaces': ('GET', '/about_network/get_interfaces', {}),
+    'get_traffic': ('GET', '/about_network/get_traffic', {'params': {'interface': 'lo'}}),
+    'connections': ('GET', '/about_network/connections', {'params': {'proto': 'tcp'}}),
+    'myip': ('GET', '/about_network/myip', {}),
+    'ping': ('POST', '/ping', {'params': {'res': PING_HOSTS[0], 'count_pkt': 4}}),
+    'ping_batch': ('POST', '/ping/batch', {'json': {'hosts': PING_HOSTS}}),
+    'metrics': ('GET', '/metrics', {}),
+}
+
+
+def _timed(function: Callable[[], int], repeat: int) -> Dict[str, float]:
+    best = None
+    items = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'items': items, 'seconds': best, 'per_s': items / best if best else 0.0}
+
+
+def bench_parse(packets: int = 100000, repeat: int = 3) -> Dict[str, Dict[str, float]]:
+    """
+    Measures the throughput of the parse paths on synthetic traffic and on the recorded ping output.
+    Every path is run `repeat` times and the fastest run is kept.
+
+    :param packets: The number of synthetic packets (default: 100000)
+    :type packets: int
+    :param repeat: The number of runs of every path (default: 3)
+    :type repeat: int
+
+    :return: A dictionary mapping every path to the number of items processed, the duration of the fastest run
+             in seconds and the number of items (packets or lines) per second.
+    :rtype: dict
+    """
+    frames = synthetic_frames(packets)
+    data = synthetic_pcap(frames)
+    decoded = [Packet(0.0, x) for x in frames]
+    packet_filter = PacketFilter(type='tcp', port=443)
+    with open(PING_OUTPUT) as file:
+        ping_output = file.read()
+    ping_lines = ping_output.count('\n')
+
+    def pcap_stream() -> int:
+        stream = PcapStream()
+        return sum(len(stream.feed(data[i:i + 65536])) for i in range(0, len(data), 65536))
+
+    def decode() -> int:
+        return sum(1 for x in decode_pcap(data) if x.to_dict())
+
+    def filter_packets() -> int:
+        for x in decode_pcap(data):
+            packet_filter.match(x)
+        return packets
+
+    def flow_table() -> int:
+        table = FlowTable()
+        for x in decoded:
+            table.update(x)
+        return packets
+
+    def tcp_analyzer() -> int:
+        analyzer = TcpAnalyzer()
+        for x in decoded:
+            analyzer.update(x)
+        return packets
+
+    def ping() -> int:
+        for _ in range(packets // 100):
+            parse_ping_output(ping_output)
+        return packets // 100 * ping_lines
+
+    return {
+        'pcap_stream': _timed(pcap_stream, repeat),
+        'decode_pcap': _timed(decode, repeat),
+        'packet_filter': _timed(filter_packets, repeat),
+        'flow_table': _timed(flow_table, repeat),
+        'tcp_analyzer': _timed(tcp_analyzer, repeat),
+        'ping_output': _timed(ping, repeat),
+    }
+
+
+def bench_serialization(records: int = 10000, repeat: int = 3) -> Dict[str, Dict[str, float]]:
+    """
+    Measures the serialization of a large capture response: FastAPI's default path (`jsonable_encoder` followed
+    by `json.dumps`), the standard library alone, orjson when it is installed, the columnar layout and gzip.
+    Every path is run `repeat` times and the fastest run is kept.
+
+    :param records: The number of decoded packets in the response (default: 10000)
+    :type records: int
+    :param repeat: The number of runs of every path (default: 3)
+    :type repeat: int
+
+    :return: A dictionary mapping every path to the number of records serialized, the duration of the fastest run
+             in seconds, the number of records per second and the size of the body in bytes.
+    :rtype: dict
+    """
+    content = {INTERFACE: [Packet(0.0, x).to_dict() for x in synthetic_frames(records)]}
+    sizes = {}
+
+    def path(name: str, function: Callable[[], bytes]) -> Callable[[], int]:
+        def run_path() -> int:
+            sizes[name] = len(function())
+            return records
+        return run_path
+
+    paths = {
+        'fastapi_default': lambda: json.dumps(jsonable_encoder(content)).encode(),
+        'stdlib': lambda: json.dumps(content, separators=(',', ':')).encode(),
+        'fast_json': lambda: dumps(content),
+        'fast_json_columns': lambda: dumps(columnar(content)),
+        'fast_json_gzip': lambda: compress(dumps(content), 'gzip', 0)[0],
+    }
+    results = {}
+    for name, function in paths.items():
+        results[name] = _timed(path(name, function), repeat)
+        results[name]['bytes'] = sizes[name]
+    return results
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] if values else 0.0
+
+
+async def _load(client: httpx.AsyncClient, method: str, url: str, kwargs: Dict[str, Any],
+                requests: int, concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker() -> None:
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400 or 'error' in response.text[:64]:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'rps': requests / elapsed,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+    }
+
+
+async def _memory(client: httpx.AsyncClient, method: str, url: str, kwargs: Dict[str, Any], samples: int) -> float:
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            await client.request(method, url, **kwargs)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return sum(peaks) / len(peaks) / 1024 if peaks else 0.0
+
+
+async def bench_api(endpoints: Optional[List[str]] = None, requests: int = 500, concurrency: int = 16,
+                    memory_samples: int = 20, packets: int = 10000) -> Dict[str, Dict[str, float]]:
+    """
+    Measures the router endpoints in-process under concurrent load. The capture engine replays synthetic traffic,
+    the ping utility is replaced by a fake executable printing recorded output and the external IP resolvers by
+    a local HTTP server, so no network access or privileges are needed.
+
+    :param endpoints: The names of the endpoints to measure, see ENDPOINTS (default: all of them)
+    :type endpoints: list
+    :param requests: The number of requests sent to every endpoint (default: 500)
+    :type requests: int
+    :param concurrency: The number of requests in flight (default: 16)
+    :type concurrency: int
+    :param memory_samples: The number of sequential requests traced to measure memory (default: 20)
+    :type memory_samples: int
+    :param packets: The number of synthetic packets replayed and written to the offline capture file (default: 10000)
+    :type packets: int
+
+    :return: A dictionary mapping every endpoint to its number of requests and errors, requests per second,
+             p50 and p99 latencies in milliseconds and the peak memory allocated per request in KiB.
+    :rtype: dict
+    """
+    from main import app
+
+    frames = synthetic_frames(packets)
+    results = {}
+    saved_env = {x: os.environ.get(x) for x in ('CAPTURE_DIR', 'PATH', 'EXTERNAL_IP_URLS')}
+    saved_engine = engine_module.CaptureEngine
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, OFFLINE_FILE), 'wb') as file:
+            file.write(synthetic_pcap(frames))
+        fake_ping(directory)
+        server = await stub_external_ip()
+        os.environ['CAPTURE_DIR'] = directory
+        os.environ['PATH'] = directory + os.pathsep + os.environ.get('PATH', '')
+        os.environ['EXTERNAL_IP_URLS'] = f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}/'
+        ReplayEngine.frames = frames
+        engine_module.CaptureEngine = ReplayEngine
+        try:
+            await app.router.startup()
+            async with httpx.AsyncClient(app=app, base_url='http://benchmark', timeout=60) as client:
+                for name in endpoints or ENDPOINTS:
+                    method, url, kwargs = ENDPOINTS[name]
+                    await client.request(method, url, **kwargs)
+                    results[name] = await _load(client, method, url, kwargs, requests, concurrency)
+                    results[name]['memory_kib'] = await _memory(client, method, url, kwargs, memory_samples)
+            await app.router.shutdown()
+        finally:
+            stop_flow_table(INTERFACE)
+            engine_module.CaptureEngine = saved_engine
+            for key, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+            server.close()
+    return results
+
+
+async def _loopback_pps(backend: CaptureBackend, seconds: float) -> float:
+    await backend.open()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.setblocking(False)
+    received = 0
+    deadline = time.monotonic() + seconds
+
+    async def flood() -> None:
+        while time.monotonic() < deadline:
+            for _ in range(64):
+                try:
+                    sender.sendto(b'x' * 64, ('127.0.0.1', 9))
+                except BlockingIOError:
+                    break
+            await asyncio.sleep(0)
+
+    async def count() -> None:
+        nonlocal received
+        while time.monotonic() < deadline:
+            frames = await backend.read()
+            if not frames:
+                # the source is exhausted, e.g. the tcpdump process exited
+                break
+            received += len(frames)
+
+    try:
+        await asyncio.wait_for(asyncio.gather(flood(), count()), timeout=seconds + 2)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        sender.close()
+        await backend.close()
+    return received / seconds
+
+
+def bench_capture(seconds: float = 1.0) -> Dict[str, Dict[str, float]]:
+    """
+    Measures the capture backends on the loopback interface while a local sender floods it with small datagrams.
+    The backends that cannot be opened (no privileges, no tcpdump) are left out.
+
+    :param seconds: The duration of the flood for every backend (default: 1.0)
+    :type seconds: float
+
+    :return: A dictionary mapping every available backend to the number of frames it read per second.
+    :rtype: dict
+    """
+    results = {}
+    for name, backend_class in (('af_packet', AfPacketBackend), ('tcpdump', TcpdumpBackend)):
+        if name == 'tcpdump' and not (shutil.which('tcpdump') and shutil.which('sudo')):
+            continue
+        try:
+            results[name] = {'per_s': asyncio.run(_loopback_pps(backend_class('lo'), seconds))}
+        except (BackendUnavailable, PermissionError):
+            continue
+    return results
+
+
+STARTUP_PROFILES: Dict[str, Optional[str]] = {
+    'all': None,
+    'counters': 'counters',
+}
+
+STARTUP_SCRIPT = """
+import asyncio, json, resource, sys, time
+
+def peak_rss():
+    # ru_maxrss keeps the peak of the parent process across exec on Linux, VmHWM does not
+    try:
+        with open('/proc/self/status') as file:
+            return next(int(x.split()[1]) for x in file if x.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+async def first_request(app):
+    await app.router.startup()
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+             'path': '/about_network/get_traffic', 'raw_path': b'/about_network/get_traffic', 'root_path': '',
+             'query_string': b'interface=lo', 'headers': [], 'client': ('127.0.0.1', 1), 'server': ('benchmark', 80)}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    await app.router.shutdown()
+    return messages[0]['status']
+
+start = time.perf_counter()
+from main import app
+imported = time.perf_counter()
+status = asyncio.run(first_request(app))
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'cold_start_ms': (time.perf_counter() - start) * 1000,
+    'rss_kib': peak_rss(),
+    'modules': len(sys.modules),
+    'status': status,
+}))
+"""
+
+
+def _slowest_imports(env: Dict[str, str], count: int) -> List[Dict[str, Any]]:
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], capture_output=True, text=True,
+                             env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    imports = []
+    for line in process.stderr.splitlines():
+        fields = line.split('|')
+        # the modules first imported by main are indented by one level below it
+        if len(fields) == 3 and fields[1].strip().isdigit() and fields[2].startswith('   ') and fields[2][3] != ' ':
+            imports.append({'module': fields[2].strip(), 'cumulative_ms': int(fields[1]) / 1000})
+    return sorted(imports, key=lambda x: -x['cumulative_ms'])[:count]
+
+
+def bench_startup(profiles: Optional[List[str]] = None, repeat: int = 3, slowest: int = 5) -> Dict[str, Dict[str, Any]]:
+    """
+    Measures the cold start of the service in fresh interpreters: the import of the application, then its startup
+    handlers and a first request to the counters API, for every set of subsystems of STARTUP_PROFILES.
+    Every profile is started `repeat` times and the fastest run is kept.
+
+    :param profiles: The names of the profiles to measure, see STARTUP_PROFILES (default: all of them)
+    :type profiles: list
+    :param repeat: The number of starts of every profile (default: 3)
+    :type repeat: int
+    :param slowest: The number of top-level imports reported, slowest first (default: 5)
+    :type slowest: int
+
+    :return: A dictionary mapping every profile to the import and cold start durations in milliseconds,
+             the peak resident memory in KiB, the number of loaded modules, the status of the first request
+             and the slowest top-level imports.
+    :rtype: dict
+    """
+    results = {}
+    for name in profiles or STARTUP_PROFILES:
+        env = dict(os.environ)
+        env.pop('NETMON_SUBSYSTEMS', None)
+        if STARTUP_PROFILES[name] is not None:
+            env['NETMON_SUBSYSTEMS'] = STARTUP_PROFILES[name]
+        runs = []
+        for _ in range(repeat):
+            process = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True, check=True,
+                                     env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            runs.append(json.loads(process.stdout.splitlines()[-1]))
+        result = min(runs, key=lambda x: x['cold_start_ms'])
+        result['slowest_imports'] = _slowest_imports(env, slowest)
+        results[name] = result
+    return results
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(packets: int = 100000, requests: int = 500, concurrency: int = 16, memory_samples: int = 20,
+        endpoints: Optional[List[str]] = None, startup_repeat: int = 3, capture_seconds: float = 1.0) -> Dict[str, Any]:
+    """
+    Runs the parse, serialization, API, startup and capture benchmarks.
+
+    :param packets: The number of synthetic packets of the parse benchmarks (default: 100000)
+    :type packets: int
+    :param requests: The number of requests sent to every endpoint (default: 500)
+    :type requests: int
+    :param concurrency: The number of requests in flight (default: 16)
+    :type concurrency: int
+    :param memory_samples: The number of sequential requests traced to measure memory (default: 20)
+    :type memory_samples: int
+    :param endpoints: The names of the endpoints to measure (default: all of them)
+    :type endpoints: list
+    :param startup_repeat: The number of cold starts of every startup profile, 0 to skip them (default: 3)
+    :type startup_repeat: int
+    :param capture_seconds: The duration of the loopback flood of every capture backend, 0 to skip them (default: 1.0)
+    :type capture_seconds: float
+
+    :return: A dictionary with the environment of the run under 'meta' and the results under 'parse', 'serialize',
+             'api', 'startup' and 'capture'.
+    :rtype: dict
+    """
+    return {
+        'meta': {
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'parse': bench_parse(packets),
+        'serialize': bench_serialization(min(packets, 10000)),
+        'api': asyncio.run(bench_api(endpoints, requests, concurrency, memory_samples, min(packets, 10000))),
+        'startup': bench_startup(repeat=startup_repeat) if startup_repeat else {},
+        'capture': bench_capture(capture_seconds) if capture_seconds else {},
+    }
+
+
+def compare(base: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.1) -> List[str]:
+    """
+    Compares two benchmark results.
+
+    :param base: The reference result
+    :type base: dict
+    :param current: The new result
+    :type current: dict
+    :param tolerance: The relative change regarded as noise (default: 0.1)
+    :type tolerance: float
+
+    :return: A description of every throughput that dropped and every latency, startup or memory figure that grew
+             by more than `tolerance`.
+    :rtype: list
+    """
+    regressions = []
+    for section, higher, lower in (('parse', ('per_s',), ()), ('serialize', ('per_s',), ()), ('api', ('rps',), ('p50_ms', 'p99_ms', 'memory_kib')),
+                                   ('startup', (), ('import_ms', 'cold_start_ms', 'rss_kib')), ('capture', ('per_s',), ())):
+        for name, old in base.get(section, {}).items():
+            new = current.get(section, {}).get(name)
+            if new is None:
+                continue
+            for key in higher + lower:
+                if not old.get(key) or key not in new:
+                    continue
+                change = new[key] / old[key] - 1
+                if (key in higher and change < -tolerance) or (key in lower and change > tolerance):
+                    regressions.append(f'{section}.{name}.{key}: {old[key]:.4g} -> {new[key]:.4g} ({change:+.1%})')
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks the parse and serialization paths, the API endpoints, the startup '
+                                                 'and the capture backends.')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file instead of stdout')
+    parser.add_argument('-c', '--compare', help='compare the results with a previous JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change regarded as noise')
+    parser.add_argument('--packets', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--memory-samples', type=int, default=20)
+    parser.add_argument('--endpoint', action='append', choices=list(ENDPOINTS), help='endpoint to measure (repeatable)')
+    parser.add_argument('--startup-repeat', type=int, default=3, help='cold starts of every startup profile, 0 to skip')
+    parser.add_argument('--capture-seconds', type=float, default=1.0, help='loopback flood per capture backend, 0 to skip')
+    args = parser.parse_args(argv)
+
+    results = run(args.packets, args.requests, args.concurrency, args.memory_samples, args.endpoint, args.startup_repeat,
+                  args.capture_seconds)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), results, args.tolerance)
+        for line in regressions:
+            print(line, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
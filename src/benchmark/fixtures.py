@@ -0,0 +1,166 @@
+import asyncio
+import os
+import random
+import socket
+import stat
+import struct
+
+from typing import List
+
+from eth_dump.backends import CaptureBackend
+from eth_dump.engine import CaptureEngine
+from eth_dump.pcap import LINKTYPE_ETHERNET, Frame, pcap_header, pcap_record
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+PING_OUTPUT = os.path.join(DATA_DIR, 'ping.txt')
+
+
+def _ethernet(payload: bytes, ethertype: int) -> bytes:
+    return b'\x02\x00\x00\x00\x00\x02\x02\x00\x00\x00\x00\x01' + struct.pack('!H', ethertype) + payload
+
+
+def _ipv4(src: bytes, dst: bytes, proto: int, payload: bytes) -> bytes:
+    return struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), 1, 0, 64, proto, 0, src, dst) + payload
+
+
+def _ipv6(src: bytes, dst: bytes, proto: int, payload: bytes) -> bytes:
+    return struct.pack('!IHBB16s16s', 6 << 28, len(payload), proto, 64, src, dst) + payload
+
+
+def synthetic_frames(count: int = 100000, flows: int = 1000, seed: int = 0) -> List[bytes]:
+    """
+    Builds a reproducible mix of Ethernet frames: mostly TCP over IPv4, with UDP, ICMP and TCP over IPv6,
+    spread over a fixed number of flows.
+
+    :param count: The number of frames (default: 100000)
+    :type count: int
+    :param flows: The number of distinct flows (default: 1000)
+    :type flows: int
+    :param seed: The seed of the random generator (default: 0)
+    :type seed: int
+
+    :return: A list of frames.
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    endpoints = []
+    for i in range(flows):
+        kind = rng.choices(('tcp', 'udp', 'icmp', 'tcp6'), (70, 20, 5, 5))[0]
+        client, server = 0x0a000000 + rng.randrange(1 << 16), 0xc0000200 + rng.randrange(256)
+        endpoints.append((kind, struct.pack('!I', client), struct.pack('!I', server),
+                          rng.randrange(32768, 61000), rng.choice((22, 53, 80, 443, 5432, 8080))))
+    frames = []
+    for _ in range(count):
+        kind, client, server, cport, sport = rng.choice(endpoints)
+        src, dst, ports = (client, server, (cport, sport)) if rng.random() < 0.5 else (server, client, (sport, cport))
+        payload = bytes(rng.choice((0, 0, 64, 512, 1400)))
+        if kind == 'udp':
+            frame = _ethernet(_ipv4(src, dst, 17, struct.pack('!HHHH', *ports, 8 + len(payload), 0) + payload), 0x0800)
+        elif kind == 'icmp':
+            frame = _ethernet(_ipv4(src, dst, 1, b'\x08\x00\x00\x00\x00\x01\x00\x01' + payload), 0x0800)
+        else:
+            segment = struct.pack('!HHIIBBHHH', *ports, rng.randrange(1 << 32), 1, 5 << 4, 0x18, 501, 0, 0) + payload
+            if kind == 'tcp':
+                frame = _ethernet(_ipv4(src, dst, 6, segment), 0x0800)
+            else:
+                frame = _ethernet(_ipv6(b'\xfd' + bytes(11) + src, b'\xfd' + bytes(11) + dst, 6, segment), 0x86dd)
+        frames.append(frame)
+    return frames
+
+
+def synthetic_pcap(frames: List[bytes], start: float = 1700000000.0) -> bytes:
+    """
+    :param frames: The frames to write
+    :type frames: list
+    :param start: The timestamp of the first frame, the next ones are 1 ms apart (default: 1700000000)
+    :type start: float
+
+    :return: The contents of a pcap file holding the frames.
+    :rtype: bytes
+    """
+    return pcap_header(LINKTYPE_ETHERNET) + b''.join(
+        pcap_record(start + i / 1000, x, len(x)) for i, x in enumerate(frames)
+    )
+
+
+def fake_ping(directory: str) -> str:
+    """
+    Writes a fake 'ping' executable that prints the recorded output of the ping utility and exits,
+    so the ping endpoints can be measured without network access.
+
+    :param directory: The directory to write the executable to, to be prepended to PATH
+    :type directory: str
+
+    :return: The path of the executable.
+    :rtype: str
+    """
+    path = os.path.join(directory, 'ping')
+    with open(path, 'w') as file:
+        file.write(f'#!/bin/sh\nexec cat "{PING_OUTPUT}"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+async def stub_external_ip(address: str = '203.0.113.7') -> asyncio.AbstractServer:
+    """
+    Starts a local HTTP server answering every request with an IP address, standing in for the external IP resolvers.
+
+    :param address: The address to answer with (default: '203.0.113.7')
+    :type address: str
+
+    :return: The running server.
+    :rtype: asyncio.AbstractServer
+    """
+    response = f'HTTP/1.1 200 OK\r\nContent-Length: {len(address)}\r\n\r\n{address}'.encode()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await reader.readuntil(b'\r\n\r\n')
+        writer.write(response)
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0, family=socket.AF_INET)
+
+
+class ReplayBackend(CaptureBackend):
+    """
+    The ReplayBackend class replays a list of frames in a loop at a fixed rate, standing in for a network interface.
+    """
+    name = 'replay'
+    batch = 256
+
+    def __init__(self, interface: str, frames: List[bytes], rate: float = 50000.0) -> None:
+        super().__init__(interface)
+        self.frames = frames
+        self.rate = rate
+        self._position = 0
+
+    async def open(self) -> None:
+        pass
+
+    async def read(self) -> List[Frame]:
+        await asyncio.sleep(self.batch / self.rate)
+        ts = asyncio.get_running_loop().time()
+        frames = self.frames
+        batch = []
+        for _ in range(self.batch):
+            frame = frames[self._position]
+            batch.append((ts, frame, len(frame)))
+            self._position = (self._position + 1) % len(frames)
+        return batch
+
+    async def close(self) -> None:
+        pass
+
+
+class ReplayEngine(CaptureEngine):
+    """
+    The ReplayEngine class is a capture engine fed by a ReplayBackend.
+    """
+    linger = 0
+    frames: List[bytes] = []
+    rate = 50000.0
+
+    async def _open_backend(self) -> CaptureBackend:
+        return ReplayBackend(self.interface, self.frames, self.rate)
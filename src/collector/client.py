@@ -0,0 +1,113 @@
+import asyncio
+import os
+import threading
+
+from multiprocessing.connection import Client, Connection
+from typing import Any, Dict, Optional
+
+from .shm import SnapshotReader
+
+
+class CollectorError(OSError):
+    """
+    Raised when the collector process rejects a command, e.g. when a capture cannot be opened on an interface.
+    """
+
+
+class CollectorClient:
+    """
+    The CollectorClient class is the connection of an API worker to the collector process. Commands go through
+    a local control socket; the data (captured frames, counters, flow tables) is read from shared memory.
+    """
+
+    def __init__(self, address: str, authkey: bytes) -> None:
+        """
+        :param address: The path of the control socket of the collector
+        :type address: str
+        :param authkey: The key authenticating the workers to the collector
+        :type authkey: bytes
+
+        :return: None
+        :rtype: None
+        """
+        self.address = address
+        self.authkey = authkey
+        self._connection: Optional[Connection] = None
+        self._pid = 0
+        self._lock = threading.Lock()
+        self._snapshots: Dict[str, SnapshotReader] = {}
+
+    def call(self, command: str, *args: Any) -> Any:
+        """
+        Sends a command to the collector and waits for its reply.
+
+        :param command: The name of the command
+        :type command: str
+        :param args: The arguments of the command
+        :type args: Any
+
+        :return: The result of the command.
+        :rtype: Any
+        """
+        with self._lock:
+            if self._connection is None or self._pid != os.getpid():
+                self._connection = Client(self.address, authkey=self.authkey)
+                self._pid = os.getpid()
+            try:
+                self._connection.send((command, *args))
+                status, result = self._connection.recv()
+            except (EOFError, OSError):
+                self._connection = None
+                raise CollectorError(f'The collector at {self.address} is not reachable')
+        if status == 'error':
+            raise CollectorError(result)
+        return result
+
+    async def acall(self, command: str, *args: Any) -> Any:
+        """
+        Asynchronously sends a command to the collector without blocking the event loop.
+
+        :param command: The name of the command
+        :type command: str
+        :param args: The arguments of the command
+        :type args: Any
+
+        :return: The result of the command.
+        :rtype: Any
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.call, command, *args)
+
+    def snapshot(self, name: str, default: Any = None) -> Any:
+        """
+        :param name: The name of a snapshot published by the collector
+        :type name: str
+        :param default: The value returned while nothing has been published (default: None)
+        :type default: Any
+
+        :return: The latest version of the snapshot.
+        :rtype: Any
+        """
+        reader = self._snapshots.get(name)
+        if reader is None:
+            reader = self._snapshots[name] = SnapshotReader(name)
+        return reader.load(default)
+
+
+_client: Optional[CollectorClient] = None
+
+
+def get_client() -> Optional[CollectorClient]:
+    """
+    Returns the client of the collector process when the application runs in multi-worker mode, that is when the
+    COLLECTOR_ADDRESS and COLLECTOR_AUTHKEY environment variables are set by `collector.start_collector`.
+
+    :return: The collector client, or None in single-process mode.
+    :rtype: CollectorClient
+    """
+    global _client
+    address = os.environ.get('COLLECTOR_ADDRESS')
+    if not address:
+        return None
+    if _client is None or _client.address != address:
+        _client = CollectorClient(address, bytes.fromhex(os.environ.get('COLLECTOR_AUTHKEY', '')))
+    return _client
@@ -0,0 +1,402 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import secrets
+import signal
+import tempfile
+import threading
+import time
+
+from collections import Counter
+from multiprocessing.connection import Connection, Listener
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from about_network.bandwidth import BandwidthSummary, get_bandwidth_meter, stop_bandwidth_meter
+from about_network.sampler import TrafficSummary, get_sampler
+from eth_dump.engine import engine_stats, get_engine
+from eth_dump.flows import FlowSummary, get_flow_table, stop_flow_table
+from eth_dump.tcp import TcpSummary, get_tcp_analyzer, stop_tcp_analyzer
+from history.history import get_recorder
+
+from .shm import SharedRing, SnapshotPublisher
+
+
+class Collector:
+    """
+    The Collector class runs in a dedicated process in multi-worker mode. It owns the capture engines, the traffic
+    sampler, the flow tables and the TCP analyzers, and shares their results with the API workers through shared memory:
+        - the frames of every captured interface are written once to a shared ring read by every worker;
+        - the samples of the last `sampler_window` seconds of the traffic sampler are published after every sample;
+        - a flow table, a TCP analyzer or a bandwidth meter is published once a worker asked for it, then every
+          `publish_interval` seconds if it changed, as a bounded summary of its `summary_size` top entries;
+        - the history of the counters and flow tables is recorded to disk, where the workers read it.
+    Snapshots are built and pickled in a background thread, never in the event loop draining the capture backends.
+    A snapshot that cannot be built is counted in `publish_errors` and retried at the next interval.
+    Workers send their commands through a local control socket. The interests of a worker are released
+    when its connection closes, so a crashed worker never keeps a capture running.
+    """
+
+    def __init__(self, address: str, authkey: bytes, ring_size: int = 8 << 20, publish_interval: float = 1.0,
+                 summary_size: int = 1000, sampler_window: float = 300.0) -> None:
+        """
+        :param address: The path of the control socket
+        :type address: str
+        :param authkey: The key the workers authenticate with
+        :type authkey: bytes
+        :param ring_size: The size in bytes of the frame ring of every captured interface (default: 8 MiB)
+        :type ring_size: int
+        :param publish_interval: The time in seconds between two snapshots of a changing table (default: 1.0)
+        :type publish_interval: float
+        :param summary_size: The number of entries kept per query in the published summaries (default: 1000)
+        :type summary_size: int
+        :param sampler_window: The time in seconds covered by the published traffic samples (default: 300)
+        :type sampler_window: float
+
+        :return: None
+        :rtype: None
+        """
+        self.address = address
+        self.authkey = authkey
+        self.ring_size = ring_size
+        self.publish_interval = publish_interval
+        self.summary_size = summary_size
+        self.sampler_window = sampler_window
+        self.prefix = f'netmon-{os.getpid()}'
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.rings: Dict[str, Tuple[SharedRing, Callable, int]] = {}
+        self.snapshots: Dict[str, SnapshotPublisher] = {}
+        self.sources: Dict[str, Tuple[Callable[[], Any], Callable[[], Any]]] = {}
+        self.published: Dict[str, Any] = {}
+        self.publish_errors: Counter = Counter()
+        self._sequence = itertools.count(1)
+        self._publish_lock = threading.Lock()
+        self._capture_lock = asyncio.Lock()
+        self._stop = threading.Event()
+
+    def _name(self, topic: str) -> str:
+        return f'{self.prefix}-{topic}-{next(self._sequence)}'
+
+    def _publisher(self, topic: str) -> SnapshotPublisher:
+        publisher = self.snapshots.get(topic)
+        if publisher is None:
+            publisher = self.snapshots[topic] = SnapshotPublisher(self._name(topic))
+        return publisher
+
+    async def _capture(self, interface: str) -> str:
+        if interface in self.rings:
+            ring, tap, count = self.rings[interface]
+            self.rings[interface] = (ring, tap, count + 1)
+            return ring.name
+        ring = SharedRing.create(self._name('ring'), self.ring_size)
+        engine = get_engine(interface)
+        backend = None if engine.running else engine.backend
+
+        def tap(packet: Any) -> None:
+            ring.write(packet.ts, packet.data, packet.length, packet.linktype)
+
+        engine.attach(tap)
+        while engine.backend is backend and engine.running:
+            await asyncio.sleep(0.01)
+        if engine.error is not None or not engine.running:
+            engine.detach(tap)
+            ring.close()
+            raise engine.error or OSError(f'The capture of {interface} stopped')
+        self.rings[interface] = (ring, tap, 1)
+        return ring.name
+
+    def _release(self, interface: str) -> None:
+        if interface not in self.rings:
+            return
+        ring, tap, count = self.rings[interface]
+        if count > 1:
+            self.rings[interface] = (ring, tap, count - 1)
+            return
+        del self.rings[interface]
+        get_engine(interface).detach(tap)
+        ring.close()
+
+    def _check_rings(self) -> None:
+        for interface, (ring, tap, count) in list(self.rings.items()):
+            if not get_engine(interface).running:
+                del self.rings[interface]
+                ring.close()
+
+    def _publish(self, topic: str) -> None:
+        with self._publish_lock:
+            source, publisher = self.sources.get(topic), self.snapshots.get(topic)
+            if source is None or publisher is None:
+                return
+            changes, summarize = source
+            marker = changes()
+            if self.published.get(topic) != marker or not publisher.version:
+                publisher.publish(summarize())
+                self.published[topic] = marker
+
+    async def _share(self, topic: str, changes: Callable[[], Any], summarize: Callable[[], Any]) -> str:
+        # the first request publishes the table at once, off the event loop; afterwards the publishing thread
+        # publishes it again whenever `changes` returns a new value
+        publisher = self._publisher(topic)
+        if topic not in self.sources:
+            self.sources[topic] = (changes, summarize)
+            await self.loop.run_in_executor(None, self._publish, topic)
+        return publisher.name
+
+    def _unshare(self, topic: str) -> None:
+        with self._publish_lock:
+            self.sources.pop(topic, None)
+            self.published.pop(topic, None)
+            publisher = self.snapshots.pop(topic, None)
+            if publisher is not None:
+                publisher.close()
+
+    async def _flows(self, interface: str) -> str:
+        table = get_flow_table(interface)
+        return await self._share(
+            f'flows-{interface}', lambda: (table.packets, table.evicted), lambda: FlowSummary(table, self.summary_size)
+        )
+
+    async def _stop_flows(self, interface: str) -> bool:
+        await self.loop.run_in_executor(None, self._unshare, f'flows-{interface}')
+        return stop_flow_table(interface)
+
+    async def _tcp(self, interface: str) -> str:
+        analyzer = get_tcp_analyzer(interface)
+        return await self._share(
+            f'tcp-{interface}', lambda: analyzer.packets, lambda: TcpSummary(analyzer, self.summary_size)
+        )
+
+    async def _stop_tcp(self, interface: str) -> bool:
+        await self.loop.run_in_executor(None, self._unshare, f'tcp-{interface}')
+        return stop_tcp_analyzer(interface)
+
+    async def _bandwidth(self, interface: str) -> str:
+        meter = get_bandwidth_meter(interface)
+        return await self._share(f'bandwidth-{interface}', lambda: meter.packets, lambda: BandwidthSummary(meter))
+
+    async def _stop_bandwidth(self, interface: str) -> bool:
+        await self.loop.run_in_executor(None, self._unshare, f'bandwidth-{interface}')
+        return stop_bandwidth_meter(interface)
+
+    def _sampler(self) -> str:
+        with self._publish_lock:
+            publisher = self._publisher('sampler')
+            if not publisher.version:
+                publisher.publish(TrafficSummary(get_sampler(), self.sampler_window))
+        return publisher.name
+
+    def _stats(self) -> Dict[str, Dict[str, int]]:
+        self._check_rings()
+        return engine_stats()
+
+    async def handle(self, command: str, args: tuple, interests: Counter) -> Any:
+        """
+        Executes a command of a worker in the event loop of the collector.
+
+        :param command: 'capture', 'release', 'flows', 'stop_flows', 'tcp', 'stop_tcp', 'bandwidth', 'stop_bandwidth',
+                        'sampler' or 'stats'
+        :type command: str
+        :param args: The arguments of the command
+        :type args: tuple
+        :param interests: The interfaces captured for the worker, released when it disconnects
+        :type interests: Counter
+
+        :return: The result of the command.
+        :rtype: Any
+        """
+        if command == 'capture':
+            self._check_rings()
+            async with self._capture_lock:
+                name = await self._capture(args[0])
+            interests[args[0]] += 1
+            return name
+        if command == 'release':
+            if interests[args[0]] > 0:
+                interests[args[0]] -= 1
+                self._release(args[0])
+            return True
+        if command == 'flows':
+            return await self._flows(args[0])
+        if command == 'stop_flows':
+            return await self._stop_flows(args[0])
+        if command == 'tcp':
+            return await self._tcp(args[0])
+        if command == 'stop_tcp':
+            return await self._stop_tcp(args[0])
+        if command == 'bandwidth':
+            return await self._bandwidth(args[0])
+        if command == 'stop_bandwidth':
+            return await self._stop_bandwidth(args[0])
+        if command == 'sampler':
+            return await self.loop.run_in_executor(None, self._sampler)
+        if command == 'stats':
+            return self._stats()
+        raise ValueError(f'Unknown command: {command}')
+
+    def _serve_connection(self, connection: Connection) -> None:
+        interests: Counter = Counter()
+        try:
+            while True:
+                try:
+                    command, *args = connection.recv()
+                except (EOFError, OSError):
+                    return
+                future = asyncio.run_coroutine_threadsafe(self.handle(command, tuple(args), interests), self.loop)
+                try:
+                    reply = ('ok', future.result())
+                except Exception as error:
+                    reply = ('error', str(error) or type(error).__name__)
+                try:
+                    connection.send(reply)
+                except OSError:
+                    return
+        finally:
+            connection.close()
+
+            def release() -> None:
+                for interface, count in interests.items():
+                    for _ in range(count):
+                        self._release(interface)
+
+            if not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(release)
+
+    def _accept(self, listener: Listener) -> None:
+        while not self._stop.is_set():
+            try:
+                connection = listener.accept()
+            except OSError:
+                if self._stop.is_set():
+                    return
+                continue
+            threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+    def _publish_sampler(self) -> None:
+        sampler = get_sampler()
+        while not self._stop.wait(sampler.interval):
+            try:
+                with self._publish_lock:
+                    publisher = self.snapshots.get('sampler')
+                    if publisher is not None:
+                        publisher.publish(TrafficSummary(sampler, self.sampler_window))
+            except Exception:
+                self.publish_errors['sampler'] += 1
+
+    def _publish_changes(self) -> None:
+        # a failing topic is counted and retried at the next interval, the other topics are still published
+        while not self._stop.wait(self.publish_interval):
+            for topic in list(self.sources):
+                try:
+                    self._publish(topic)
+                except Exception:
+                    self.publish_errors[topic] += 1
+
+    async def serve(self) -> None:
+        """
+        Asynchronously serves the workers until `stop` is called.
+
+        :return: None
+        :rtype: None
+        """
+        self.loop = asyncio.get_running_loop()
+        listener = Listener(self.address, 'AF_UNIX', authkey=self.authkey)
+        threads = [
+            threading.Thread(target=self._accept, args=(listener,), name='collector-accept', daemon=True),
+            threading.Thread(target=self._publish_sampler, name='collector-sampler', daemon=True),
+            threading.Thread(target=self._publish_changes, name='collector-publisher', daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        recorder = get_recorder()
+        try:
+            while not self._stop.is_set():
+                await asyncio.sleep(0.5)
+        finally:
+            listener.close()
+            recorder.stop()
+            for interface in list(self.rings):
+                ring, tap, count = self.rings.pop(interface)
+                ring.close()
+            with self._publish_lock:
+                for publisher in self.snapshots.values():
+                    publisher.close()
+                self.snapshots = {}
+                self.sources = {}
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def run_collector(address: str, authkey: bytes, ring_size: int, publish_interval: float = 1.0,
+                  summary_size: int = 1000, sampler_window: float = 300.0) -> None:
+    """
+    The entry point of the collector process.
+
+    :param address: The path of the control socket
+    :type address: str
+    :param authkey: The key the workers authenticate with
+    :type authkey: bytes
+    :param ring_size: The size in bytes of the frame ring of every captured interface
+    :type ring_size: int
+    :param publish_interval: The time in seconds between two snapshots of a changing table (default: 1.0)
+    :type publish_interval: float
+    :param summary_size: The number of entries kept per query in the published summaries (default: 1000)
+    :type summary_size: int
+    :param sampler_window: The time in seconds covered by the published traffic samples (default: 300)
+    :type sampler_window: float
+
+    :return: None
+    :rtype: None
+    """
+    os.environ.pop('COLLECTOR_ADDRESS', None)
+    os.environ.pop('COLLECTOR_AUTHKEY', None)
+    collector = Collector(address, authkey, ring_size, publish_interval, summary_size, sampler_window)
+
+    async def serve() -> None:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, collector.stop)
+        await collector.serve()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def start_collector(timeout: float = 10.0) -> multiprocessing.Process:
+    """
+    Starts the collector process and sets the COLLECTOR_ADDRESS and COLLECTOR_AUTHKEY environment variables,
+    so the API workers started afterwards read captures, counters and flow tables from it instead of collecting
+    them themselves. The size of the frame rings, the interval between two snapshots of a changing table, the
+    number of entries of the published summaries and the time covered by the published traffic samples are read
+    from the COLLECTOR_RING_SIZE, COLLECTOR_PUBLISH_INTERVAL, COLLECTOR_SUMMARY_SIZE and COLLECTOR_SAMPLER_WINDOW
+    environment variables.
+
+    :param timeout: The time in seconds to wait for the control socket (default: 10)
+    :type timeout: float
+
+    :return: The collector process.
+    :rtype: multiprocessing.Process
+    """
+    address = os.path.join(tempfile.mkdtemp(prefix='netmon-'), 'collector.sock')
+    authkey = secrets.token_bytes(32)
+    args = (
+        address,
+        authkey,
+        int(os.environ.get('COLLECTOR_RING_SIZE', 8 << 20)),
+        float(os.environ.get('COLLECTOR_PUBLISH_INTERVAL', 1.0)),
+        int(os.environ.get('COLLECTOR_SUMMARY_SIZE', 1000)),
+        float(os.environ.get('COLLECTOR_SAMPLER_WINDOW', 300.0)),
+    )
+    process = multiprocessing.get_context('spawn').Process(
+        target=run_collector, args=args, name='netmon-collector', daemon=True
+    )
+    process.start()
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(address):
+        if not process.is_alive() or time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError('The collector process did not start')
+        time.sleep(0.01)
+    os.environ['COLLECTOR_ADDRESS'] = address
+    os.environ['COLLECTOR_AUTHKEY'] = authkey.hex()
+    return process
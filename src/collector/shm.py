@@ -0,0 +1,359 @@
+import pickle
+import struct
+import sys
+
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, List, Optional, Set, Tuple
+
+
+RingFrame = Tuple[float, bytes, int, int]
+
+_RING_HDR = struct.Struct('=QQQ')
+_RING_DATA = 64
+_RECORD = struct.Struct('=dIIHxx')
+_WRAP = 0xffffffff
+_POINTER = struct.Struct('=QH')
+_POINTER_SIZE = 256
+
+
+# The names of the segments created by this process and not unlinked yet.
+_owned: Set[str] = set()
+
+
+def create_segment(name: Optional[str], size: int) -> SharedMemory:
+    """
+    Creates a shared memory segment, unlinked by `unlink_segment` or when this process exits.
+
+    :param name: The name of the segment, or None for a random name
+    :type name: str
+    :param size: The size of the segment in bytes
+    :type size: int
+
+    :return: The new segment.
+    :rtype: SharedMemory
+    """
+    segment = SharedMemory(name, create=True, size=size)
+    _owned.add(segment.name)
+    return segment
+
+
+def unlink_segment(segment: SharedMemory) -> None:
+    """
+    Closes and unlinks a segment created by `create_segment`.
+
+    :param segment: The segment
+    :type segment: SharedMemory
+
+    :return: None
+    :rtype: None
+    """
+    _owned.discard(segment.name)
+    segment.close()
+    if sys.version_info < (3, 13):
+        # processes started by multiprocessing share the resource tracker of their parent, where a reader
+        # of the segment may have unregistered it; registering a name again is a no-op otherwise
+        resource_tracker.register('/' + segment.name, 'shared_memory')
+    segment.unlink()
+
+
+def attach_segment(name: str) -> SharedMemory:
+    """
+    Maps an existing shared memory segment. The mapping is not left registered with the resource tracker,
+    so the segment is only unlinked by the process that created it, not when a reader exits.
+
+    :param name: The name of the segment
+    :type name: str
+
+    :return: The mapped segment.
+    :rtype: SharedMemory
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name, track=False)
+    segment = SharedMemory(name)
+    # the tracker keeps one entry per name, so the registration of a segment created by this process is kept
+    if segment.name not in _owned:
+        resource_tracker.unregister('/' + segment.name, 'shared_memory')
+    return segment
+
+
+def _align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+class SharedRing:
+    """
+    The SharedRing class is a single-producer ring buffer of captured frames in a shared memory segment.
+    The producer never waits for readers: every reader keeps its own position and skips ahead, counting
+    the lost bytes, when it has been lapped.
+
+    Layout: a 64-byte header (write position, capacity, closed flag) followed by the data area, which holds
+    8-byte aligned records (timestamp, captured length, wire length, link type, frame bytes). Positions grow
+    monotonically, so a reader detects that a record was overwritten by comparing positions.
+    """
+
+    def __init__(self, segment: SharedMemory, owner: bool) -> None:
+        self.segment = segment
+        self.owner = owner
+        self.buf = segment.buf
+        self.capacity = _RING_HDR.unpack_from(self.buf, 0)[1]
+        self.max_record = self.capacity // 4
+        self.position = _RING_HDR.unpack_from(self.buf, 0)[0]
+
+    @classmethod
+    def create(cls, name: Optional[str] = None, capacity: int = 8 << 20) -> 'SharedRing':
+        """
+        Creates a new ring.
+
+        :param name: The name of the shared memory segment (default: a random name)
+        :type name: str
+        :param capacity: The size of the data area in bytes, a multiple of 8 (default: 8 MiB)
+        :type capacity: int
+
+        :return: The ring, owned by the caller.
+        :rtype: SharedRing
+        """
+        segment = create_segment(name, _RING_DATA + capacity)
+        _RING_HDR.pack_into(segment.buf, 0, 0, capacity, 0)
+        return cls(segment, True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedRing':
+        """
+        :param name: The name of the shared memory segment of an existing ring
+        :type name: str
+
+        :return: The ring, to be read with `reader`.
+        :rtype: SharedRing
+        """
+        return cls(attach_segment(name), False)
+
+    @property
+    def name(self) -> str:
+        return self.segment.name
+
+    @property
+    def closed(self) -> bool:
+        return bool(_RING_HDR.unpack_from(self.buf, 0)[2])
+
+    def write(self, ts: float, data: bytes, wirelen: int, linktype: int) -> bool:
+        """
+        Appends a frame, overwriting the oldest frames when the ring is full.
+
+        :param ts: The capture time of the frame
+        :type ts: float
+        :param data: The captured bytes of the frame
+        :type data: bytes
+        :param wirelen: The length of the frame on the wire
+        :type wirelen: int
+        :param linktype: The link type of the frame
+        :type linktype: int
+
+        :return: False if the frame is larger than a quarter of the ring and was not written.
+        :rtype: bool
+        """
+        size = _align(_RECORD.size + len(data))
+        if size > self.max_record:
+            return False
+        buf, capacity, position = self.buf, self.capacity, self.position
+        offset = position % capacity
+        if offset + size > capacity:
+            if capacity - offset >= _RECORD.size:
+                _RECORD.pack_into(buf, _RING_DATA + offset, 0.0, _WRAP, 0, 0)
+            position += capacity - offset
+            offset = 0
+        start = _RING_DATA + offset
+        _RECORD.pack_into(buf, start, ts, len(data), wirelen, linktype)
+        buf[start + _RECORD.size:start + _RECORD.size + len(data)] = data
+        self.position = position + size
+        struct.pack_into('=Q', buf, 0, self.position)
+        return True
+
+    def close(self) -> None:
+        """
+        Marks the ring as closed for its readers and releases the segment; the owner also unlinks it.
+
+        :return: None
+        :rtype: None
+        """
+        if self.owner:
+            struct.pack_into('=Q', self.buf, 16, 1)
+        self.buf = None
+        if self.owner:
+            unlink_segment(self.segment)
+        else:
+            self.segment.close()
+
+    def reader(self) -> 'RingReader':
+        """
+        :return: A reader starting at the current write position.
+        :rtype: RingReader
+        """
+        return RingReader(self)
+
+
+class RingReader:
+    """
+    The RingReader class reads the frames of a SharedRing from its own position.
+    """
+
+    def __init__(self, ring: SharedRing) -> None:
+        self.ring = ring
+        self.position = _RING_HDR.unpack_from(ring.buf, 0)[0]
+        self.lost = 0
+
+    def read(self, limit: int = 4096) -> List[RingFrame]:
+        """
+        Reads the frames written since the previous call.
+
+        :param limit: The maximum number of frames returned (default: 4096)
+        :type limit: int
+
+        :return: The (timestamp, bytes, wire length, link type) tuples of the frames.
+        :rtype: list
+        """
+        ring = self.ring
+        buf, capacity = ring.buf, ring.capacity
+        end = _RING_HDR.unpack_from(buf, 0)[0]
+        if end - self.position > capacity - ring.max_record:
+            self.lost += end - self.position
+            self.position = end
+            return []
+        frames, positions = [], []
+        position = self.position
+        while position < end and len(frames) < limit:
+            offset = position % capacity
+            if capacity - offset < _RECORD.size:
+                position += capacity - offset
+                continue
+            ts, caplen, wirelen, linktype = _RECORD.unpack_from(buf, _RING_DATA + offset)
+            if caplen == _WRAP:
+                position += capacity - offset
+                continue
+            start = _RING_DATA + offset + _RECORD.size
+            frames.append((ts, bytes(buf[start:start + caplen]), wirelen, linktype))
+            positions.append(position)
+            position += _align(_RECORD.size + caplen)
+        self.position = position
+        safe = _RING_HDR.unpack_from(buf, 0)[0] - capacity + ring.max_record
+        if positions and positions[0] < safe:
+            valid = [x for x, start in zip(frames, positions) if start >= safe]
+            self.lost += sum(_align(_RECORD.size + len(x[1])) for x in frames[:len(frames) - len(valid)])
+            frames = valid
+        return frames
+
+
+class SnapshotPublisher:
+    """
+    The SnapshotPublisher class shares the latest version of a picklable object between processes.
+    Every version is written to a new shared memory segment of the exact size, and a small pointer segment
+    with a sequence lock names the current one, so readers never see a partially written version.
+    """
+
+    def __init__(self, name: str) -> None:
+        """
+        :param name: The name of the pointer segment; versions are named after it
+        :type name: str
+
+        :return: None
+        :rtype: None
+        """
+        self.pointer = create_segment(name, _POINTER_SIZE)
+        _POINTER.pack_into(self.pointer.buf, 0, 0, 0)
+        self.version = 0
+        self.segments: List[SharedMemory] = []
+
+    @property
+    def name(self) -> str:
+        return self.pointer.name
+
+    def publish(self, value: Any) -> int:
+        """
+        Publishes a new version. The previous version is unlinked; readers that attached it keep their mapping.
+
+        :param value: The object to share
+        :type value: Any
+
+        :return: The number of the published version.
+        :rtype: int
+        """
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self.version += 1
+        segment = create_segment(f'{self.name}-{self.version}', max(1, len(data)))
+        segment.buf[:len(data)] = data
+        sequence = 2 * self.version
+        name = segment.name.lstrip('/').encode()
+        buf = self.pointer.buf
+        struct.pack_into('=Q', buf, 0, sequence - 1)
+        buf[_POINTER.size:_POINTER.size + len(name)] = name
+        _POINTER.pack_into(buf, 0, sequence, len(name))
+        self.segments.append(segment)
+        while len(self.segments) > 2:
+            unlink_segment(self.segments.pop(0))
+        return self.version
+
+    def close(self) -> None:
+        """
+        Unlinks the pointer segment and every version.
+
+        :return: None
+        :rtype: None
+        """
+        for segment in self.segments:
+            unlink_segment(segment)
+        self.segments = []
+        unlink_segment(self.pointer)
+
+
+class SnapshotReader:
+    """
+    The SnapshotReader class loads the latest version published by a SnapshotPublisher, unpickling it
+    only when a new version has been published since the previous call.
+    """
+
+    def __init__(self, name: str) -> None:
+        """
+        :param name: The name of the pointer segment
+        :type name: str
+
+        :return: None
+        :rtype: None
+        """
+        self.pointer = attach_segment(name)
+        self.version = 0
+        self.value: Any = None
+
+    def load(self, default: Any = None) -> Any:
+        """
+        :param default: The value returned while nothing has been published (default: None)
+        :type default: Any
+
+        :return: The latest published object.
+        :rtype: Any
+        """
+        for _ in range(100):
+            buf = self.pointer.buf
+            sequence, length = _POINTER.unpack_from(buf, 0)
+            if sequence & 1:
+                continue
+            name = bytes(buf[_POINTER.size:_POINTER.size + length]).decode()
+            if _POINTER.unpack_from(buf, 0)[0] != sequence:
+                continue
+            if sequence == 0:
+                return default
+            if sequence // 2 == self.version:
+                return self.value
+            try:
+                segment = attach_segment(name)
+            except FileNotFoundError:
+                continue
+            try:
+                self.value = pickle.loads(segment.buf)
+            finally:
+                segment.close()
+            self.version = sequence // 2
+            return self.value
+        return self.value if self.version else default
+
+    def close(self) -> None:
+        self.pointer.close()
@@ -0,0 +1,368 @@
+import asyncio
+import mmap
+import socket
+import struct
+import threading
+
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from collector.client import get_client
+from collector.shm import RingReader, SharedRing
+
+from .filters import attach_filter
+from .pcap import LINKTYPE_ETHERNET, LINKTYPE_RAW, Frame, PcapStream
+
+
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_USER = 1
+TP_STATUS_VLAN_VALID = 1 << 4
+TP_STATUS_VLAN_TPID_VALID = 1 << 6
+PACKET_OUTGOING = 4
+
+_STATUS = struct.Struct('=I')
+_BLOCK_HDR = struct.Struct('=II')
+_PACKET_HDR = struct.Struct('=IIIIIIHH')
+_VLAN_HDR = struct.Struct('=IH')
+_SLL_PKTTYPE_OFFSET = 48 + 10
+_ARPHRD_LINKTYPES = {1: LINKTYPE_ETHERNET, 772: LINKTYPE_ETHERNET, 65534: LINKTYPE_RAW}
+
+
+class BackendUnavailable(OSError):
+    """
+    Raised when a capture backend cannot be used on this host, e.g. without AF_PACKET sockets or a collector process.
+    """
+
+
+class CaptureBackend(ABC):
+    """
+    The CaptureBackend class is the interface of the packet sources used by the capture engine.
+    A backend is opened once, then read in batches of frames until it is closed.
+    """
+    name = ''
+
+    def __init__(self, interface: str = 'wlp4s0', snaplen: int = 65535) -> None:
+        """
+        :param interface: The network interface to capture packets from (default: 'wlp4s0')
+        :type interface: str
+        :param snaplen: The maximum number of bytes kept from every frame (default: 65535)
+        :type snaplen: int
+
+        :return: None
+        :rtype: None
+        """
+        self.interface = interface
+        self.snaplen = snaplen
+        self.linktype = LINKTYPE_ETHERNET
+
+    @abstractmethod
+    async def open(self) -> None:
+        pass
+
+    @abstractmethod
+    async def read(self) -> List[Frame]:
+        """
+        Asynchronously waits for captured frames.
+
+        :return: A non-empty list of (timestamp, frame bytes, original length) tuples,
+                 or an empty list once the source is exhausted.
+        :rtype: list
+        """
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: A dictionary with the number of packets received and dropped by the kernel.
+        :rtype: dict
+        """
+        return {'kernel_received': 0, 'kernel_dropped': 0}
+
+
+class AfPacketBackend(CaptureBackend):
+    """
+    The AfPacketBackend class captures packets in-process through a Linux AF_PACKET socket with a memory-mapped
+    TPACKET_V3 receive ring. Packet headers are read in place from the ring and only the frame bytes are copied
+    out before a block is handed back to the kernel.
+    """
+    name = 'af_packet'
+
+    def __init__(self, interface: str = 'wlp4s0', snaplen: int = 65535, block_size: int = 1 << 20,
+                 block_nr: int = 16, timeout_ms: int = 8, bpf: Optional[List[Tuple[int, int, int, int]]] = None) -> None:
+        """
+        :param interface: The network interface to capture packets from (default: 'wlp4s0')
+        :type interface: str
+        :param snaplen: The maximum number of bytes kept from every frame (default: 65535)
+        :type snaplen: int
+        :param block_size: The size of a ring block, a multiple of the page size (default: 1 MiB)
+        :type block_size: int
+        :param block_nr: The number of blocks in the ring (default: 16)
+        :type block_nr: int
+        :param timeout_ms: The time after which the kernel retires a partially filled block (default: 8)
+        :type timeout_ms: int
+        :param bpf: A classic BPF program for Ethernet frames attached to the socket, so the kernel drops
+                    non-matching frames; it is not attached on interfaces of another link type (default: none)
+        :type bpf: list
+
+        :return: None
+        :rtype: None
+        """
+        super().__init__(interface, snaplen)
+        self.block_size = block_size
+        self.block_nr = block_nr
+        self.timeout_ms = timeout_ms
+        self.bpf = bpf
+        self._sock: Optional[socket.socket] = None
+        self._ring: Optional[mmap.mmap] = None
+        self._block = 0
+        self._loopback = False
+        self._received = 0
+        self._dropped = 0
+        self._stats_lock = threading.Lock()
+
+    async def open(self) -> None:
+        if not hasattr(socket, 'AF_PACKET'):
+            raise BackendUnavailable('AF_PACKET sockets are not available on this platform')
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            try:
+                sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+                frame_size = 2048
+                sock.setsockopt(SOL_PACKET, PACKET_RX_RING, struct.pack(
+                    '=IIIIIII', self.block_size, self.block_nr, frame_size,
+                    self.block_size // frame_size * self.block_nr, self.timeout_ms, 0, 0
+                ))
+                self._ring = mmap.mmap(sock.fileno(), self.block_size * self.block_nr)
+            except OSError as error:
+                raise BackendUnavailable(f'TPACKET_V3 receive rings are not available: {error}') from error
+            sock.bind((self.interface, ETH_P_ALL))
+            if self.bpf is not None and _ARPHRD_LINKTYPES.get(sock.getsockname()[3]) == LINKTYPE_ETHERNET:
+                attach_filter(sock, self.bpf)
+            sock.setblocking(False)
+        except BaseException:
+            if self._ring is not None:
+                self._ring.close()
+                self._ring = None
+            sock.close()
+            raise
+        hatype = sock.getsockname()[3]
+        self._loopback = hatype == 772
+        self.linktype = _ARPHRD_LINKTYPES.get(hatype, LINKTYPE_ETHERNET)
+        self._sock = sock
+
+    async def read(self) -> List[Frame]:
+        while True:
+            offset = self._block * self.block_size
+            if _STATUS.unpack_from(self._ring, offset + 8)[0] & TP_STATUS_USER:
+                frames = self._read_block(offset)
+                _STATUS.pack_into(self._ring, offset + 8, 0)
+                self._block = (self._block + 1) % self.block_nr
+                if frames:
+                    return frames
+            else:
+                await self._wait_readable()
+
+    def _read_block(self, offset: int) -> List[Frame]:
+        ring = self._ring
+        snaplen = self.snaplen
+        num_pkts, packet = _BLOCK_HDR.unpack_from(ring, offset + 12)
+        packet += offset
+        frames = []
+        for _ in range(num_pkts):
+            next_offset, sec, nsec, caplen, wirelen, status, mac, _net = _PACKET_HDR.unpack_from(ring, packet)
+            if not (self._loopback and ring[packet + _SLL_PKTTYPE_OFFSET] == PACKET_OUTGOING):
+                data = ring[packet + mac:packet + mac + min(caplen, snaplen)]
+                if status & TP_STATUS_VLAN_VALID:
+                    tci, tpid = _VLAN_HDR.unpack_from(ring, packet + 32)
+                    tpid = tpid if status & TP_STATUS_VLAN_TPID_VALID else 0x8100
+                    data = data[:12] + struct.pack('!HH', tpid, tci & 0xffff) + data[12:]
+                frames.append((sec + nsec * 1e-9, data, wirelen))
+            packet += next_offset
+        return frames
+
+    async def _wait_readable(self) -> None:
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = self._sock.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(fd)
+
+    async def close(self) -> None:
+        if self._sock is not None:
+            self.stats()
+            with self._stats_lock:
+                self._sock.close()
+                self._sock = None
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            if self._sock is not None:
+                received, dropped, _ = struct.unpack('=III', self._sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12))
+                self._received += received
+                self._dropped += dropped
+        return {'kernel_received': self._received, 'kernel_dropped': self._dropped}
+
+
+class TcpdumpBackend(CaptureBackend):
+    """
+    The TcpdumpBackend class captures packets with a 'sudo tcpdump' child process writing a binary pcap stream
+    to its stdout. It is the fallback when AF_PACKET sockets are not available.
+    """
+    name = 'tcpdump'
+
+    def __init__(self, interface: str = 'wlp4s0', snaplen: int = 65535) -> None:
+        super().__init__(interface, snaplen)
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._stream = PcapStream()
+
+    def command(self) -> List[str]:
+        """
+        Builds the argv of the capture process.
+
+        :return: The tcpdump command line without any filter expression.
+        :rtype: list
+        """
+        return ['sudo', 'tcpdump', '-i', self.interface, '-U', '-s', str(self.snaplen), '-w', '-']
+
+    async def open(self) -> None:
+        self._process = await asyncio.create_subprocess_exec(
+            *self.command(),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+
+    async def read(self) -> List[Frame]:
+        while True:
+            chunk = await self._process.stdout.read(1 << 16)
+            if not chunk:
+                return []
+            frames = self._stream.feed(chunk)
+            if self._stream.linktype is not None:
+                self.linktype = self._stream.linktype
+            if frames:
+                return frames
+
+    async def close(self) -> None:
+        process, self._process = self._process, None
+        if process is None or process.returncode is not None:
+            return
+        try:
+            process.terminate()
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(process.wait(), timeout=1)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+
+class SharedRingBackend(CaptureBackend):
+    """
+    The SharedRingBackend class reads the frames captured by the collector process from a shared memory ring.
+    It is used by the API workers in multi-worker mode, so an interface is captured once whatever the number
+    of workers. Empty polls back off from 1 ms up to `max_poll` seconds.
+    """
+    name = 'shared'
+    max_poll = 0.02
+
+    def __init__(self, interface: str = 'wlp4s0', snaplen: int = 65535) -> None:
+        super().__init__(interface, snaplen)
+        self._ring: Optional[SharedRing] = None
+        self._reader: Optional[RingReader] = None
+        self._pending: List[Tuple[float, bytes, int, int]] = []
+
+    async def open(self) -> None:
+        client = get_client()
+        if client is None:
+            raise BackendUnavailable('The collector process is not running')
+        self._ring = SharedRing.attach(await client.acall('capture', self.interface))
+        self._reader = self._ring.reader()
+
+    async def read(self) -> List[Frame]:
+        delay = 0.001
+        while not self._pending:
+            self._pending = self._reader.read()
+            if self._pending:
+                break
+            if self._ring.closed:
+                return []
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, self.max_poll)
+        linktype = self.linktype = self._pending[0][3]
+        count = next((i for i, x in enumerate(self._pending) if x[3] != linktype), len(self._pending))
+        frames, self._pending = self._pending[:count], self._pending[count:]
+        return [(ts, data, wirelen) for ts, data, wirelen, _ in frames]
+
+    async def close(self) -> None:
+        ring, self._ring = self._ring, None
+        if ring is None:
+            return
+        ring.close()
+        try:
+            await get_client().acall('release', self.interface)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: A dictionary with the kernel counters (kept by the collector) and the number of bytes
+                 of frames overwritten in the ring before this worker read them.
+        :rtype: dict
+        """
+        return {'kernel_received': 0, 'kernel_dropped': 0, 'ring_lost_bytes': self._reader.lost if self._reader else 0}
+
+
+BACKENDS = {
+    AfPacketBackend.name: AfPacketBackend,
+    TcpdumpBackend.name: TcpdumpBackend,
+    SharedRingBackend.name: SharedRingBackend,
+}
+
+
+async def open_backend(interface: str = 'wlp4s0', name: str = 'auto', snaplen: int = 65535,
+                       bpf: Optional[List[Tuple[int, int, int, int]]] = None) -> CaptureBackend:
+    """
+    Asynchronously opens a capture backend on a network interface.
+
+    :param interface: The network interface to capture packets from (default: 'wlp4s0')
+    :type interface: str
+    :param name: The backend to use: 'af_packet', 'tcpdump', 'shared' or 'auto' to read from the collector
+                 process in multi-worker mode, else to try AF_PACKET first and fall back to tcpdump (default: 'auto')
+    :type name: str
+    :param snaplen: The maximum number of bytes kept from every frame (default: 65535)
+    :type snaplen: int
+    :param bpf: A classic BPF program run in the kernel by the AF_PACKET backend; the other backends ignore it (default: none)
+    :type bpf: list
+
+    :return: An opened capture backend.
+    :rtype: CaptureBackend
+    """
+    if name != 'auto':
+        backend = AfPacketBackend(interface, snaplen, bpf=bpf) if name == AfPacketBackend.name else BACKENDS[name](interface, snaplen)
+        await backend.open()
+        return backend
+    if get_client() is not None:
+        backend = SharedRingBackend(interface, snaplen)
+        await backend.open()
+        return backend
+    try:
+        backend = AfPacketBackend(interface, snaplen, bpf=bpf)
+        await backend.open()
+    except (BackendUnavailable, PermissionError):
+        backend = TcpdumpBackend(interface, snaplen)
+        await backend.open()
+    return backend
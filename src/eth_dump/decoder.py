@@ -0,0 +1,294 @@
+import socket
+import struct
+
+from typing import Any, Dict, Iterator, Optional
+
+from .pcap import PCAPNG_MAGIC, LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL, LINKTYPE_RAW, iter_pcap, iter_pcapng
+
+
+PROTOCOLS = {1: 'ICMP', 6: 'TCP', 17: 'UDP', 58: 'ICMP6'}
+_TCP_FLAGS = 'FSRPAUEC'
+_IPV6_EXTENSIONS = {0, 43, 60}
+_VLAN_TYPES = {0x8100, 0x88a8}
+_FAMILIES = {0x0800: 'IP', 0x86dd: 'IP6', 0x0806: 'ARP'}
+_TCP_HDR = struct.Struct('!HHIIBBH')
+_PORTS = struct.Struct('!HH')
+
+
+def tcp_flags_notation(flags: int) -> str:
+    """
+    Formats TCP flags in tcpdump notation.
+
+    :param flags: The flags byte of a TCP header
+    :type flags: int
+
+    :return: The flags such as 'S', 'S.', 'P.', 'F.' or 'R' ('.' stands for ACK).
+    :rtype: str
+    """
+    letters = ''.join(x for i, x in enumerate(_TCP_FLAGS) if flags & 1 << i and x != 'A')
+    return letters + '.' if flags & 0x10 else letters or 'none'
+
+
+class Packet:
+    """
+    The Packet class is a compact record of a captured frame. Only the raw bytes are stored; the header offsets are
+    located on first access to any field and the fields themselves are unpacked only when they are read.
+    """
+    __slots__ = ('ts', 'data', 'length', 'linktype', '_ethertype', '_vlan', '_net', '_proto', '_trans', '_end')
+
+    def __init__(self, ts: float, data: bytes, length: Optional[int] = None, linktype: int = LINKTYPE_ETHERNET) -> None:
+        """
+        :param ts: The capture timestamp of the frame
+        :type ts: float
+        :param data: The captured bytes of the frame
+        :type data: bytes
+        :param length: The original length of the frame (default: the captured length)
+        :type length: int
+        :param linktype: The pcap link type of the frame (default: Ethernet)
+        :type linktype: int
+
+        :return: None
+        :rtype: None
+        """
+        self.ts = ts
+        self.data = data
+        self.length = len(data) if length is None else length
+        self.linktype = linktype
+        self._net = None
+
+    def _decode(self) -> None:
+        data = self.data
+        size = len(data)
+        self._vlan = None
+        self._proto = None
+        self._trans = -1
+        self._end = size
+        ethertype = None
+        net = -1
+        if self.linktype == LINKTYPE_ETHERNET and size >= 14:
+            ethertype = data[12] << 8 | data[13]
+            net = 14
+            while ethertype in _VLAN_TYPES and size >= net + 4:
+                if self._vlan is None:
+                    self._vlan = (data[net] << 8 | data[net + 1]) & 0x0fff
+                ethertype = data[net + 2] << 8 | data[net + 3]
+                net += 4
+        elif self.linktype == LINKTYPE_LINUX_SLL and size >= 16:
+            ethertype = data[14] << 8 | data[15]
+            net = 16
+        elif self.linktype == LINKTYPE_RAW and size:
+            ethertype = 0x86dd if data[0] >> 4 == 6 else 0x0800
+            net = 0
+        self._ethertype = ethertype
+        self._net = net
+
+        if ethertype == 0x0800 and size >= net + 20:
+            self._proto = data[net + 9]
+            self._end = min(size, net + (data[net + 2] << 8 | data[net + 3]))
+            if not (data[net + 6] << 8 | data[net + 7]) & 0x1fff:
+                self._trans = net + (data[net] & 0x0f) * 4
+        elif ethertype == 0x86dd and size >= net + 40:
+            proto = data[net + 6]
+            trans = net + 40
+            self._end = min(size, trans + (data[net + 4] << 8 | data[net + 5]))
+            while proto in _IPV6_EXTENSIONS and size >= trans + 2:
+                proto, trans = data[trans], trans + (data[trans + 1] + 1) * 8
+            if proto == 44 and size >= trans + 8:
+                fragment = data[trans + 2] << 8 | data[trans + 3]
+                proto, trans = data[trans], trans + 8 if not fragment & 0xfff8 else -1
+            self._proto = proto
+            self._trans = trans
+        elif ethertype not in _FAMILIES:
+            self._net = -1
+
+    def _offsets(self) -> None:
+        if self._net is None:
+            self._decode()
+
+    @property
+    def eth_src(self) -> Optional[str]:
+        if self.linktype != LINKTYPE_ETHERNET or len(self.data) < 14:
+            return None
+        return self.data[6:12].hex(':')
+
+    @property
+    def eth_dst(self) -> Optional[str]:
+        if self.linktype != LINKTYPE_ETHERNET or len(self.data) < 14:
+            return None
+        return self.data[0:6].hex(':')
+
+    @property
+    def vlan(self) -> Optional[int]:
+        self._offsets()
+        return self._vlan
+
+    @property
+    def family(self) -> Optional[str]:
+        self._offsets()
+        return _FAMILIES.get(self._ethertype) if self._net >= 0 else None
+
+    @property
+    def proto(self) -> Optional[int]:
+        self._offsets()
+        return self._proto
+
+    @property
+    def proto_name(self) -> Optional[str]:
+        proto = self.proto
+        return None if proto is None else PROTOCOLS.get(proto, f'ip-proto-{proto}')
+
+    def _address(self, v4: int, v6: int) -> Optional[bytes]:
+        self._offsets()
+        if self._proto is None:
+            return None
+        if self._ethertype == 0x0800:
+            return self.data[self._net + v4:self._net + v4 + 4]
+        return self.data[self._net + v6:self._net + v6 + 16]
+
+    @property
+    def src_raw(self) -> Optional[bytes]:
+        return self._address(12, 8)
+
+    @property
+    def dst_raw(self) -> Optional[bytes]:
+        return self._address(16, 24)
+
+    @property
+    def src(self) -> Optional[str]:
+        raw = self.src_raw
+        return None if raw is None else socket.inet_ntop(socket.AF_INET if len(raw) == 4 else socket.AF_INET6, raw)
+
+    @property
+    def dst(self) -> Optional[str]:
+        raw = self.dst_raw
+        return None if raw is None else socket.inet_ntop(socket.AF_INET if len(raw) == 4 else socket.AF_INET6, raw)
+
+    @property
+    def ttl(self) -> Optional[int]:
+        self._offsets()
+        if self._proto is None:
+            return None
+        return self.data[self._net + (8 if self._ethertype == 0x0800 else 7)]
+
+    def _has_ports(self) -> bool:
+        self._offsets()
+        return self._proto in (6, 17) and self._trans >= 0 and len(self.data) >= self._trans + 4
+
+    @property
+    def sport(self) -> Optional[int]:
+        return _PORTS.unpack_from(self.data, self._trans)[0] if self._has_ports() else None
+
+    @property
+    def dport(self) -> Optional[int]:
+        return _PORTS.unpack_from(self.data, self._trans)[1] if self._has_ports() else None
+
+    def _tcp(self) -> Optional[tuple]:
+        self._offsets()
+        if self._proto != 6 or self._trans < 0 or len(self.data) < self._trans + 16:
+            return None
+        return _TCP_HDR.unpack_from(self.data, self._trans)
+
+    @property
+    def tcp_flags(self) -> Optional[int]:
+        tcp = self._tcp()
+        return None if tcp is None else tcp[5]
+
+    @property
+    def flags(self) -> Optional[str]:
+        """
+        :return: The TCP flags in tcpdump notation ('S', 'S.', 'P.', 'F.', 'R', ...), or None for other packets.
+        :rtype: str
+        """
+        flags = self.tcp_flags
+        return None if flags is None else tcp_flags_notation(flags)
+
+    @property
+    def seq(self) -> Optional[int]:
+        tcp = self._tcp()
+        return None if tcp is None else tcp[2]
+
+    @property
+    def ack(self) -> Optional[int]:
+        tcp = self._tcp()
+        return None if tcp is None or not tcp[5] & 0x10 else tcp[3]
+
+    @property
+    def window(self) -> Optional[int]:
+        tcp = self._tcp()
+        return None if tcp is None else tcp[6]
+
+    @property
+    def icmp_type(self) -> Optional[int]:
+        self._offsets()
+        if self._proto not in (1, 58) or self._trans < 0 or len(self.data) < self._trans + 2:
+            return None
+        return self.data[self._trans]
+
+    @property
+    def icmp_code(self) -> Optional[int]:
+        return None if self.icmp_type is None else self.data[self._trans + 1]
+
+    @property
+    def payload_length(self) -> Optional[int]:
+        """
+        :return: The length of the transport payload according to the IP header, or None if it is unknown.
+        :rtype: int
+        """
+        self._offsets()
+        if self._trans < 0:
+            return None
+        if self._proto == 6:
+            tcp = self._tcp()
+            return None if tcp is None else max(0, self._end - self._trans - (tcp[4] >> 4) * 4)
+        if self._proto == 17:
+            return max(0, self._end - self._trans - 8)
+        return max(0, self._end - self._trans)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Decodes every field of the packet.
+
+        :return: A dictionary with the timestamp, lengths, link, network and transport header fields of the packet.
+                 Fields that are absent from the packet are None.
+        :rtype: dict
+        """
+        return {
+            'ts': self.ts,
+            'length': self.length,
+            'eth_src': self.eth_src,
+            'eth_dst': self.eth_dst,
+            'vlan': self.vlan,
+            'family': self.family,
+            'src': self.src,
+            'dst': self.dst,
+            'ttl': self.ttl,
+            'proto': self.proto_name,
+            'sport': self.sport,
+            'dport': self.dport,
+            'flags': self.flags,
+            'seq': self.seq,
+            'ack': self.ack,
+            'window': self.window,
+            'icmp_type': self.icmp_type,
+            'icmp_code': self.icmp_code,
+            'payload_length': self.payload_length,
+        }
+
+
+def decode_pcap(data: bytes) -> Iterator[Packet]:
+    """
+    Decodes the packets of a pcap or pcapng file held in memory (bytes or a memory map).
+
+    :param data: The contents of the pcap or pcapng file
+    :type data: bytes
+
+    :return: An iterator over the packets of the file.
+    :rtype: iterator
+    """
+    if bytes(data[:4]) == PCAPNG_MAGIC:
+        for ts, frame, length, linktype in iter_pcapng(data):
+            yield Packet(ts, frame, length, linktype)
+        return
+    linktype, frames = iter_pcap(data)
+    for ts, frame, length in frames:
+        yield Packet(ts, frame, length, linktype)
@@ -0,0 +1,491 @@
+import asyncio
+import math
+import os
+import random
+import socket
+
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from .backends import CaptureBackend, open_backend
+from .decoder import Packet
+
+
+_LOOPBACK = frozenset({socket.inet_pton(socket.AF_INET, '127.0.0.1'), socket.inet_pton(socket.AF_INET6, '::1')})
+
+
+def _pack_address(host: str) -> Optional[bytes]:
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            return socket.inet_pton(family, host)
+        except OSError:
+            pass
+    return None
+
+
+class PacketFilter:
+    """
+    The PacketFilter class is a userspace analogue of the tcpdump primitives used by the eth_dump routes
+    ('<type> and host <host> and port <port>'), applied to the packets produced by a shared capture engine.
+    Host addresses are compared in their packed form, so matching never formats an address.
+    """
+    __slots__ = ('type', 'host', 'port', 'addresses')
+    types = ('ip', 'ip6', 'arp', 'tcp', 'udp', 'icmp', 'icmp6', 'vlan')
+
+    def __init__(self, type: Optional[str] = None, host: Optional[str] = None, port: Optional[int] = None) -> None:
+        """
+        Initializes a new filter. Every criterion that is None matches any packet.
+        A host given by name matches nothing until the filter is resolved with `resolve`.
+
+        :param type: The type of packets to match (ip, ip6, arp, tcp, udp, icmp, icmp6, vlan)
+        :type type: str
+        :param host: The source or destination address to match ('localhost' matches the loopback addresses)
+        :type host: str
+        :param port: The source or destination port to match
+        :type port: int
+
+        :return: None
+        :rtype: None
+        """
+        self.type = type.lower() if type else None
+        if self.type is not None and self.type not in self.types:
+            raise ValueError(f'Unknown packet type: {type}')
+        self.host = host
+        self.port = port
+        self.addresses: Optional[FrozenSet[bytes]] = None
+        if host == 'localhost':
+            self.addresses = _LOOPBACK
+        elif host is not None and _pack_address(host) is not None:
+            self.addresses = frozenset({_pack_address(host)})
+
+    async def resolve(self) -> 'PacketFilter':
+        """
+        Asynchronously resolves the host name of the filter to its addresses.
+
+        :return: The filter itself.
+        :rtype: PacketFilter
+        """
+        if self.host is not None and self.addresses is None:
+            try:
+                infos = await asyncio.get_running_loop().getaddrinfo(self.host, None)
+            except OSError:
+                infos = []
+            self.addresses = frozenset(_pack_address(x[4][0]) for x in infos)
+        return self
+
+    def match(self, packet: Packet) -> bool:
+        """
+        Checks whether a captured packet satisfies the filter.
+
+        :param packet: The captured packet
+        :type packet: Packet
+
+        :return: True if the packet matches every criterion of the filter.
+        :rtype: bool
+        """
+        if self.type is not None and not self._match_type(packet):
+            return False
+        if self.host is not None:
+            if not self.addresses or (packet.src_raw not in self.addresses and packet.dst_raw not in self.addresses):
+                return False
+        if self.port is not None and self.port != packet.sport and self.port != packet.dport:
+            return False
+        return True
+
+    def _match_type(self, packet: Packet) -> bool:
+        if self.type == 'ip':
+            return packet.family == 'IP'
+        if self.type == 'ip6':
+            return packet.family == 'IP6'
+        if self.type == 'arp':
+            return packet.family == 'ARP'
+        if self.type == 'vlan':
+            return packet.vlan is not None
+        if self.type == 'tcp':
+            return packet.proto == 6
+        if self.type == 'udp':
+            return packet.proto == 17
+        if self.type == 'icmp':
+            return packet.proto == 1
+        return packet.proto == 58
+
+
+class PacketSampler:
+    """
+    The PacketSampler class thins out the packets delivered to a subscriber on a busy link: systematic 1-in-N
+    sampling, then probabilistic sampling, then a token bucket limiting the packets per second, measured on the
+    capture timestamps. Sampled packets can also be truncated to their first `snaplen` bytes, enough for the headers.
+    """
+    __slots__ = ('every', 'probability', 'rate', 'burst', 'snaplen', 'sampled_out', 'rate_limited',
+                 '_count', '_tokens', '_last', '_random')
+
+    def __init__(self, every: int = 1, probability: float = 1.0, rate: Optional[float] = None,
+                 burst: Optional[int] = None, snaplen: Optional[int] = None, seed: Optional[int] = None) -> None:
+        """
+        :param every: Keep one matching packet out of `every`, starting with the first one (default: 1, keep all)
+        :type every: int
+        :param probability: The probability with which each remaining packet is kept (default: 1.0)
+        :type probability: float
+        :param rate: The maximum number of packets kept per second (default: no limit)
+        :type rate: float
+        :param burst: The number of packets that may be kept at once above the rate (default: one second worth of packets)
+        :type burst: int
+        :param snaplen: The maximum number of bytes kept from every packet (default: the whole captured frame)
+        :type snaplen: int
+        :param seed: The seed of the random generator of the probabilistic sampling (default: random)
+        :type seed: int
+
+        :return: None
+        :rtype: None
+        """
+        if every < 1:
+            raise ValueError(f'Invalid sampling interval: {every}')
+        if not 0 < probability <= 1:
+            raise ValueError(f'Invalid sampling probability: {probability}')
+        if rate is not None and rate <= 0:
+            raise ValueError(f'Invalid rate limit: {rate}')
+        if snaplen is not None and snaplen < 1:
+            raise ValueError(f'Invalid snapshot length: {snaplen}')
+        self.every = every
+        self.probability = probability
+        self.rate = rate
+        self.burst = max(1, burst if burst is not None else math.ceil(rate or 1))
+        self.snaplen = snaplen
+        self.sampled_out = 0
+        self.rate_limited = 0
+        self._count = 0
+        self._tokens = float(self.burst)
+        self._last: Optional[float] = None
+        self._random = random.Random(seed).random
+
+    def admit(self, packet: Packet) -> Optional[Packet]:
+        """
+        Decides whether a matching packet is kept.
+
+        :param packet: The matching packet
+        :type packet: Packet
+
+        :return: The packet, truncated to `snaplen` bytes, or None if it is sampled out or over the rate limit.
+        :rtype: Packet
+        """
+        if self.every > 1:
+            skip = self._count
+            self._count = (skip + 1) % self.every
+            if skip:
+                self.sampled_out += 1
+                return None
+        if self.probability < 1.0 and self._random() >= self.probability:
+            self.sampled_out += 1
+            return None
+        if self.rate is not None:
+            if self._last is not None:
+                self._tokens = min(self.burst, self._tokens + max(0.0, packet.ts - self._last) * self.rate)
+            self._last = packet.ts
+            if self._tokens < 1.0:
+                self.rate_limited += 1
+                return None
+            self._tokens -= 1.0
+        if self.snaplen is not None and len(packet.data) > self.snaplen:
+            packet = Packet(packet.ts, packet.data[:self.snaplen], packet.length, packet.linktype)
+        return packet
+
+
+class Subscription:
+    """
+    The Subscription class is a bounded queue of packets that match a filter, fed by a CaptureEngine.
+    """
+
+    def __init__(self, engine: 'CaptureEngine', packet_filter: PacketFilter, maxsize: int,
+                 sampler: Optional[PacketSampler] = None) -> None:
+        self.engine = engine
+        self.filter = packet_filter
+        self.sampler = sampler
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.matched = 0
+        self.dropped = 0
+        self.final: Optional[Dict[str, int]] = None
+        self._baseline = engine.backend_stats()
+
+    def push(self, item: Packet) -> None:
+        self.matched += 1
+        if self.sampler is not None:
+            item = self.sampler.admit(item)
+            if item is None:
+                return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: A dictionary with the counters of the backend since the subscription started, e.g. the packets
+                 received and dropped by the kernel for the whole interface, and the userspace counters of the subscription:
+                 the matching packets, those sampled out or over the rate limit and those dropped because the queue was full.
+                 Once unsubscribed, the counters are those of the moment it left.
+        :rtype: dict
+        """
+        if self.final is not None:
+            return self.final
+        stats = {x: max(0, y - self._baseline.get(x, 0)) for x, y in self.engine.backend_stats().items()}
+        stats.update(
+            matched=self.matched,
+            sampled_out=self.sampler.sampled_out if self.sampler is not None else 0,
+            rate_limited=self.sampler.rate_limited if self.sampler is not None else 0,
+            queue_dropped=self.dropped,
+        )
+        return stats
+
+    def close(self) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(None)
+
+    async def get(self) -> Optional[Packet]:
+        """
+        Waits for the next matching packet.
+
+        :return: The next packet, or None once the capture has stopped.
+        :rtype: Packet
+        """
+        item = await self.queue.get()
+        if item is None:
+            self.queue.put_nowait(None)
+            if self.engine.error is not None:
+                raise self.engine.error
+        return item
+
+    async def __aenter__(self) -> 'Subscription':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.engine.unsubscribe(self)
+
+
+class CaptureEngine:
+    """
+    The CaptureEngine class owns a single long-lived capture backend on a network interface and fans the captured
+    packets out to any number of subscribers, each with its own filter.
+    """
+    linger = 5.0
+
+    def __init__(self, interface: str = 'wlp4s0', backend: str = 'auto',
+                 bpf: Optional[List[Tuple[int, int, int, int]]] = None, snaplen: int = 65535) -> None:
+        """
+        Initializes a new engine. The capture backend is opened with the first subscriber and closed
+        `linger` seconds after the last one leaves.
+
+        :param interface: The network interface to capture packets from (default: 'wlp4s0')
+        :type interface: str
+        :param backend: The capture backend to use: 'af_packet', 'tcpdump' or 'auto' (default: 'auto')
+        :type backend: str
+        :param bpf: A classic BPF program run in the kernel before packets reach the engine, for engines
+                    not shared between unrelated subscribers (default: none, see `filters.compile_filter`)
+        :type bpf: list
+        :param snaplen: The maximum number of bytes the backend copies from every frame (default: 65535)
+        :type snaplen: int
+
+        :return: None
+        :rtype: None
+        """
+        self.interface = interface
+        self.backend_name = backend
+        self.bpf = bpf
+        self.snaplen = snaplen
+        self.loop = asyncio.get_running_loop()
+        self.subscribers: List[Subscription] = []
+        self.taps: List[Callable[[Packet], None]] = []
+        self.error: Optional[BaseException] = None
+        self.tap_errors = 0
+        self.tap_error: Optional[str] = None
+        self.packets_seen = 0
+        self.packets_dropped = 0
+        self.backend: Optional[CaptureBackend] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def subscribe(self, packet_filter: Optional[PacketFilter] = None, maxsize: int = 1024,
+                  sampler: Optional[PacketSampler] = None) -> Subscription:
+        """
+        Registers a new subscriber and opens the capture backend if it is not running yet.
+
+        :param packet_filter: The filter to apply to captured packets (default: match everything)
+        :type packet_filter: PacketFilter
+        :param maxsize: The maximum number of packets buffered for the subscriber; the excess is dropped (default: 1024)
+        :type maxsize: int
+        :param sampler: The sampling applied to the matching packets (default: keep every matching packet)
+        :type sampler: PacketSampler
+
+        :return: A subscription that can be used as an async context manager.
+        :rtype: Subscription
+        """
+        subscription = Subscription(self, packet_filter or PacketFilter(), maxsize, sampler)
+        self.subscribers.append(subscription)
+        self._start()
+        return subscription
+
+    def attach(self, tap: Callable[[Packet], None]) -> None:
+        """
+        Registers a tap: a synchronous callback invoked from the capture loop with every captured packet.
+        Taps keep the capture running like subscribers, so they must be cheap and must not block.
+        A tap raising an exception is detached and counted in `stats`, the capture goes on for the others.
+
+        :param tap: The callback
+        :type tap: callable
+
+        :return: None
+        :rtype: None
+        """
+        self.taps.append(tap)
+        self._start()
+
+    def detach(self, tap: Callable[[Packet], None]) -> None:
+        """
+        Removes a tap and schedules the capture backend to close if nothing else uses it.
+
+        :param tap: The callback passed to `attach`
+        :type tap: callable
+
+        :return: None
+        :rtype: None
+        """
+        if tap in self.taps:
+            self.taps.remove(tap)
+        self._schedule_stop()
+
+    def _start(self) -> None:
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+        if self._task is None or self._task.done():
+            self.error = None
+            self._task = self.loop.create_task(self._run())
+
+    def _schedule_stop(self) -> None:
+        if not self.subscribers and not self.taps and self._task is not None and not self._task.done():
+            if self._stop_handle is None:
+                self._stop_handle = self.loop.call_later(self.linger, self.stop)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """
+        Removes a subscriber and schedules the capture backend to close if nothing else uses it.
+
+        :param subscription: The subscription to remove
+        :type subscription: Subscription
+
+        :return: None
+        :rtype: None
+        """
+        if subscription in self.subscribers:
+            subscription.final = subscription.stats()
+            self.subscribers.remove(subscription)
+            self.packets_dropped += subscription.dropped
+        self._schedule_stop()
+
+    def stop(self) -> None:
+        """
+        Stops the capture.
+
+        :return: None
+        :rtype: None
+        """
+        self._stop_handle = None
+        if self._task is not None:
+            self._task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: A dictionary with the name of the backend, the number of captured packets, the number of packets
+                 dropped for slow subscribers, the kernel counters of the backend, the number of active subscribers and
+                 taps and the number of taps detached after raising an exception.
+        :rtype: dict
+        """
+        stats = {
+            'backend': self.backend.name if self.backend is not None else None,
+            'packets_seen': self.packets_seen,
+            'packets_dropped': self.packets_dropped + sum(x.dropped for x in self.subscribers),
+            'subscribers': len(self.subscribers),
+            'taps': len(self.taps),
+            'tap_errors': self.tap_errors,
+        }
+        stats.update(self.backend_stats())
+        return stats
+
+    def backend_stats(self) -> Dict[str, int]:
+        """
+        :return: The counters of the capture backend (see `CaptureBackend.stats`), empty if it was never opened.
+        :rtype: dict
+        """
+        return self.backend.stats() if self.backend is not None else {}
+
+    def _tap_failed(self, tap: Callable[[Packet], None], error: Exception) -> None:
+        # a new list, the capture loop keeps iterating the current one for this packet
+        self.tap_errors += 1
+        self.tap_error = f'{type(error).__name__}: {error}'
+        self.taps = [x for x in self.taps if x is not tap]
+        self._schedule_stop()
+
+    async def _open_backend(self) -> CaptureBackend:
+        return await open_backend(self.interface, self.backend_name, self.snaplen, bpf=self.bpf)
+
+    async def _run(self) -> None:
+        try:
+            self.backend = await self._open_backend()
+            while True:
+                frames = await self.backend.read()
+                if not frames:
+                    break
+                self.packets_seen += len(frames)
+                linktype = self.backend.linktype
+                for ts, data, wirelen in frames:
+                    packet = Packet(ts, data, wirelen, linktype)
+                    for tap in self.taps:
+                        try:
+                            tap(packet)
+                        except Exception as error:
+                            self._tap_failed(tap, error)
+                    for subscription in self.subscribers:
+                        if subscription.filter.match(packet):
+                            subscription.push(packet)
+        except asyncio.CancelledError:
+            pass
+        except Exception as error:
+            self.error = error
+        finally:
+            if self.backend is not None:
+                await self.backend.close()
+            for subscription in self.subscribers:
+                subscription.close()
+
+
+_engines: Dict[str, CaptureEngine] = {}
+
+
+def get_engine(interface: str = 'wlp4s0') -> CaptureEngine:
+    """
+    Returns the shared capture engine for a network interface, creating it on first use.
+    The number of bytes copied from every frame is read from the CAPTURE_SNAPLEN environment variable.
+
+    :param interface: The network interface to capture packets from (default: 'wlp4s0')
+    :type interface: str
+
+    :return: The capture engine bound to the running event loop.
+    :rtype: CaptureEngine
+    """
+    engine = _engines.get(interface)
+    if engine is None or engine.loop is not asyncio.get_running_loop():
+        engine = _engines[interface] = CaptureEngine(interface, snaplen=int(os.environ.get('CAPTURE_SNAPLEN', 65535)))
+    return engine
+
+
+def engine_stats() -> Dict[str, Dict[str, int]]:
+    """
+    :return: A dictionary mapping every interface with a capture engine to the statistics of the engine
+             (see `CaptureEngine.stats`).
+    :rtype: dict
+    """
+    return {interface: engine.stats() for interface, engine in list(_engines.items())}
@@ -1,118 +1,292 @@
 import asyncio
+import mmap
 
-from typing import Dict, List
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from .decoder import decode_pcap
+from .engine import PacketFilter, PacketSampler, Subscription, get_engine
+from .names import get_name_resolver
+
+
+async def _resolve_names(addresses: Iterable[str]) -> Dict[str, Optional[str]]:
+    """
+    Asynchronously resolves addresses to host names through the shared reverse resolver, outside of the capture path.
+
+    :param addresses: The addresses to resolve
+    :type addresses: iterable
+
+    :return: A dictionary mapping every address to its host name, or to None if it cannot be resolved.
+    :rtype: dict
+    """
+    return await get_name_resolver().resolve_many(addresses)
+
+
+def _record_addresses(records: List[Dict[str, Any]], keys: Iterable[str]) -> List[str]:
+    return [x[key] for x in records for key in keys if x.get(key)]
+
+
+async def _add_names(records: List[Dict[str, Any]], keys: Iterable[str] = ('src', 'dst')) -> None:
+    """
+    Asynchronously adds the host names of the addresses to records: '<key>_name' for every key.
+
+    :param records: The records, e.g. decoded packets or flows
+    :type records: list
+    :param keys: The fields holding the addresses (default: 'src' and 'dst')
+    :type keys: iterable
+
+    :return: None
+    :rtype: None
+    """
+    keys = tuple(keys)
+    names = await _resolve_names(_record_addresses(records, keys))
+    for record in records:
+        for key in keys:
+            record[f'{key}_name'] = names.get(record[key])
+
+
+def _attach_names(records: List[Dict[str, Any]], keys: Iterable[str] = ('src', 'dst')) -> None:
+    """
+    Adds the cached host names of the addresses to records without waiting: the names that are not cached yet are
+    None, and are set on the records after the fact, when their lookup completes.
+
+    :param records: The records, e.g. decoded packets or flows
+    :type records: list
+    :param keys: The fields holding the addresses (default: 'src' and 'dst')
+    :type keys: iterable
+
+    :return: None
+    :rtype: None
+    """
+    keys = tuple(keys)
+    resolver = get_name_resolver()
+    missing = []
+    for record in records:
+        for key in keys:
+            found, name = resolver.cached(record[key]) if record[key] else (True, None)
+            record[f'{key}_name'] = name
+            if not found:
+                missing.append((record, key))
+    if missing:
+        lookup = asyncio.ensure_future(_resolve_names(record[key] for record, key in missing))
+
+        def fill(future: asyncio.Future) -> None:
+            if not future.cancelled() and future.exception() is None:
+                names = future.result()
+                for record, key in missing:
+                    record[f'{key}_name'] = names.get(record[key])
+
+        lookup.add_done_callback(fill)
+
+
+def _scan_file(path: str, packet_filter: PacketFilter, count_pkt: int, offset: int) -> List[Dict[str, Any]]:
+    with open(path, 'rb') as file:
+        if not file.seek(0, 2):
+            return []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            packets = (x for x in decode_pcap(data) if packet_filter.match(x))
+            return [x.to_dict() for x in islice(packets, offset, offset + count_pkt if count_pkt else None)]
 
 
 class EthernetDump:
     """
     The EthernetDump class is designed to monitor the amount of sent and received traffic through a specified network interface.
+    Packets are taken from the shared capture engine of the interface, so concurrent requests do not start new tcpdump processes.
     """
 
-    async def get_data(self, interface: str = 'wlp4s0', count_pkt: int = 1, type: str = 'ip', dns: bool = False) -> Dict[str, List[str]]:
+    stream_buffer = 256
+    subscription: Optional[Subscription] = None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: The kernel and userspace counters of the latest capture of this dump (see `Subscription.stats`),
+                 empty if it has not started capturing.
+        :rtype: dict
         """
-        Asynchronously captures packets from a network interface using tcpdump and returns the parsed data in a dictionary.
+        return self.subscription.stats() if self.subscription is not None else {}
+
+    async def stream(self, interface: str = 'wlp4s0', count_pkt: int = 0, dns: bool = False,
+                     packet_filter: Optional[PacketFilter] = None,
+                     sampler: Optional[PacketSampler] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Asynchronously yields the decoded packets captured on the interface as soon as they arrive.
+        At most `stream_buffer` packets are buffered for a slow consumer; the excess is dropped for this consumer only.
+        The counters of the capture are available from `stats` while and after it runs.
+
+        :param interface: The network interface to capture packets from (default: 'wlp4s0')
+        :type interface: str
+        :param count_pkt: The number of packets to capture, 0 for no limit (default: 0)
+        :type count_pkt: int
+        :param dns: Whether or not to add the host names of the addresses to the decoded packets, from the resolver
+                    cache without waiting: names still being resolved are None when the packet is yielded (default: False)
+        :type dns: bool
+        :param packet_filter: The filter that captured packets must match (default: match everything)
+        :type packet_filter: PacketFilter
+        :param sampler: The sampling applied to the matching packets before they are decoded (default: keep all)
+        :type sampler: PacketSampler
+
+        :return: An asynchronous iterator over the decoded packets.
+        :rtype: AsyncIterator
+        """
+        packet_filter = await (packet_filter or PacketFilter()).resolve()
+        sent = 0
+        self.subscription = get_engine(interface).subscribe(packet_filter, self.stream_buffer, sampler)
+        async with self.subscription as subscription:
+            while not count_pkt or sent < count_pkt:
+                packet = await subscription.get()
+                if packet is None:
+                    break
+                record = packet.to_dict()
+                if dns:
+                    _attach_names([record])
+                yield record
+                sent += 1
+
+    async def _collect(self, interface: str, count_pkt: int, dns: bool, packet_filter: PacketFilter,
+                       sampler: Optional[PacketSampler] = None) -> Dict[str, Any]:
+        """
+        Asynchronously waits for the requested number of packets from the capture engine of the interface.
+
+        :param interface: The network interface to capture packets from
+        :type interface: str
+        :param count_pkt: The number of packets to capture
+        :type count_pkt: int
+        :param dns: Whether or not to add the host names of the addresses to the decoded packets
+        :type dns: bool
+        :param packet_filter: The filter that captured packets must match
+        :type packet_filter: PacketFilter
+        :param sampler: The sampling applied to the matching packets (default: keep all)
+        :type sampler: PacketSampler
+
+        :return: A dictionary containing the decoded packets in a list under the specified interface key,
+                 and the counters of the capture under 'stats'.
+        :rtype: dict
+        """
+        records = [x async for x in self.stream(interface, count_pkt, False, packet_filter, sampler)]
+        if dns:
+            await _add_names(records)
+        return {interface: records, 'stats': self.stats()}
+
+    async def get_data(self, interface: str = 'wlp4s0', count_pkt: int = 1, type: str = 'ip', dns: bool = False,
+                       sampler: Optional[PacketSampler] = None) -> Dict[str, Any]:
+        """
+        Asynchronously captures packets from a network interface through the shared capture engine and returns the parsed data in a dictionary.
 
         :param interface: The network interface to capture packets from (default: 'wlp4s0')
         :type interface: str
         :param count_pkt: The number of packets to capture (default: 1)
         :type count_pkt: int
-        :param type: The type of packets to capture (default: 'ip')
+        :param type: The type of packets to capture: ip, ip6, arp, tcp, udp, icmp, icmp6 or vlan (default: 'ip')
         :type type: str
-        :param dns: Whether or not to perform DNS resolution on captured packets (default: False)
+        :param dns: Whether or not to add the host names of the addresses to the decoded packets (default: False)
         :type dns: bool
+        :param sampler: The sampling applied to the matching packets (default: keep all)
+        :type sampler: PacketSampler
 
-        :return: A dictionary containing the captured data in a list under the specified interface key.
+        :return: A dictionary containing the decoded packets in a list under the specified interface key,
+                 and the counters of the capture under 'stats'.
         :rtype: dict
         """
-        process = await asyncio.create_subprocess_exec(
-            'sudo', 'tcpdump', '-i', interface, '-n' if not dns else '', '-l', '-c', str(
-                count_pkt), '-t', str(type),
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-        return {interface: [x for x in stdout.decode().split('\n') if x]}
+        return await self._collect(interface, count_pkt, dns, PacketFilter(type=type), sampler)
 
-    async def get_data_by_port(self, interface: str = "wlp4s0", count_pkt: int = 1, dns: bool = False, port: int = 443) -> Dict[str, List[str]]:
+    async def get_data_by_port(self, interface: str = "wlp4s0", count_pkt: int = 1, dns: bool = False, port: int = 443,
+                               sampler: Optional[PacketSampler] = None) -> Dict[str, Any]:
         """
-        Asynchronously captures packets from a network interface using tcpdump with 
+        Asynchronously captures packets from a network interface through the shared capture engine with 
         the specified port and returns the parsed data in a dictionary.
 
         :param interface: The network interface to capture packets from (default: 'wlp4s0')
         :type interface: str
         :param count_pkt: The number of packets to capture (default: 1)
         :type count_pkt: int
-        :param dns: Whether or not to perform DNS resolution on captured packets (default: False)
+        :param dns: Whether or not to add the host names of the addresses to the decoded packets (default: False)
         :type dns: bool
         :param port: The port to capture packets on (default: 443)
         :type port: int
+        :param sampler: The sampling applied to the matching packets (default: keep all)
+        :type sampler: PacketSampler
 
-        :return: A dictionary containing the captured data in a list under the specified interface key.
+        :return: A dictionary containing the decoded packets in a list under the specified interface key,
+                 and the counters of the capture under 'stats'.
         :rtype: dict
         """
-        process = await asyncio.create_subprocess_exec(
-            'sudo', 'tcpdump', '-i', interface, '-n' if not dns else '', '-l',
-            '-c', str(count_pkt), 'port', str(port),
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-        return {interface: [x for x in stdout.decode().split('\n') if x]}
+        return await self._collect(interface, count_pkt, dns, PacketFilter(port=port), sampler)
 
-    async def get_data_by_host(self, interface: str = "wlp4s0", count_pkt: int = 1, type: str = 'ip', dns: bool = False, host: str = "localhost") -> Dict[str, List[str]]:
+    async def get_data_by_host(self, interface: str = "wlp4s0", count_pkt: int = 1, type: str = 'ip', dns: bool = False, host: str = "localhost",
+                               sampler: Optional[PacketSampler] = None) -> Dict[str, Any]:
         """
-        Asynchronously captures packets from a network interface using tcpdump with 
+        Asynchronously captures packets from a network interface through the shared capture engine with 
         the specified host and returns the parsed data in a dictionary.
 
         :param interface: The network interface to capture packets from (default: 'wlp4s0')
         :type interface: str
         :param count_pkt: The number of packets to capture (default: 1)
         :type count_pkt: int
-        :param type: The type of packets to capture (default: 'ip')
+        :param type: The type of packets to capture: ip, ip6, arp, tcp, udp, icmp, icmp6 or vlan (default: 'ip')
         :type type: str
-        :param dns: Whether or not to perform DNS resolution on captured packets (default: False)
+        :param dns: Whether or not to add the host names of the addresses to the decoded packets (default: False)
         :type dns: bool
         :param host: The host to capture packets on (default: 'localhost')
         :type host: str
+        :param sampler: The sampling applied to the matching packets (default: keep all)
+        :type sampler: PacketSampler
 
-        :return: A dictionary containing the captured data in a list under the specified interface key.
+        :return: A dictionary containing the decoded packets in a list under the specified interface key,
+                 and the counters of the capture under 'stats'.
         :rtype: dict
         """
-        process = await asyncio.create_subprocess_exec(
-            'sudo', 'tcpdump', '-i', interface, '-n' if not dns else '', '-l',
-            '-c', str(count_pkt), '-t', type, 'and host', host,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-        return {interface: [x for x in stdout.decode().split('\n') if x]}
+        return await self._collect(interface, count_pkt, dns, PacketFilter(type=type, host=host), sampler)
 
-    async def get_data_by_host_and_port(self, interface: str = "wlp4s0", count_pkt: int = 1, type: str = 'ip', dns: bool = False, host: str = "localhost", port: int = 443) -> Dict[str, List[str]]:
+    async def get_data_by_host_and_port(self, interface: str = "wlp4s0", count_pkt: int = 1, type: str = 'ip', dns: bool = False, host: str = "localhost", port: int = 443,
+                                        sampler: Optional[PacketSampler] = None) -> Dict[str, Any]:
         """
-        Asynchronously captures packets from a network interface using tcpdump with
+        Asynchronously captures packets from a network interface through the shared capture engine with
         the specified host and port and returns the parsed data in a dictionary.
 
         :param interface: The network interface to capture packets from (default: 'wlp4s0')
         :type interface: str
         :param count_pkt: The number of packets to capture (default: 1)
         :type count_pkt: int
-        :param type: The type of packets to capture (default: 'ip')
+        :param type: The type of packets to capture: ip, ip6, arp, tcp, udp, icmp, icmp6 or vlan (default: 'ip')
         :type type: str
-        :param dns: Whether or not to perform DNS resolution on captured packets (default: False)
+        :param dns: Whether or not to add the host names of the addresses to the decoded packets (default: False)
         :type dns: bool
         :param host: The host to capture packets on (default: 'localhost')
         :type host: str
         :param port: The port to capture packets on (default: 443)
         :type port: int
+        :param sampler: The sampling applied to the matching packets (default: keep all)
+        :type sampler: PacketSampler
 
-        :return: A dictionary containing the captured data in a list under the specified interface key.
+        :return: A dictionary containing the decoded packets in a list under the specified interface key,
+                 and the counters of the capture under 'stats'.
         :rtype: dict
         """
-        process = await asyncio.create_subprocess_exec(
-            'sudo', 'tcpdump', '-i', interface, '-n' if not dns else '', '-l',
-            '-c', str(count_pkt), '-t', type, 'and host', host, 'and port', str(port),
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-        return {interface: [x for x in stdout.decode().split('\n') if x]}
+        return await self._collect(interface, count_pkt, dns, PacketFilter(type=type, host=host, port=port), sampler)
+
+    async def analyze_file(self, path: str, count_pkt: int = 0, offset: int = 0, dns: bool = False,
+                           packet_filter: Optional[PacketFilter] = None) -> List[Dict[str, Any]]:
+        """
+        Asynchronously decodes the packets of a pcap or pcapng file that match a filter, the same way as captured packets.
+        The file is memory-mapped and scanned in the default executor, so large captures are not read into memory.
+
+        :param path: The path of the pcap or pcapng file
+        :type path: str
+        :param count_pkt: The number of matching packets to return, 0 for no limit (default: 0)
+        :type count_pkt: int
+        :param offset: The number of matching packets to skip (default: 0)
+        :type offset: int
+        :param dns: Whether or not to add the host names of the addresses to the decoded packets (default: False)
+        :type dns: bool
+        :param packet_filter: The filter that packets must match (default: match everything)
+        :type packet_filter: PacketFilter
+
+        :return: A list of the decoded packets.
+        :rtype: list
+        """
+        packet_filter = await (packet_filter or PacketFilter()).resolve()
+        loop = asyncio.get_running_loop()
+        records = await loop.run_in_executor(None, _scan_file, path, packet_filter, count_pkt, offset)
+        if dns:
+            await _add_names(records)
+        return records
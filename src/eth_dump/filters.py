@@ -0,0 +1,579 @@
+import asyncio
+import ctypes
+import ipaddress
+import socket
+import struct
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple, Union
+
+from .decoder import Packet
+
+
+SO_ATTACH_FILTER = 26
+
+BPF_LD_W_ABS = 0x20
+BPF_LD_H_ABS = 0x28
+BPF_LD_B_ABS = 0x30
+BPF_LD_H_IND = 0x48
+BPF_LDX_B_MSH = 0xb1
+BPF_ALU_AND_K = 0x54
+BPF_JMP_JEQ_K = 0x15
+BPF_JMP_JGT_K = 0x25
+BPF_JMP_JGE_K = 0x35
+BPF_JMP_JSET_K = 0x45
+BPF_RET_K = 0x06
+SKF_AD_VLAN_TAG_PRESENT = 0xfffff000 + 48
+
+PROTOCOLS = ('ip', 'ip6', 'arp', 'tcp', 'udp', 'icmp', 'icmp6', 'vlan')
+DIRECTIONS = ('any', 'src', 'dst')
+
+_ETHERTYPES = {'ip': 0x0800, 'ip6': 0x86dd, 'arp': 0x0806}
+_IP_PROTOCOLS = {'tcp': 6, 'udp': 17, 'icmp': 1, 'icmp6': 58}
+_IPV6_EXTENSIONS = (0, 43, 44, 60)
+_LOOPBACK = ('127.0.0.1', '::1')
+
+Node = Tuple
+Instruction = Tuple[int, int, int, int]
+
+
+def _error(message: str, expression: Any) -> ValueError:
+    return ValueError(f'{message}: {expression!r}')
+
+
+def _direction(expression: Dict[str, Any]) -> str:
+    direction = expression.get('dir', 'any')
+    if direction not in DIRECTIONS:
+        raise _error('Unknown direction', direction)
+    return direction
+
+
+def normalize(expression: Any) -> Node:
+    """
+    Validates a filter expression and converts it to its canonical form: nested 'and'/'or' are flattened,
+    operands are sorted and deduplicated, double negations and constant operands are removed, so equivalent
+    expressions share a single compiled plan.
+
+    An expression is a dictionary holding one of:
+        - {'and': [expression, ...]}, {'or': [expression, ...]}, {'not': expression}
+        - {'proto': 'ip' | 'ip6' | 'arp' | 'tcp' | 'udp' | 'icmp' | 'icmp6' | 'vlan'}
+        - {'host': address or name, 'dir': 'any' | 'src' | 'dst'}
+        - {'net': 'address/prefix', 'dir': ...}
+        - {'port': port or [first, last], 'dir': ...}
+    An empty dictionary matches every packet.
+
+    :param expression: The filter expression
+    :type expression: dict
+
+    :return: The canonical form of the expression as nested tuples.
+    :rtype: tuple
+    """
+    if not isinstance(expression, dict):
+        raise _error('A filter expression must be an object', expression)
+    if not expression:
+        return ('true',)
+    keys = set(expression) - {'dir'}
+    if len(keys) != 1:
+        raise _error('A filter expression must have exactly one operator', expression)
+    operator = keys.pop()
+    value = expression[operator]
+    if 'dir' in expression and operator not in ('host', 'net', 'port'):
+        raise _error(f"'dir' does not apply to '{operator}'", expression)
+
+    if operator in ('and', 'or'):
+        if not isinstance(value, list) or not value:
+            raise _error(f"'{operator}' takes a non-empty list", value)
+        operands = set()
+        for item in map(normalize, value):
+            operands.update(item[1] if item[0] == operator else (item,))
+        absorbing, neutral = (('false',), ('true',)) if operator == 'and' else (('true',), ('false',))
+        if absorbing in operands:
+            return absorbing
+        operands.discard(neutral)
+        if not operands:
+            return neutral
+        if len(operands) == 1:
+            return operands.pop()
+        return (operator, tuple(sorted(operands, key=repr)))
+    if operator == 'not':
+        operand = normalize(value)
+        if operand[0] == 'not':
+            return operand[1]
+        if operand[0] in ('true', 'false'):
+            return ('false',) if operand[0] == 'true' else ('true',)
+        return ('not', operand)
+    if operator == 'proto':
+        if value not in PROTOCOLS:
+            raise _error('Unknown protocol', value)
+        return ('proto', value)
+    if operator == 'host':
+        if not isinstance(value, str) or not value:
+            raise _error('A host must be a non-empty string', value)
+        try:
+            value = str(ipaddress.ip_address(value))
+        except ValueError:
+            value = value.lower()
+        return ('host', _direction(expression), value)
+    if operator == 'net':
+        try:
+            network = ipaddress.ip_network(value, strict=False)
+        except (TypeError, ValueError):
+            raise _error('Invalid network', value) from None
+        return ('net', _direction(expression), str(network))
+    if operator == 'port':
+        first, last = (value, value) if not isinstance(value, list) else (value if len(value) == 2 else (None, None))
+        if not all(isinstance(x, int) and 0 <= x <= 65535 for x in (first, last)) or first > last:
+            raise _error('A port must be a number or a [first, last] range within 0-65535', value)
+        return ('port', _direction(expression), first, last)
+    raise _error('Unknown operator', operator)
+
+
+def _host_names(node: Node) -> List[str]:
+    if node[0] in ('and', 'or'):
+        return [x for item in node[1] for x in _host_names(item)]
+    if node[0] == 'not':
+        return _host_names(node[1])
+    if node[0] == 'host':
+        try:
+            ipaddress.ip_address(node[2])
+        except ValueError:
+            return [node[2]]
+    return []
+
+
+async def _resolve_hosts(names: List[str]) -> Dict[str, FrozenSet[bytes]]:
+    loop = asyncio.get_running_loop()
+    addresses = {}
+    for name in set(names):
+        if name == 'localhost':
+            addresses[name] = frozenset(socket.inet_pton(socket.AF_INET6 if ':' in x else socket.AF_INET, x) for x in _LOOPBACK)
+            continue
+        try:
+            infos = await loop.getaddrinfo(name, None)
+        except OSError:
+            infos = []
+        addresses[name] = frozenset(
+            socket.inet_pton(x[0], x[4][0].split('%')[0]) for x in infos if x[0] in (socket.AF_INET, socket.AF_INET6)
+        )
+    return addresses
+
+
+def _host_addresses(host: str, names: Dict[str, FrozenSet[bytes]]) -> FrozenSet[bytes]:
+    if host in names:
+        return names[host]
+    return frozenset({ipaddress.ip_address(host).packed})
+
+
+def _in_net(address: Optional[bytes], size: int, mask: int, value: int) -> bool:
+    return address is not None and len(address) == size and int.from_bytes(address, 'big') & mask == value
+
+
+def _in_range(port: Optional[int], first: int, last: int) -> bool:
+    return port is not None and first <= port <= last
+
+
+def _predicate_source(node: Node, names: Dict[str, FrozenSet[bytes]], constants: Dict[str, Any]) -> str:
+    def constant(value: Any) -> str:
+        name = f'c{len(constants)}'
+        constants[name] = value
+        return name
+
+    def fields(direction: str, src: str, dst: str) -> List[str]:
+        return {'src': [src], 'dst': [dst]}.get(direction, [src, dst])
+
+    kind = node[0]
+    if kind == 'true':
+        return 'True'
+    if kind == 'false':
+        return 'False'
+    if kind in ('and', 'or'):
+        return '(' + f' {kind} '.join(_predicate_source(x, names, constants) for x in node[1]) + ')'
+    if kind == 'not':
+        return f'(not {_predicate_source(node[1], names, constants)})'
+    if kind == 'proto':
+        name = node[1]
+        if name in _ETHERTYPES:
+            return f"(p.family == '{name.upper()}')"
+        if name == 'vlan':
+            return '(p.vlan is not None)'
+        return f'(p.proto == {_IP_PROTOCOLS[name]})'
+    if kind == 'host':
+        addresses = constant(_host_addresses(node[2], names))
+        return '(' + ' or '.join(f'p.{x} in {addresses}' for x in fields(node[1], 'src_raw', 'dst_raw')) + ')'
+    if kind == 'net':
+        network = ipaddress.ip_network(node[2])
+        arguments = f'{network.max_prefixlen // 8}, {int(network.netmask)}, {int(network.network_address)}'
+        return '(' + ' or '.join(f'_in_net(p.{x}, {arguments})' for x in fields(node[1], 'src_raw', 'dst_raw')) + ')'
+    first, last = node[2], node[3]
+    if first == last:
+        return '(' + ' or '.join(f'p.{x} == {first}' for x in fields(node[1], 'sport', 'dport')) + ')'
+    return '(' + ' or '.join(f'_in_range(p.{x}, {first}, {last})' for x in fields(node[1], 'sport', 'dport')) + ')'
+
+
+def compile_predicate(node: Node, names: Optional[Dict[str, FrozenSet[bytes]]] = None) -> Callable[[Packet], bool]:
+    """
+    Compiles a normalized expression to a Python function evaluating it on a decoded packet.
+
+    :param node: The normalized expression (see `normalize`)
+    :type node: tuple
+    :param names: The resolved addresses of the host names of the expression (default: none)
+    :type names: dict
+
+    :return: A function taking a Packet and returning True if it matches.
+    :rtype: callable
+    """
+    constants = {'_in_net': _in_net, '_in_range': _in_range}
+    source = f'lambda p: {_predicate_source(node, names or {}, constants)}'
+    return eval(compile(source, '<filter>', 'eval'), constants)
+
+
+class _Label:
+    __slots__ = ()
+
+
+def _insn(code: int, k: int = 0, jt: Optional[_Label] = None, jf: Optional[_Label] = None) -> list:
+    return [code, jt, jf, k]
+
+
+class _BpfGenerator:
+    """
+    Generates a classic BPF program for Ethernet frames. Every primitive jumps to a 'true' or a 'false' label;
+    packets whose headers cannot be checked in the kernel (IPv6 extension headers, VLAN tags in the frame) jump to
+    the accept label so they are decided by the userspace predicate.
+    """
+
+    def __init__(self, names: Dict[str, FrozenSet[bytes]]) -> None:
+        self.names = names
+        self.accept = _Label()
+
+    def _ethertype(self, ethertype: int, otherwise: _Label) -> list:
+        return [_insn(BPF_LD_H_ABS, 12), _insn(BPF_JMP_JEQ_K, ethertype, None, otherwise)]
+
+    def _ip_proto(self, family: str, proto: int, true: _Label, false: _Label) -> list:
+        if family == 'ip':
+            return self._ethertype(0x0800, false) + [_insn(BPF_LD_B_ABS, 23), _insn(BPF_JMP_JEQ_K, proto, true, false)]
+        code = self._ethertype(0x86dd, false) + [_insn(BPF_LD_B_ABS, 20), _insn(BPF_JMP_JEQ_K, proto, true, None)]
+        for extension in _IPV6_EXTENSIONS:
+            code.append(_insn(BPF_JMP_JEQ_K, extension, self.accept, None))
+        code[-1][2] = false
+        return code
+
+    def _proto(self, name: str, true: _Label, false: _Label) -> list:
+        if name in _ETHERTYPES:
+            return [_insn(BPF_LD_H_ABS, 12), _insn(BPF_JMP_JEQ_K, _ETHERTYPES[name], true, false)]
+        if name == 'vlan':
+            return [_insn(BPF_LD_W_ABS, SKF_AD_VLAN_TAG_PRESENT), _insn(BPF_JMP_JEQ_K, 1, true, false)]
+        proto = _IP_PROTOCOLS[name]
+        if name == 'icmp':
+            return self._ip_proto('ip', proto, true, false)
+        if name == 'icmp6':
+            return self._ip_proto('ip6', proto, true, false)
+        ip6 = _Label()
+        return self._ip_proto('ip', proto, true, ip6) + [ip6] + self._ip_proto('ip6', proto, true, false)
+
+    @staticmethod
+    def _words(value: bytes, mask: bytes) -> List[Tuple[int, int, int]]:
+        words = []
+        for i in range(0, len(value), 4):
+            word_mask = int.from_bytes(mask[i:i + 4], 'big')
+            if word_mask:
+                words.append((i, word_mask, int.from_bytes(value[i:i + 4], 'big') & word_mask))
+        return words
+
+    def _address(self, direction: str, value: bytes, mask: bytes, true: _Label, false: _Label) -> list:
+        ip4 = len(value) == 4
+        offsets = {'src': (26,) if ip4 else (22,), 'dst': (30,) if ip4 else (38,)}.get(direction, (26, 30) if ip4 else (22, 38))
+        code = self._ethertype(0x0800 if ip4 else 0x86dd, false)
+        words = self._words(value, mask)
+        if not words:
+            code[-1][1] = true
+            return code
+        for n, offset in enumerate(offsets):
+            miss = _Label() if n + 1 < len(offsets) else false
+            for i, (position, word_mask, word) in enumerate(words):
+                code.append(_insn(BPF_LD_W_ABS, offset + position))
+                if word_mask != 0xffffffff:
+                    code.append(_insn(BPF_ALU_AND_K, word_mask))
+                code.append(_insn(BPF_JMP_JEQ_K, word, true if i + 1 == len(words) else None, miss))
+            if miss is not false:
+                code.append(miss)
+        return code
+
+    def _addresses(self, direction: str, networks: List[Tuple[bytes, bytes]], true: _Label, false: _Label) -> list:
+        code = []
+        for n, (value, mask) in enumerate(networks):
+            miss = _Label() if n + 1 < len(networks) else false
+            code += self._address(direction, value, mask, true, miss)
+            if miss is not false:
+                code.append(miss)
+        return code or [_insn(BPF_LD_H_ABS, 12), _insn(BPF_JMP_JEQ_K, 0, false, false)]
+
+    def _port_test(self, first: int, last: int, true: _Label, miss: _Label) -> list:
+        if first == last:
+            return [_insn(BPF_JMP_JEQ_K, first, true, miss)]
+        check_last = _Label()
+        return [_insn(BPF_JMP_JGE_K, first, check_last, miss), check_last, _insn(BPF_JMP_JGT_K, last, miss, true)]
+
+    def _ports(self, direction: str, first: int, last: int, true: _Label, false: _Label) -> list:
+        offsets = {'src': (0,), 'dst': (2,)}.get(direction, (0, 2))
+        ip6, ip4_ports, ip6_ports = _Label(), _Label(), _Label()
+        code = [
+            _insn(BPF_LD_H_ABS, 12), _insn(BPF_JMP_JEQ_K, 0x0800, None, ip6),
+            _insn(BPF_LD_B_ABS, 23), _insn(BPF_JMP_JEQ_K, 6, ip4_ports, None), _insn(BPF_JMP_JEQ_K, 17, None, false),
+            ip4_ports, _insn(BPF_LD_H_ABS, 20), _insn(BPF_JMP_JSET_K, 0x1fff, false, None),
+            _insn(BPF_LDX_B_MSH, 14),
+        ]
+        for n, offset in enumerate(offsets):
+            miss = _Label() if n + 1 < len(offsets) else false
+            code += [_insn(BPF_LD_H_IND, 14 + offset)] + self._port_test(first, last, true, miss)
+            if miss is not false:
+                code.append(miss)
+        code += [
+            ip6, _insn(BPF_JMP_JEQ_K, 0x86dd, None, false),
+            _insn(BPF_LD_B_ABS, 20), _insn(BPF_JMP_JEQ_K, 6, ip6_ports, None), _insn(BPF_JMP_JEQ_K, 17, ip6_ports, None),
+        ]
+        for extension in _IPV6_EXTENSIONS:
+            code.append(_insn(BPF_JMP_JEQ_K, extension, self.accept, None))
+        code[-1][2] = false
+        code.append(ip6_ports)
+        for n, offset in enumerate(offsets):
+            miss = _Label() if n + 1 < len(offsets) else false
+            code += [_insn(BPF_LD_H_ABS, 54 + offset)] + self._port_test(first, last, true, miss)
+            if miss is not false:
+                code.append(miss)
+        return code
+
+    def generate(self, node: Node, true: _Label, false: _Label) -> list:
+        kind = node[0]
+        if kind in ('and', 'or'):
+            code = []
+            for item in node[1][:-1]:
+                label = _Label()
+                code += self.generate(item, label, false) if kind == 'and' else self.generate(item, true, label)
+                code.append(label)
+            return code + self.generate(node[1][-1], true, false)
+        if kind == 'not':
+            return self.generate(node[1], false, true)
+        if kind == 'proto':
+            return self._proto(node[1], true, false)
+        if kind == 'host':
+            networks = [(x, b'\xff' * len(x)) for x in sorted(_host_addresses(node[2], self.names))]
+            return self._addresses(node[1], networks, true, false)
+        if kind == 'net':
+            network = ipaddress.ip_network(node[2])
+            return self._addresses(node[1], [(network.network_address.packed, network.netmask.packed)], true, false)
+        return self._ports(node[1], node[2], node[3], true, false)
+
+    def program(self, node: Node, snaplen: int) -> List[Instruction]:
+        if node[0] in ('true', 'false'):
+            return [(BPF_RET_K, 0, 0, snaplen if node[0] == 'true' else 0)]
+        reject = _Label()
+        code = [
+            _insn(BPF_LD_H_ABS, 12),
+            _insn(BPF_JMP_JEQ_K, 0x8100, self.accept, None),
+            _insn(BPF_JMP_JEQ_K, 0x88a8, self.accept, None),
+        ]
+        code += self.generate(node, self.accept, reject)
+        code += [self.accept, _insn(BPF_RET_K, snaplen), reject, _insn(BPF_RET_K, 0)]
+        positions = {}
+        instructions = []
+        for item in code:
+            if isinstance(item, _Label):
+                positions[item] = len(instructions)
+            else:
+                instructions.append(item)
+        program = []
+        for index, (code_, jt, jf, k) in enumerate(instructions):
+            offsets = [0 if x is None else positions[x] - index - 1 for x in (jt, jf)]
+            if any(x < 0 or x > 255 for x in offsets):
+                raise ValueError('Filter expression too large for a BPF program')
+            program.append((code_, offsets[0], offsets[1], k))
+        if len(program) > 4096:
+            raise ValueError('Filter expression too large for a BPF program')
+        return program
+
+
+_MNEMONICS = {
+    BPF_LD_W_ABS: ('ld', '[{k}]'), BPF_LD_H_ABS: ('ldh', '[{k}]'), BPF_LD_B_ABS: ('ldb', '[{k}]'),
+    BPF_LD_H_IND: ('ldh', '[x + {k}]'), BPF_LDX_B_MSH: ('ldxb', '4*([{k}]&0xf)'), BPF_ALU_AND_K: ('and', '#{k:#x}'),
+    BPF_JMP_JEQ_K: ('jeq', '#{k:#x}'), BPF_JMP_JGT_K: ('jgt', '#{k:#x}'), BPF_JMP_JGE_K: ('jge', '#{k:#x}'),
+    BPF_JMP_JSET_K: ('jset', '#{k:#x}'), BPF_RET_K: ('ret', '#{k}'),
+}
+
+
+def bpf_text(program: List[Instruction]) -> List[str]:
+    """
+    Formats a BPF program like 'tcpdump -d'.
+
+    :param program: The (code, jt, jf, k) instructions
+    :type program: list
+
+    :return: One line per instruction.
+    :rtype: list
+    """
+    lines = []
+    for index, (code, jt, jf, k) in enumerate(program):
+        mnemonic, operand = _MNEMONICS[code]
+        if code == BPF_LD_W_ABS and k == SKF_AD_VLAN_TAG_PRESENT:
+            operand = 'vlan_avail'
+        else:
+            operand = operand.format(k=k)
+        line = f'({index:03d}) {mnemonic:<8} {operand}'
+        if code & 0x07 == 0x05:
+            line = f'{line:<32} jt {index + 1 + jt}\tjf {index + 1 + jf}'
+        lines.append(line)
+    return lines
+
+
+def attach_filter(sock: socket.socket, program: List[Instruction]) -> None:
+    """
+    Attaches a classic BPF program to a socket (SO_ATTACH_FILTER), so the kernel drops non-matching packets
+    before they are copied to userspace.
+
+    :param sock: The socket, usually an AF_PACKET socket
+    :type sock: socket.socket
+    :param program: The (code, jt, jf, k) instructions
+    :type program: list
+
+    :return: None
+    :rtype: None
+    """
+    instructions = ctypes.create_string_buffer(b''.join(struct.pack('=HBBI', *x) for x in program))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, struct.pack('HL', len(program), ctypes.addressof(instructions)))
+
+
+class CompiledFilter:
+    """
+    The CompiledFilter class is a filter expression compiled to a Python predicate for userspace and offline
+    matching, and to a classic BPF program that can be attached to a capture socket. It can be used wherever
+    a PacketFilter is expected.
+    """
+    __slots__ = ('expression', 'names', 'match', 'bpf', 'bpf_error', 'expires')
+
+    def __init__(self, expression: Node, names: Optional[Dict[str, FrozenSet[bytes]]] = None,
+                 snaplen: int = 65535, ttl: float = 300.0) -> None:
+        """
+        :param expression: The normalized expression (see `normalize`)
+        :type expression: tuple
+        :param names: The resolved addresses of the host names of the expression (default: none)
+        :type names: dict
+        :param snaplen: The number of bytes of matching packets the BPF program keeps (default: 65535)
+        :type snaplen: int
+        :param ttl: The time in seconds after which a plan with host names must be resolved again (default: 300)
+        :type ttl: float
+
+        :return: None
+        :rtype: None
+        """
+        self.expression = expression
+        self.names = names or {}
+        self.match: Callable[[Packet], bool] = compile_predicate(expression, self.names)
+        try:
+            self.bpf: Optional[List[Instruction]] = _BpfGenerator(self.names).program(expression, snaplen)
+            self.bpf_error: Optional[str] = None
+        except ValueError as error:
+            self.bpf, self.bpf_error = None, str(error)
+        self.expires = time.monotonic() + ttl if self.names else float('inf')
+
+    async def resolve(self) -> 'CompiledFilter':
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return: A dictionary with the canonical expression, the BPF program as (code, jt, jf, k) instructions
+                 and in 'tcpdump -d' notation (None if it does not fit in a BPF program, see 'bpf_error'),
+                 and the resolved host names.
+        :rtype: dict
+        """
+        return {
+            'expression': self.expression,
+            'bpf': self.bpf,
+            'bpf_text': bpf_text(self.bpf) if self.bpf is not None else None,
+            'bpf_error': self.bpf_error,
+            'hosts': {name: sorted(socket.inet_ntop(socket.AF_INET if len(x) == 4 else socket.AF_INET6, x) for x in addresses)
+                      for name, addresses in self.names.items()},
+        }
+
+
+class FilterCache:
+    """
+    The FilterCache class keeps the most recently used compiled filters by canonical expression, so repeated queries
+    skip compilation. Plans that depend on host names expire so the names are resolved again.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0) -> None:
+        """
+        :param maxsize: The number of plans kept (default: 256)
+        :type maxsize: int
+        :param ttl: The lifetime in seconds of plans with host names (default: 300)
+        :type ttl: float
+
+        :return: None
+        :rtype: None
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.plans: 'OrderedDict[Tuple[Node, int], CompiledFilter]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, expression: Union[Dict[str, Any], Node], snaplen: int = 65535) -> CompiledFilter:
+        """
+        Asynchronously returns the compiled filter of an expression, compiling it on a cache miss.
+
+        :param expression: The filter expression (see `normalize`), or its canonical form
+        :type expression: dict
+        :param snaplen: The number of bytes of matching packets the BPF program keeps (default: 65535)
+        :type snaplen: int
+
+        :return: The compiled filter.
+        :rtype: CompiledFilter
+        """
+        node = expression if isinstance(expression, tuple) else normalize(expression)
+        key = (node, snaplen)
+        plan = self.plans.get(key)
+        if plan is not None and plan.expires > time.monotonic():
+            self.plans.move_to_end(key)
+            self.hits += 1
+            return plan
+        self.misses += 1
+        plan = CompiledFilter(node, await _resolve_hosts(_host_names(node)), snaplen, self.ttl)
+        self.plans[key] = plan
+        self.plans.move_to_end(key)
+        while len(self.plans) > self.maxsize:
+            self.plans.popitem(last=False)
+        return plan
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: A dictionary with the number of cached plans, cache hits and cache misses.
+        :rtype: dict
+        """
+        return {'plans': len(self.plans), 'hits': self.hits, 'misses': self.misses}
+
+
+_cache = FilterCache()
+
+
+async def compile_filter(expression: Dict[str, Any], snaplen: int = 65535) -> CompiledFilter:
+    """
+    Asynchronously compiles a filter expression through the shared plan cache.
+
+    :param expression: The filter expression (see `normalize`)
+    :type expression: dict
+    :param snaplen: The number of bytes of matching packets the BPF program keeps (default: 65535)
+    :type snaplen: int
+
+    :return: The compiled filter.
+    :rtype: CompiledFilter
+    """
+    return await _cache.get(expression, snaplen)
+
+
+def filter_cache() -> FilterCache:
+    """
+    :return: The shared plan cache.
+    :rtype: FilterCache
+    """
+    return _cache
@@ -0,0 +1,432 @@
+import hashlib
+import heapq
+import socket
+import struct
+
+from array import array
+from collections import OrderedDict
+from operator import attrgetter
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from collector.client import get_client
+
+from .decoder import PROTOCOLS, Packet, tcp_flags_notation
+from .engine import CaptureEngine, get_engine
+
+
+FlowKey = Tuple[int, bytes, int, bytes, int]
+
+# The counters flows can be sorted by.
+FLOW_SORTS = ('bytes', 'packets', 'last_seen')
+
+# The key of a service port in the top-N sketch: the IP protocol and the port number.
+_PORT = struct.Struct('!BH')
+
+
+def _ntop(address: bytes) -> str:
+    return socket.inet_ntop(socket.AF_INET if len(address) == 4 else socket.AF_INET6, address)
+
+
+class Flow:
+    """
+    The Flow class holds the counters of one bidirectional flow. The endpoints are stored in a canonical order,
+    so both directions of a connection update the same flow.
+    """
+    __slots__ = ('key', 'bytes', 'packets', 'first_seen', 'last_seen', 'flags')
+
+    def __init__(self, key: FlowKey, ts: float) -> None:
+        self.key = key
+        self.bytes = 0
+        self.packets = 0
+        self.first_seen = ts
+        self.last_seen = ts
+        self.flags = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return: A dictionary with the protocol, endpoints, byte and packet counts, first and last seen
+                 timestamps and the TCP flags seen on the flow.
+        :rtype: dict
+        """
+        proto, src, sport, dst, dport = self.key
+        return {
+            'proto': PROTOCOLS.get(proto, f'ip-proto-{proto}'),
+            'src': _ntop(src),
+            'sport': sport,
+            'dst': _ntop(dst),
+            'dport': dport,
+            'bytes': self.bytes,
+            'packets': self.packets,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'flags': tcp_flags_notation(self.flags) if proto == 6 else None,
+        }
+
+
+class TopK:
+    """
+    The TopK class estimates the heaviest keys of a stream in bounded memory: the weights are counted in a
+    count-min sketch and only the best candidates are remembered, pruned back to `k` keys when they reach `2 * k`.
+    Every row of the sketch indexes its counters with its own 32 bits of a BLAKE2b digest of the key, so the rows
+    collide independently and the estimates do not depend on the hash seed of the process.
+    """
+
+    def __init__(self, k: int = 100, width: int = 4096, depth: int = 4) -> None:
+        """
+        :param k: The number of keys to keep track of (default: 100)
+        :type k: int
+        :param width: The number of counters in every row of the sketch (default: 4096)
+        :type width: int
+        :param depth: The number of rows of the sketch, at most 16 (default: 4)
+        :type depth: int
+
+        :return: None
+        :rtype: None
+        """
+        if not 1 <= depth <= 16:
+            raise ValueError(f'Invalid sketch depth: {depth}')
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+        self.candidates: Dict[bytes, int] = {}
+
+    def _indexes(self, key: bytes) -> Tuple[int, ...]:
+        return struct.unpack(f'<{self.depth}I', hashlib.blake2b(key, digest_size=4 * self.depth).digest())
+
+    def add(self, key: bytes, weight: int) -> None:
+        """
+        Adds a weight to a key.
+
+        :param key: The key
+        :type key: bytes
+        :param weight: The weight to add
+        :type weight: int
+
+        :return: None
+        :rtype: None
+        """
+        estimate = None
+        width = self.width
+        for row, value in zip(self.rows, self._indexes(key)):
+            index = value % width
+            row[index] += weight
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        candidates = self.candidates
+        candidates[key] = estimate
+        if len(candidates) >= 2 * self.k:
+            self.candidates = dict(heapq.nlargest(self.k, candidates.items(), key=lambda x: x[1]))
+
+    def top(self, n: int) -> List[Tuple[bytes, int]]:
+        """
+        :param n: The number of keys to return
+        :type n: int
+
+        :return: The `n` heaviest keys with their estimated weights, heaviest first.
+        :rtype: list
+        """
+        # the candidates are copied first, so the top can be read in another thread while keys are added
+        return heapq.nlargest(n, list(self.candidates.items()), key=lambda x: x[1])
+
+
+class FlowTable:
+    """
+    The FlowTable class aggregates captured packets into flows keyed by their 5-tuple. The table is kept in
+    least-recently-seen order, so flows are evicted cheaply when they have been idle for `idle_timeout` seconds
+    or when the table holds more than `max_flows` flows.
+    """
+
+    def __init__(self, max_flows: int = 200000, idle_timeout: float = 300.0, top_k: int = 100) -> None:
+        """
+        :param max_flows: The maximum number of flows kept in memory (default: 200000)
+        :type max_flows: int
+        :param idle_timeout: The time in seconds after which an idle flow is evicted (default: 300)
+        :type idle_timeout: float
+        :param top_k: The number of hosts and ports tracked for the top-N queries (default: 100)
+        :type top_k: int
+
+        :return: None
+        :rtype: None
+        """
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.flows: 'OrderedDict[FlowKey, Flow]' = OrderedDict()
+        self.talkers = TopK(top_k)
+        self.ports = TopK(top_k)
+        self.packets = 0
+        self.evicted = 0
+        self.engine: Optional[CaptureEngine] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {
+            'max_flows': self.max_flows,
+            'idle_timeout': self.idle_timeout,
+            'flows': [(x.key, x.bytes, x.packets, x.first_seen, x.last_seen, x.flags) for x in self.flows.values()],
+            'talkers': self.talkers,
+            'ports': self.ports,
+            'packets': self.packets,
+            'evicted': self.evicted,
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state['max_flows'], state['idle_timeout'])
+        for key, size, packets, first_seen, last_seen, flags in state['flows']:
+            flow = self.flows[key] = Flow(key, first_seen)
+            flow.bytes, flow.packets, flow.last_seen, flow.flags = size, packets, last_seen, flags
+        self.talkers, self.ports = state['talkers'], state['ports']
+        self.packets, self.evicted = state['packets'], state['evicted']
+
+    def update(self, packet: Packet) -> None:
+        """
+        Accounts a captured packet. Non-IP packets are ignored.
+
+        :param packet: The captured packet
+        :type packet: Packet
+
+        :return: None
+        :rtype: None
+        """
+        proto = packet.proto
+        if proto is None:
+            return
+        src, dst = packet.src_raw, packet.dst_raw
+        sport, dport = packet.sport or 0, packet.dport or 0
+        if (src, sport) <= (dst, dport):
+            key = (proto, src, sport, dst, dport)
+        else:
+            key = (proto, dst, dport, src, sport)
+        ts = packet.ts
+        flows = self.flows
+        flow = flows.get(key)
+        if flow is None:
+            flow = flows[key] = Flow(key, ts)
+            if len(flows) > self.max_flows:
+                flows.popitem(last=False)
+                self.evicted += 1
+        else:
+            flows.move_to_end(key)
+        length = packet.length
+        flow.bytes += length
+        flow.packets += 1
+        flow.last_seen = ts
+        if proto == 6:
+            flow.flags |= packet.tcp_flags or 0
+        self.talkers.add(src, length)
+        self.talkers.add(dst, length)
+        if sport or dport:
+            self.ports.add(_PORT.pack(proto, min(sport, dport)), length)
+        self.packets += 1
+        if not self.packets & 0x3ff:
+            self.expire(ts)
+
+    def expire(self, now: float) -> None:
+        """
+        Evicts the flows idle for more than `idle_timeout` seconds.
+
+        :param now: The current time
+        :type now: float
+
+        :return: None
+        :rtype: None
+        """
+        flows = self.flows
+        deadline = now - self.idle_timeout
+        while flows and next(iter(flows.values())).last_seen < deadline:
+            flows.popitem(last=False)
+            self.evicted += 1
+
+    def top_flows(self, n: int = 10, sort: str = 'bytes') -> List[Dict[str, Any]]:
+        """
+        :param n: The number of flows to return (default: 10)
+        :type n: int
+        :param sort: The counter to sort by: 'bytes', 'packets' or 'last_seen' (default: 'bytes')
+        :type sort: str
+
+        :return: The `n` largest flows.
+        :rtype: list
+        """
+        return [x.to_dict() for x in heapq.nlargest(n, self.flows.values(), key=attrgetter(sort))]
+
+    def top_talkers(self, n: int = 10) -> List[Dict[str, Any]]:
+        """
+        :param n: The number of hosts to return (default: 10)
+        :type n: int
+
+        :return: The hosts with the most bytes sent and received (estimated), largest first.
+        :rtype: list
+        """
+        return _talkers(self.talkers.top(n))
+
+    def top_ports(self, n: int = 10) -> List[Dict[str, Any]]:
+        """
+        :param n: The number of ports to return (default: 10)
+        :type n: int
+
+        :return: The service ports (the lower port of every flow) with the most bytes (estimated), largest first.
+        :rtype: list
+        """
+        return _ports(self.ports.top(n))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: A dictionary with the number of flows in the table, the number of evicted flows
+                 and the number of packets accounted.
+        :rtype: dict
+        """
+        return {'flows': len(self.flows), 'evicted': self.evicted, 'packets': self.packets}
+
+
+def _talkers(top: List[Tuple[bytes, int]]) -> List[Dict[str, Any]]:
+    return [{'host': _ntop(x), 'bytes': weight} for x, weight in top]
+
+
+def _ports(top: List[Tuple[bytes, int]]) -> List[Dict[str, Any]]:
+    result = []
+    for key, weight in top:
+        proto, port = _PORT.unpack(key)
+        result.append({'proto': PROTOCOLS.get(proto, f'ip-proto-{proto}'), 'port': port, 'bytes': weight})
+    return result
+
+
+class FlowSummary:
+    """
+    The FlowSummary class is a bounded copy of a FlowTable: its statistics and its `size` largest flows by every
+    sort key, hosts and ports. It answers the queries of the table for up to `size` results. The containers of the
+    table are copied before they are scanned, so a summary can be taken in another thread while packets are accounted.
+    """
+
+    def __init__(self, table: Optional[FlowTable] = None, size: int = 1000) -> None:
+        """
+        :param table: The flow table to summarize (default: an empty summary)
+        :type table: FlowTable
+        :param size: The number of flows, hosts and ports kept per query (default: 1000)
+        :type size: int
+
+        :return: None
+        :rtype: None
+        """
+        self.size = size
+        self.flows: List[Flow] = []
+        self.talkers: List[Tuple[bytes, int]] = []
+        self.ports: List[Tuple[bytes, int]] = []
+        self.counters = {'flows': 0, 'evicted': 0, 'packets': 0}
+        if table is None:
+            return
+        flows = list(table.flows.values())
+        selected = {x.key for sort in FLOW_SORTS for x in heapq.nlargest(size, flows, key=attrgetter(sort))}
+        # the order of the table is kept, so ties are broken as in the table
+        self.flows = [x for x in flows if x.key in selected]
+        self.talkers = table.talkers.top(size)
+        self.ports = table.ports.top(size)
+        self.counters = {'flows': len(flows), 'evicted': table.evicted, 'packets': table.packets}
+
+    def top_flows(self, n: int = 10, sort: str = 'bytes') -> List[Dict[str, Any]]:
+        """
+        :param n: The number of flows to return, at most `size` (default: 10)
+        :type n: int
+        :param sort: The counter to sort by: 'bytes', 'packets' or 'last_seen' (default: 'bytes')
+        :type sort: str
+
+        :return: The `n` largest flows of the table when it was summarized.
+        :rtype: list
+        """
+        return [x.to_dict() for x in heapq.nlargest(n, self.flows, key=attrgetter(sort))]
+
+    def top_talkers(self, n: int = 10) -> List[Dict[str, Any]]:
+        """
+        :param n: The number of hosts to return, at most `size` (default: 10)
+        :type n: int
+
+        :return: The hosts with the most bytes sent and received (estimated), largest first.
+        :rtype: list
+        """
+        return _talkers(self.talkers[:n])
+
+    def top_ports(self, n: int = 10) -> List[Dict[str, Any]]:
+        """
+        :param n: The number of ports to return, at most `size` (default: 10)
+        :type n: int
+
+        :return: The service ports with the most bytes (estimated), largest first.
+        :rtype: list
+        """
+        return _ports(self.ports[:n])
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: The statistics of the table when it was summarized (see `FlowTable.stats`).
+        :rtype: dict
+        """
+        return dict(self.counters)
+
+
+_tables: Dict[str, FlowTable] = {}
+
+
+def get_flow_table(interface: str = 'wlp4s0') -> FlowTable:
+    """
+    Returns the flow table of a network interface, attaching it to the capture engine of the interface
+    on first use so that every captured packet is accounted from then on.
+
+    :param interface: The network interface (default: 'wlp4s0')
+    :type interface: str
+
+    :return: The flow table of the interface.
+    :rtype: FlowTable
+    """
+    table = _tables.get(interface)
+    if table is None:
+        table = _tables[interface] = FlowTable()
+    engine = get_engine(interface)
+    if table.engine is not engine:
+        engine.attach(table.update)
+        table.engine = engine
+    return table
+
+
+async def load_flow_table(interface: str = 'wlp4s0') -> Union[FlowTable, FlowSummary]:
+    """
+    Asynchronously returns the flow table of a network interface. In multi-worker mode the flow tables are kept
+    by the collector process, and this returns the latest summary it published (see `FlowSummary`).
+
+    :param interface: The network interface (default: 'wlp4s0')
+    :type interface: str
+
+    :return: The flow table of the interface, or its summary.
+    :rtype: FlowTable or FlowSummary
+    """
+    client = get_client()
+    if client is None:
+        return get_flow_table(interface)
+    return client.snapshot(await client.acall('flows', interface), FlowSummary())
+
+
+def stop_flow_table(interface: str = 'wlp4s0') -> bool:
+    """
+    Detaches the flow table of a network interface from its capture engine and drops it.
+
+    :param interface: The network interface (default: 'wlp4s0')
+    :type interface: str
+
+    :return: True if the interface had a flow table.
+    :rtype: bool
+    """
+    client = get_client()
+    if client is not None:
+        return client.call('stop_flows', interface)
+    table = _tables.pop(interface, None)
+    if table is None:
+        return False
+    if table.engine is not None:
+        table.engine.detach(table.update)
+    return True
+
+
+def flow_stats() -> Dict[str, Dict[str, int]]:
+    """
+    :return: A dictionary mapping every interface with a flow table to the statistics of the table
+             (see `FlowTable.stats`).
+    :rtype: dict
+    """
+    return {interface: table.stats() for interface, table in list(_tables.items())}
@@ -0,0 +1,301 @@
+import asyncio
+import os
+import time
+import uuid
+
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .engine import PacketFilter, PacketSampler
+from .eth_dump import EthernetDump, _add_names
+
+
+FINISHED = ('done', 'timeout', 'cancelled', 'failed')
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when a capture job is submitted while the scheduler or the interface has no room left for it.
+    """
+
+
+class CaptureJob:
+    """
+    The CaptureJob class is a capture running in the background. The decoded packets are kept as they arrive,
+    so they are available while the job runs and after it stops, whether it completed, timed out or was cancelled.
+    """
+
+    def __init__(self, interface: str, count_pkt: int, packet_filter: PacketFilter, dns: bool, timeout: float,
+                 sampler: Optional[PacketSampler] = None, background: bool = True) -> None:
+        """
+        :param interface: The network interface to capture packets from
+        :type interface: str
+        :param count_pkt: The number of packets to capture, 0 for no limit
+        :type count_pkt: int
+        :param packet_filter: The filter that captured packets must match
+        :type packet_filter: PacketFilter
+        :param dns: Whether or not to add the host names of the addresses to the decoded packets
+        :type dns: bool
+        :param timeout: The maximum time in seconds from submission to the end of the job, queued time included
+        :type timeout: float
+        :param sampler: The sampling applied to the matching packets (default: keep all)
+        :type sampler: PacketSampler
+        :param background: False if a request waits for the job to stop (default: True)
+        :type background: bool
+
+        :return: None
+        :rtype: None
+        """
+        self.id = uuid.uuid4().hex
+        self.interface = interface
+        self.count_pkt = count_pkt
+        self.filter = packet_filter
+        self.dns = dns
+        self.timeout = timeout
+        self.sampler = sampler
+        self.background = background
+        self.dump = EthernetDump()
+        self.status = 'queued'
+        self.error: Optional[str] = None
+        self.records: List[Dict[str, Any]] = []
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _capture(self) -> None:
+        async for record in self.dump.stream(self.interface, self.count_pkt, self.dns, self.filter, self.sampler):
+            self.records.append(record)
+            self._notify()
+        if self.dns:
+            await _add_names(self.records)
+
+    async def wait(self) -> 'CaptureJob':
+        """
+        Asynchronously waits for the job to stop.
+
+        :return: The job itself.
+        :rtype: CaptureJob
+        """
+        if self.task is not None:
+            await asyncio.wait({self.task})
+        return self
+
+    def cancel(self) -> bool:
+        """
+        Cancels the job. Its capture subscription is released at once, so the capture backend stops
+        when no other job or request uses the interface.
+
+        :return: True if the job was queued or running.
+        :rtype: bool
+        """
+        if self.done or self.task is None:
+            return False
+        self.task.cancel()
+        if self.status == 'queued':
+            # a task cancelled before its first step never enters JobScheduler._run, so the job is finished here
+            self.status = 'cancelled'
+            self.finished_at = time.time()
+            self._notify()
+        return True
+
+    async def follow(self, offset: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Asynchronously yields the decoded packets of the job, the ones already captured first, until the job stops.
+
+        :param offset: The number of packets to skip (default: 0)
+        :type offset: int
+
+        :return: An asynchronous iterator over the decoded packets.
+        :rtype: AsyncIterator
+        """
+        while True:
+            changed = self._changed
+            while offset < len(self.records):
+                yield self.records[offset]
+                offset += 1
+            if self.done:
+                return
+            await changed.wait()
+
+    def to_dict(self, offset: Optional[int] = None) -> Dict[str, Any]:
+        """
+        :param offset: The number of packets to skip, or None to leave the packets out (default: None)
+        :type offset: int
+
+        :return: A dictionary with the ID, the parameters, the status, the times, the number of packets
+                 and the kernel and userspace counters of the job, and the packets from `offset` on.
+        :rtype: dict
+        """
+        result = {
+            'job_id': self.id,
+            'interface': self.interface,
+            'count_pkt': self.count_pkt,
+            'timeout': self.timeout,
+            'background': self.background,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'packets': len(self.records),
+            'stats': self.dump.stats(),
+        }
+        if offset is not None:
+            result['records'] = self.records[offset:]
+        return result
+
+
+class JobScheduler:
+    """
+    The JobScheduler class runs capture jobs in the background. At most `max_running` jobs capture at the same
+    time, the others wait in a queue; every interface holds at most `per_interface` queued or running background jobs.
+    Jobs awaited by a request share the capture engine of the interface and only count toward the queue limit.
+    The timeout of a job runs from its submission, queued time included. Finished jobs are kept for `keep` seconds
+    so their results can still be fetched.
+    """
+
+    def __init__(self, max_running: int = 8, per_interface: int = 4, max_queued: int = 64,
+                 keep: float = 600.0, max_jobs: int = 1000) -> None:
+        """
+        :param max_running: The number of jobs capturing at the same time (default: 8)
+        :type max_running: int
+        :param per_interface: The number of queued or running background jobs allowed per interface (default: 4)
+        :type per_interface: int
+        :param max_queued: The number of jobs allowed to wait for a free slot (default: 64)
+        :type max_queued: int
+        :param keep: The time in seconds during which finished jobs are kept (default: 600)
+        :type keep: float
+        :param max_jobs: The maximum number of jobs kept, the oldest finished ones are dropped first (default: 1000)
+        :type max_jobs: int
+
+        :return: None
+        :rtype: None
+        """
+        self.max_running = max_running
+        self.per_interface = per_interface
+        self.max_queued = max_queued
+        self.keep = keep
+        self.max_jobs = max_jobs
+        self.loop = asyncio.get_running_loop()
+        self.jobs: 'OrderedDict[str, CaptureJob]' = OrderedDict()
+        self._slots = asyncio.Semaphore(max_running)
+
+    def _prune(self) -> None:
+        deadline = time.time() - self.keep
+        finished = [x for x in self.jobs.values() if x.done]
+        excess = len(self.jobs) - self.max_jobs
+        for job in finished:
+            if excess > 0:
+                del self.jobs[job.id]
+                excess -= 1
+            elif job.finished_at < deadline:
+                del self.jobs[job.id]
+
+    def submit(self, interface: str = 'wlp4s0', count_pkt: int = 1, packet_filter: Optional[PacketFilter] = None,
+               dns: bool = False, timeout: float = 15.0, sampler: Optional[PacketSampler] = None,
+               background: bool = True) -> CaptureJob:
+        """
+        Queues a new capture job.
+
+        :param interface: The network interface to capture packets from (default: 'wlp4s0')
+        :type interface: str
+        :param count_pkt: The number of packets to capture, 0 for no limit (default: 1)
+        :type count_pkt: int
+        :param packet_filter: The filter that captured packets must match (default: match everything)
+        :type packet_filter: PacketFilter
+        :param dns: Whether or not to add the host names of the addresses to the decoded packets (default: False)
+        :type dns: bool
+        :param timeout: The maximum time in seconds from submission to the end of the job, queued time included;
+                        the packets captured so far are kept (default: 15)
+        :type timeout: float
+        :param sampler: The sampling applied to the matching packets (default: keep all)
+        :type sampler: PacketSampler
+        :param background: False if the caller waits for the job, which then does not count toward the
+                           per-interface limit (default: True)
+        :type background: bool
+
+        :return: The queued job.
+        :rtype: CaptureJob
+        """
+        self._prune()
+        active = [x for x in self.jobs.values() if not x.done]
+        if background and sum(1 for x in active if x.background and x.interface == interface) >= self.per_interface:
+            raise QuotaExceeded(f'Too many capture jobs on {interface} (limit: {self.per_interface})')
+        if sum(1 for x in active if x.status == 'queued') >= self.max_queued:
+            raise QuotaExceeded(f'Too many queued capture jobs (limit: {self.max_queued})')
+        job = CaptureJob(interface, count_pkt, packet_filter or PacketFilter(), dns, timeout, sampler, background)
+        self.jobs[job.id] = job
+        job.task = self.loop.create_task(self._run(job))
+        return job
+
+    async def _execute(self, job: CaptureJob) -> None:
+        async with self._slots:
+            job.status = 'running'
+            job.started_at = time.time()
+            await job._capture()
+
+    async def _run(self, job: CaptureJob) -> None:
+        try:
+            await asyncio.wait_for(self._execute(job), job.timeout)
+            job.status = 'done'
+        except asyncio.TimeoutError:
+            job.status = 'timeout'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+        except Exception as error:
+            job.status = 'failed'
+            job.error = str(error) or type(error).__name__
+        finally:
+            job.finished_at = time.time()
+            job._notify()
+
+    def get(self, job_id: str) -> Optional[CaptureJob]:
+        """
+        :param job_id: The ID of the job
+        :type job_id: str
+
+        :return: The job, or None if it is unknown or was dropped.
+        :rtype: CaptureJob
+        """
+        return self.jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: A dictionary with the number of jobs per status.
+        :rtype: dict
+        """
+        stats = {x: 0 for x in ('queued', 'running') + FINISHED}
+        for job in self.jobs.values():
+            stats[job.status] += 1
+        return stats
+
+
+_scheduler: Optional[JobScheduler] = None
+
+
+def get_scheduler() -> JobScheduler:
+    """
+    Returns the capture job scheduler of the running event loop, creating it on first use. The limits are read
+    from the CAPTURE_MAX_JOBS, CAPTURE_JOBS_PER_INTERFACE and CAPTURE_MAX_QUEUED environment variables.
+
+    :return: The job scheduler.
+    :rtype: JobScheduler
+    """
+    global _scheduler
+    if _scheduler is None or _scheduler.loop is not asyncio.get_running_loop():
+        _scheduler = JobScheduler(
+            int(os.environ.get('CAPTURE_MAX_JOBS', 8)),
+            int(os.environ.get('CAPTURE_JOBS_PER_INTERFACE', 4)),
+            int(os.environ.get('CAPTURE_MAX_QUEUED', 64)),
+        )
+    return _scheduler
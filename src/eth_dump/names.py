@@ -0,0 +1,383 @@
+import asyncio
+import ipaddress
+import os
+import random
+import socket
+import struct
+import time
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+Server = Tuple[str, int]
+
+_HEADER = struct.Struct('!HHHHHH')
+_RR = struct.Struct('!HHIH')
+_PTR = 12
+_SOA = 6
+_NXDOMAIN = 3
+
+
+class DnsError(OSError):
+    """
+    Raised when a name server cannot answer a query: timeout, truncated or malformed answer, or server failure.
+    """
+
+
+def ptr_query(qid: int, address: str) -> bytes:
+    """
+    Builds a recursive PTR query for the reverse name of an address.
+
+    :param qid: The query ID
+    :type qid: int
+    :param address: The IPv4 or IPv6 address
+    :type address: str
+
+    :return: The DNS message.
+    :rtype: bytes
+    """
+    labels = ipaddress.ip_address(address).reverse_pointer.split('.')
+    qname = b''.join(bytes([len(x)]) + x.encode() for x in labels) + b'\x00'
+    return _HEADER.pack(qid, 0x0100, 1, 0, 0, 0) + qname + struct.pack('!HH', _PTR, 1)
+
+
+def _read_name(data: bytes, offset: int) -> Tuple[str, int]:
+    labels, end, jumps = [], None, 0
+    while True:
+        length = data[offset]
+        if length & 0xc0 == 0xc0:
+            if jumps > 16:
+                raise DnsError('Compression loop in a DNS answer')
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack_from('!H', data, offset)[0] & 0x3fff
+            jumps += 1
+        elif length:
+            labels.append(data[offset + 1:offset + 1 + length].decode('ascii', 'replace'))
+            offset += 1 + length
+        else:
+            return '.'.join(labels), end if end is not None else offset + 1
+
+
+def parse_ptr_response(data: bytes, qid: int) -> Tuple[int, Optional[str], Optional[int]]:
+    """
+    Parses the answer to a PTR query.
+
+    :param data: The DNS message
+    :type data: bytes
+    :param qid: The ID of the query
+    :type qid: int
+
+    :return: The response code, the host name (None if there is no PTR record) and the time to live: the TTL of
+             the PTR record, or for a negative answer the minimum of the SOA record (None if there is none).
+    :rtype: tuple
+    """
+    try:
+        rid, flags, qdcount, ancount, nscount, _ = _HEADER.unpack_from(data)
+        if rid != qid or not flags & 0x8000:
+            raise DnsError('Unexpected DNS message')
+        if flags & 0x0200:
+            raise DnsError('Truncated DNS answer')
+        offset = _HEADER.size
+        for _ in range(qdcount):
+            offset = _read_name(data, offset)[1] + 4
+        name, ttl = None, None
+        for index in range(ancount + nscount):
+            offset = _read_name(data, offset)[1]
+            rtype, _, rttl, length = _RR.unpack_from(data, offset)
+            offset += _RR.size
+            if index < ancount and rtype == _PTR and name is None:
+                name, ttl = _read_name(data, offset)[0], rttl
+            elif index >= ancount and rtype == _SOA and name is None:
+                position = _read_name(data, _read_name(data, offset)[1])[1]
+                ttl = min(rttl, struct.unpack_from('!5I', data, position)[4])
+            offset += length
+    except (IndexError, struct.error) as error:
+        raise DnsError(f'Malformed DNS answer: {error}')
+    return flags & 0xf, name, ttl
+
+
+def read_nameservers(path: str = '/etc/resolv.conf') -> List[Server]:
+    """
+    :param path: The resolver configuration file (default: '/etc/resolv.conf')
+    :type path: str
+
+    :return: The (address, port) pairs of the name servers it lists.
+    :rtype: list
+    """
+    servers = []
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    servers.append((fields[1].split('%')[0], 53))
+    except OSError:
+        pass
+    return servers
+
+
+def read_hosts(path: str = '/etc/hosts') -> Dict[str, str]:
+    """
+    :param path: The static host table (default: '/etc/hosts')
+    :type path: str
+
+    :return: A dictionary mapping every address of the table to its first host name.
+    :rtype: dict
+    """
+    hosts = {}
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split('#', 1)[0].split()
+                if len(fields) >= 2:
+                    try:
+                        address = str(ipaddress.ip_address(fields[0]))
+                    except ValueError:
+                        continue
+                    hosts.setdefault(address, fields[1])
+    except OSError:
+        pass
+    return hosts
+
+
+class _DnsProtocol(asyncio.DatagramProtocol):
+    """
+    The UDP endpoint of one name server, matching the answers to the pending queries by ID.
+    """
+
+    def __init__(self) -> None:
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        if len(data) >= 2:
+            future = self.pending.get(struct.unpack_from('!H', data)[0])
+            if future is not None and not future.done():
+                future.set_result(data)
+
+    def error_received(self, error: Exception) -> None:
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(DnsError(str(error)))
+
+    def connection_lost(self, error: Optional[Exception]) -> None:
+        self.error_received(error or DnsError('The DNS socket was closed'))
+
+
+class ReverseResolver:
+    """
+    The ReverseResolver class resolves addresses to host names with asynchronous PTR queries, so lookups never
+    block the capture. Answers are kept in an LRU cache of `maxsize` addresses for the TTL of their record, clamped
+    to [`min_ttl`, `max_ttl`]; negative answers are kept for the SOA minimum (else `negative_ttl`) and failed lookups
+    for `error_ttl`. Concurrent lookups of the same address share a single query, and at most `concurrency`
+    queries are in flight at once. Addresses of the static host table are answered without a query.
+    Without any name server, lookups fall back to the system resolver in the default executor.
+    """
+
+    def __init__(self, servers: Optional[List[Server]] = None, hosts: Optional[Dict[str, str]] = None,
+                 maxsize: int = 4096, min_ttl: float = 30.0, max_ttl: float = 3600.0, negative_ttl: float = 300.0,
+                 error_ttl: float = 30.0, timeout: float = 1.0, attempts: int = 2, concurrency: int = 32) -> None:
+        """
+        :param servers: The (address, port) pairs of the name servers (default: the servers of /etc/resolv.conf)
+        :type servers: list
+        :param hosts: The static host table (default: /etc/hosts)
+        :type hosts: dict
+        :param maxsize: The maximum number of cached addresses (default: 4096)
+        :type maxsize: int
+        :param min_ttl: The minimum time in seconds a host name is cached (default: 30)
+        :type min_ttl: float
+        :param max_ttl: The maximum time in seconds a host name is cached (default: 3600)
+        :type max_ttl: float
+        :param negative_ttl: The time in seconds a missing name is cached without SOA minimum (default: 300)
+        :type negative_ttl: float
+        :param error_ttl: The time in seconds a failed lookup is cached (default: 30)
+        :type error_ttl: float
+        :param timeout: The timeout of a query in seconds (default: 1)
+        :type timeout: float
+        :param attempts: The number of rounds over the name servers before a lookup fails (default: 2)
+        :type attempts: int
+        :param concurrency: The maximum number of queries in flight (default: 32)
+        :type concurrency: int
+
+        :return: None
+        :rtype: None
+        """
+        self.servers = list(read_nameservers() if servers is None else servers)
+        self.hosts = read_hosts() if hosts is None else hosts
+        self.maxsize = maxsize
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.error_ttl = error_ttl
+        self.timeout = timeout
+        self.attempts = attempts
+        self.concurrency = concurrency
+        self.cache: 'OrderedDict[str, Tuple[Optional[str], float]]' = OrderedDict()
+        self.counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'queries': 0, 'failures': 0}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._endpoints: Dict[Server, _DnsProtocol] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _bind(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._endpoints = {}
+            self._inflight = {}
+
+    def cached(self, address: str) -> Tuple[bool, Optional[str]]:
+        """
+        Looks an address up in the cache only.
+
+        :param address: The address
+        :type address: str
+
+        :return: Whether a fresh answer is cached, and the cached host name (None for a negative answer).
+        :rtype: tuple
+        """
+        entry = self.cache.get(address)
+        if entry is None or entry[1] <= time.monotonic():
+            return False, None
+        self.cache.move_to_end(address)
+        return True, entry[0]
+
+    def _store(self, address: str, name: Optional[str], ttl: float) -> None:
+        cache = self.cache
+        cache[address] = (name, time.monotonic() + ttl)
+        cache.move_to_end(address)
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+    async def _endpoint(self, server: Server) -> _DnsProtocol:
+        protocol = self._endpoints.get(server)
+        if protocol is None or protocol.transport is None or protocol.transport.is_closing():
+            _, protocol = await self._loop.create_datagram_endpoint(_DnsProtocol, remote_addr=server)
+            self._endpoints[server] = protocol
+        return protocol
+
+    async def _query(self, server: Server, address: str) -> Tuple[int, Optional[str], Optional[int]]:
+        protocol = await self._endpoint(server)
+        qid = random.getrandbits(16)
+        while qid in protocol.pending:
+            qid = random.getrandbits(16)
+        future = protocol.pending[qid] = self._loop.create_future()
+        try:
+            self.counters['queries'] += 1
+            protocol.transport.sendto(ptr_query(qid, address))
+            data = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise DnsError(f'The name server {server[0]} did not answer')
+        finally:
+            protocol.pending.pop(qid, None)
+        return parse_ptr_response(data, qid)
+
+    async def _lookup(self, address: str) -> Tuple[Optional[str], float]:
+        if not self.servers:
+            try:
+                host, _ = await self._loop.getnameinfo((address, 0), socket.NI_NAMEREQD)
+                return host, self.max_ttl
+            except OSError:
+                return None, self.negative_ttl
+        for _ in range(self.attempts):
+            for server in self.servers:
+                try:
+                    rcode, name, ttl = await self._query(server, address)
+                except (DnsError, OSError):
+                    continue
+                if name is not None:
+                    return name, max(self.min_ttl, min(ttl, self.max_ttl))
+                if rcode in (0, _NXDOMAIN):
+                    return None, self.negative_ttl if ttl is None else max(self.min_ttl, min(ttl, self.negative_ttl))
+        self.counters['failures'] += 1
+        return None, self.error_ttl
+
+    async def _resolve(self, address: str) -> Optional[str]:
+        try:
+            async with self._semaphore:
+                name, ttl = await self._lookup(address)
+            self._store(address, name, ttl)
+            return name
+        finally:
+            del self._inflight[address]
+
+    async def resolve(self, address: str) -> Optional[str]:
+        """
+        Asynchronously resolves an address to a host name, from the cache when possible.
+
+        :param address: The IPv4 or IPv6 address
+        :type address: str
+
+        :return: The host name, or None if the address has no name or the lookup failed.
+        :rtype: str
+        """
+        self._bind()
+        found, name = self.cached(address)
+        if found:
+            self.counters['hits'] += 1
+            return name
+        if address in self.hosts:
+            self._store(address, self.hosts[address], self.max_ttl)
+            return self.hosts[address]
+        future = self._inflight.get(address)
+        if future is None:
+            self.counters['misses'] += 1
+            future = self._inflight[address] = asyncio.ensure_future(self._resolve(address))
+        else:
+            self.counters['coalesced'] += 1
+        return await asyncio.shield(future)
+
+    async def resolve_many(self, addresses: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Asynchronously resolves several addresses, concurrently within the concurrency limit.
+
+        :param addresses: The addresses
+        :type addresses: iterable
+
+        :return: A dictionary mapping every address to its host name, or to None.
+        :rtype: dict
+        """
+        unique = list(dict.fromkeys(addresses))
+        return dict(zip(unique, await asyncio.gather(*(self.resolve(x) for x in unique))))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: A dictionary with the number of cached addresses, of cache hits and misses, of lookups that joined
+                 a query in flight, of queries sent and of failed lookups.
+        :rtype: dict
+        """
+        return {'size': len(self.cache), **self.counters}
+
+
+_resolver: Optional[ReverseResolver] = None
+
+
+def get_name_resolver() -> ReverseResolver:
+    """
+    Returns the shared reverse resolver. The name servers are read from the comma-separated DNS_SERVERS environment
+    variable (address or address:port, default: /etc/resolv.conf), the cache size from DNS_CACHE_SIZE and the
+    maximum number of queries in flight from DNS_CONCURRENCY.
+
+    :return: The reverse resolver.
+    :rtype: ReverseResolver
+    """
+    global _resolver
+    if _resolver is None:
+        servers = None
+        if os.environ.get('DNS_SERVERS'):
+            servers = []
+            for item in os.environ['DNS_SERVERS'].split(','):
+                host, _, port = item.strip().rpartition(':') if item.count(':') == 1 else (item.strip(), '', '')
+                servers.append((host, int(port or 53)))
+        _resolver = ReverseResolver(
+            servers,
+            maxsize=int(os.environ.get('DNS_CACHE_SIZE', 4096)),
+            concurrency=int(os.environ.get('DNS_CONCURRENCY', 32)),
+        )
+    return _resolver
@@ -0,0 +1,205 @@
+import struct
+
+from typing import Iterator, List, Optional, Tuple
+
+
+Frame = Tuple[float, bytes, int]
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+
+_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+
+
+class PcapStream:
+    """
+    The PcapStream class incrementally parses a classic pcap byte stream (for example the output of 'tcpdump -w -')
+    into frames, so it can be fed with chunks of any size.
+    """
+
+    def __init__(self) -> None:
+        self.linktype: Optional[int] = None
+        self.snaplen = 0
+        self._buffer = bytearray()
+        self._record: Optional[struct.Struct] = None
+        self._resolution = 1e-6
+
+    def feed(self, data: bytes) -> List[Frame]:
+        """
+        Appends a chunk of the stream and returns every frame that became complete.
+
+        :param data: The next chunk of the pcap stream
+        :type data: bytes
+
+        :return: A list of (timestamp, frame bytes, original length) tuples.
+        :rtype: list
+        """
+        buffer = self._buffer
+        buffer += data
+        if self._record is None:
+            if len(buffer) < 24:
+                return []
+            magic = bytes(buffer[:4])
+            if magic not in _MAGIC:
+                raise ValueError('Not a pcap stream')
+            order, self._resolution = _MAGIC[magic]
+            self._record = struct.Struct(order + 'IIII')
+            self.snaplen, linktype = struct.unpack_from(order + 'II', buffer, 16)
+            self.linktype = linktype & 0xffff
+            offset = 24
+        else:
+            offset = 0
+        frames = []
+        record = self._record
+        resolution = self._resolution
+        end = len(buffer)
+        while offset + 16 <= end:
+            sec, frac, caplen, wirelen = record.unpack_from(buffer, offset)
+            if offset + 16 + caplen > end:
+                break
+            frames.append((sec + frac * resolution, bytes(buffer[offset + 16:offset + 16 + caplen]), wirelen))
+            offset += 16 + caplen
+        del buffer[:offset]
+        return frames
+
+
+def iter_pcap(data: bytes) -> Tuple[int, Iterator[Frame]]:
+    """
+    Parses a classic pcap file held in memory (bytes or a memory map).
+
+    :param data: The contents of the pcap file
+    :type data: bytes
+
+    :return: A tuple of the link type of the file and an iterator over its frames.
+    :rtype: tuple
+    """
+    magic = bytes(data[:4])
+    if len(data) < 24 or magic not in _MAGIC:
+        raise ValueError('Not a pcap file')
+    order, resolution = _MAGIC[magic]
+    linktype = struct.unpack_from(order + 'I', data, 20)[0] & 0xffff
+    record = struct.Struct(order + 'IIII')
+
+    def frames() -> Iterator[Frame]:
+        offset = 24
+        end = len(data)
+        while offset + 16 <= end:
+            sec, frac, caplen, wirelen = record.unpack_from(data, offset)
+            offset += 16
+            if offset + caplen > end:
+                break
+            yield sec + frac * resolution, bytes(data[offset:offset + caplen]), wirelen
+            offset += caplen
+
+    return linktype, frames()
+
+
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+_PCAPNG_SECTION = 0x0a0d0d0a
+_PCAPNG_INTERFACE = 1
+_PCAPNG_SIMPLE_PACKET = 3
+_PCAPNG_ENHANCED_PACKET = 6
+_PCAPNG_OPT_TSRESOL = 9
+
+
+def iter_pcapng(data: bytes) -> Iterator[Tuple[float, bytes, int, int]]:
+    """
+    Parses a pcapng file held in memory (bytes or a memory map). Interfaces with different link types
+    and timestamp resolutions are supported.
+
+    :param data: The contents of the pcapng file
+    :type data: bytes
+
+    :return: An iterator over (timestamp, frame bytes, original length, link type) tuples.
+    :rtype: iterator
+    """
+    if bytes(data[:4]) != PCAPNG_MAGIC:
+        raise ValueError('Not a pcapng file')
+    offset = 0
+    end = len(data)
+    order = '<'
+    interfaces: List[Tuple[int, int, float]] = []
+    while offset + 12 <= end:
+        if bytes(data[offset:offset + 4]) == PCAPNG_MAGIC:
+            order = '<' if bytes(data[offset + 8:offset + 12]) == b'\x4d\x3c\x2b\x1a' else '>'
+            interfaces = []
+        kind, length = struct.unpack_from(order + 'II', data, offset)
+        if length < 12 or offset + length > end:
+            break
+        body = offset + 8
+        if kind == _PCAPNG_INTERFACE:
+            linktype, _, snaplen = struct.unpack_from(order + 'HHI', data, body)
+            interfaces.append((linktype, snaplen, _pcapng_resolution(data, body + 8, offset + length - 4, order)))
+        elif kind == _PCAPNG_ENHANCED_PACKET:
+            interface, high, low, caplen, wirelen = struct.unpack_from(order + 'IIIII', data, body)
+            if interface >= len(interfaces):
+                raise ValueError(f'Unknown interface id {interface} in an enhanced packet block')
+            linktype, _, resolution = interfaces[interface]
+            yield ((high << 32 | low) * resolution, bytes(data[body + 20:body + 20 + caplen]), wirelen, linktype)
+        elif kind == _PCAPNG_SIMPLE_PACKET and interfaces:
+            linktype, snaplen, _ = interfaces[0]
+            wirelen = struct.unpack_from(order + 'I', data, body)[0]
+            caplen = min(wirelen, snaplen or wirelen, length - 16)
+            yield (0.0, bytes(data[body + 4:body + 4 + caplen]), wirelen, linktype)
+        offset += length
+
+
+def _pcapng_resolution(data: bytes, offset: int, end: int, order: str) -> float:
+    while offset + 4 <= end:
+        code, length = struct.unpack_from(order + 'HH', data, offset)
+        if code == 0:
+            break
+        if code == _PCAPNG_OPT_TSRESOL and length >= 1:
+            value = data[offset + 4]
+            return 2.0 ** -(value & 0x7f) if value & 0x80 else 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def pcap_header(linktype: int = LINKTYPE_ETHERNET, snaplen: int = 65535) -> bytes:
+    """
+    :return: The global header of a classic pcap file with nanosecond timestamps.
+    :rtype: bytes
+    """
+    return struct.pack('<IHHiIII', 0xa1b23c4d, 2, 4, 0, 0, snaplen, linktype)
+
+
+def pcap_record(ts: float, data: bytes, wirelen: int) -> bytes:
+    """
+    :return: A classic pcap record (nanosecond timestamp) followed by the frame.
+    :rtype: bytes
+    """
+    nanoseconds = round(ts * 1e9)
+    return struct.pack('<IIII', nanoseconds // 1000000000, nanoseconds % 1000000000, len(data), wirelen) + data
+
+
+def pcapng_header(linktype: int = LINKTYPE_ETHERNET, snaplen: int = 65535) -> bytes:
+    """
+    :return: A pcapng section header block followed by one interface description block
+             with nanosecond timestamps.
+    :rtype: bytes
+    """
+    section = struct.pack('<IIIHHqI', _PCAPNG_SECTION, 28, 0x1a2b3c4d, 1, 0, -1, 28)
+    options = struct.pack('<HHB3x', _PCAPNG_OPT_TSRESOL, 1, 9) + struct.pack('<HH', 0, 0)
+    length = 20 + len(options)
+    interface = struct.pack('<IIHHI', _PCAPNG_INTERFACE, length, linktype, 0, snaplen) + options + struct.pack('<I', length)
+    return section + interface
+
+
+def pcapng_record(ts: float, data: bytes, wirelen: int) -> bytes:
+    """
+    :return: A pcapng enhanced packet block (nanosecond timestamp) holding the frame.
+    :rtype: bytes
+    """
+    nanoseconds = round(ts * 1e9)
+    padding = -len(data) % 4
+    length = 32 + len(data) + padding
+    return struct.pack(
+        '<IIIIIII', _PCAPNG_ENHANCED_PACKET, length, 0, nanoseconds >> 32, nanoseconds & 0xffffffff, len(data), wirelen
+    ) + data + bytes(padding) + struct.pack('<I', length)
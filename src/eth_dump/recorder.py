@@ -0,0 +1,320 @@
+import os
+import threading
+import time
+
+from collections import deque
+from datetime import datetime
+from typing import Any, BinaryIO, Deque, Dict, List, Optional, Tuple
+
+from .decoder import Packet
+from .engine import CaptureEngine, PacketFilter, get_engine
+from .pcap import LINKTYPE_ETHERNET, pcap_header, pcap_record, pcapng_header, pcapng_record
+
+
+FORMATS = {
+    'pcap': (pcap_header, pcap_record),
+    'pcapng': (pcapng_header, pcapng_record),
+}
+
+
+def capture_dir() -> str:
+    """
+    :return: The directory holding the capture files, read from the CAPTURE_DIR environment variable
+             (default: 'captures' in the working directory).
+    :rtype: str
+    """
+    return os.path.abspath(os.environ.get('CAPTURE_DIR', 'captures'))
+
+
+def capture_path(name: str) -> str:
+    """
+    Resolves the name of a capture file inside the capture directory.
+
+    :param name: The file name, relative to the capture directory
+    :type name: str
+
+    :return: The absolute path of the file.
+    :rtype: str
+    """
+    root = capture_dir()
+    path = os.path.abspath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f'Capture file outside of {root}: {name}')
+    return path
+
+
+class RotatingCaptureWriter:
+    """
+    The RotatingCaptureWriter class writes frames to pcap or pcapng files in a directory, starting a new file
+    when the current one exceeds `max_file_size` bytes or `max_file_seconds` seconds, and deleting the oldest
+    files beyond `max_files`, so disk usage stays below `max_files * max_file_size`.
+    """
+
+    def __init__(self, directory: str, prefix: str, format: str = 'pcap', linktype: int = LINKTYPE_ETHERNET,
+                 snaplen: int = 65535, max_file_size: int = 100 * 10**6, max_file_seconds: float = 3600.0,
+                 max_files: int = 10) -> None:
+        """
+        :param directory: The directory of the capture files
+        :type directory: str
+        :param prefix: The prefix of the file names
+        :type prefix: str
+        :param format: The file format, 'pcap' or 'pcapng' (default: 'pcap')
+        :type format: str
+        :param linktype: The link type of the frames (default: Ethernet)
+        :type linktype: int
+        :param snaplen: The snapshot length written in the file header (default: 65535)
+        :type snaplen: int
+        :param max_file_size: The size in bytes after which a new file is started (default: 100 MB)
+        :type max_file_size: int
+        :param max_file_seconds: The age in seconds after which a new file is started (default: 3600)
+        :type max_file_seconds: float
+        :param max_files: The number of files kept, the oldest ones are deleted (default: 10)
+        :type max_files: int
+
+        :return: None
+        :rtype: None
+        """
+        if format not in FORMATS:
+            raise ValueError(f'Unknown capture file format: {format}')
+        self.directory = directory
+        self.prefix = prefix
+        self.format = format
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.max_file_size = max_file_size
+        self.max_file_seconds = max_file_seconds
+        self.max_files = max_files
+        self.files: List[str] = []
+        self.packets = 0
+        self._header, self._record = FORMATS[format]
+        self._file: Optional[BinaryIO] = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _rotate(self) -> None:
+        self.close()
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.directory, f'{self.prefix}-{stamp}-{self._sequence}.{self.format}')
+        self._sequence += 1
+        self._file = open(path, 'wb', buffering=1 << 20)
+        header = self._header(self.linktype, self.snaplen)
+        self._file.write(header)
+        self._size = len(header)
+        self._opened_at = time.monotonic()
+        self.files.append(path)
+        while len(self.files) > self.max_files:
+            try:
+                os.remove(self.files.pop(0))
+            except FileNotFoundError:
+                pass
+
+    def write(self, ts: float, data: bytes, wirelen: int) -> None:
+        """
+        Appends a frame to the current file, rotating it first if needed.
+
+        :param ts: The capture timestamp of the frame
+        :type ts: float
+        :param data: The captured bytes of the frame
+        :type data: bytes
+        :param wirelen: The original length of the frame
+        :type wirelen: int
+
+        :return: None
+        :rtype: None
+        """
+        if (self._file is None or self._size >= self.max_file_size
+                or time.monotonic() - self._opened_at >= self.max_file_seconds):
+            self._rotate()
+        record = self._record(ts, data, wirelen)
+        self._file.write(record)
+        self._size += len(record)
+        self.packets += 1
+
+    def close(self) -> None:
+        """
+        Flushes and closes the current file.
+
+        :return: None
+        :rtype: None
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CaptureRecorder:
+    """
+    The CaptureRecorder class writes the packets captured on an interface that match a filter to rotating
+    capture files. It is attached to the capture engine of the interface as a tap that only queues the packets,
+    a background thread writes them, so the capture loop never waits for the disk. A new file is started
+    whenever the link type of the packets changes, since a pcap file holds a single link type. The recording
+    stops on the first error writing the files, which is then reported by `status`.
+    """
+    max_pending = 10000
+
+    def __init__(self, interface: str, writer: RotatingCaptureWriter, packet_filter: Optional[PacketFilter] = None) -> None:
+        self.interface = interface
+        self.writer = writer
+        self.filter = packet_filter or PacketFilter()
+        self.engine: Optional[CaptureEngine] = None
+        self.error: Optional[str] = None
+        self.dropped = 0
+        self._pending: Deque[Tuple[float, bytes, int, int]] = deque()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def __call__(self, packet: Packet) -> None:
+        if self.filter.match(packet):
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append((packet.ts, packet.data, packet.length, packet.linktype))
+            self._wakeup.set()
+
+    def _write(self) -> None:
+        writer = self.writer
+        try:
+            while True:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                while self._pending:
+                    ts, data, wirelen, linktype = self._pending.popleft()
+                    if linktype != writer.linktype:
+                        writer.close()
+                        writer.linktype = linktype
+                    writer.write(ts, data, wirelen)
+                if self._stopping:
+                    writer.close()
+                    return
+        except OSError as error:
+            self.error = str(error)
+            self._pending.clear()
+            try:
+                writer.close()
+            except OSError:
+                pass
+            engine = self.engine
+            if engine is not None:
+                try:
+                    engine.loop.call_soon_threadsafe(self._detach, engine)
+                except RuntimeError:
+                    pass
+
+    def _detach(self, engine: CaptureEngine) -> None:
+        if self.engine is engine:
+            engine.detach(self)
+            self.engine = None
+
+    def start(self) -> 'CaptureRecorder':
+        """
+        Starts the writer thread and attaches the recorder to the capture engine of the interface.
+
+        :return: The recorder itself.
+        :rtype: CaptureRecorder
+        """
+        self._thread = threading.Thread(target=self._write, name=f'recorder-{self.interface}', daemon=True)
+        self._thread.start()
+        self.engine = get_engine(self.interface)
+        self.engine.attach(self)
+        return self
+
+    def stop(self) -> None:
+        """
+        Detaches the recorder from the capture engine, waits for the queued packets to be written
+        and closes the current file.
+
+        :return: None
+        :rtype: None
+        """
+        if self.engine is not None:
+            self._detach(self.engine)
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def status(self) -> Dict[str, Any]:
+        """
+        :return: A dictionary with the interface, the file format, the number of packets written, the number of
+                 packets dropped while the writer thread lagged behind, the capture files and the error that
+                 stopped the recording, if any.
+        :rtype: dict
+        """
+        return {
+            'interface': self.interface,
+            'format': self.writer.format,
+            'packets': self.writer.packets,
+            'dropped': self.dropped,
+            'files': [os.path.relpath(x, capture_dir()) for x in list(self.writer.files)],
+            'error': self.error,
+        }
+
+
+_recorders: Dict[str, CaptureRecorder] = {}
+
+
+def start_recording(interface: str = 'wlp4s0', format: str = 'pcap', packet_filter: Optional[PacketFilter] = None,
+                    max_file_size: int = 100 * 10**6, max_file_seconds: float = 3600.0,
+                    max_files: int = 10) -> CaptureRecorder:
+    """
+    Starts writing the packets captured on an interface to rotating files in the capture directory,
+    replacing the recorder already running on the interface.
+
+    :param interface: The network interface to record (default: 'wlp4s0')
+    :type interface: str
+    :param format: The file format, 'pcap' or 'pcapng' (default: 'pcap')
+    :type format: str
+    :param packet_filter: The filter that recorded packets must match (default: record everything)
+    :type packet_filter: PacketFilter
+    :param max_file_size: The size in bytes after which a new file is started (default: 100 MB)
+    :type max_file_size: int
+    :param max_file_seconds: The age in seconds after which a new file is started (default: 3600)
+    :type max_file_seconds: float
+    :param max_files: The number of files kept, the oldest ones are deleted (default: 10)
+    :type max_files: int
+
+    :return: The running recorder.
+    :rtype: CaptureRecorder
+    """
+    stop_recording(interface)
+    writer = RotatingCaptureWriter(
+        capture_dir(), interface, format,
+        max_file_size=max_file_size, max_file_seconds=max_file_seconds, max_files=max_files
+    )
+    recorder = _recorders[interface] = CaptureRecorder(interface, writer, packet_filter).start()
+    return recorder
+
+
+def stop_recording(interface: str = 'wlp4s0') -> Optional[CaptureRecorder]:
+    """
+    Stops the recorder running on an interface.
+
+    :param interface: The network interface (default: 'wlp4s0')
+    :type interface: str
+
+    :return: The stopped recorder, or None if the interface was not being recorded.
+    :rtype: CaptureRecorder
+    """
+    recorder = _recorders.pop(interface, None)
+    if recorder is not None:
+        recorder.stop()
+    return recorder
+
+
+def recording_status() -> Dict[str, Any]:
+    """
+    :return: A dictionary with the status of the running recorders and the capture files found in the capture directory
+             with their sizes in bytes.
+    :rtype: dict
+    """
+    root = capture_dir()
+    files = {}
+    if os.path.isdir(root):
+        for entry in sorted(os.scandir(root), key=lambda x: x.name):
+            if entry.is_file() and entry.name.endswith(tuple(f'.{x}' for x in FORMATS)):
+                files[entry.name] = entry.stat().st_size
+    return {'recorders': [x.status() for x in _recorders.values()], 'files': files}
@@ -1,9 +1,21 @@
 import asyncio
 
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-from fastapi import APIRouter, Query
-from .eth_dump import EthernetDump
+from fastapi import APIRouter, Body, Depends, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from about_network.inventory import interface_query
+from serialization.serialization import FastJSONRoute, stream_response
+
+from .eth_dump import EthernetDump, _add_names
+from .engine import PacketFilter, PacketSampler
+from .filters import compile_filter, filter_cache
+from .flows import load_flow_table, stop_flow_table
+from .jobs import QuotaExceeded, get_scheduler
+from .names import get_name_resolver
+from .recorder import capture_path, recording_status, start_recording, stop_recording
+from .tcp import HOST_SORTS, analyze_tcp_file, load_tcp_analyzer, stop_tcp_analyzer
 
 
 router = APIRouter(
@@ -11,59 +23,149 @@ router = APIRouter(
     tags=["Ethernet Dump"],
     dependencies=[],
     responses={404: {"description": "Not found"}},
+    route_class=FastJSONRoute,
 )
 
 
+def sampling_query(
+    every: int = Query(
+        description="Выборка 1 из N: сохранить каждый N-й подходящий пакет (по умолчанию: все пакеты)",
+        default=1,
+        ge=1,
+    ),
+    probability: float = Query(
+        description="Вероятность сохранить подходящий пакет (по умолчанию: 1)",
+        default=1.0,
+        gt=0,
+        le=1,
+    ),
+    rate: float = Query(
+        description="Максимальное количество декодируемых пакетов в секунду (по умолчанию: без ограничения)",
+        default=None,
+        gt=0,
+    ),
+    burst: int = Query(
+        description="Количество пакетов сверх ограничения скорости, допустимое за один раз (по умолчанию: rate)",
+        default=None,
+        ge=1,
+    ),
+    snaplen: int = Query(
+        description="Количество сохраняемых байт каждого пакета, например 128 - только заголовки (по умолчанию: весь пакет)",
+        default=None,
+        ge=14,
+    ),
+) -> Optional[PacketSampler]:
+    """
+    Собирает параметры выборки пакетов для загруженных каналов.
+
+    :param every: Сохранить каждый N-й подходящий пакет (по умолчанию: 1)
+    :type every: int
+    :param probability: Вероятность сохранить подходящий пакет (по умолчанию: 1)
+    :type probability: float
+    :param rate: Максимальное количество пакетов в секунду (по умолчанию: без ограничения)
+    :type rate: float
+    :param burst: Количество пакетов сверх ограничения скорости (по умолчанию: rate)
+    :type burst: int
+    :param snaplen: Количество сохраняемых байт каждого пакета (по умолчанию: весь пакет)
+    :type snaplen: int
+
+    :return: Выборка пакетов, либо None, если сохраняются все пакеты целиком
+    :rtype: PacketSampler
+    """
+    if every == 1 and probability == 1.0 and rate is None and snaplen is None:
+        return None
+    return PacketSampler(every, probability, rate, burst, snaplen)
+
+
+async def run_capture_job(interface: str, count_pkt: int, dns: bool, packet_filter: PacketFilter,
+                          timeout: float = 15, sampler: Optional[PacketSampler] = None) -> Dict[str, Any]:
+    """
+    Запускает задание захвата через общий планировщик и ждет его завершения.
+    Если клиент отключился, задание отменяется.
+
+    :param interface: Название сетевого интерфейса
+    :type interface: str
+    :param count_pkt: Количество пакетов для дампа
+    :type count_pkt: int
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS)
+    :type dns: bool
+    :param packet_filter: Фильтр пакетов
+    :type packet_filter: PacketFilter
+    :param timeout: Максимальное время захвата в секундах (по умолчанию: 15)
+    :type timeout: float
+    :param sampler: Выборка пакетов (по умолчанию: все пакеты)
+    :type sampler: PacketSampler
+
+    :return: Словарь с пакетами, захваченными до завершения или истечения времени (тогда добавляется 'timeout': True),
+             и счетчиками захвата ядра и приложения ('stats'), либо с ошибкой
+    :rtype: dict
+    """
+    try:
+        job = get_scheduler().submit(interface, count_pkt, packet_filter, dns, timeout, sampler, background=False)
+    except QuotaExceeded as e:
+        return {'error': str(e)}
+    try:
+        await job.wait()
+    except asyncio.CancelledError:
+        job.cancel()
+        raise
+    if job.status == 'failed':
+        return {'error': job.error}
+    if job.status == 'timeout':
+        if job.dns:
+            await _add_names(job.records)
+        return {interface: job.records, 'stats': job.dump.stats(), 'timeout': True}
+    return {interface: job.records, 'stats': job.dump.stats()}
+
+
 @router.get("/")
 async def get_eth_dump(
-    interface: str = Query(
-        description="Название интерфейса",
-        default="wlp4s0",
-    ),
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
     count_pkt: int = Query(
         description="Количество пакетов для дампа",
         default=1,
     ),
     type: str = Query(
-        description="Тип пакетов. Пример: tcp, udp, ip, vlan, wlan",
+        description="Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan",
         default="ip",
+        regex=r"^(ip|ip6|arp|tcp|udp|icmp|icmp6|vlan)$",
     ),
     dns: bool = Query(
-        description="Использовать DNS для разрешения имен хостов вместо IP-адресов",
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
         default=False,
     ),
 ) -> Dict[str, Any]:
     """
     Сделать дамп Ethernet-трафика на указанном интерфейсе и вернуть словарь с результатами.
 
-    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: 'wlp4s0')
+    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: интерфейс маршрута по умолчанию)
     :type interface: str
     :param count_pkt: Количество пакетов для дампа (по умолчанию: 1)
     :type count_pkt: int
-    :param type: Тип пакетов (tcp, udp, ip, vlan, wlan) (по умолчанию: 'ip')
+    :param type: Тип пакетов (ip, ip6, arp, tcp, udp, icmp, icmp6, vlan) (по умолчанию: 'ip')
     :type type: str
-    :param dns: Использовать DNS для разрешения имен хостов вместо IP-адресов (по умолчанию: False)
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
     :type dns: bool
+    :param sampler: Выборка пакетов: every, probability, rate, burst, snaplen (по умолчанию: все пакеты целиком)
+    :type sampler: PacketSampler
 
     :return: Словарь, содержащий количество загруженного и отправленного трафика
     :rtype: dict
     """
-    responce = await EthernetDump().get_data(interface, count_pkt, type, dns)
-    return responce
+    return await run_capture_job(interface, count_pkt, dns, PacketFilter(type=type), sampler=sampler)
 
 
 @router.get("/port")
 async def get_eth_dump_extended(
-    interface: str = Query(
-        description="Название сетевого интерфейса",
-        default="wlp4s0",
-    ),
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
     count_pkt: int = Query(
         description="Количество пакетов для дампа",
         default=1,
     ),
     dns: bool = Query(
-        description="Использовать DNS для разрешения имен хостов вместо IP-адресов",
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
         default=False,
     ),
     port: int = Query(
@@ -75,46 +177,38 @@ async def get_eth_dump_extended(
     Сделать дамп Ethernet-трафика на указанном интерфейсе и вернуть словарь с результатами.
     Более расширенная версия.
 
-    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: 'wlp4s0')
+    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: интерфейс маршрута по умолчанию)
     :type interface: str
     :param count_pkt: Количество пакетов для дампа (по умолчанию: 1)
     :type count_pkt: int
-    :param dns: Использовать DNS для разрешения имен хостов вместо IP-адресов (по умолчанию: False)
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
     :type dns: bool
     :param port: Номер порта (по умолчанию: 443)
     :type port: int
+    :param sampler: Выборка пакетов: every, probability, rate, burst, snaplen (по умолчанию: все пакеты целиком)
+    :type sampler: PacketSampler
 
     :return: Словарь, содержащий количество загруженного и отправленного трафика
     :rtype: dict
     """
-    try:
-        responce = await asyncio.wait_for(
-            EthernetDump().get_data_by_port(
-                interface, count_pkt, dns, port
-            ),
-            timeout=15
-        )
-    except asyncio.TimeoutError:
-        return {interface: 'timeout'}
-    return responce
+    return await run_capture_job(interface, count_pkt, dns, PacketFilter(port=port), sampler=sampler)
 
 
 @router.get("/host")
 async def get_eth_dump_extended(
-    interface: str = Query(
-        description="Название сетевого интерфейса",
-        default="wlp4s0",
-    ),
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
     count_pkt: int = Query(
         description="Количество пакетов для дампа",
         default=1,
     ),
     type: str = Query(
-        description="Тип пакетов. Пример: tcp, udp, ip, vlan, wlan",
+        description="Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan",
         default="ip",
+        regex=r"^(ip|ip6|arp|tcp|udp|icmp|icmp6|vlan)$",
     ),
     dns: bool = Query(
-        description="Использовать DNS для разрешения имен хостов вместо IP-адресов",
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
         default=False,
     ),
     host: str = Query(
@@ -126,48 +220,40 @@ async def get_eth_dump_extended(
     Сделать дамп Ethernet-трафика на указанном интерфейсе и вернуть словарь с результатами.
     Более расширенная версия.
 
-    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: 'wlp4s0')
+    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: интерфейс маршрута по умолчанию)
     :type interface: str
     :param count_pkt: Количество пакетов для дампа (по умолчанию: 1)
     :type count_pkt: int
-    :param type: Тип пакетов. Пример: tcp, udp, ip, vlan, wlan
+    :param type: Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan
     :type type: str
-    :param dns: Использовать DNS для разрешения имен хостов вместо IP-адресов (по умолчанию: False)
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
     :type dns: bool
     :param host: Имя или IP-адрес для дампа (по умолчанию: 'localhost')
     :type host: str
+    :param sampler: Выборка пакетов: every, probability, rate, burst, snaplen (по умолчанию: все пакеты целиком)
+    :type sampler: PacketSampler
 
     :return: Словарь, содержащий количество загруженного и отправленного трафика
     :rtype: dict
     """
-    try:
-        responce = await asyncio.wait_for(
-            EthernetDump().get_data_by_host(
-                interface, count_pkt, type, dns, host
-            ),
-            timeout=15
-        )
-    except asyncio.TimeoutError:
-        return {interface: 'timeout'}
-    return responce
+    return await run_capture_job(interface, count_pkt, dns, PacketFilter(type=type, host=host), sampler=sampler)
 
 
 @router.get("/host_and_port")
 async def get_eth_dump_extended(
-    interface: str = Query(
-        description="Название сетевого интерфейса",
-        default="wlp4s0",
-    ),
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
     count_pkt: int = Query(
         description="Количество пакетов для дампа",
         default=1,
     ),
     type: str = Query(
-        description="Тип пакетов. Пример: tcp, udp, ip, vlan, wlan",
+        description="Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan",
         default="ip",
+        regex=r"^(ip|ip6|arp|tcp|udp|icmp|icmp6|vlan)$",
     ),
     dns: bool = Query(
-        description="Использовать DNS для разрешения имен хостов вместо IP-адресов",
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
         default=False,
     ),
     host: str = Query(
@@ -183,28 +269,1029 @@ async def get_eth_dump_extended(
     Сделать дамп Ethernet-трафика на указанном интерфейсе и вернуть словарь с результатами.
     Более расширенная версия.
 
-    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: 'wlp4s0')
+    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: интерфейс маршрута по умолчанию)
     :type interface: str
     :param count_pkt: Количество пакетов для дампа (по умолчанию: 1)
     :type count_pkt: int
-    :param type: Тип пакетов. Пример: tcp, udp, ip, vlan, wlan
+    :param type: Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan
     :type type: str
-    :param dns: Использовать DNS для разрешения имен хостов вместо IP-адресов (по умолчанию: False)
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
     :type dns: bool
     :param host: Имя или IP-адрес для дампа (по умолчанию: 'localhost')
     :type host: str
     :param port: Номер порта (по умолчанию: 443)
     :type port: int
+    :param sampler: Выборка пакетов: every, probability, rate, burst, snaplen (по умолчанию: все пакеты целиком)
+    :type sampler: PacketSampler
 
     :return: Словарь, содержащий количество загруженного и отправленного трафика
     :rtype: dict
     """
+    return await run_capture_job(interface, count_pkt, dns, PacketFilter(type=type, host=host, port=port), sampler=sampler)
+
+
+@router.get("/stream")
+async def stream_eth_dump(
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
+    count_pkt: int = Query(
+        description="Количество пакетов для дампа (0 - без ограничения)",
+        default=0,
+        ge=0,
+    ),
+    type: str = Query(
+        description="Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan",
+        default="ip",
+        regex=r"^(ip|ip6|arp|tcp|udp|icmp|icmp6|vlan)$",
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+    format: str = Query(
+        description="Формат потока: ndjson или sse",
+        default="ndjson",
+        regex=r"^(ndjson|sse)$",
+    ),
+) -> StreamingResponse:
+    """
+    Потоковый дамп Ethernet-трафика: каждый пакет отправляется клиенту сразу после захвата.
+
+    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param count_pkt: Количество пакетов для дампа, 0 - без ограничения (по умолчанию: 0)
+    :type count_pkt: int
+    :param type: Тип пакетов (ip, ip6, arp, tcp, udp, icmp, icmp6, vlan) (по умолчанию: 'ip')
+    :type type: str
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+    :param format: Формат потока: ndjson или sse (по умолчанию: 'ndjson')
+    :type format: str
+    :param sampler: Выборка пакетов: every, probability, rate, burst, snaplen (по умолчанию: все пакеты целиком)
+    :type sampler: PacketSampler
+
+    :return: Поток декодированных пакетов
+    :rtype: StreamingResponse
+    """
+    return stream_response(EthernetDump().stream(interface, count_pkt, dns, PacketFilter(type=type), sampler), format)
+
+
+@router.get("/port/stream")
+async def stream_eth_dump_by_port(
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
+    count_pkt: int = Query(
+        description="Количество пакетов для дампа (0 - без ограничения)",
+        default=0,
+        ge=0,
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+    port: int = Query(
+        description="Номер порта для дампа",
+        default=443,
+    ),
+    format: str = Query(
+        description="Формат потока: ndjson или sse",
+        default="ndjson",
+        regex=r"^(ndjson|sse)$",
+    ),
+) -> StreamingResponse:
+    """
+    Потоковый дамп Ethernet-трафика на указанном порту.
+
+    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param count_pkt: Количество пакетов для дампа, 0 - без ограничения (по умолчанию: 0)
+    :type count_pkt: int
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+    :param port: Номер порта (по умолчанию: 443)
+    :type port: int
+    :param format: Формат потока: ndjson или sse (по умолчанию: 'ndjson')
+    :type format: str
+    :param sampler: Выборка пакетов: every, probability, rate, burst, snaplen (по умолчанию: все пакеты целиком)
+    :type sampler: PacketSampler
+
+    :return: Поток декодированных пакетов
+    :rtype: StreamingResponse
+    """
+    return stream_response(EthernetDump().stream(interface, count_pkt, dns, PacketFilter(port=port), sampler), format)
+
+
+@router.get("/host/stream")
+async def stream_eth_dump_by_host(
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
+    count_pkt: int = Query(
+        description="Количество пакетов для дампа (0 - без ограничения)",
+        default=0,
+        ge=0,
+    ),
+    type: str = Query(
+        description="Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan",
+        default="ip",
+        regex=r"^(ip|ip6|arp|tcp|udp|icmp|icmp6|vlan)$",
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+    host: str = Query(
+        description="Имя или IP-адрес для дампа",
+        default="localhost",
+    ),
+    format: str = Query(
+        description="Формат потока: ndjson или sse",
+        default="ndjson",
+        regex=r"^(ndjson|sse)$",
+    ),
+) -> StreamingResponse:
+    """
+    Потоковый дамп Ethernet-трафика указанного хоста.
+
+    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param count_pkt: Количество пакетов для дампа, 0 - без ограничения (по умолчанию: 0)
+    :type count_pkt: int
+    :param type: Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan
+    :type type: str
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+    :param host: Имя или IP-адрес для дампа (по умолчанию: 'localhost')
+    :type host: str
+    :param format: Формат потока: ndjson или sse (по умолчанию: 'ndjson')
+    :type format: str
+    :param sampler: Выборка пакетов: every, probability, rate, burst, snaplen (по умолчанию: все пакеты целиком)
+    :type sampler: PacketSampler
+
+    :return: Поток декодированных пакетов
+    :rtype: StreamingResponse
+    """
+    return stream_response(
+        EthernetDump().stream(interface, count_pkt, dns, PacketFilter(type=type, host=host), sampler), format
+    )
+
+
+@router.get("/host_and_port/stream")
+async def stream_eth_dump_by_host_and_port(
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
+    count_pkt: int = Query(
+        description="Количество пакетов для дампа (0 - без ограничения)",
+        default=0,
+        ge=0,
+    ),
+    type: str = Query(
+        description="Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan",
+        default="ip",
+        regex=r"^(ip|ip6|arp|tcp|udp|icmp|icmp6|vlan)$",
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+    host: str = Query(
+        description="Имя или IP-адрес для дампа",
+        default="localhost",
+    ),
+    port: int = Query(
+        description="Номер порта",
+        default=443,
+    ),
+    format: str = Query(
+        description="Формат потока: ndjson или sse",
+        default="ndjson",
+        regex=r"^(ndjson|sse)$",
+    ),
+) -> StreamingResponse:
+    """
+    Потоковый дамп Ethernet-трафика указанного хоста на указанном порту.
+
+    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param count_pkt: Количество пакетов для дампа, 0 - без ограничения (по умолчанию: 0)
+    :type count_pkt: int
+    :param type: Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan
+    :type type: str
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+    :param host: Имя или IP-адрес для дампа (по умолчанию: 'localhost')
+    :type host: str
+    :param port: Номер порта (по умолчанию: 443)
+    :type port: int
+    :param format: Формат потока: ndjson или sse (по умолчанию: 'ndjson')
+    :type format: str
+    :param sampler: Выборка пакетов: every, probability, rate, burst, snaplen (по умолчанию: все пакеты целиком)
+    :type sampler: PacketSampler
+
+    :return: Поток декодированных пакетов
+    :rtype: StreamingResponse
+    """
+    return stream_response(
+        EthernetDump().stream(interface, count_pkt, dns, PacketFilter(type=type, host=host, port=port), sampler), format
+    )
+
+
+@router.websocket("/ws")
+async def eth_dump_websocket(
+    websocket: WebSocket,
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
+    count_pkt: int = Query(default=0, ge=0),
+    type: str = Query(default="ip", regex=r"^(ip|ip6|arp|tcp|udp|icmp|icmp6|vlan)$"),
+    dns: bool = Query(default=False),
+    host: str = Query(default=None),
+    port: int = Query(default=None),
+) -> None:
+    """
+    Потоковый дамп Ethernet-трафика через WebSocket: каждый пакет отправляется отдельным JSON-сообщением.
+    Параметры фильтра (interface, count_pkt, type, dns, host, port) и выборки (every, probability, rate, burst, snaplen)
+    передаются в строке запроса. Если захват остановился с ошибкой, отправляется сообщение {'error': ...}
+    и соединение закрывается с кодом 1011.
+    """
+    await websocket.accept()
+    records = EthernetDump().stream(interface, count_pkt, dns, PacketFilter(type=type, host=host, port=port), sampler)
+    error = None
+    try:
+        async for record in records:
+            try:
+                await websocket.send_json(record)
+            except (WebSocketDisconnect, OSError, RuntimeError):
+                return
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    finally:
+        await records.aclose()
+    try:
+        if error is None:
+            await websocket.close()
+        else:
+            await websocket.send_json({'error': error})
+            await websocket.close(code=1011)
+    except (WebSocketDisconnect, OSError, RuntimeError):
+        pass
+
+
+@router.get("/flows")
+async def get_flows(
+    interface: str = Depends(interface_query),
+    limit: int = Query(
+        description="Количество потоков в ответе",
+        default=10,
+        ge=1,
+    ),
+    sort: str = Query(
+        description="Поле для сортировки: bytes, packets, last_seen",
+        default="bytes",
+        regex=r"^(bytes|packets|last_seen)$",
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+) -> Dict[str, Any]:
+    """
+    Получить самые крупные сетевые потоки (по 5-кортежу) на указанном интерфейсе.
+    Первый запрос включает учет потоков на интерфейсе, он продолжается до вызова DELETE /eth_dump/flows.
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param limit: Количество потоков в ответе (по умолчанию: 10)
+    :type limit: int
+    :param sort: Поле для сортировки: bytes, packets, last_seen (по умолчанию: 'bytes')
+    :type sort: str
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+
+    :return: Словарь, содержащий статистику таблицы потоков и список потоков
+    :rtype: dict
+    """
+    table = await load_flow_table(interface)
+    flows = table.top_flows(limit, sort)
+    if dns:
+        await _add_names(flows)
+    return {'interface': interface, 'stats': table.stats(), 'flows': flows}
+
+
+@router.get("/flows/top_talkers")
+async def get_top_talkers(
+    interface: str = Depends(interface_query),
+    limit: int = Query(
+        description="Количество хостов в ответе",
+        default=10,
+        ge=1,
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+) -> Dict[str, Any]:
+    """
+    Получить хосты с наибольшим объемом переданного и полученного трафика (оценка).
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param limit: Количество хостов в ответе (по умолчанию: 10)
+    :type limit: int
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+
+    :return: Словарь, содержащий список хостов и объем их трафика в байтах
+    :rtype: dict
+    """
+    talkers = (await load_flow_table(interface)).top_talkers(limit)
+    if dns:
+        await _add_names(talkers, ('host',))
+    return {'interface': interface, 'top_talkers': talkers}
+
+
+@router.get("/flows/top_ports")
+async def get_top_ports(
+    interface: str = Depends(interface_query),
+    limit: int = Query(
+        description="Количество портов в ответе",
+        default=10,
+        ge=1,
+    ),
+) -> Dict[str, Any]:
+    """
+    Получить порты сервисов с наибольшим объемом трафика (оценка).
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param limit: Количество портов в ответе (по умолчанию: 10)
+    :type limit: int
+
+    :return: Словарь, содержащий список портов и объем их трафика в байтах
+    :rtype: dict
+    """
+    return {'interface': interface, 'top_ports': (await load_flow_table(interface)).top_ports(limit)}
+
+
+@router.get("/dns/stats")
+async def get_dns_stats() -> Dict[str, Any]:
+    """
+    Получить статистику кэша обратного DNS: размер, попадания, промахи, объединенные запросы,
+    отправленные запросы и ошибки.
+
+    :return: Словарь со статистикой кэша
+    :rtype: dict
+    """
+    return get_name_resolver().stats()
+
+
+@router.delete("/flows")
+async def delete_flows(
+    interface: str = Depends(interface_query),
+) -> Dict[str, Any]:
+    """
+    Остановить учет потоков на указанном интерфейсе и удалить накопленную статистику.
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+
+    :return: Словарь с признаком того, что учет потоков был остановлен
+    :rtype: dict
+    """
+    return {'interface': interface, 'stopped': stop_flow_table(interface)}
+
+
+@router.get("/tcp")
+async def get_tcp_connections(
+    interface: str = Depends(interface_query),
+    limit: int = Query(
+        description="Количество соединений в ответе",
+        default=10,
+        ge=1,
+    ),
+    sort: str = Query(
+        description="Поле для сортировки: retransmits, out_of_order, zero_window, rtt, handshake_rtt, bytes, last_seen",
+        default="retransmits",
+        regex=r"^(retransmits|out_of_order|zero_window|rtt|handshake_rtt|bytes|last_seen)$",
+    ),
+    closed: bool = Query(
+        description="Включить недавно закрытые соединения",
+        default=True,
+    ),
+) -> Dict[str, Any]:
+    """
+    Получить состояние TCP-соединений на указанном интерфейсе: RTT рукопожатия и данных, повторные передачи,
+    сегменты не по порядку, нулевое окно и сбросы. Первый запрос включает анализ TCP на интерфейсе,
+    он продолжается до вызова DELETE /eth_dump/tcp.
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param limit: Количество соединений в ответе (по умолчанию: 10)
+    :type limit: int
+    :param sort: Поле для сортировки (по умолчанию: 'retransmits')
+    :type sort: str
+    :param closed: Включить недавно закрытые соединения (по умолчанию: True)
+    :type closed: bool
+
+    :return: Словарь, содержащий статистику анализатора и список соединений
+    :rtype: dict
+    """
+    analyzer = await load_tcp_analyzer(interface)
+    return {'interface': interface, 'stats': analyzer.stats(), 'connections': analyzer.top_connections(limit, sort, closed)}
+
+
+@router.get("/tcp/hosts")
+async def get_tcp_hosts(
+    interface: str = Depends(interface_query),
+    limit: int = Query(
+        description="Количество хостов в ответе",
+        default=10,
+        ge=1,
+    ),
+    sort: str = Query(
+        description="Поле для сортировки: retransmits, retransmit_rate, out_of_order, zero_window, resets, rtt, "
+                    "handshake_rtt, connections, bytes",
+        default="retransmits",
+        regex=r"^(retransmits|retransmit_rate|out_of_order|zero_window|resets|rtt|handshake_rtt|connections|bytes)$",
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+) -> Dict[str, Any]:
+    """
+    Получить состояние TCP-соединений, сгруппированное по удаленным хостам (серверам).
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param limit: Количество хостов в ответе (по умолчанию: 10)
+    :type limit: int
+    :param sort: Поле для сортировки (по умолчанию: 'retransmits')
+    :type sort: str
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+
+    :return: Словарь, содержащий список удаленных хостов и их показатели
+    :rtype: dict
+    """
+    hosts = (await load_tcp_analyzer(interface)).top_hosts(limit, sort)
+    if dns:
+        await _add_names(hosts, ('host',))
+    return {'interface': interface, 'hosts': hosts}
+
+
+@router.delete("/tcp")
+async def delete_tcp(
+    interface: str = Depends(interface_query),
+) -> Dict[str, Any]:
+    """
+    Остановить анализ TCP на указанном интерфейсе и удалить накопленную статистику.
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+
+    :return: Словарь с признаком того, что анализ TCP был остановлен
+    :rtype: dict
+    """
+    return {'interface': interface, 'stopped': stop_tcp_analyzer(interface)}
+
+
+@router.get("/tcp/offline")
+async def get_tcp_offline(
+    file: str = Query(
+        description="Имя файла pcap/pcapng в каталоге записей",
+    ),
+    limit: int = Query(
+        description="Количество соединений и хостов в ответе",
+        default=10,
+        ge=1,
+    ),
+    sort: str = Query(
+        description="Поле для сортировки соединений: retransmits, out_of_order, zero_window, rtt, handshake_rtt, "
+                    "bytes, last_seen",
+        default="retransmits",
+        regex=r"^(retransmits|out_of_order|zero_window|rtt|handshake_rtt|bytes|last_seen)$",
+    ),
+) -> Dict[str, Any]:
+    """
+    Проанализировать TCP-соединения сохраненного файла pcap/pcapng.
+
+    :param file: Имя файла в каталоге записей
+    :type file: str
+    :param limit: Количество соединений и хостов в ответе (по умолчанию: 10)
+    :type limit: int
+    :param sort: Поле для сортировки соединений (по умолчанию: 'retransmits')
+    :type sort: str
+
+    :return: Словарь со статистикой анализатора, соединениями и удаленными хостами файла или ошибкой
+    :rtype: dict
+    """
+    try:
+        analyzer = await analyze_tcp_file(capture_path(file))
+    except FileNotFoundError:
+        return {'error': f'File not found: {file}'}
+    except ValueError as e:
+        return {'error': str(e)}
+    return {
+        'file': file,
+        'stats': analyzer.stats(),
+        'connections': analyzer.top_connections(limit, sort),
+        'hosts': analyzer.top_hosts(limit, sort if sort in HOST_SORTS else 'retransmits'),
+    }
+
+
+@router.post("/record/start")
+async def start_record(
+    interface: str = Depends(interface_query),
+    format: str = Query(
+        description="Формат файлов: pcap или pcapng",
+        default="pcap",
+        regex=r"^(pcap|pcapng)$",
+    ),
+    type: str = Query(
+        description="Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan (по умолчанию записываются все пакеты)",
+        default=None,
+        regex=r"^(ip|ip6|arp|tcp|udp|icmp|icmp6|vlan)$",
+    ),
+    host: str = Query(
+        description="Хост для записи",
+        default=None,
+    ),
+    port: int = Query(
+        description="Номер порта для записи",
+        default=None,
+    ),
+    max_file_size: int = Query(
+        description="Размер файла в байтах, после которого начинается новый файл",
+        default=100 * 10**6,
+        gt=0,
+    ),
+    max_file_seconds: float = Query(
+        description="Время в секундах, после которого начинается новый файл",
+        default=3600.0,
+        gt=0,
+    ),
+    max_files: int = Query(
+        description="Количество хранимых файлов, самые старые удаляются",
+        default=10,
+        gt=0,
+    ),
+) -> Dict[str, Any]:
+    """
+    Начать запись трафика указанного интерфейса в файлы pcap/pcapng с ротацией по размеру и времени.
+    Файлы создаются в каталоге из переменной окружения CAPTURE_DIR.
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param format: Формат файлов: pcap или pcapng (по умолчанию: 'pcap')
+    :type format: str
+    :param type: Тип записываемых пакетов (по умолчанию: все пакеты)
+    :type type: str
+    :param host: Хост для записи (по умолчанию: любой)
+    :type host: str
+    :param port: Номер порта для записи (по умолчанию: любой)
+    :type port: int
+    :param max_file_size: Размер файла в байтах, после которого начинается новый файл (по умолчанию: 100 МБ)
+    :type max_file_size: int
+    :param max_file_seconds: Время в секундах, после которого начинается новый файл (по умолчанию: 3600)
+    :type max_file_seconds: float
+    :param max_files: Количество хранимых файлов (по умолчанию: 10)
+    :type max_files: int
+
+    :return: Словарь с состоянием запущенной записи
+    :rtype: dict
+    """
+    packet_filter = await PacketFilter(type=type, host=host, port=port).resolve()
+    recorder = start_recording(interface, format, packet_filter, max_file_size, max_file_seconds, max_files)
+    return recorder.status()
+
+
+@router.post("/record/stop")
+async def stop_record(
+    interface: str = Depends(interface_query),
+) -> Dict[str, Any]:
+    """
+    Остановить запись трафика указанного интерфейса.
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+
+    :return: Словарь с состоянием остановленной записи или ошибкой, если запись не велась
+    :rtype: dict
+    """
+    recorder = stop_recording(interface)
+    if recorder is None:
+        return {'error': f'Interface {interface} is not being recorded'}
+    return recorder.status()
+
+
+@router.get("/record")
+async def get_record() -> Dict[str, Any]:
+    """
+    Получить состояние запущенных записей и список файлов в каталоге записей.
+
+    :return: Словарь с запущенными записями и размерами файлов в байтах
+    :rtype: dict
+    """
+    return recording_status()
+
+
+@router.get("/offline")
+async def get_eth_dump_offline(
+    file: str = Query(
+        description="Имя файла pcap/pcapng в каталоге записей",
+    ),
+    count_pkt: int = Query(
+        description="Количество пакетов, 0 - все пакеты файла",
+        default=100,
+        ge=0,
+    ),
+    offset: int = Query(
+        description="Количество пропускаемых подходящих пакетов",
+        default=0,
+        ge=0,
+    ),
+    type: str = Query(
+        description="Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan (по умолчанию все пакеты)",
+        default=None,
+        regex=r"^(ip|ip6|arp|tcp|udp|icmp|icmp6|vlan)$",
+    ),
+    host: str = Query(
+        description="Хост для фильтрации",
+        default=None,
+    ),
+    port: int = Query(
+        description="Номер порта для фильтрации",
+        default=None,
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+) -> Dict[str, Any]:
+    """
+    Разобрать сохраненный файл pcap/pcapng с теми же фильтрами, что и при захвате трафика.
+
+    :param file: Имя файла в каталоге записей
+    :type file: str
+    :param count_pkt: Количество пакетов, 0 - все пакеты файла (по умолчанию: 100)
+    :type count_pkt: int
+    :param offset: Количество пропускаемых подходящих пакетов (по умолчанию: 0)
+    :type offset: int
+    :param type: Тип пакетов (по умолчанию: все пакеты)
+    :type type: str
+    :param host: Хост для фильтрации (по умолчанию: любой)
+    :type host: str
+    :param port: Номер порта для фильтрации (по умолчанию: любой)
+    :type port: int
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+
+    :return: Словарь с декодированными пакетами файла или ошибкой
+    :rtype: dict
+    """
     try:
-        responce = await asyncio.wait_for(
-            EthernetDump().get_data_by_host_and_port(
-                interface, count_pkt, type, dns, host, port),
-            timeout=15
+        path = capture_path(file)
+        packets = await EthernetDump().analyze_file(
+            path, count_pkt, offset, dns, PacketFilter(type=type, host=host, port=port)
         )
-    except asyncio.TimeoutError:
-        return {interface: 'timeout'}
-    return responce
+    except FileNotFoundError:
+        return {'error': f'File not found: {file}'}
+    except ValueError as e:
+        return {'error': str(e)}
+    return {file: packets}
+
+
+@router.post("/jobs")
+async def submit_job(
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
+    count_pkt: int = Query(
+        description="Количество пакетов для дампа, 0 - без ограничения (до истечения времени)",
+        default=1,
+        ge=0,
+    ),
+    type: str = Query(
+        description="Тип пакетов: ip, ip6, arp, tcp, udp, icmp, icmp6, vlan (по умолчанию все пакеты)",
+        default=None,
+        regex=r"^(ip|ip6|arp|tcp|udp|icmp|icmp6|vlan)$",
+    ),
+    host: str = Query(
+        description="Имя или IP-адрес для дампа",
+        default=None,
+    ),
+    port: int = Query(
+        description="Номер порта для дампа",
+        default=None,
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+    timeout: float = Query(
+        description="Максимальное время захвата в секундах, захваченные пакеты сохраняются",
+        default=15.0,
+        gt=0,
+    ),
+) -> Dict[str, Any]:
+    """
+    Поставить задание захвата трафика в очередь и сразу вернуть его идентификатор.
+    Результаты можно получать по идентификатору, пока задание выполняется, и после его завершения.
+
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param count_pkt: Количество пакетов, 0 - без ограничения (по умолчанию: 1)
+    :type count_pkt: int
+    :param type: Тип пакетов (по умолчанию: все пакеты)
+    :type type: str
+    :param host: Имя или IP-адрес для дампа (по умолчанию: любой)
+    :type host: str
+    :param port: Номер порта для дампа (по умолчанию: любой)
+    :type port: int
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+    :param timeout: Максимальное время захвата в секундах (по умолчанию: 15)
+    :type timeout: float
+    :param sampler: Выборка пакетов: every, probability, rate, burst, snaplen (по умолчанию: все пакеты целиком)
+    :type sampler: PacketSampler
+
+    :return: Словарь с описанием задания или ошибкой, если превышен лимит заданий
+    :rtype: dict
+    """
+    try:
+        job = get_scheduler().submit(interface, count_pkt, PacketFilter(type=type, host=host, port=port), dns, timeout, sampler)
+    except QuotaExceeded as e:
+        return {'error': str(e)}
+    return job.to_dict()
+
+
+@router.get("/jobs")
+async def list_jobs() -> Dict[str, Any]:
+    """
+    Получить список заданий захвата.
+
+    :return: Словарь с количеством заданий по состояниям и описанием каждого задания
+    :rtype: dict
+    """
+    scheduler = get_scheduler()
+    return {'stats': scheduler.stats(), 'jobs': [x.to_dict() for x in scheduler.jobs.values()]}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    offset: int = Query(
+        description="Количество пропускаемых пакетов (для получения только новых пакетов)",
+        default=0,
+        ge=0,
+    ),
+) -> Dict[str, Any]:
+    """
+    Получить состояние задания захвата и захваченные пакеты.
+
+    :param job_id: Идентификатор задания
+    :type job_id: str
+    :param offset: Количество пропускаемых пакетов (по умолчанию: 0)
+    :type offset: int
+
+    :return: Словарь с описанием задания и пакетами начиная с offset, или ошибкой
+    :rtype: dict
+    """
+    job = get_scheduler().get(job_id)
+    if job is None:
+        return {'error': f'Job not found: {job_id}'}
+    return job.to_dict(offset)
+
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_job(
+    job_id: str,
+    offset: int = Query(
+        description="Количество пропускаемых пакетов",
+        default=0,
+        ge=0,
+    ),
+    format: str = Query(
+        description="Формат потока: ndjson или sse",
+        default="ndjson",
+        regex=r"^(ndjson|sse)$",
+    ),
+) -> Any:
+    """
+    Получать пакеты задания захвата по мере их поступления, пока задание не завершится.
+
+    :param job_id: Идентификатор задания
+    :type job_id: str
+    :param offset: Количество пропускаемых пакетов (по умолчанию: 0)
+    :type offset: int
+    :param format: Формат потока: ndjson или sse (по умолчанию: 'ndjson')
+    :type format: str
+
+    :return: Потоковый ответ с пакетами или словарь с ошибкой
+    :rtype: StreamingResponse
+    """
+    job = get_scheduler().get(job_id)
+    if job is None:
+        return {'error': f'Job not found: {job_id}'}
+    return stream_response(job.follow(offset), format)
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str) -> Dict[str, Any]:
+    """
+    Отменить задание захвата. Уже захваченные пакеты сохраняются.
+
+    :param job_id: Идентификатор задания
+    :type job_id: str
+
+    :return: Словарь с описанием задания или ошибкой
+    :rtype: dict
+    """
+    job = get_scheduler().get(job_id)
+    if job is None:
+        return {'error': f'Job not found: {job_id}'}
+    if job.cancel():
+        await job.wait()
+    return job.to_dict()
+
+
+FILTER_EXAMPLE = {'and': [{'proto': 'tcp'}, {'net': '10.0.0.0/8', 'dir': 'src'}, {'port': [8000, 8080]}]}
+
+
+@router.post("/filter")
+async def get_eth_dump_filter(
+    expression: Dict[str, Any] = Body(
+        description="Выражение фильтра: and, or, not, proto, host, net, port (с направлением dir: any, src, dst)",
+        example=FILTER_EXAMPLE,
+    ),
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
+    count_pkt: int = Query(
+        description="Количество пакетов для дампа",
+        default=1,
+        ge=0,
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+    timeout: float = Query(
+        description="Максимальное время захвата в секундах",
+        default=15.0,
+        gt=0,
+    ),
+) -> Dict[str, Any]:
+    """
+    Сделать дамп Ethernet-трафика по выражению фильтра. Выражение компилируется один раз
+    и кэшируется по нормализованной форме.
+
+    :param expression: Выражение фильтра, например {"and": [{"proto": "tcp"}, {"port": [8000, 8080], "dir": "dst"}]}
+    :type expression: dict
+    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param count_pkt: Количество пакетов для дампа (по умолчанию: 1)
+    :type count_pkt: int
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+    :param timeout: Максимальное время захвата в секундах (по умолчанию: 15)
+    :type timeout: float
+    :param sampler: Выборка пакетов: every, probability, rate, burst, snaplen (по умолчанию: все пакеты целиком)
+    :type sampler: PacketSampler
+
+    :return: Словарь с захваченными пакетами или ошибкой
+    :rtype: dict
+    """
+    try:
+        packet_filter = await compile_filter(expression)
+    except ValueError as e:
+        return {'error': str(e)}
+    return await run_capture_job(interface, count_pkt, dns, packet_filter, timeout, sampler=sampler)
+
+
+@router.post("/filter/stream")
+async def stream_eth_dump_filter(
+    expression: Dict[str, Any] = Body(
+        description="Выражение фильтра: and, or, not, proto, host, net, port (с направлением dir: any, src, dst)",
+        example=FILTER_EXAMPLE,
+    ),
+    interface: str = Depends(interface_query),
+    sampler: Optional[PacketSampler] = Depends(sampling_query),
+    count_pkt: int = Query(
+        description="Количество пакетов для дампа (0 - без ограничения)",
+        default=0,
+        ge=0,
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+    format: str = Query(
+        description="Формат потока: ndjson или sse",
+        default="ndjson",
+        regex=r"^(ndjson|sse)$",
+    ),
+) -> Any:
+    """
+    Потоковый дамп Ethernet-трафика по выражению фильтра.
+
+    :param expression: Выражение фильтра
+    :type expression: dict
+    :param interface: Название сетевого интерфейса, откуда получить трафик (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param count_pkt: Количество пакетов для дампа, 0 - без ограничения (по умолчанию: 0)
+    :type count_pkt: int
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+    :param format: Формат потока: ndjson или sse (по умолчанию: 'ndjson')
+    :type format: str
+    :param sampler: Выборка пакетов: every, probability, rate, burst, snaplen (по умолчанию: все пакеты целиком)
+    :type sampler: PacketSampler
+
+    :return: Поток декодированных пакетов или словарь с ошибкой
+    :rtype: StreamingResponse
+    """
+    try:
+        packet_filter = await compile_filter(expression)
+    except ValueError as e:
+        return {'error': str(e)}
+    return stream_response(EthernetDump().stream(interface, count_pkt, dns, packet_filter, sampler), format)
+
+
+@router.post("/filter/offline")
+async def get_eth_dump_filter_offline(
+    expression: Dict[str, Any] = Body(
+        description="Выражение фильтра: and, or, not, proto, host, net, port (с направлением dir: any, src, dst)",
+        example=FILTER_EXAMPLE,
+    ),
+    file: str = Query(
+        description="Имя файла pcap/pcapng в каталоге записей",
+    ),
+    count_pkt: int = Query(
+        description="Количество пакетов, 0 - все пакеты файла",
+        default=100,
+        ge=0,
+    ),
+    offset: int = Query(
+        description="Количество пропускаемых подходящих пакетов",
+        default=0,
+        ge=0,
+    ),
+    dns: bool = Query(
+        description="Добавить к IP-адресам имена хостов (обратный DNS)",
+        default=False,
+    ),
+) -> Dict[str, Any]:
+    """
+    Разобрать сохраненный файл pcap/pcapng по выражению фильтра.
+
+    :param expression: Выражение фильтра
+    :type expression: dict
+    :param file: Имя файла в каталоге записей
+    :type file: str
+    :param count_pkt: Количество пакетов, 0 - все пакеты файла (по умолчанию: 100)
+    :type count_pkt: int
+    :param offset: Количество пропускаемых подходящих пакетов (по умолчанию: 0)
+    :type offset: int
+    :param dns: Добавить к IP-адресам имена хостов (обратный DNS) (по умолчанию: False)
+    :type dns: bool
+
+    :return: Словарь с декодированными пакетами файла или ошибкой
+    :rtype: dict
+    """
+    try:
+        packet_filter = await compile_filter(expression)
+        packets = await EthernetDump().analyze_file(capture_path(file), count_pkt, offset, dns, packet_filter)
+    except FileNotFoundError:
+        return {'error': f'File not found: {file}'}
+    except ValueError as e:
+        return {'error': str(e)}
+    return {file: packets}
+
+
+@router.post("/filter/compile")
+async def compile_eth_dump_filter(
+    expression: Dict[str, Any] = Body(
+        description="Выражение фильтра: and, or, not, proto, host, net, port (с направлением dir: any, src, dst)",
+        example=FILTER_EXAMPLE,
+    ),
+    snaplen: int = Query(
+        description="Количество сохраняемых байтов подходящих пакетов",
+        default=65535,
+        gt=0,
+    ),
+) -> Dict[str, Any]:
+    """
+    Скомпилировать выражение фильтра и вернуть его нормализованную форму и программу classic BPF,
+    которую можно подключить к сокету захвата в ядре.
+
+    :param expression: Выражение фильтра
+    :type expression: dict
+    :param snaplen: Количество сохраняемых байтов подходящих пакетов (по умолчанию: 65535)
+    :type snaplen: int
+
+    :return: Словарь с нормализованным выражением, программой BPF и статистикой кэша, или ошибкой
+    :rtype: dict
+    """
+    try:
+        packet_filter = await compile_filter(expression, snaplen)
+    except ValueError as e:
+        return {'error': str(e)}
+    return {**packet_filter.to_dict(), 'cache': filter_cache().stats()}
@@ -0,0 +1,623 @@
+import asyncio
+import heapq
+import mmap
+
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from collector.client import get_client
+
+from .decoder import Packet, decode_pcap
+from .engine import CaptureEngine, get_engine
+from .flows import _ntop
+
+
+ConnectionKey = Tuple[bytes, int, bytes, int]
+
+SEQ_MASK = 0xffffffff
+FIN, SYN, RST, ACK = 0x01, 0x02, 0x04, 0x10
+
+
+def _seq_diff(a: int, b: int) -> int:
+    """
+    :return: The signed distance from sequence number `b` to `a`, modulo 2**32.
+    :rtype: int
+    """
+    diff = (a - b) & SEQ_MASK
+    return diff - 0x100000000 if diff & 0x80000000 else diff
+
+
+def _min(value: Optional[float], sample: float) -> float:
+    return sample if value is None else min(value, sample)
+
+
+class _Direction:
+    """
+    The sequence state of one direction of a TCP connection: the end of the highest segment seen, the time it was
+    seen, the segment whose acknowledgment is awaited for an RTT sample and the end of the FIN, if any.
+    """
+    __slots__ = ('next_seq', 'advanced', 'sample_end', 'sample_ts', 'fin_end')
+
+    def __init__(self) -> None:
+        self.next_seq: Optional[int] = None
+        self.advanced = 0.0
+        self.sample_end: Optional[int] = None
+        self.sample_ts = 0.0
+        self.fin_end: Optional[int] = None
+
+
+class TcpConnection:
+    """
+    The TcpConnection class holds the health counters of one TCP connection. Like flows, the endpoints are stored
+    in a canonical order; `client` is the index of the endpoint that sent the SYN, or None if the handshake was missed.
+    """
+    __slots__ = ('key', 'client', 'state', 'first_seen', 'last_seen', 'packets', 'bytes', 'syn_ts', 'synack_ts',
+                 'handshake_rtt', 'srtt', 'min_rtt', 'rtt_samples', 'retransmits', 'out_of_order', 'zero_window',
+                 'resets', 'directions')
+
+    def __init__(self, key: ConnectionKey, ts: float) -> None:
+        self.key = key
+        self.client: Optional[int] = None
+        self.state = 'established'
+        self.first_seen = ts
+        self.last_seen = ts
+        self.packets = 0
+        self.bytes = 0
+        self.syn_ts: Optional[float] = None
+        self.synack_ts: Optional[float] = None
+        self.handshake_rtt: Optional[float] = None
+        self.srtt: Optional[float] = None
+        self.min_rtt: Optional[float] = None
+        self.rtt_samples = 0
+        self.retransmits = 0
+        self.out_of_order = 0
+        self.zero_window = 0
+        self.resets = 0
+        self.directions = (_Direction(), _Direction())
+
+    @property
+    def server(self) -> int:
+        """
+        :return: The index of the endpoint that accepted the connection, or of the endpoint with the lower port
+                 if the handshake was missed.
+        :rtype: int
+        """
+        if self.client is not None:
+            return 1 - self.client
+        return 0 if self.key[1] < self.key[3] else 1
+
+    def add_rtt(self, rtt: float) -> None:
+        """
+        Adds an RTT sample, smoothed the way TCP does (RFC 6298).
+
+        :param rtt: The round-trip time in seconds
+        :type rtt: float
+
+        :return: None
+        :rtype: None
+        """
+        self.srtt = rtt if self.srtt is None else self.srtt + (rtt - self.srtt) / 8
+        self.min_rtt = _min(self.min_rtt, rtt)
+        self.rtt_samples += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return: A dictionary with the client and server endpoints, the state, first and last seen timestamps,
+                 packet and payload byte counts, the handshake RTT, the smoothed and minimum data RTT in seconds
+                 with their number of samples, and the retransmission, out-of-order, zero-window and reset counts.
+        :rtype: dict
+        """
+        server = self.server
+        key = self.key
+        return {
+            'src': _ntop(key[2 - 2 * server]),
+            'sport': key[3 - 2 * server],
+            'dst': _ntop(key[2 * server]),
+            'dport': key[2 * server + 1],
+            'state': self.state,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'handshake_rtt': self.handshake_rtt,
+            'rtt': self.srtt,
+            'rtt_min': self.min_rtt,
+            'rtt_samples': self.rtt_samples,
+            'retransmits': self.retransmits,
+            'out_of_order': self.out_of_order,
+            'zero_window': self.zero_window,
+            'resets': self.resets,
+        }
+
+
+class TcpHost:
+    """
+    The TcpHost class aggregates the health counters of the closed connections to one remote host (the server side).
+    """
+    __slots__ = ('connections', 'packets', 'bytes', 'handshake_sum', 'handshake_count', 'handshake_min', 'rtt_sum',
+                 'rtt_count', 'rtt_min', 'retransmits', 'out_of_order', 'zero_window', 'resets')
+
+    def __init__(self) -> None:
+        self.connections = 0
+        self.packets = 0
+        self.bytes = 0
+        self.handshake_sum = 0.0
+        self.handshake_count = 0
+        self.handshake_min: Optional[float] = None
+        self.rtt_sum = 0.0
+        self.rtt_count = 0
+        self.rtt_min: Optional[float] = None
+        self.retransmits = 0
+        self.out_of_order = 0
+        self.zero_window = 0
+        self.resets = 0
+
+    def add(self, connection: TcpConnection) -> None:
+        """
+        Adds the counters of a connection.
+
+        :param connection: The connection
+        :type connection: TcpConnection
+
+        :return: None
+        :rtype: None
+        """
+        self.connections += 1
+        self.packets += connection.packets
+        self.bytes += connection.bytes
+        if connection.handshake_rtt is not None:
+            self.handshake_sum += connection.handshake_rtt
+            self.handshake_count += 1
+            self.handshake_min = _min(self.handshake_min, connection.handshake_rtt)
+        if connection.srtt is not None:
+            self.rtt_sum += connection.srtt
+            self.rtt_count += 1
+            self.rtt_min = _min(self.rtt_min, connection.min_rtt)
+        self.retransmits += connection.retransmits
+        self.out_of_order += connection.out_of_order
+        self.zero_window += connection.zero_window
+        self.resets += connection.resets
+
+    def copy(self) -> 'TcpHost':
+        """
+        :return: A copy of the counters.
+        :rtype: TcpHost
+        """
+        host = TcpHost()
+        for name in self.__slots__:
+            setattr(host, name, getattr(self, name))
+        return host
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return: A dictionary with the number of connections, packets and payload bytes, the mean and minimum
+                 handshake RTT, the mean of the smoothed RTT of the connections and the minimum RTT in seconds,
+                 the retransmission, out-of-order, zero-window and reset counts and the share of retransmitted packets.
+        :rtype: dict
+        """
+        return {
+            'connections': self.connections,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'handshake_rtt': self.handshake_sum / self.handshake_count if self.handshake_count else None,
+            'handshake_rtt_min': self.handshake_min,
+            'rtt': self.rtt_sum / self.rtt_count if self.rtt_count else None,
+            'rtt_min': self.rtt_min,
+            'retransmits': self.retransmits,
+            'retransmit_rate': self.retransmits / self.packets if self.packets else 0.0,
+            'out_of_order': self.out_of_order,
+            'zero_window': self.zero_window,
+            'resets': self.resets,
+        }
+
+
+CONNECTION_SORTS: Dict[str, Callable[[TcpConnection], float]] = {
+    'retransmits': lambda x: x.retransmits,
+    'out_of_order': lambda x: x.out_of_order,
+    'zero_window': lambda x: x.zero_window,
+    'rtt': lambda x: x.srtt or 0.0,
+    'handshake_rtt': lambda x: x.handshake_rtt or 0.0,
+    'bytes': lambda x: x.bytes,
+    'last_seen': lambda x: x.last_seen,
+}
+
+HOST_SORTS = ('retransmits', 'retransmit_rate', 'out_of_order', 'zero_window', 'resets', 'rtt', 'handshake_rtt',
+              'connections', 'bytes')
+
+
+class TcpAnalyzer:
+    """
+    The TcpAnalyzer class follows the sequence and acknowledgment numbers of the captured TCP connections to measure
+    their health: the handshake RTT (SYN to the ACK completing the handshake), the data RTT (a data segment to the
+    acknowledgment covering it, skipping retransmitted segments as in Karn's algorithm), retransmissions, out-of-order
+    segments (segments filling a gap within `reorder_window` seconds, or the minimum RTT once it is known),
+    zero-window advertisements and resets.
+
+    Only a few numbers are kept per direction of a connection. Connections are closed on RST, on the ACK of the second
+    FIN, after `idle_timeout` seconds of inactivity or when the table holds more than `max_connections` connections;
+    their counters are then added to their remote host and the latest `keep_closed` of them are kept for inspection.
+    """
+
+    def __init__(self, max_connections: int = 100000, idle_timeout: float = 300.0, max_hosts: int = 10000,
+                 keep_closed: int = 1000, reorder_window: float = 0.003) -> None:
+        """
+        :param max_connections: The maximum number of open connections kept in memory (default: 100000)
+        :type max_connections: int
+        :param idle_timeout: The time in seconds after which an idle connection is closed (default: 300)
+        :type idle_timeout: float
+        :param max_hosts: The maximum number of remote hosts aggregated, least recently updated first out (default: 10000)
+        :type max_hosts: int
+        :param keep_closed: The number of closed connections kept (default: 1000)
+        :type keep_closed: int
+        :param reorder_window: The time in seconds within which a segment filling a gap is out of order rather than
+                               retransmitted, until the RTT of the connection is known (default: 0.003)
+        :type reorder_window: float
+
+        :return: None
+        :rtype: None
+        """
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.max_hosts = max_hosts
+        self.reorder_window = reorder_window
+        self.connections: 'OrderedDict[ConnectionKey, TcpConnection]' = OrderedDict()
+        self.hosts: 'OrderedDict[bytes, TcpHost]' = OrderedDict()
+        self.closed: Deque[TcpConnection] = deque(maxlen=keep_closed)
+        self.packets = 0
+        self.closes = {'closed': 0, 'reset': 0, 'idle': 0, 'evicted': 0}
+        self.engine: Optional[CaptureEngine] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state['engine'] = None
+        return state
+
+    def update(self, packet: Packet) -> None:
+        """
+        Accounts a captured packet. Packets other than TCP segments are ignored.
+
+        :param packet: The captured packet
+        :type packet: Packet
+
+        :return: None
+        :rtype: None
+        """
+        tcp = packet._tcp()
+        if tcp is None:
+            return
+        sport, dport, seq, ack, _, flags, window = tcp
+        src, dst = packet.src_raw, packet.dst_raw
+        if (src, sport) <= (dst, dport):
+            key, side = (src, sport, dst, dport), 0
+        else:
+            key, side = (dst, dport, src, sport), 1
+        ts = packet.ts
+        connections = self.connections
+        connection = connections.get(key)
+        if connection is None:
+            connection = connections[key] = TcpConnection(key, ts)
+            if len(connections) > self.max_connections:
+                self._close(next(iter(connections.values())), 'evicted')
+        else:
+            connections.move_to_end(key)
+        payload = packet.payload_length or 0
+        connection.packets += 1
+        connection.bytes += payload
+        connection.last_seen = ts
+        sending, receiving = connection.directions[side], connection.directions[1 - side]
+
+        if flags & SYN:
+            if not flags & ACK:
+                if connection.syn_ts is None:
+                    connection.client, connection.state, connection.syn_ts = side, 'handshake', ts
+                else:
+                    # the SYN was retransmitted, so the SYN-ACK cannot be matched to one of them (Karn's algorithm)
+                    connection.syn_ts = -1.0
+            elif connection.synack_ts is None:
+                if connection.client is None:
+                    connection.client = 1 - side
+                connection.synack_ts = ts
+        elif flags & ACK and connection.state == 'handshake' and side == connection.client \
+                and connection.synack_ts is not None:
+            if connection.syn_ts >= 0:
+                connection.handshake_rtt = ts - connection.syn_ts
+            connection.state = 'established'
+
+        length = payload + (flags & SYN) // SYN + (flags & FIN)
+        if length:
+            end = (seq + length) & SEQ_MASK
+            if sending.next_seq is None or _seq_diff(seq, sending.next_seq) >= 0:
+                sending.next_seq, sending.advanced = end, ts
+                if payload and sending.sample_end is None and not flags & SYN:
+                    sending.sample_end, sending.sample_ts = end, ts
+            elif not (payload == 1 and length == 1 and _seq_diff(end, sending.next_seq) == 0):
+                # a segment below the highest one seen, other than a keep-alive probe resending the last byte
+                if ts - sending.advanced < (connection.min_rtt or self.reorder_window):
+                    connection.out_of_order += 1
+                else:
+                    connection.retransmits += 1
+                    sending.sample_end = None
+                if _seq_diff(end, sending.next_seq) > 0:
+                    sending.next_seq = end
+            if flags & FIN:
+                sending.fin_end = end
+                connection.state = 'closing'
+
+        if flags & ACK:
+            if receiving.sample_end is not None and _seq_diff(ack, receiving.sample_end) >= 0:
+                connection.add_rtt(ts - receiving.sample_ts)
+                receiving.sample_end = None
+            if receiving.fin_end is not None and sending.fin_end is not None and not flags & FIN \
+                    and _seq_diff(ack, receiving.fin_end) >= 0:
+                self._close(connection, 'closed')
+        if not window and not flags & (RST | SYN):
+            connection.zero_window += 1
+        if flags & RST:
+            connection.resets += 1
+            self._close(connection, 'reset')
+
+        self.packets += 1
+        if not self.packets & 0x3ff:
+            self.expire(ts)
+
+    def _close(self, connection: TcpConnection, reason: str) -> None:
+        if self.connections.pop(connection.key, None) is None:
+            return
+        connection.state = reason
+        self.closes[reason] += 1
+        self.closed.append(connection)
+        self._host(connection.key[2 * connection.server]).add(connection)
+
+    def _host(self, address: bytes) -> TcpHost:
+        hosts = self.hosts
+        host = hosts.get(address)
+        if host is None:
+            host = hosts[address] = TcpHost()
+            if len(hosts) > self.max_hosts:
+                hosts.popitem(last=False)
+        else:
+            hosts.move_to_end(address)
+        return host
+
+    def expire(self, now: float) -> None:
+        """
+        Closes the connections idle for more than `idle_timeout` seconds.
+
+        :param now: The current time
+        :type now: float
+
+        :return: None
+        :rtype: None
+        """
+        connections = self.connections
+        deadline = now - self.idle_timeout
+        while connections:
+            connection = next(iter(connections.values()))
+            if connection.last_seen >= deadline:
+                break
+            self._close(connection, 'idle')
+
+    def top_connections(self, n: int = 10, sort: str = 'retransmits', closed: bool = True) -> List[Dict[str, Any]]:
+        """
+        :param n: The number of connections to return (default: 10)
+        :type n: int
+        :param sort: The counter to sort by, see CONNECTION_SORTS (default: 'retransmits')
+        :type sort: str
+        :param closed: Whether or not to include the latest closed connections (default: True)
+        :type closed: bool
+
+        :return: The `n` connections with the highest counter.
+        :rtype: list
+        """
+        connections = list(self.connections.values())
+        if closed:
+            connections.extend(self.closed)
+        return [x.to_dict() for x in heapq.nlargest(n, connections, key=CONNECTION_SORTS[sort])]
+
+    def top_hosts(self, n: int = 10, sort: str = 'retransmits') -> List[Dict[str, Any]]:
+        """
+        :param n: The number of hosts to return (default: 10)
+        :type n: int
+        :param sort: The counter to sort by, see HOST_SORTS (default: 'retransmits')
+        :type sort: str
+
+        :return: The `n` remote hosts with the highest counter, aggregated over their closed and open connections.
+        :rtype: list
+        """
+        return heapq.nlargest(n, self._host_rows(), key=lambda x: x[sort] or 0.0)
+
+    def _host_rows(self) -> List[Dict[str, Any]]:
+        # the containers are copied first, so the hosts can be aggregated in another thread while packets are analyzed
+        hosts = {address: x.copy() for address, x in list(self.hosts.items())}
+        for connection in list(self.connections.values()):
+            address = connection.key[2 * connection.server]
+            if address not in hosts:
+                hosts[address] = TcpHost()
+            hosts[address].add(connection)
+        return [dict(x.to_dict(), host=_ntop(address)) for address, x in hosts.items()]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: A dictionary with the number of open connections, remote hosts and packets accounted,
+                 and the number of connections closed by FIN, reset, idle timeout and eviction.
+        :rtype: dict
+        """
+        return dict(self.closes, connections=len(self.connections), hosts=len(self.hosts), packets=self.packets)
+
+
+class TcpSummary:
+    """
+    The TcpSummary class is a bounded copy of a TcpAnalyzer: its statistics, its `size` top open and closed connections
+    by every sort key and its `size` top remote hosts by every sort key. It answers the queries of the analyzer for up
+    to `size` results. The containers of the analyzer are copied before they are scanned, so a summary can be taken
+    in another thread while packets are analyzed.
+    """
+
+    def __init__(self, analyzer: Optional[TcpAnalyzer] = None, size: int = 1000) -> None:
+        """
+        :param analyzer: The TCP analyzer to summarize (default: an empty summary)
+        :type analyzer: TcpAnalyzer
+        :param size: The number of connections and hosts kept per query (default: 1000)
+        :type size: int
+
+        :return: None
+        :rtype: None
+        """
+        self.size = size
+        self.connections: List[TcpConnection] = []
+        self.closed: List[TcpConnection] = []
+        self.hosts: List[Dict[str, Any]] = []
+        self.counters = {'closed': 0, 'reset': 0, 'idle': 0, 'evicted': 0, 'connections': 0, 'hosts': 0, 'packets': 0}
+        if analyzer is None:
+            return
+        connections, closed = list(analyzer.connections.values()), list(analyzer.closed)
+        self.connections, self.closed = self._select(connections, size), self._select(closed, size)
+        hosts = analyzer._host_rows()
+        selected = {x['host'] for sort in HOST_SORTS for x in heapq.nlargest(size, hosts, key=lambda x: x[sort] or 0.0)}
+        self.hosts = [x for x in hosts if x['host'] in selected]
+        self.counters = dict(analyzer.closes, connections=len(connections), hosts=len(analyzer.hosts),
+                             packets=analyzer.packets)
+
+    @staticmethod
+    def _select(connections: List[TcpConnection], size: int) -> List[TcpConnection]:
+        selected = {id(x) for key in CONNECTION_SORTS.values() for x in heapq.nlargest(size, connections, key=key)}
+        # the order of the analyzer is kept, so ties are broken as in the analyzer
+        return [x for x in connections if id(x) in selected]
+
+    def top_connections(self, n: int = 10, sort: str = 'retransmits', closed: bool = True) -> List[Dict[str, Any]]:
+        """
+        :param n: The number of connections to return, at most `size` (default: 10)
+        :type n: int
+        :param sort: The counter to sort by, see CONNECTION_SORTS (default: 'retransmits')
+        :type sort: str
+        :param closed: Whether or not to include the latest closed connections (default: True)
+        :type closed: bool
+
+        :return: The `n` connections with the highest counter when the analyzer was summarized.
+        :rtype: list
+        """
+        connections = self.connections + self.closed if closed else self.connections
+        return [x.to_dict() for x in heapq.nlargest(n, connections, key=CONNECTION_SORTS[sort])]
+
+    def top_hosts(self, n: int = 10, sort: str = 'retransmits') -> List[Dict[str, Any]]:
+        """
+        :param n: The number of hosts to return, at most `size` (default: 10)
+        :type n: int
+        :param sort: The counter to sort by, see HOST_SORTS (default: 'retransmits')
+        :type sort: str
+
+        :return: The `n` remote hosts with the highest counter when the analyzer was summarized.
+        :rtype: list
+        """
+        return heapq.nlargest(n, self.hosts, key=lambda x: x[sort] or 0.0)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: The statistics of the analyzer when it was summarized (see `TcpAnalyzer.stats`).
+        :rtype: dict
+        """
+        return dict(self.counters)
+
+
+def analyze_pcap(data: bytes, analyzer: Optional[TcpAnalyzer] = None) -> TcpAnalyzer:
+    """
+    Feeds the packets of a pcap or pcapng file held in memory (bytes or a memory map) to a TCP analyzer.
+
+    :param data: The contents of the pcap or pcapng file
+    :type data: bytes
+    :param analyzer: The analyzer (default: a new one)
+    :type analyzer: TcpAnalyzer
+
+    :return: The analyzer.
+    :rtype: TcpAnalyzer
+    """
+    if analyzer is None:
+        analyzer = TcpAnalyzer()
+    update = analyzer.update
+    for packet in decode_pcap(data):
+        update(packet)
+    return analyzer
+
+
+def _analyze_file(path: str) -> TcpAnalyzer:
+    with open(path, 'rb') as file:
+        if not file.seek(0, 2):
+            return TcpAnalyzer()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return analyze_pcap(data)
+
+
+async def analyze_tcp_file(path: str) -> TcpAnalyzer:
+    """
+    Asynchronously analyzes the TCP connections of a pcap or pcapng file. The file is memory-mapped and scanned
+    in the default executor.
+
+    :param path: The path of the pcap or pcapng file
+    :type path: str
+
+    :return: The analyzer holding the connections of the file.
+    :rtype: TcpAnalyzer
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, _analyze_file, path)
+
+
+_analyzers: Dict[str, TcpAnalyzer] = {}
+
+
+def get_tcp_analyzer(interface: str = 'wlp4s0') -> TcpAnalyzer:
+    """
+    Returns the TCP analyzer of a network interface, attaching it to the capture engine of the interface
+    on first use so that every captured packet is analyzed from then on.
+
+    :param interface: The network interface (default: 'wlp4s0')
+    :type interface: str
+
+    :return: The TCP analyzer of the interface.
+    :rtype: TcpAnalyzer
+    """
+    analyzer = _analyzers.get(interface)
+    if analyzer is None:
+        analyzer = _analyzers[interface] = TcpAnalyzer()
+    engine = get_engine(interface)
+    if analyzer.engine is not engine:
+        engine.attach(analyzer.update)
+        analyzer.engine = engine
+    return analyzer
+
+
+async def load_tcp_analyzer(interface: str = 'wlp4s0') -> Union[TcpAnalyzer, TcpSummary]:
+    """
+    Asynchronously returns the TCP analyzer of a network interface. In multi-worker mode the analyzers are kept
+    by the collector process, and this returns the latest summary it published (see `TcpSummary`).
+
+    :param interface: The network interface (default: 'wlp4s0')
+    :type interface: str
+
+    :return: The TCP analyzer of the interface, or its summary.
+    :rtype: TcpAnalyzer or TcpSummary
+    """
+    client = get_client()
+    if client is None:
+        return get_tcp_analyzer(interface)
+    return client.snapshot(await client.acall('tcp', interface), TcpSummary())
+
+
+def stop_tcp_analyzer(interface: str = 'wlp4s0') -> bool:
+    """
+    Detaches the TCP analyzer of a network interface from its capture engine and drops it.
+
+    :param interface: The network interface (default: 'wlp4s0')
+    :type interface: str
+
+    :return: True if the interface had a TCP analyzer.
+    :rtype: bool
+    """
+    client = get_client()
+    if client is not None:
+        return client.call('stop_tcp', interface)
+    analyzer = _analyzers.pop(interface, None)
+    if analyzer is None:
+        return False
+    if analyzer.engine is not None:
+        analyzer.engine.detach(analyzer.update)
+    return True
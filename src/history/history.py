@@ -0,0 +1,458 @@
+import asyncio
+import bisect
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from about_network.sampler import FIELDS, get_sampler
+from eth_dump.flows import flow_stats
+
+
+KINDS = {
+    'traffic': FIELDS,
+    'flows': ('flows', 'packets', 'evicted'),
+}
+
+TIERS = ((1, 86400), (60, 30 * 86400), (3600, 365 * 86400))
+
+_HEADER = struct.Struct('=8sII')
+_MAGIC = b'NMHIST01'
+_NAME = re.compile(r'^[\w:@-][\w.:@-]*$')
+
+
+def history_dir() -> str:
+    """
+    :return: The directory holding the history, read from the HISTORY_DIR environment variable
+             (default: 'netmon/history' in $XDG_DATA_HOME, else in ~/.local/share).
+    :rtype: str
+    """
+    default = os.path.join(os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'), 'netmon', 'history')
+    return os.path.abspath(os.environ.get('HISTORY_DIR') or default)
+
+
+class _Writer:
+    """
+    The append position of one tier of one series: the open segment and the time of its latest record.
+    """
+    __slots__ = ('fd', 'start', 'last', 'pending')
+
+    def __init__(self) -> None:
+        self.fd: Optional[int] = None
+        self.start: Optional[int] = None
+        self.last = -math.inf
+        self.pending: Optional[Tuple[float, Tuple[float, ...]]] = None
+
+
+class HistoryStore:
+    """
+    The HistoryStore class is an embedded on-disk store of sampled counters. Every series (a kind of counters
+    and a name, e.g. the traffic of an interface) is kept at several resolutions (tiers): the samples are appended
+    to the finest tier, and the coarser tiers receive the latest sample of every interval of their resolution, which
+    loses nothing for cumulative counters. Every tier is split into append-only segment files of `segment_records`
+    records named after their start time, so range queries only open the segments overlapping the range, map them
+    and find the range by binary search. Segments older than the retention of their tier are deleted, and the oldest
+    segments of the finest tiers are deleted first when the store grows over `max_bytes`.
+
+    Layout: <root>/<kind>/<name>/<resolution>/<start>.seg, every segment holding a 16-byte header (magic, number
+    of fields, resolution) followed by records of native doubles (time, then the value of every field).
+    """
+
+    def __init__(self, root: str, tiers: Sequence[Tuple[int, float]] = TIERS, max_bytes: int = 256 << 20,
+                 segment_records: int = 3600, kinds: Optional[Dict[str, Sequence[str]]] = None) -> None:
+        """
+        :param root: The directory of the store
+        :type root: str
+        :param tiers: The (resolution, retention) pairs of the tiers in seconds, finest first (default: 1 s for a day,
+                      1 min for 30 days, 1 h for a year)
+        :type tiers: list
+        :param max_bytes: The maximum size of the store on disk (default: 256 MiB)
+        :type max_bytes: int
+        :param segment_records: The number of resolution intervals covered by a segment (default: 3600)
+        :type segment_records: int
+        :param kinds: The fields of every kind of series (default: 'traffic' and 'flows', see KINDS)
+        :type kinds: dict
+
+        :return: None
+        :rtype: None
+        """
+        self.root = root
+        self.tiers = tuple(tiers)
+        self.max_bytes = max_bytes
+        self.segment_records = segment_records
+        self.kinds = dict(KINDS if kinds is None else kinds)
+        self.writers: Dict[Tuple[str, str, int], _Writer] = {}
+        self._lock = threading.Lock()
+
+    def _directory(self, kind: str, name: str, resolution: Optional[int] = None) -> str:
+        if kind not in self.kinds:
+            raise ValueError(f'Unknown kind of series: {kind}')
+        if not _NAME.match(name):
+            raise ValueError(f'Invalid series name: {name}')
+        path = os.path.join(self.root, kind, name)
+        return path if resolution is None else os.path.join(path, str(resolution))
+
+    def _segments(self, directory: str) -> List[int]:
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(x[:-4]) for x in names if x.endswith('.seg') and x[:-4].isdigit())
+
+    def _open(self, kind: str, name: str, resolution: int, writer: _Writer, start: int) -> None:
+        if writer.fd is not None:
+            os.close(writer.fd)
+            writer.fd = None
+        directory = self._directory(kind, name, resolution)
+        os.makedirs(directory, exist_ok=True)
+        width = 8 * (len(self.kinds[kind]) + 1)
+        fd = os.open(os.path.join(directory, f'{start}.seg'), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        size = os.fstat(fd).st_size
+        if size < _HEADER.size:
+            os.ftruncate(fd, 0)
+            os.write(fd, _HEADER.pack(_MAGIC, len(self.kinds[kind]), resolution))
+        elif (size - _HEADER.size) % width:
+            os.ftruncate(fd, size - (size - _HEADER.size) % width)
+        size = os.fstat(fd).st_size
+        if size > _HEADER.size:
+            writer.last = max(writer.last, struct.unpack('=d', os.pread(fd, 8, size - width))[0])
+        writer.fd, writer.start = fd, start
+        self._expire(kind, name, resolution)
+
+    def _writer(self, kind: str, name: str, resolution: int) -> _Writer:
+        writer = self.writers.get((kind, name, resolution))
+        if writer is None:
+            writer = self.writers[(kind, name, resolution)] = _Writer()
+            segments = self._segments(self._directory(kind, name, resolution))
+            if segments:
+                self._open(kind, name, resolution, writer, segments[-1])
+        return writer
+
+    def _write(self, kind: str, name: str, resolution: int, ts: float, values: Tuple[float, ...]) -> bool:
+        writer = self._writer(kind, name, resolution)
+        if ts <= writer.last:
+            return False
+        span = resolution * self.segment_records
+        start = int(ts // span * span)
+        if writer.start != start:
+            self._open(kind, name, resolution, writer, start)
+        os.write(writer.fd, struct.pack(f'={len(values) + 1}d', ts, *values))
+        writer.last = ts
+        return True
+
+    def append(self, kind: str, name: str, ts: float, values: Dict[str, float]) -> None:
+        """
+        Appends a sample to a series. Samples not newer than the latest one of the series are ignored.
+
+        :param kind: The kind of the series, e.g. 'traffic'
+        :type kind: str
+        :param name: The name of the series, e.g. the interface
+        :type name: str
+        :param ts: The time of the sample
+        :type ts: float
+        :param values: The value of every field of the kind
+        :type values: dict
+
+        :return: None
+        :rtype: None
+        """
+        self._directory(kind, name)
+        record = tuple(float(values[x]) for x in self.kinds[kind])
+        with self._lock:
+            if not self._write(kind, name, self.tiers[0][0], ts, record):
+                return
+            for resolution, retention in self.tiers[1:]:
+                writer = self._writer(kind, name, resolution)
+                pending = writer.pending
+                if pending is not None and pending[0] // resolution != ts // resolution:
+                    if writer.last < pending[0] // resolution * resolution:
+                        self._write(kind, name, resolution, *pending)
+                writer.pending = (ts, record)
+
+    def _expire(self, kind: str, name: str, resolution: int) -> None:
+        retention = dict(self.tiers)[resolution]
+        directory = self._directory(kind, name, resolution)
+        span = resolution * self.segment_records
+        deadline = time.time() - retention
+        active = self.writers[(kind, name, resolution)].start
+        for start in self._segments(directory):
+            if start + span < deadline and start != active:
+                os.unlink(os.path.join(directory, f'{start}.seg'))
+        self._shrink()
+
+    def _shrink(self) -> None:
+        active = {os.path.join(self._directory(k, n, r), f'{x.start}.seg') for (k, n, r), x in self.writers.items() if x.fd is not None}
+        files, total = [], 0
+        rank = {resolution: i for i, (resolution, retention) in enumerate(self.tiers)}
+        for directory, _, names in os.walk(self.root):
+            for file in names:
+                if not file.endswith('.seg'):
+                    continue
+                path = os.path.join(directory, file)
+                size = os.path.getsize(path)
+                total += size
+                resolution = os.path.basename(directory)
+                if path not in active and resolution.isdigit():
+                    files.append((rank.get(int(resolution), 0), int(file[:-4]), size, path))
+        files.sort()
+        for _, _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            os.unlink(path)
+            total -= size
+
+    def resolution(self, start: float, end: float, max_points: int = 1000, now: Optional[float] = None) -> int:
+        """
+        Picks the finest tier still holding the start of a range that returns at most `max_points` points.
+
+        :param start: The start of the range
+        :type start: float
+        :param end: The end of the range
+        :type end: float
+        :param max_points: The maximum number of points (default: 1000)
+        :type max_points: int
+        :param now: The current time (default: the current time)
+        :type now: float
+
+        :return: The resolution of the tier in seconds.
+        :rtype: int
+        """
+        now = time.time() if now is None else now
+        for resolution, retention in self.tiers:
+            if start >= now - retention and (end - start) / resolution <= max_points:
+                return resolution
+        return self.tiers[-1][0]
+
+    def query(self, kind: str, name: str, start: float, end: float, resolution: Optional[int] = None,
+              max_points: int = 1000) -> Dict[str, Any]:
+        """
+        Reads the samples of a series in a time range.
+
+        :param kind: The kind of the series
+        :type kind: str
+        :param name: The name of the series
+        :type name: str
+        :param start: The start of the range
+        :type start: float
+        :param end: The end of the range
+        :type end: float
+        :param resolution: The resolution of the tier to read in seconds (default: chosen with `resolution`)
+        :type resolution: int
+        :param max_points: The maximum number of points used to choose the resolution (default: 1000)
+        :type max_points: int
+
+        :return: A dictionary with the resolution, the number of segments read and the points of the range,
+                 every point holding the time of the sample under 'ts' and the value of every field.
+        :rtype: dict
+        """
+        if resolution is None:
+            resolution = self.resolution(start, end, max_points)
+        if resolution not in dict(self.tiers):
+            raise ValueError(f'Unknown resolution: {resolution}')
+        directory = self._directory(kind, name, resolution)
+        fields = self.kinds[kind]
+        width = len(fields) + 1
+        span = resolution * self.segment_records
+        points, read = [], 0
+        for segment in self._segments(directory):
+            if segment + span <= start or segment > end:
+                continue
+            read += 1
+            try:
+                file = open(os.path.join(directory, f'{segment}.seg'), 'rb')
+            except FileNotFoundError:
+                continue
+            with file:
+                size = os.fstat(file.fileno()).st_size
+                count = (size - _HEADER.size) // (8 * width)
+                if count <= 0:
+                    continue
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                    view = memoryview(mapping)[_HEADER.size:_HEADER.size + 8 * width * count].cast('d')
+                    try:
+                        first = bisect.bisect_left(range(count), start, key=lambda i: view[i * width])
+                        last = bisect.bisect_right(range(count), end, key=lambda i: view[i * width])
+                        for i in range(first * width, last * width, width):
+                            points.append({'ts': view[i], **dict(zip(fields, view[i + 1:i + width].tolist()))})
+                    finally:
+                        view.release()
+        with self._lock:
+            writer = self.writers.get((kind, name, resolution))
+            pending = writer.pending if writer is not None else None
+        if pending is not None and start <= pending[0] <= end and (not points or pending[0] > points[-1]['ts']):
+            points.append({'ts': pending[0], **dict(zip(fields, pending[1]))})
+        return {'kind': kind, 'name': name, 'resolution': resolution, 'segments': read, 'points': points}
+
+    def series(self) -> List[Dict[str, Any]]:
+        """
+        :return: The stored series with their kind, name, fields and the resolutions holding data.
+        :rtype: list
+        """
+        result = []
+        for kind, fields in self.kinds.items():
+            try:
+                names = sorted(os.listdir(os.path.join(self.root, kind)))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                resolutions = [x for x, _ in self.tiers if self._segments(os.path.join(self.root, kind, name, str(x)))]
+                if resolutions:
+                    result.append({'kind': kind, 'name': name, 'fields': list(fields), 'resolutions': resolutions})
+        return result
+
+    def close(self) -> None:
+        """
+        Closes the open segments. Samples pending for the coarser tiers are dropped.
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            for writer in self.writers.values():
+                if writer.fd is not None:
+                    os.close(writer.fd)
+            self.writers = {}
+
+
+class HistoryRecorder:
+    """
+    The HistoryRecorder class appends the latest samples of the traffic sampler and the statistics of the flow
+    tables to a history store in a background thread, at the interval of the sampler.
+    """
+
+    def __init__(self, store: HistoryStore, interval: Optional[float] = None) -> None:
+        """
+        :param store: The history store
+        :type store: HistoryStore
+        :param interval: The time between two recordings in seconds (default: the interval of the traffic sampler)
+        :type interval: float
+
+        :return: None
+        :rtype: None
+        """
+        self.store = store
+        self.interval = interval
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self) -> None:
+        """
+        Appends the latest traffic samples and the current flow table statistics to the store.
+
+        :return: None
+        :rtype: None
+        """
+        now = time.time()
+        for interface, series in list(get_sampler().series.items()):
+            latest = series.latest()
+            if latest is not None:
+                self.store.append('traffic', interface, latest['ts'], latest)
+        for interface, stats in flow_stats().items():
+            self.store.append('flows', interface, now, stats)
+
+    def start(self) -> 'HistoryRecorder':
+        """
+        Starts the background thread if it is not running yet.
+
+        :return: The recorder itself.
+        :rtype: HistoryRecorder
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            if self.interval is None:
+                self.interval = get_sampler().interval
+            self._thread = threading.Thread(target=self._run, name='history-recorder', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the background thread and closes the store.
+
+        :return: None
+        :rtype: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.store.close()
+
+    def _run(self) -> None:
+        deadline = time.monotonic()
+        while True:
+            deadline += self.interval
+            if self._stop.wait(max(0.0, deadline - time.monotonic())):
+                return
+            try:
+                self.record()
+            except (OSError, ValueError):
+                self.errors += 1
+
+
+_store: Optional[HistoryStore] = None
+_recorder: Optional[HistoryRecorder] = None
+
+
+def get_history() -> HistoryStore:
+    """
+    Returns the shared history store. The directory is read from the HISTORY_DIR environment variable
+    (see `history_dir`) and the size limit in bytes from HISTORY_MAX_BYTES.
+
+    :return: The history store.
+    :rtype: HistoryStore
+    """
+    global _store
+    root = history_dir()
+    if _store is None or _store.root != root:
+        _store = HistoryStore(root, max_bytes=int(os.environ.get('HISTORY_MAX_BYTES', 256 << 20)))
+    return _store
+
+
+def get_recorder() -> HistoryRecorder:
+    """
+    Returns the shared history recorder of the shared store, starting it on first use. In multi-worker mode
+    only the collector process records; the workers read the store from disk.
+
+    :return: The running history recorder.
+    :rtype: HistoryRecorder
+    """
+    global _recorder
+    store = get_history()
+    if _recorder is None or _recorder.store is not store:
+        if _recorder is not None:
+            _recorder.stop()
+        _recorder = HistoryRecorder(store)
+    return _recorder.start()
+
+
+async def query_history(kind: str, name: str, start: float, end: float, resolution: Optional[int] = None,
+                        max_points: int = 1000) -> Dict[str, Any]:
+    """
+    Asynchronously reads the samples of a series of the shared store in the default executor.
+
+    :param kind: The kind of the series
+    :type kind: str
+    :param name: The name of the series
+    :type name: str
+    :param start: The start of the range
+    :type start: float
+    :param end: The end of the range
+    :type end: float
+    :param resolution: The resolution of the tier to read in seconds (default: chosen from the range)
+    :type resolution: int
+    :param max_points: The maximum number of points used to choose the resolution (default: 1000)
+    :type max_points: int
+
+    :return: The result of `HistoryStore.query`.
+    :rtype: dict
+    """
+    store = get_history()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, store.query, kind, name, start, end, resolution, max_points)
@@ -0,0 +1,100 @@
+import time
+
+from typing import Dict, Any
+
+from fastapi import APIRouter, Depends, Query
+
+from about_network.inventory import interface_query
+from collector.client import get_client
+from serialization.serialization import FastJSONRoute
+
+from .history import get_history, get_recorder, query_history
+
+
+router = APIRouter(
+    prefix="/history",
+    tags=["History"],
+    dependencies=[],
+    responses={404: {"description": "Not found"}},
+    route_class=FastJSONRoute,
+)
+
+RESOLUTIONS = {'1s': 1, '1m': 60, '1h': 3600}
+
+
+@router.on_event("startup")
+async def start_recorder() -> None:
+    """
+    Запустить фоновую запись истории счетчиков при старте приложения.
+    В многопроцессном режиме историю записывает процесс-сборщик.
+    """
+    if get_client() is None:
+        get_recorder()
+
+
+@router.get("/series")
+async def get_series() -> Dict[str, Any]:
+    """
+    Получить список сохраненных рядов истории.
+
+    :return: Словарь со списком рядов: вид (traffic, flows), имя (интерфейс), поля и доступные разрешения в секундах
+    :rtype: dict
+    """
+    return {'series': get_history().series()}
+
+
+@router.get("/query")
+async def get_range(
+    kind: str = Query(
+        description="Вид ряда: traffic (счетчики интерфейса) или flows (статистика таблицы потоков)",
+        default="traffic",
+        regex=r"^(traffic|flows)$",
+    ),
+    interface: str = Depends(interface_query),
+    start: float = Query(
+        description="Начало диапазона, Unix-время в секундах (по умолчанию: час назад)",
+        default=None,
+    ),
+    end: float = Query(
+        description="Конец диапазона, Unix-время в секундах (по умолчанию: сейчас)",
+        default=None,
+    ),
+    resolution: str = Query(
+        description="Разрешение: 1s, 1m, 1h или auto (самое точное, дающее не больше max_points точек)",
+        default="auto",
+        regex=r"^(1s|1m|1h|auto)$",
+    ),
+    max_points: int = Query(
+        description="Максимальное количество точек для выбора разрешения auto",
+        default=1000,
+        ge=1,
+    ),
+) -> Dict[str, Any]:
+    """
+    Получить историю счетчиков интерфейса или статистики потоков за диапазон времени.
+    Читаются только сегменты, пересекающиеся с диапазоном.
+
+    :param kind: Вид ряда: traffic или flows (по умолчанию: 'traffic')
+    :type kind: str
+    :param interface: Название сетевого интерфейса (по умолчанию: интерфейс маршрута по умолчанию)
+    :type interface: str
+    :param start: Начало диапазона, Unix-время (по умолчанию: час назад)
+    :type start: float
+    :param end: Конец диапазона, Unix-время (по умолчанию: сейчас)
+    :type end: float
+    :param resolution: Разрешение: 1s, 1m, 1h или auto (по умолчанию: 'auto')
+    :type resolution: str
+    :param max_points: Максимальное количество точек для разрешения auto (по умолчанию: 1000)
+    :type max_points: int
+
+    :return: Словарь с разрешением, количеством прочитанных сегментов и точками ряда
+    :rtype: dict
+    """
+    end = time.time() if end is None else end
+    start = end - 3600 if start is None else start
+    if start > end:
+        return {"error": "Начало диапазона позже его конца"}
+    try:
+        return await query_history(kind, interface, start, end, RESOLUTIONS.get(resolution), max_points)
+    except ValueError as error:
+        return {"error": str(error)}
@@ -1,51 +1,92 @@
-from typing import Dict, Any
-from fastapi import FastAPI, Query
-
-from eth_dump.router import router as router_eth_dump
-from about_network.router import router as router_about_network
-
-from utils import (
-    get_ping_status
-)
-
-app = FastAPI(
-    title="Network Monitor",
-    version="0.0.1",
-    description="""
-    Web-сервис для анализа и мониторинга сетевых подключений на локальном компьютере
-    """,
-)
-
-app.include_router(router_about_network)
-app.include_router(router_eth_dump)
-
-
-@app.post("/ping", )
-async def ping(
-    res: str = Query(
-        description="IP-адрес сервера для проверки доступности (ping)",
-        default="8.8.8.8",
-    ),
-    count_pkt: int = Query(
-        description="Количество пакетов для проверки (ping)",
-        default=1,
-    )
-) -> Dict[str, Any]:
+import importlib
+import os
+
+from typing import List, Optional
+
+from fastapi import APIRouter, FastAPI
+
+from serialization.serialization import FastJSONRoute
+
+
+# Подсистемы сервиса и модули их роутеров. Модуль импортируется, только если подсистема включена,
+# поэтому узлам, которым нужны лишь счетчики интерфейсов, не приходится загружать захват трафика.
+SUBSYSTEMS = {
+    'counters': 'about_network.router',
+    'capture': 'eth_dump.router',
+    'ping': 'ping.router',
+    'metrics': 'metrics.router',
+    'history': 'history.router',
+}
+
+
+def enabled_subsystems() -> List[str]:
+    """
+    Возвращает подсистемы, перечисленные через запятую в переменной окружения NETMON_SUBSYSTEMS
+    (по умолчанию: все подсистемы из SUBSYSTEMS). Кроме названий подсистем можно указать плагин —
+    модуль с роутером в виде 'package.module' (роутер router) или 'package.module:attribute'.
+
+    :return: Список подсистем и плагинов
+    :rtype: list
+    """
+    value = os.environ.get('NETMON_SUBSYSTEMS')
+    if not value:
+        return list(SUBSYSTEMS)
+    return [x.strip() for x in value.split(',') if x.strip()]
+
+
+def load_router(name: str) -> APIRouter:
+    """
+    Импортирует роутер подсистемы или плагина.
+
+    :param name: Название подсистемы из SUBSYSTEMS или путь к роутеру плагина ('package.module[:attribute]')
+    :type name: str
+
+    :return: Роутер подсистемы
+    :rtype: APIRouter
+    """
+    module, _, attribute = SUBSYSTEMS.get(name, name).partition(':')
+    return getattr(importlib.import_module(module), attribute or 'router')
+
+
+def create_app(subsystems: Optional[List[str]] = None) -> FastAPI:
     """
-    Конечная точка для проверки состояния сервера путем пинга.
+    Создает приложение с роутерами указанных подсистем.
 
-    :param res: IP-адрес сервера для пинга (по умолчанию: '8.8.8.8')
-    :type res: str
-    :param count_pkt: Количество пакетов для пинга (по умолчанию: 1)
-    :type count_pkt: int
+    :param subsystems: Подсистемы и плагины (по умолчанию: см. enabled_subsystems)
+    :type subsystems: list
 
-    :return: Словарь, содержащий количество загруженного и отправленного трафика на выбранном интерфейсе
-    :rtype: dict
+    :return: Приложение FastAPI
+    :rtype: FastAPI
     """
-    responce = await get_ping_status(res, count_pkt)
-    return responce
+    app = FastAPI(
+        title="Network Monitor",
+        version="0.0.1",
+        description="""
+        Web-сервис для анализа и мониторинга сетевых подключений на локальном компьютере
+        """,
+    )
+    app.router.route_class = FastJSONRoute
+    for name in enabled_subsystems() if subsystems is None else subsystems:
+        app.include_router(load_router(name))
+    return app
+
+
+app = create_app()
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    workers = int(os.environ.get("WORKERS", 1))
+    if workers > 1:
+        # Захват трафика, счетчики интерфейсов и таблицы потоков ведутся в одном процессе-сборщике,
+        # рабочие процессы читают их из разделяемой памяти.
+        from collector.collector import start_collector
+
+        collector = start_collector()
+        try:
+            uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
+        finally:
+            collector.terminate()
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
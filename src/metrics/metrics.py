@@ -0,0 +1,214 @@
+import gzip
+import os
+import threading
+import time
+
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import psutil
+
+from about_network.sampler import TrafficSampler, get_sampler
+from collector.client import get_client
+from eth_dump.engine import engine_stats
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+INTERFACE_METRICS = (
+    ('bytes_recv', 'netmon_network_receive_bytes_total', 'Bytes received by the network interface.'),
+    ('bytes_sent', 'netmon_network_transmit_bytes_total', 'Bytes sent by the network interface.'),
+    ('packets_recv', 'netmon_network_receive_packets_total', 'Packets received by the network interface.'),
+    ('packets_sent', 'netmon_network_transmit_packets_total', 'Packets sent by the network interface.'),
+    ('errin', 'netmon_network_receive_errors_total', 'Receive errors of the network interface.'),
+    ('errout', 'netmon_network_transmit_errors_total', 'Transmit errors of the network interface.'),
+    ('dropin', 'netmon_network_receive_drop_total', 'Incoming packets dropped by the network interface.'),
+    ('dropout', 'netmon_network_transmit_drop_total', 'Outgoing packets dropped by the network interface.'),
+)
+
+CAPTURE_METRICS = (
+    ('packets_seen', 'netmon_capture_packets_total', 'counter', 'Packets captured by the capture engine.'),
+    ('packets_dropped', 'netmon_capture_dropped_total', 'counter', 'Packets dropped for slow subscribers.'),
+    ('kernel_received', 'netmon_capture_kernel_received_total', 'counter', 'Packets received by the kernel capture ring.'),
+    ('kernel_dropped', 'netmon_capture_kernel_dropped_total', 'counter', 'Packets dropped by the kernel capture ring.'),
+    ('subscribers', 'netmon_capture_subscribers', 'gauge', 'Active subscribers of the capture engine.'),
+    ('taps', 'netmon_capture_taps', 'gauge', 'Active taps of the capture engine.'),
+)
+
+_SOCKET_TYPES = {(2, 1): ('ipv4', 'tcp'), (2, 2): ('ipv4', 'udp'), (10, 1): ('ipv6', 'tcp'), (10, 2): ('ipv6', 'udp')}
+
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_metric(name: str, type: str, help: str, samples: Iterable[Sample]) -> List[str]:
+    """
+    Renders one metric family in the Prometheus text exposition format.
+
+    :param name: The name of the metric
+    :type name: str
+    :param type: The type of the metric: 'counter' or 'gauge'
+    :type type: str
+    :param help: The description of the metric
+    :type help: str
+    :param samples: The (labels, value) pairs of the metric
+    :type samples: iterable
+
+    :return: The lines of the metric family.
+    :rtype: list
+    """
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} {type}']
+    for labels, value in samples:
+        if labels:
+            label_text = ','.join(f'{key}="{_escape(str(x))}"' for key, x in labels.items())
+            lines.append(f'{name}{{{label_text}}} {_format_value(value)}')
+        else:
+            lines.append(f'{name} {_format_value(value)}')
+    return lines
+
+
+class MetricsExporter:
+    """
+    The MetricsExporter class collects the interface counters, the socket counts and the capture engine statistics
+    in a background thread at a fixed interval and keeps the rendered exposition body, plain and gzip-compressed,
+    so a scrape only copies bytes from memory.
+    """
+
+    def __init__(self, interval: float = 15.0, sampler: Optional[TrafficSampler] = None) -> None:
+        """
+        :param interval: The time between two collections in seconds (default: 15)
+        :type interval: float
+        :param sampler: The traffic sampler to read the interface counters from (default: the shared sampler)
+        :type sampler: TrafficSampler
+
+        :return: None
+        :rtype: None
+        """
+        self.interval = interval
+        self.sampler = sampler
+        self.body = b''
+        self.body_gzip = b''
+        self.collected_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _interface_lines(self) -> List[str]:
+        sampler = self.sampler or get_sampler()
+        latest = {name: series.latest() for name, series in list(sampler.series.items())}
+        latest = {name: x for name, x in sorted(latest.items()) if x is not None}
+        lines = []
+        for field, name, help in INTERFACE_METRICS:
+            lines += render_metric(name, 'counter', help, (({'interface': x}, values[field]) for x, values in latest.items()))
+        return lines
+
+    def _socket_lines(self) -> List[str]:
+        try:
+            connections = psutil.net_connections(kind='inet')
+        except psutil.AccessDenied:
+            return []
+        counts = Counter((*_SOCKET_TYPES.get((x.family, x.type), ('other', 'other')), x.status) for x in connections)
+        return render_metric(
+            'netmon_sockets', 'gauge', 'Open sockets by family, protocol and state.',
+            (({'family': family, 'protocol': protocol, 'state': state}, count)
+             for (family, protocol, state), count in sorted(counts.items()))
+        )
+
+    def _capture_lines(self) -> List[str]:
+        client = get_client()
+        stats = sorted((client.call('stats') if client is not None else engine_stats()).items())
+        lines = []
+        for field, name, type, help in CAPTURE_METRICS:
+            lines += render_metric(name, type, help, (({'interface': x}, values.get(field, 0)) for x, values in stats))
+        return lines
+
+    def collect(self) -> bytes:
+        """
+        Collects every metric and replaces the cached exposition body.
+
+        :return: The new exposition body.
+        :rtype: bytes
+        """
+        start = time.perf_counter()
+        lines = self._interface_lines() + self._socket_lines() + self._capture_lines()
+        now = time.time()
+        lines += render_metric('netmon_metrics_collect_seconds', 'gauge', 'Duration of the last collection.',
+                               [({}, round(time.perf_counter() - start, 6))])
+        lines += render_metric('netmon_metrics_collected_timestamp_seconds', 'gauge', 'Time of the last collection.',
+                               [({}, round(now, 3))])
+        body = ('\n'.join(lines) + '\n').encode()
+        body_gzip = gzip.compress(body, compresslevel=6, mtime=0)
+        with self._lock:
+            self.body, self.body_gzip, self.collected_at = body, body_gzip, now
+        return body
+
+    def render(self, gzipped: bool = False) -> bytes:
+        """
+        :param gzipped: Whether to return the gzip-compressed body (default: False)
+        :type gzipped: bool
+
+        :return: The cached exposition body of the latest collection.
+        :rtype: bytes
+        """
+        with self._lock:
+            return self.body_gzip if gzipped else self.body
+
+    def start(self) -> 'MetricsExporter':
+        """
+        Collects the metrics once and starts the background thread if it is not running yet.
+
+        :return: The exporter itself.
+        :rtype: MetricsExporter
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self.collect()
+            self._thread = threading.Thread(target=self._run, name='metrics-exporter', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the background thread.
+
+        :return: None
+        :rtype: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        deadline = time.monotonic()
+        while True:
+            deadline += self.interval
+            if self._stop.wait(max(0.0, deadline - time.monotonic())):
+                return
+            self.collect()
+
+
+_exporter: Optional[MetricsExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> MetricsExporter:
+    """
+    Returns the shared metrics exporter, starting it on first use. The collection interval is read
+    from the METRICS_INTERVAL environment variable.
+
+    :return: The running metrics exporter.
+    :rtype: MetricsExporter
+    """
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = MetricsExporter(float(os.environ.get('METRICS_INTERVAL', 15.0)))
+        return _exporter.start()
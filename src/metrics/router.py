@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Request, Response
+
+from .metrics import CONTENT_TYPE, get_exporter
+
+
+router = APIRouter(
+    tags=["Metrics"],
+    dependencies=[],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.on_event("startup")
+async def start_exporter() -> None:
+    """
+    Запустить фоновый сбор метрик при старте приложения.
+    """
+    get_exporter()
+
+
+@router.get("/metrics", response_class=Response)
+async def metrics(request: Request) -> Response:
+    """
+    Метрики в формате Prometheus: счетчики байтов, пакетов, ошибок и отбрасываний по интерфейсам,
+    количество сокетов по состояниям и статистика движков захвата.
+    Метрики собираются в фоне, запрос лишь отдает последний готовый ответ.
+
+    :return: Текст метрик в формате Prometheus (сжатый gzip, если клиент это поддерживает)
+    :rtype: Response
+    """
+    gzipped = 'gzip' in request.headers.get('accept-encoding', '')
+    headers = {'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'} if gzipped else {'Vary': 'Accept-Encoding'}
+    return Response(get_exporter().render(gzipped), media_type=CONTENT_TYPE, headers=headers)
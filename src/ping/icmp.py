@@ -0,0 +1,173 @@
+import asyncio
+import itertools
+import os
+import socket
+import struct
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+_ECHO = struct.Struct('!BBHHH')
+_sequence = itertools.count()
+
+
+def checksum(data: bytes) -> int:
+    """
+    Computes the Internet checksum (RFC 1071) of a message.
+
+    :param data: The message
+    :type data: bytes
+
+    :return: The 16-bit one's complement checksum.
+    :rtype: int
+    """
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def open_icmp_socket() -> Tuple[socket.socket, bool]:
+    """
+    Opens an ICMP socket, preferring an unprivileged datagram socket (net.ipv4.ping_group_range)
+    and falling back to a raw socket.
+
+    :return: A tuple of the non-blocking socket and a flag telling whether it is a raw socket.
+    :rtype: tuple
+    """
+    try:
+        sock, raw = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+    except PermissionError:
+        sock, raw = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+    sock.setblocking(False)
+    return sock, raw
+
+
+class IcmpProber:
+    """
+    The IcmpProber class sends ICMP echo requests to many targets over a single socket and matches the replies
+    by sequence number, so a sweep over hundreds of hosts does not fork a ping process per host.
+    """
+
+    def __init__(self, payload_size: int = 56) -> None:
+        """
+        :param payload_size: The size of the echo payload in bytes (default: 56)
+        :type payload_size: int
+
+        :return: None
+        :rtype: None
+        """
+        self.payload = bytes(payload_size)
+        self.identifier = os.getpid() & 0xffff
+        self._pending: Dict[int, Tuple[str, float]] = {}
+        self._rtts: Dict[str, List[float]] = {}
+        self._sock: Optional[socket.socket] = None
+        self._raw = False
+        self._done: Optional[asyncio.Event] = None
+
+    def _packet(self, sequence: int) -> bytes:
+        header = _ECHO.pack(ICMP_ECHO_REQUEST, 0, 0, self.identifier, sequence)
+        return _ECHO.pack(ICMP_ECHO_REQUEST, 0, checksum(header + self.payload), self.identifier, sequence) + self.payload
+
+    def _on_readable(self) -> None:
+        now = time.perf_counter()
+        while True:
+            try:
+                data = self._sock.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                continue
+            if self._raw:
+                data = data[(data[0] & 0x0f) * 4:]
+            if len(data) < _ECHO.size:
+                continue
+            kind, _, _, identifier, sequence = _ECHO.unpack_from(data)
+            if kind != ICMP_ECHO_REPLY or (self._raw and identifier != self.identifier):
+                continue
+            probe = self._pending.pop(sequence, None)
+            if probe is not None:
+                self._rtts[probe[0]].append((now - probe[1]) * 1000)
+        if not self._pending:
+            self._done.set()
+
+    async def ping(self, targets: Dict[str, str], count: int = 1, timeout: float = 1.0,
+                   interval: float = 0.2) -> Dict[str, Dict[str, float]]:
+        """
+        Asynchronously pings every target `count` times, all targets in parallel.
+
+        :param targets: A dictionary mapping the requested host names to their IPv4 addresses
+        :type targets: dict
+        :param count: The number of echo requests sent to every target (default: 1)
+        :type count: int
+        :param timeout: The time to wait for the replies after the last request in seconds (default: 1.0)
+        :type timeout: float
+        :param interval: The time between two rounds of requests in seconds (default: 0.2)
+        :type interval: float
+
+        :return: A dictionary mapping every host to its statistics (see `summarize`).
+        :rtype: dict
+        """
+        loop = asyncio.get_running_loop()
+        self._sock, self._raw = open_icmp_socket()
+        self._rtts = {x: [] for x in targets}
+        self._pending = {}
+        self._done = asyncio.Event()
+        loop.add_reader(self._sock.fileno(), self._on_readable)
+        try:
+            for round_number in range(count):
+                for host, address in targets.items():
+                    sequence = next(_sequence) & 0xffff
+                    self._pending[sequence] = (host, time.perf_counter())
+                    try:
+                        self._sock.sendto(self._packet(sequence), (address, 0))
+                    except OSError:
+                        self._pending.pop(sequence, None)
+                if round_number < count - 1:
+                    await asyncio.sleep(interval)
+            if self._pending:
+                self._done.clear()
+                try:
+                    await asyncio.wait_for(self._done.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            loop.remove_reader(self._sock.fileno())
+            self._sock.close()
+        return {host: summarize(count, rtts) for host, rtts in self._rtts.items()}
+
+
+def summarize(transmitted: int, rtts: List[float]) -> Dict[str, float]:
+    """
+    Computes the statistics printed by ping from a list of round-trip times.
+
+    :param transmitted: The number of echo requests sent
+    :type transmitted: int
+    :param rtts: The round-trip times of the received replies in milliseconds
+    :type rtts: list
+
+    :return: A dictionary with the number of packets transmitted and received, the packet loss in percent
+             and the min/avg/max/mdev round-trip times in milliseconds (None if nothing was received).
+    :rtype: dict
+    """
+    received = len(rtts)
+    result = {
+        'transmitted': transmitted,
+        'received': received,
+        'loss': round(100.0 * (transmitted - received) / transmitted, 1) if transmitted else 0.0,
+        'min': None, 'avg': None, 'max': None, 'mdev': None,
+    }
+    if rtts:
+        avg = sum(rtts) / received
+        result.update({
+            'min': round(min(rtts), 3),
+            'avg': round(avg, 3),
+            'max': round(max(rtts), 3),
+            'mdev': round(max(0.0, sum(x * x for x in rtts) / received - avg * avg) ** 0.5, 3),
+        })
+    return result
@@ -0,0 +1,153 @@
+import asyncio
+import re
+import socket
+
+from typing import Any, Dict, List, Tuple
+
+from .icmp import IcmpProber, summarize
+
+
+_PACKETS_RE = re.compile(r'(\d+) packets transmitted, (\d+) (?:packets )?received')
+_RTT_RE = re.compile(r'(?:rtt|round-trip) min/avg/max/(?:mdev|stddev) = ([\d.]+)/([\d.]+)/([\d.]+)/([\d.]+)')
+
+
+def clean_host(url: str) -> str:
+    """
+    Strips the scheme, the 'www.' prefix and the path from a URL, leaving the host name.
+
+    :param url: A host name, an IP address or a URL
+    :type url: str
+
+    :return: The host part of the URL.
+    :rtype: str
+    """
+    return re.sub(r'https?://(?:www\.)?(.*?)(?:/.*)?$', r'\1', url)
+
+
+def parse_ping_output(output: str) -> Dict[str, Any]:
+    """
+    Parses the summary printed by the ping utility.
+
+    :param output: The standard output of ping
+    :type output: str
+
+    :return: A dictionary with the number of packets transmitted and received, the packet loss in percent
+             and the min/avg/max/mdev round-trip times in milliseconds (None if nothing was received).
+    :rtype: dict
+    """
+    packets = _PACKETS_RE.search(output)
+    if packets is None:
+        return {'error': 'Unable to parse ping output'}
+    transmitted, received = int(packets.group(1)), int(packets.group(2))
+    result = summarize(transmitted, [])
+    result['received'] = received
+    result['loss'] = round(100.0 * (transmitted - received) / transmitted, 1) if transmitted else 0.0
+    rtt = _RTT_RE.search(output)
+    if rtt is not None:
+        result.update(zip(('min', 'avg', 'max', 'mdev'), map(float, rtt.groups())))
+    return result
+
+
+async def ping_host(host: str, count: int = 1, timeout: float = 1.0) -> Dict[str, Any]:
+    """
+    Asynchronously pings a host with the ping utility and parses its statistics.
+    The child process is killed if it does not finish in time.
+
+    :param host: The host name or IP address to ping
+    :type host: str
+    :param count: The number of packets to send (default: 1)
+    :type count: int
+    :param timeout: The time to wait for each reply in seconds (default: 1.0)
+    :type timeout: float
+
+    :return: The statistics of the host (see `parse_ping_output`), or a dictionary with an 'error' key.
+    :rtype: dict
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            'ping', '-n', '-c', str(count), '-W', str(max(1, round(timeout))), host,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except OSError as error:
+        return {'error': str(error)}
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=count + timeout + 1)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return {'error': 'timeout'}
+    if not stdout and stderr:
+        return {'error': stderr.decode().strip()}
+    return parse_ping_output(stdout.decode())
+
+
+async def ping_many(hosts: List[str], count: int = 1, timeout: float = 1.0, concurrency: int = 32,
+                    prober: str = 'process') -> Dict[str, Dict[str, Any]]:
+    """
+    Asynchronously pings many hosts concurrently.
+
+    :param hosts: The host names, IP addresses or URLs to ping
+    :type hosts: list
+    :param count: The number of packets sent to every host (default: 1)
+    :type count: int
+    :param timeout: The time to wait for each reply in seconds (default: 1.0)
+    :type timeout: float
+    :param concurrency: The maximum number of ping processes running at the same time (default: 32)
+    :type concurrency: int
+    :param prober: 'process' to run the ping utility per host, or 'icmp' to probe every IPv4 host
+                   over a single ICMP socket (default: 'process')
+    :type prober: str
+
+    :return: A dictionary mapping every host to its statistics or to a dictionary with an 'error' key.
+    :rtype: dict
+    """
+    hosts = list(dict.fromkeys(clean_host(x) for x in hosts))
+    if prober == 'icmp':
+        return await _ping_icmp(hosts, count, timeout)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(host: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await ping_host(host, count, timeout)
+
+    results = await asyncio.gather(*(bounded(x) for x in hosts))
+    return dict(zip(hosts, results))
+
+
+async def resolve_hosts(hosts: List[str],
+                        family: int = socket.AF_INET) -> Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]:
+    """
+    Asynchronously resolves host names concurrently.
+
+    :param hosts: The host names or IP addresses
+    :type hosts: list
+    :param family: The address family, or 0 for the first address of any family (default: AF_INET)
+    :type family: int
+
+    :return: A tuple of a dictionary mapping the resolved hosts to their address and a dictionary mapping
+             the other hosts to a dictionary with an 'error' key.
+    :rtype: tuple
+    """
+    loop = asyncio.get_running_loop()
+    infos = await asyncio.gather(
+        *(loop.getaddrinfo(x, None, family=family, type=socket.SOCK_DGRAM) for x in hosts),
+        return_exceptions=True
+    )
+    targets, errors = {}, {}
+    for host, info in zip(hosts, infos):
+        if isinstance(info, Exception) or not info:
+            errors[host] = {'error': 'Unable to resolve host'}
+        else:
+            targets[host] = info[0][4][0]
+    return targets, errors
+
+
+async def _ping_icmp(hosts: List[str], count: int, timeout: float) -> Dict[str, Dict[str, Any]]:
+    targets, results = await resolve_hosts(hosts)
+    if targets:
+        try:
+            results.update(await IcmpProber().ping(targets, count, timeout))
+        except OSError as error:
+            results.update({x: {'error': str(error)} for x in targets})
+    return {x: results[x] for x in hosts}
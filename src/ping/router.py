@@ -0,0 +1,152 @@
+from typing import Dict, Any, List
+
+from fastapi import APIRouter, Body, Query
+
+from serialization.serialization import FastJSONRoute
+from utils import get_ping_status
+
+from .ping import ping_many
+from .trace import trace_many
+
+
+router = APIRouter(
+    prefix="/ping",
+    tags=["Ping"],
+    dependencies=[],
+    responses={404: {"description": "Not found"}},
+    route_class=FastJSONRoute,
+)
+
+
+@router.post("")
+async def ping(
+    res: str = Query(
+        description="IP-адрес сервера для проверки доступности (ping)",
+        default="8.8.8.8",
+    ),
+    count_pkt: int = Query(
+        description="Количество пакетов для проверки (ping)",
+        default=1,
+    )
+) -> Dict[str, Any]:
+    """
+    Конечная точка для проверки состояния сервера путем пинга.
+
+    :param res: IP-адрес сервера для пинга (по умолчанию: '8.8.8.8')
+    :type res: str
+    :param count_pkt: Количество пакетов для пинга (по умолчанию: 1)
+    :type count_pkt: int
+
+    :return: Словарь, содержащий количество загруженного и отправленного трафика на выбранном интерфейсе
+    :rtype: dict
+    """
+    responce = await get_ping_status(res, count_pkt)
+    return responce
+
+
+@router.post("/batch")
+async def ping_batch(
+    hosts: List[str] = Body(
+        description="Список IP-адресов или имен серверов для проверки доступности",
+        embed=True,
+        min_items=1,
+    ),
+    count_pkt: int = Query(
+        description="Количество пакетов для каждого сервера",
+        default=1,
+        ge=1,
+    ),
+    timeout: float = Query(
+        description="Время ожидания ответа в секундах",
+        default=1.0,
+        gt=0,
+    ),
+    concurrency: int = Query(
+        description="Максимальное количество одновременно запущенных процессов ping",
+        default=32,
+        ge=1,
+    ),
+    prober: str = Query(
+        description="Способ проверки: process (утилита ping) или icmp (один ICMP-сокет на все серверы, только IPv4)",
+        default="process",
+        regex=r"^(process|icmp)$",
+    ),
+) -> Dict[str, Any]:
+    """
+    Проверить доступность нескольких серверов одновременно.
+
+    :param hosts: Список IP-адресов или имен серверов
+    :type hosts: list
+    :param count_pkt: Количество пакетов для каждого сервера (по умолчанию: 1)
+    :type count_pkt: int
+    :param timeout: Время ожидания ответа в секундах (по умолчанию: 1.0)
+    :type timeout: float
+    :param concurrency: Максимальное количество одновременно запущенных процессов ping (по умолчанию: 32)
+    :type concurrency: int
+    :param prober: Способ проверки: process или icmp (по умолчанию: 'process')
+    :type prober: str
+
+    :return: Словарь, содержащий для каждого сервера количество отправленных и полученных пакетов,
+             процент потерь и время отклика (min/avg/max/mdev, мс)
+    :rtype: dict
+    """
+    return await ping_many(hosts, count_pkt, timeout, concurrency, prober)
+
+
+@router.post("/trace")
+async def trace(
+    hosts: List[str] = Body(
+        description="Список IP-адресов или имен серверов для трассировки",
+        embed=True,
+        min_items=1,
+    ),
+    max_hops: int = Query(
+        description="Максимальное количество хопов",
+        default=30,
+        ge=1,
+        le=64,
+    ),
+    queries: int = Query(
+        description="Количество проб на каждый хоп",
+        default=3,
+        ge=1,
+        le=10,
+    ),
+    timeout: float = Query(
+        description="Время ожидания ответов в секундах",
+        default=1.0,
+        gt=0,
+    ),
+    mtu: bool = Query(
+        description="Определить MTU пути",
+        default=False,
+    ),
+    refresh: bool = Query(
+        description="Повторить трассировку, даже если результат есть в кэше",
+        default=False,
+    ),
+) -> Dict[str, Any]:
+    """
+    Трассировать маршруты к нескольким серверам одновременно: пробы на все хопы всех серверов отправляются
+    параллельно через UDP-сокеты, ошибки ICMP читаются из очереди ошибок сокета. Результаты кэшируются
+    на время TRACE_CACHE_TTL секунд (по умолчанию 300).
+
+    :param hosts: Список IP-адресов или имен серверов
+    :type hosts: list
+    :param max_hops: Максимальное количество хопов (по умолчанию: 30)
+    :type max_hops: int
+    :param queries: Количество проб на каждый хоп (по умолчанию: 3)
+    :type queries: int
+    :param timeout: Время ожидания ответов в секундах (по умолчанию: 1.0)
+    :type timeout: float
+    :param mtu: Определить MTU пути (по умолчанию: False)
+    :type mtu: bool
+    :param refresh: Повторить трассировку, даже если результат есть в кэше (по умолчанию: False)
+    :type refresh: bool
+
+    :return: Словарь, содержащий для каждого сервера его адрес, признак достижимости и список хопов с адресами,
+             количеством отправленных и полученных проб, процентом потерь и временем отклика (min/avg/max/mdev, мс),
+             а также MTU пути, если он запрошен
+    :rtype: dict
+    """
+    return await trace_many(hosts, max_hops, queries, timeout, mtu, refresh)
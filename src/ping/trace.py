@@ -0,0 +1,551 @@
+import asyncio
+import errno
+import itertools
+import os
+import socket
+import struct
+import time
+
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .icmp import summarize
+from .ping import clean_host, resolve_hosts
+
+
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+IPV6_RECVERR = getattr(socket, 'IPV6_RECVERR', 25)
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IPV6_MTU_DISCOVER = getattr(socket, 'IPV6_MTU_DISCOVER', 23)
+PMTUDISC_PROBE = 3
+ORIGIN_LOCAL, ORIGIN_ICMP, ORIGIN_ICMP6 = 1, 2, 3
+BASE_PORT = 33434
+MAX_SIZE = 65535
+HEADER_SIZES = {socket.AF_INET: 28, socket.AF_INET6: 48}
+MIN_MTU = {socket.AF_INET: 68, socket.AF_INET6: 1280}
+# Common link MTUs (RFC 1191 plateaus, tunnels, PPPoE and jumbo frames), probed in the first round of MTU discovery
+PLATEAUS = (68, 296, 508, 576, 1006, 1280, 1400, 1420, 1480, 1492, 1500, 2002, 4352, 8166, 9000, 17914, 32000, MAX_SIZE)
+UNREACHABLE = {
+    socket.AF_INET: {0: '!N', 1: '!H', 2: '!P', 9: '!X', 10: '!X', 13: '!X'},
+    socket.AF_INET6: {0: '!N', 1: '!X', 3: '!H', 5: '!X', 6: '!X'},
+}
+_EXTENDED_ERR = struct.Struct('=IBBBBII')
+_PROBE = struct.Struct('!I')
+_sequence = itertools.count()
+
+# The kind of reply ('hop', 'reached', 'too_big', 'unreachable' or 'error' if it could not be sent), the address
+# of the sender, the MTU it reported, the round-trip time in milliseconds and the notation of an unreachable message
+Reply = Tuple[str, Optional[str], int, Optional[float], Optional[str]]
+
+
+def _family(address: str) -> int:
+    return socket.AF_INET6 if ':' in address else socket.AF_INET
+
+
+def _classify(origin: int, error: int, kind: int, code: int) -> Tuple[Optional[str], Optional[str]]:
+    """
+    :return: The kind of reply of an extended socket error: 'hop' for a time exceeded message, 'reached' for
+             a port unreachable message, 'too_big' for a fragmentation needed or packet too big message or a local
+             EMSGSIZE error, 'unreachable' for any other destination unreachable message and None otherwise;
+             and the traceroute notation of the unreachable messages.
+    :rtype: tuple
+    """
+    if origin == ORIGIN_LOCAL:
+        return ('too_big' if error == errno.EMSGSIZE else None), None
+    if origin == ORIGIN_ICMP:
+        if kind == 11:
+            return 'hop', None
+        if kind == 3:
+            if code == 3:
+                return 'reached', None
+            if code == 4:
+                return 'too_big', None
+            return 'unreachable', UNREACHABLE[socket.AF_INET].get(code, f'!<{code}>')
+    elif origin == ORIGIN_ICMP6:
+        if kind == 3:
+            return 'hop', None
+        if kind == 2:
+            return 'too_big', None
+        if kind == 1:
+            if code == 4:
+                return 'reached', None
+            return 'unreachable', UNREACHABLE[socket.AF_INET6].get(code, f'!<{code}>')
+    return None, None
+
+
+class PathProber:
+    """
+    The PathProber class traces the paths to many targets and discovers their path MTU over one unprivileged UDP socket
+    per address family. All the probes of a round are sent at once, each with its own TTL or size, instead of hop
+    by hop; the ICMP errors they trigger are read from the error queue of the socket (IP_RECVERR), which holds
+    the address of the router that sent them and the payload of the probe, identifying it. Linux only.
+    """
+
+    def __init__(self, port: int = BASE_PORT, payload_size: int = 32) -> None:
+        """
+        :param port: The destination port of the probes with a TTL of 1, incremented with the TTL (default: 33434)
+        :type port: int
+        :param payload_size: The size of the payload of the traceroute probes in bytes (default: 32)
+        :type payload_size: int
+
+        :return: None
+        :rtype: None
+        """
+        self.port = port
+        self.payload_size = max(payload_size, _PROBE.size)
+        self._sockets: Dict[int, socket.socket] = {}
+        self._pending: Dict[int, Tuple[Callable[[Any, Reply], None], Any, float]] = {}
+        self._local_mtu: Dict[str, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def __aenter__(self) -> 'PathProber':
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the sockets of the prober.
+
+        :return: None
+        :rtype: None
+        """
+        for sock in self._sockets.values():
+            self._loop.remove_reader(sock.fileno())
+            sock.close()
+        self._sockets.clear()
+        self._pending.clear()
+
+    def _socket(self, family: int) -> socket.socket:
+        sock = self._sockets.get(family)
+        if sock is not None:
+            return sock
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            if family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+                sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, PMTUDISC_PROBE)
+            else:
+                sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+                sock.setsockopt(socket.IPPROTO_IPV6, IPV6_MTU_DISCOVER, PMTUDISC_PROBE)
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(sock.fileno(), self._on_readable, sock)
+        self._sockets[family] = sock
+        return sock
+
+    def _on_readable(self, sock: socket.socket) -> None:
+        now = time.perf_counter()
+        while True:
+            try:
+                data, ancillary, _, address = sock.recvmsg(_PROBE.size, 512, socket.MSG_ERRQUEUE)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                continue
+            for level, kind, cdata in ancillary:
+                if (level, kind) not in ((socket.IPPROTO_IP, IP_RECVERR), (socket.IPPROTO_IPV6, IPV6_RECVERR)):
+                    continue
+                error, origin, icmp_type, code, _, info, _ = _EXTENDED_ERR.unpack_from(cdata)
+                reply, flag = _classify(origin, error, icmp_type, code)
+                if origin == ORIGIN_LOCAL:
+                    if reply is not None:
+                        self._local_mtu[address[0]] = info
+                    continue
+                if reply is None or len(data) < _PROBE.size:
+                    continue
+                probe = self._pending.pop(_PROBE.unpack_from(data)[0], None)
+                if probe is None:
+                    continue
+                offender_family = struct.unpack_from('=H', cdata, _EXTENDED_ERR.size)[0]
+                offender = None
+                if offender_family == socket.AF_INET:
+                    offender = socket.inet_ntop(socket.AF_INET, cdata[_EXTENDED_ERR.size + 4:_EXTENDED_ERR.size + 8])
+                elif offender_family == socket.AF_INET6:
+                    offender = socket.inet_ntop(socket.AF_INET6, cdata[_EXTENDED_ERR.size + 8:_EXTENDED_ERR.size + 24])
+                callback, context, sent = probe
+                callback(context, (reply, offender, info, (now - sent) * 1000, flag))
+        # Datagrams sent back by a service listening on a probed port are not probe replies
+        while True:
+            try:
+                sock.recv(1)
+            except OSError:
+                break
+
+    async def _send(self, address: str, ttl: int, size: Optional[int], callback: Callable[[Any, Reply], None],
+                    context: Any) -> Optional[int]:
+        """
+        Asynchronously sends a probe, waiting for room in the socket buffer if needed.
+
+        :param address: The destination address
+        :type address: str
+        :param ttl: The TTL (hop limit) of the probe
+        :type ttl: int
+        :param size: The size of the IP packet, or None for a traceroute probe
+        :type size: int
+        :param callback: The function called with `context` and the reply to the probe
+        :type callback: callable
+        :param context: The value passed to the callback
+        :type context: Any
+
+        :return: The sequence number of the probe, or None if it could not be sent; the callback is then called at once,
+                 with a 'too_big' reply and the local MTU if the probe was larger, or with an 'error' reply.
+        :rtype: int
+        """
+        family = _family(address)
+        sock = self._socket(family)
+        sequence = next(_sequence) & 0xffffffff
+        payload = _PROBE.pack(sequence).ljust(self.payload_size if size is None else size - HEADER_SIZES[family], b'\0')
+        if family == socket.AF_INET:
+            level, option = socket.IPPROTO_IP, socket.IP_TTL
+        else:
+            level, option = socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS
+        attempts = 0
+        while True:
+            self._pending[sequence] = (callback, context, time.perf_counter())
+            try:
+                # the TTL is set before every attempt, as other probes may be sent while this one waits
+                sock.setsockopt(level, option, ttl)
+                sock.sendto(payload, (address, self.port + ttl - 1))
+                return sequence
+            except (BlockingIOError, InterruptedError):
+                await asyncio.sleep(0.001)
+            except OSError as error:
+                if error.errno == errno.EMSGSIZE:
+                    del self._pending[sequence]
+                    self._on_readable(sock)
+                    callback(context, ('too_big', None, self._local_mtu.pop(address, 0), None, None))
+                    return None
+                # the ICMP error of an earlier probe is also reported by the next call once, and clears on the way
+                attempts += 1
+                if attempts == 3:
+                    del self._pending[sequence]
+                    callback(context, ('error', None, 0, None, None))
+                    return None
+
+    async def _wait(self, sequences: List[int], done: asyncio.Event, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for sequence in sequences:
+            self._pending.pop(sequence, None)
+
+    async def trace(self, targets: Dict[str, str], max_hops: int = 30, queries: int = 3, timeout: float = 1.0,
+                    interval: float = 0.05) -> Dict[str, Dict[str, Any]]:
+        """
+        Asynchronously traces the paths to the targets, all hops of all targets in parallel. Every round sends one probe
+        per hop; once the distance to a target is known, the next rounds stop at it. Routers and targets rate-limit
+        their ICMP errors (net.ipv4.icmp_ratelimit), so a longer `interval` gives a more accurate loss on the last hops.
+
+        :param targets: A dictionary mapping the requested host names to their IPv4 or IPv6 addresses
+        :type targets: dict
+        :param max_hops: The maximum number of hops (default: 30)
+        :type max_hops: int
+        :param queries: The number of probes sent to every hop (default: 3)
+        :type queries: int
+        :param timeout: The time to wait for the replies after the last round in seconds (default: 1.0)
+        :type timeout: float
+        :param interval: The time between two rounds in seconds (default: 0.05)
+        :type interval: float
+
+        :return: A dictionary mapping every host to its address, whether it was reached, the traceroute notation of
+                 the unreachable message that ended the path, if any, and the list of hops up to it; every hop has
+                 its TTL, the address that answered most (None if none did), the other addresses that answered
+                 and its statistics (see `summarize`).
+        :rtype: dict
+        """
+        paths = {
+            host: {'sent': [0] * (max_hops + 1), 'replies': [[] for _ in range(max_hops + 1)],
+                   'outstanding': [0] * (max_hops + 1), 'distance': None, 'flag': None}
+            for host in targets
+        }
+        done = asyncio.Event()
+        sending = True
+
+        def complete() -> bool:
+            return not sending and all(
+                not any(path['outstanding'][1:(path['distance'] or max_hops) + 1]) for path in paths.values()
+            )
+
+        def reply(context: Tuple[str, int], answer: Reply) -> None:
+            host, ttl = context
+            path = paths[host]
+            path['outstanding'][ttl] -= 1
+            kind, offender, _, rtt, flag = answer
+            if kind in ('reached', 'unreachable') and (path['distance'] is None or ttl < path['distance']):
+                path['distance'], path['flag'] = ttl, flag
+            if kind not in ('too_big', 'error'):
+                path['replies'][ttl].append((offender, rtt))
+            if complete():
+                done.set()
+
+        sequences = []
+        for round_number in range(queries):
+            for host, address in targets.items():
+                path = paths[host]
+                for ttl in range(1, (path['distance'] or max_hops) + 1):
+                    path['sent'][ttl] += 1
+                    path['outstanding'][ttl] += 1
+                    sequence = await self._send(address, ttl, None, reply, (host, ttl))
+                    if sequence is not None:
+                        sequences.append(sequence)
+            if round_number < queries - 1:
+                await asyncio.sleep(interval)
+        sending = False
+        if not complete():
+            await self._wait(sequences, done, timeout)
+
+        results = {}
+        for host, address in targets.items():
+            path = paths[host]
+            last = path['distance'] or max(
+                [x for x in range(1, max_hops + 1) if path['replies'][x]], default=0
+            )
+            hops = []
+            for ttl in range(1, last + 1):
+                replies = path['replies'][ttl]
+                addresses = [x for x, _ in Counter(x for x, _ in replies).most_common()]
+                hop = {'ttl': ttl, 'address': addresses[0] if addresses else None, 'addresses': addresses[1:]}
+                hop.update(summarize(path['sent'][ttl], [x for _, x in replies]))
+                hops.append(hop)
+            results[host] = {
+                'address': address,
+                'reached': path['distance'] is not None and path['flag'] is None,
+                'unreachable': path['flag'],
+                'hops': hops,
+            }
+        return results
+
+    async def path_mtu(self, targets: Dict[str, str], max_hops: int = 30, timeout: float = 1.0,
+                       rounds: int = 4, probes: int = 8) -> Dict[str, Dict[str, Any]]:
+        """
+        Asynchronously discovers the path MTU to the targets, all targets and sizes in parallel. The first round probes
+        the common link MTUs; every next round probes the MTUs reported by the routers (fragmentation needed or packet
+        too big messages) and `probes` sizes spread between the largest size that reached the target and the smallest
+        one that did not, so paths dropping large packets silently converge too.
+
+        :param targets: A dictionary mapping the requested host names to their IPv4 or IPv6 addresses
+        :type targets: dict
+        :param max_hops: The TTL of the probes (default: 30)
+        :type max_hops: int
+        :param timeout: The time to wait for the replies of a round in seconds (default: 1.0)
+        :type timeout: float
+        :param rounds: The maximum number of rounds (default: 4)
+        :type rounds: int
+        :param probes: The number of sizes spread over the remaining range in every round after the first (default: 8)
+        :type probes: int
+
+        :return: A dictionary mapping every host to its path MTU (the size of the largest IP packet that reached it,
+                 None if none did), the smallest MTU reported on the way, the address that reported it
+                 (None for the local interface) and the number of probes sent.
+        :rtype: dict
+        """
+        state = {
+            host: {'lower': 0, 'upper': MAX_SIZE, 'reported': None, 'reported_by': None, 'candidates': set(),
+                   'tried': set(), 'probes': 0}
+            for host in targets
+        }
+        for host, address in targets.items():
+            minimum = MIN_MTU[_family(address)]
+            state[host]['candidates'] = {x for x in PLATEAUS if x >= minimum}
+
+        def reply(context: Tuple[str, int, Dict[str, int]], answer: Reply) -> None:
+            host, size, outstanding = context
+            mtu = state[host]
+            outstanding['count'] -= 1
+            kind, offender, info, _, _ = answer
+            if kind != 'error':
+                answered.add((host, size))
+            if kind == 'reached':
+                mtu['lower'] = max(mtu['lower'], size)
+            elif kind == 'too_big':
+                mtu['upper'] = min(mtu['upper'], size - 1)
+                if info and (mtu['reported'] is None or info < mtu['reported']):
+                    mtu['reported'], mtu['reported_by'] = info, offender
+                if info and info < size:
+                    mtu['candidates'].add(info)
+            if not outstanding['count']:
+                done.set()
+
+        for _ in range(rounds):
+            done = asyncio.Event()
+            outstanding = {'count': 0}
+            sequences = []
+            sent: List[Tuple[str, int]] = []
+            answered = set()
+            for host, address in targets.items():
+                mtu = state[host]
+                # largest first: the target answers the first probes that reach it before its ICMP rate limit applies
+                sizes = sorted(
+                    (x for x in mtu['candidates'] if mtu['lower'] < x <= mtu['upper'] and x not in mtu['tried']),
+                    reverse=True
+                )
+                mtu['candidates'] = set()
+                for size in sizes:
+                    mtu['tried'].add(size)
+                    mtu['probes'] += 1
+                    outstanding['count'] += 1
+                    sent.append((host, size))
+                    sequence = await self._send(address, max_hops, size, reply, (host, size, outstanding))
+                    if sequence is not None:
+                        sequences.append(sequence)
+            if not sent:
+                break
+            if outstanding['count']:
+                await self._wait(sequences, done, timeout)
+            for host, size in sent:
+                mtu = state[host]
+                if (host, size) not in answered and mtu['lower'] and size > mtu['lower']:
+                    # a probe larger than one that reached the target and left unanswered was dropped silently
+                    mtu['upper'] = min(mtu['upper'], size - 1)
+            for host in targets:
+                mtu = state[host]
+                if mtu['lower'] and mtu['lower'] < mtu['upper']:
+                    step = (mtu['upper'] - mtu['lower']) / (probes + 1)
+                    mtu['candidates'].update(round(mtu['lower'] + step * (x + 1)) for x in range(probes))
+                    mtu['candidates'].add(mtu['upper'])
+        return {
+            host: {'mtu': x['lower'] or None, 'reported': x['reported'], 'reported_by': x['reported_by'],
+                   'probes': x['probes']}
+            for host, x in state.items()
+        }
+
+
+class PathCache:
+    """
+    The PathCache class keeps the results of path traces for `ttl` seconds, so repeated sweeps over the same targets
+    do not probe the paths again while they are fresh. The least recently used entries are dropped first.
+    """
+
+    def __init__(self, ttl: float = 300.0, maxsize: int = 10000) -> None:
+        """
+        :param ttl: The time in seconds during which a result is reused (default: 300)
+        :type ttl: float
+        :param maxsize: The maximum number of results kept (default: 10000)
+        :type maxsize: int
+
+        :return: None
+        :rtype: None
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries: 'OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        """
+        :param key: The key of the result
+        :type key: tuple
+
+        :return: A copy of the result with 'cached' set to True and its age in seconds under 'age',
+                 or None if there is no fresh result.
+        :rtype: dict
+        """
+        entry = self.entries.get(key)
+        now = time.monotonic()
+        if entry is None or now - entry[0] > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return dict(entry[1], cached=True, age=round(now - entry[0], 3))
+
+    def put(self, key: Tuple, result: Dict[str, Any]) -> None:
+        """
+        Stores a result.
+
+        :param key: The key of the result
+        :type key: tuple
+        :param result: The result
+        :type result: dict
+
+        :return: None
+        :rtype: None
+        """
+        self.entries[key] = (time.monotonic(), result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: A dictionary with the number of results kept, the hits and the misses of the cache.
+        :rtype: dict
+        """
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+_cache: Optional[PathCache] = None
+
+
+def get_path_cache() -> PathCache:
+    """
+    Returns the shared cache of path traces. The time during which a result is reused is read from
+    the TRACE_CACHE_TTL environment variable (in seconds, default: 300).
+
+    :return: The path cache.
+    :rtype: PathCache
+    """
+    global _cache
+    if _cache is None:
+        _cache = PathCache(float(os.environ.get('TRACE_CACHE_TTL', 300)))
+    return _cache
+
+
+async def trace_many(hosts: List[str], max_hops: int = 30, queries: int = 3, timeout: float = 1.0,
+                     mtu: bool = False, refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    Asynchronously traces the paths to many hosts in parallel, reusing the cached results of recent traces.
+
+    :param hosts: The host names, IP addresses or URLs to trace
+    :type hosts: list
+    :param max_hops: The maximum number of hops (default: 30)
+    :type max_hops: int
+    :param queries: The number of probes sent to every hop (default: 3)
+    :type queries: int
+    :param timeout: The time to wait for the replies in seconds (default: 1.0)
+    :type timeout: float
+    :param mtu: Whether or not to discover the path MTU too (default: False)
+    :type mtu: bool
+    :param refresh: Whether or not to probe the paths again even if they are cached (default: False)
+    :type refresh: bool
+
+    :return: A dictionary mapping every host to its trace (see `PathProber.trace`, with the path MTU under 'mtu'
+             if requested, and whether it comes from the cache under 'cached') or to a dictionary with an 'error' key.
+    :rtype: dict
+    """
+    hosts = list(dict.fromkeys(clean_host(x) for x in hosts))
+    targets, results = await resolve_hosts(hosts, 0)
+    cache = get_path_cache()
+    missing = {}
+    for host, address in targets.items():
+        cached = None if refresh else cache.get((address, max_hops, queries, mtu))
+        if cached is None:
+            missing[host] = address
+        else:
+            results[host] = cached
+    if missing:
+        try:
+            async with PathProber() as prober:
+                if mtu:
+                    traces, mtus = await asyncio.gather(
+                        prober.trace(missing, max_hops, queries, timeout), prober.path_mtu(missing, max_hops, timeout)
+                    )
+                    for host, result in traces.items():
+                        result['mtu'] = mtus[host]
+                else:
+                    traces = await prober.trace(missing, max_hops, queries, timeout)
+        except OSError as error:
+            traces = {x: {'error': str(error)} for x in missing}
+        for host, result in traces.items():
+            if 'error' not in result:
+                cache.put((missing[host], max_hops, queries, mtu), result)
+                result = dict(result, cached=False, age=0.0)
+            results[host] = result
+    return {x: results[x] for x in hosts}
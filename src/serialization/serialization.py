@@ -0,0 +1,222 @@
+import functools
+import gzip
+import inspect
+import json
+import os
+
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from fastapi import Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from starlette.responses import Response, StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serializes a value to compact JSON with orjson when it is installed, else with the standard library.
+    Values that JSON cannot represent directly (datetimes, named tuples, models...) are converted
+    with FastAPI's `jsonable_encoder`, so only those pay for it.
+
+    :param content: The value to serialize
+    :type content: Any
+
+    :return: The UTF-8 encoded JSON document.
+    :rtype: bytes
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(content, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(content, default=jsonable_encoder, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def columnar(content: Any) -> Any:
+    """
+    Converts the lists of records of a response into columns: every list of dictionaries at the top level
+    becomes a dictionary mapping every field to the list of its values, a field missing from a record being None.
+    Field names are then sent once instead of once per record.
+
+    :param content: The response content
+    :type content: Any
+
+    :return: The content with its lists of records in columnar form.
+    :rtype: Any
+    """
+    if not isinstance(content, dict):
+        return content
+    result = {}
+    for key, value in content.items():
+        if isinstance(value, list) and value and all(isinstance(x, dict) for x in value):
+            fields = list(dict.fromkeys(field for record in value for field in record))
+            value = {field: [x.get(field) for x in value] for field in fields}
+        result[key] = value
+    return result
+
+
+def accepted_encodings(header: str) -> List[str]:
+    """
+    :param header: The value of an Accept-Encoding header
+    :type header: str
+
+    :return: The encodings accepted by the client, those with q=0 excluded.
+    :rtype: list
+    """
+    encodings = []
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        if name and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.append(name.strip().lower())
+    return encodings
+
+
+def compress(body: bytes, accept_encoding: str, min_size: int) -> Tuple[bytes, Optional[str]]:
+    """
+    Compresses a response body with zstd (when the zstandard package is installed) or gzip,
+    whichever the client accepts first in that order, if the body is at least `min_size` bytes long.
+
+    :param body: The response body
+    :type body: bytes
+    :param accept_encoding: The Accept-Encoding header of the request
+    :type accept_encoding: str
+    :param min_size: The size in bytes from which bodies are compressed
+    :type min_size: int
+
+    :return: The body and its content encoding, None if it was left uncompressed.
+    :rtype: tuple
+    """
+    if len(body) < min_size or not accept_encoding:
+        return body, None
+    encodings = accepted_encodings(accept_encoding)
+    if zstandard is not None and 'zstd' in encodings:
+        return zstandard.ZstdCompressor(level=3).compress(body), 'zstd'
+    if 'gzip' in encodings:
+        return gzip.compress(body, compresslevel=5, mtime=0), 'gzip'
+    return body, None
+
+
+class FastJSONResponse(Response):
+    """
+    The FastJSONResponse class is a JSON response serialized with `dumps`, optionally in columnar layout
+    and compressed according to the Accept-Encoding header of the request.
+    """
+    media_type = 'application/json'
+
+    def __init__(self, content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None,
+                 layout: str = 'records', accept_encoding: str = '', min_size: Optional[int] = None) -> None:
+        """
+        :param content: The response content
+        :type content: Any
+        :param status_code: The HTTP status code (default: 200)
+        :type status_code: int
+        :param headers: Additional response headers (default: none)
+        :type headers: dict
+        :param layout: 'records' to keep lists of records as they are, 'columns' to send them in columns (default: 'records')
+        :type layout: str
+        :param accept_encoding: The Accept-Encoding header of the request (default: no compression)
+        :type accept_encoding: str
+        :param min_size: The size in bytes from which bodies are compressed
+                         (default: the RESPONSE_COMPRESS_MIN_SIZE environment variable, else 4096)
+        :type min_size: int
+
+        :return: None
+        :rtype: None
+        """
+        self.accept_encoding = accept_encoding
+        self.min_size = int(os.environ.get('RESPONSE_COMPRESS_MIN_SIZE', 4096)) if min_size is None else min_size
+        super().__init__(columnar(content) if layout == 'columns' else content, status_code, headers)
+        if self.content_encoding is not None:
+            self.headers['content-encoding'] = self.content_encoding
+        self.headers['vary'] = 'Accept-Encoding'
+
+    def render(self, content: Any) -> bytes:
+        body, self.content_encoding = compress(dumps(content), self.accept_encoding, self.min_size)
+        return body
+
+
+def fast_json_endpoint(endpoint: Callable) -> Callable:
+    """
+    Wraps a path operation so that its result is sent as a FastJSONResponse. The wrapper adds a 'layout' query
+    parameter and reads the Accept-Encoding header; results that already are responses are returned unchanged.
+    The return annotation is kept, so the response model still documents the route, but the result is neither
+    validated against it nor passed through `jsonable_encoder` again.
+
+    :param endpoint: The asynchronous path operation function
+    :type endpoint: callable
+
+    :return: The wrapped path operation function.
+    :rtype: callable
+    """
+    if getattr(endpoint, 'fast_json', False) or not inspect.iscoroutinefunction(endpoint):
+        return endpoint
+    signature = inspect.signature(endpoint)
+    extra = [inspect.Parameter('fast_json_request', inspect.Parameter.KEYWORD_ONLY, annotation=Request)]
+    if 'layout' not in signature.parameters:
+        extra.append(inspect.Parameter(
+            'layout', inspect.Parameter.KEYWORD_ONLY, annotation=str,
+            default=Query(
+                description="Формат списков записей: records (список объектов) или columns (массив значений для каждого поля)",
+                default='records',
+                regex=r"^(records|columns)$",
+            ),
+        ))
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args: Any, fast_json_request: Request, **kwargs: Any) -> Any:
+        layout = 'records' if 'layout' in signature.parameters else kwargs.pop('layout')
+        content = await endpoint(*args, **kwargs)
+        if isinstance(content, Response):
+            return content
+        return FastJSONResponse(content, layout=layout, accept_encoding=fast_json_request.headers.get('accept-encoding', ''))
+
+    wrapper.__signature__ = signature.replace(parameters=[*signature.parameters.values(), *extra])
+    wrapper.fast_json = True
+    return wrapper
+
+
+class FastJSONRoute(APIRoute):
+    """
+    The FastJSONRoute class is an APIRoute serializing the results of its path operation with `fast_json_endpoint`.
+    Use it as the route class of a router: APIRouter(route_class=FastJSONRoute).
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs: Any) -> None:
+        super().__init__(path, fast_json_endpoint(endpoint), **kwargs)
+
+
+def stream_response(records: AsyncIterator[Any], format: str = 'ndjson') -> StreamingResponse:
+    """
+    Wraps an asynchronous iterator of records into a streaming response, every record being sent as soon as it is produced.
+
+    :param records: The asynchronous iterator of records, e.g. decoded packets or change events
+    :type records: AsyncIterator
+    :param format: The stream format: 'ndjson' (one JSON document per line) or 'sse' (Server-Sent Events) (default: 'ndjson')
+    :type format: str
+
+    :return: The streaming response.
+    :rtype: StreamingResponse
+    """
+    template = 'data: {}\n\n' if format == 'sse' else '{}\n'
+
+    async def body() -> AsyncIterator[str]:
+        async for record in records:
+            yield template.format(dumps(record).decode())
+
+    return StreamingResponse(body(), media_type=STREAM_FORMATS[format])
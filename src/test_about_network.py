@@ -0,0 +1,400 @@
+import asyncio
+import os
+import pickle
+import socket
+import subprocess
+import time
+
+import psutil
+import pytest
+
+from about_network import bandwidth as bandwidth_module
+
+from about_network.about_network import Traffic
+from about_network.bandwidth import BandwidthMeter, BandwidthSummary, SocketOwners
+from about_network.connections import ConnectionFilter, ConnectionTable
+from about_network.external_ip import ExternalIpResolver
+from about_network.inventory import InterfaceInventory, get_inventory
+from about_network.sampler import FIELDS, TrafficSampler, TrafficSeries, TrafficSummary
+from eth_dump.decoder import Packet
+
+
+def counters(value: float) -> dict:
+    return {x: value for x in FIELDS}
+
+
+def test_traffic_series_ring_buffer():
+    series = TrafficSeries(4)
+    for i in range(10):
+        series.append(float(i), counters(i * 100))
+    assert series.count == 4
+    assert series.delta(1) == {'ts': 8.0, 'seconds': 1.0, **counters(100.0)}
+    assert series.delta(100)['seconds'] == 3.0
+    assert series.delta()['bytes_sent'] == 900.0
+
+
+def test_traffic_from_sampler():
+    sampler = TrafficSampler(interval=1.0, capacity=8)
+    sampler.series['eth9'] = TrafficSeries(8)
+    sampler.series['eth9'].append(1000.0, counters(0))
+    sampler.series['eth9'].append(1001.0, counters(2000))
+    sampler.series['eth9'].append(1002.0, counters(3000))
+    traffic = asyncio.run(Traffic('eth9', sampler).get_traffic('kB', window=1))
+    assert (traffic['bytes_sent'], traffic['bytes_recv_per_s'], traffic['packets_sent_per_s']) == (1.0, 1.0, 1000.0)
+    total = asyncio.run(Traffic('eth9', sampler).get_traffic('B'))
+    assert (total['bytes_recv'], total['dropin']) == (3000.0, 3000)
+    assert 'error' in asyncio.run(Traffic('missing0', sampler).get_traffic())
+
+    for ts in range(1003, 1010):
+        sampler.series['eth9'].append(float(ts), counters(1000 * ts - 1000000))
+    summary = pickle.loads(pickle.dumps(TrafficSummary(sampler, window=3)))
+    assert summary.series['eth9'].count == 4
+    assert summary.window('eth9', 3) == sampler.window('eth9', 3)
+    assert summary.window('eth9') == sampler.window('eth9') and summary.window('eth9', 60)['seconds'] == 3.0
+    assert summary.window('missing0') is None
+
+
+def test_sampler_polls_loopback():
+    sampler = TrafficSampler(interval=0.05, capacity=16).start()
+    try:
+        asyncio.run(asyncio.sleep(0.2))
+        assert sampler.series['lo'].count >= 3
+        assert sampler.window('lo', 0.1)['seconds'] > 0
+    finally:
+        sampler.stop()
+
+
+async def stub_http_server(body: str, delay: float = 0.0, status: int = 200):
+    hits = []
+
+    async def handle(reader, writer):
+        await reader.readuntil(b'\r\n\r\n')
+        hits.append(body)
+        await asyncio.sleep(delay)
+        writer.write(f'HTTP/1.1 {status} OK\r\nContent-Length: {len(body)}\r\n\r\n{body}'.encode())
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}/', hits
+
+
+def test_external_ip_cache_and_coalescing():
+    async def run():
+        server, url, hits = await stub_http_server('203.0.113.7', delay=0.05)
+        resolver = ExternalIpResolver([url], ttl=60)
+        results = await asyncio.gather(*(resolver.get() for _ in range(10)))
+        results.append(await resolver.get())
+        resolver.fetched_at -= 61
+        stale = await resolver.get()
+        await asyncio.sleep(0.1)
+        server.close()
+        return results, stale, hits
+
+    results, stale, hits = asyncio.run(run())
+    assert results == [{'external_ip': '203.0.113.7'}] * 11
+    assert stale == {'external_ip': '203.0.113.7'}
+    assert len(hits) == 2
+
+
+def test_external_ip_fallbacks():
+    async def run():
+        bad, bad_url, _ = await stub_http_server('not an address')
+        slow, slow_url, _ = await stub_http_server('198.51.100.1', delay=0.5)
+        fast, fast_url, _ = await stub_http_server('198.51.100.2')
+        raced = await ExternalIpResolver([bad_url, slow_url, fast_url]).get()
+        ordered = await ExternalIpResolver([bad_url, slow_url, fast_url], race=False).get()
+        failed = await ExternalIpResolver([bad_url]).get()
+        for server in (bad, slow, fast):
+            server.close()
+        return raced, ordered, failed
+
+    raced, ordered, failed = asyncio.run(run())
+    assert raced == {'external_ip': '198.51.100.2'}
+    assert ordered == {'external_ip': '198.51.100.1'}
+    assert failed == {'error': 'Unable to retrieve external IP address'}
+
+
+TCP_HEADER = '  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n'
+
+
+def tcp_line(local: str, remote: str, state: str, inode: int) -> str:
+    return f'   0: {local} {remote} {state} 00000000:00000000 00:00000000 00000000  1000        0 {inode} 1 0 20 4 30 10 -1\n'
+
+
+def test_connection_table_delta(tmp_path):
+    listen = tcp_line('0100007F:1F90', '00000000:0000', '0A', 100)
+    client = tcp_line('0100007F:C000', '0100007F:1F90', '01', 101)
+    (tmp_path / 'tcp').write_text(TCP_HEADER + listen)
+    (tmp_path / 'udp6').write_text(TCP_HEADER + tcp_line('00000000000000000000000001000000:0035', '0' * 32 + ':0000', '07', 102))
+    table = ConnectionTable(str(tmp_path), min_interval=0, max_events=4)
+    first = table.snapshot()
+    assert first['cursor'] == 1
+    assert {(x['proto'], x['family'], x['local_address'], x['local_port'], x['state']) for x in first['connections']} == {
+        ('tcp', 'ipv4', '127.0.0.1', 8080, 'LISTEN'), ('udp', 'ipv6', '::1', 53, 'NONE'),
+    }
+    assert [x['inode'] for x in table.snapshot(ConnectionFilter(state='listen'))['connections']] == [100]
+
+    (tmp_path / 'tcp').write_text(TCP_HEADER + listen + client)
+    (tmp_path / 'udp6').write_text(TCP_HEADER)
+    delta = table.delta(1)
+    assert (delta['cursor'], delta['reset']) == (3, False)
+    assert [x['remote_port'] for x in delta['opened']] == [8080] and [x['local_port'] for x in delta['closed']] == [53]
+    assert table.delta(1, ConnectionFilter(proto='tcp', remote_port=8080))['opened'][0]['local_port'] == 49152
+
+    (tmp_path / 'tcp').write_text(TCP_HEADER + listen.replace(' 0A ', ' 07 '))
+    delta = table.delta(3)
+    assert ([x['state'] for x in delta['changed']], [x['inode'] for x in delta['closed']]) == (['CLOSE'], [101])
+    assert table.delta(5) == {'cursor': 6, 'reset': False, 'opened': [], 'closed': [], 'changed': []}
+    assert table.delta(1)['reset']
+
+
+def test_connections_endpoint():
+    from fastapi.testclient import TestClient
+    from main import app
+
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    port = server.getsockname()[1]
+    try:
+        client = TestClient(app)
+        response = client.get('/about_network/connections', params={'local_port': port, 'with_pid': True}).json()
+        assert [(x['state'], x['pid']) for x in response['connections']] == [('LISTEN', os.getpid())]
+        assert client.get('/about_network/connections', params={'pid': os.getpid(), 'local_port': port}).json()['connections']
+        delta = client.get('/about_network/connections', params={'cursor': response['cursor'], 'proto': 'tcp'}).json()
+        assert set(delta) == {'cursor', 'reset', 'opened', 'closed', 'changed'}
+    finally:
+        server.close()
+
+
+def fake_process(proc, pid: int, inodes, cgroup: str = '0::/user.slice/app.scope') -> None:
+    directory = proc / str(pid)
+    (directory / 'fd').mkdir(parents=True)
+    for fd, inode in enumerate(inodes):
+        os.symlink(f'socket:[{inode}]', directory / 'fd' / str(fd))
+    (directory / 'comm').write_text(f'proc{pid}\n')
+    (directory / 'cgroup').write_text(cgroup + '\n')
+
+
+def test_socket_owners_incremental(tmp_path):
+    net, proc = tmp_path / 'net', tmp_path / 'proc'
+    net.mkdir()
+    proc.mkdir()
+    listen = tcp_line('0100000A:01BB', '00000000:0000', '0A', 100)
+    client = tcp_line('0100000A:C000', '08080808:0035', '01', 101)
+    (net / 'tcp').write_text(TCP_HEADER + listen + client)
+    (net / 'udp6').write_text(TCP_HEADER + tcp_line('0' * 32 + ':0035', '0' * 32 + ':0000', '07', 102))
+    fake_process(proc, 10, [100, 102])
+    fake_process(proc, 20, [101], '12:cpu:/v1\n1:name=systemd:/system.slice/db.service')
+    fake_process(proc, 30, [])
+    owners = SocketOwners(str(net), str(proc), min_interval=0, full_interval=3600)
+    owners.refresh()
+    assert owners.scans == 3
+    local, remote, google = socket.inet_aton('10.0.0.1'), socket.inet_aton('10.0.0.9'), socket.inet_aton('8.8.8.8')
+    assert owners.lookup(6, remote, 50000, local, 443) == (None, 10)
+    assert owners.lookup(6, local, 49152, google, 53) == (20, None)
+    assert owners.lookup(17, google, 53, local, 53) == (None, 10)
+    assert owners.lookup(17, local, 53, google, 53) == (10, None)
+    assert owners.describe(20) == ('proc20', '/system.slice/db.service')
+
+    accepted = tcp_line('0100000A:01BB', '0900000A:C350', '01', 103)
+    (net / 'tcp').write_text(TCP_HEADER + listen + client + accepted + tcp_line('0100000A:C001', '08080808:0050', '01', 104))
+    os.symlink('socket:[103]', proc / '10' / 'fd' / '2')
+    os.symlink('socket:[104]', proc / '30' / 'fd' / '0')
+    owners.refresh()
+    assert owners.scans == 5 and owners.unowned == {'104'}
+    assert owners.lookup(6, local, 443, remote, 50000) == (10, None)
+    assert owners.lookup(6, local, 49153, google, 80) == (None, None)
+    owners.full_interval = 0
+    owners.refresh()
+    assert owners.lookup(6, local, 49153, google, 80) == (30, None)
+
+
+def test_bandwidth_meter_windows(tmp_path):
+    from test_eth_dump import ethernet, ipv4, tcp
+
+    net, proc = tmp_path / 'net', tmp_path / 'proc'
+    net.mkdir()
+    proc.mkdir()
+    (net / 'tcp').write_text(TCP_HEADER + tcp_line('0100000A:01BB', '0200000A:C350', '01', 100)
+                             + tcp_line('0100000A:01BC', '00000000:0000', '0A', 101))
+    fake_process(proc, 10, [100])
+    fake_process(proc, 11, [101])
+    owners = SocketOwners(str(net), str(proc), min_interval=0)
+    owners.refresh()
+    meter = BandwidthMeter(owners, horizon=60)
+    out = ethernet(ipv4('10.0.0.1', '10.0.0.2', 6, tcp(443, 50000, 0x18, b'x' * 946)))
+    back = ethernet(ipv4('10.0.0.2', '10.0.0.1', 6, tcp(50000, 443, 0x10)))
+    stray = ethernet(ipv4('10.0.0.2', '10.0.0.3', 17, b'\x00' * 8))
+    for second in range(1000, 1010):
+        meter.update(Packet(second + 0.5, out, 1000))
+        meter.update(Packet(second + 0.5, back, 100))
+    meter.update(Packet(1009.5, stray, 50))
+    meter.update(Packet(1009.5, ethernet(ipv4('10.0.0.2', '10.0.0.1', 6, tcp(50001, 444, 0x02))), 60))
+    assert len(meter._memo) == 4
+
+    top = meter.top(10, window=5, now=1010.0)
+    assert [(x['pid'], x['name'], x['bytes_sent'], x['bytes_recv'], x['packets']) for x in top['top']] == [
+        (10, 'proc10', 5000, 500, 10), (11, 'proc11', 0, 60, 1),
+    ]
+    assert top['top'][0]['bytes_sent_per_s'] == 1000.0 and top['unattributed'] == {'bytes': 50, 'packets': 1}
+    assert meter.top(1, window=600, now=1010.0)['top'][0]['bytes_sent'] == 10000
+    by_cgroup = meter.top(10, window=5, by='cgroup', now=1010.0)['top']
+    assert by_cgroup == [{'cgroup': '/user.slice/app.scope', 'pids': [10, 11], 'bytes_sent': 5000, 'bytes_recv': 560,
+                          'packets': 11, 'bytes_sent_per_s': 1000.0, 'bytes_recv_per_s': 112.0}]
+
+    owners.refresh()
+    meter.update(Packet(1010.5, out, 1000))
+    assert len(meter._memo) == 1
+    meter.processes.clear()
+    summary = pickle.loads(pickle.dumps(BandwidthSummary(meter)))
+    assert meter.processes == {}
+    for by in ('process', 'cgroup'):
+        assert summary.top(10, 5, by, now=1011.0) == meter.top(10, 5, by, now=1011.0)
+    assert summary.stats() == meter.stats()
+
+
+def test_bandwidth_endpoint():
+    from fastapi.testclient import TestClient
+    from main import app
+
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    try:
+        with TestClient(app) as client:
+            client.get('/about_network/bandwidth', params={'interface': 'lo'})
+            meter = bandwidth_module._meters['lo']
+            for _ in range(200):
+                if meter.engine.backend is not None and meter.owners.generation or meter.engine.error is not None:
+                    break
+                time.sleep(0.01)
+            if meter.engine.error is not None:
+                pytest.skip(f'Capture on the loopback interface is not available: {meter.engine.error}')
+            sender = socket.create_connection(server.getsockname())
+            receiver, _ = server.accept()
+            time.sleep(0.1)
+            for _ in range(200):
+                sender.sendall(b'x' * 1000)
+                receiver.recv(65536)
+                response = client.get('/about_network/bandwidth', params={'interface': 'lo', 'window': 5}).json()
+                if any(x['pid'] == os.getpid() and x['bytes_sent'] > 0 for x in response['top']):
+                    break
+                time.sleep(0.01)
+            sender.close()
+            receiver.close()
+            assert any(x['pid'] == os.getpid() and x['bytes_sent'] > 0 for x in response['top'])
+            assert response['stats']['packets'] > 0
+            cgroups = client.get('/about_network/bandwidth', params={'interface': 'lo', 'by': 'cgroup'}).json()['top']
+            assert any(os.getpid() in x['pids'] for x in cgroups)
+            assert client.delete('/about_network/bandwidth', params={'interface': 'lo'}).json()['stopped']
+    finally:
+        server.close()
+
+
+def fake_interface(sysfs, name: str, index: int, driver: str = None, queues: int = 1) -> None:
+    directory = sysfs / name
+    (directory / 'queues').mkdir(parents=True)
+    for i in range(queues):
+        (directory / 'queues' / f'rx-{i}').mkdir()
+        (directory / 'queues' / f'tx-{i}').mkdir()
+    if driver is not None:
+        (sysfs / 'drivers' / driver).mkdir(parents=True, exist_ok=True)
+        (directory / 'device').mkdir()
+        os.symlink(sysfs / 'drivers' / driver, directory / 'device' / 'driver')
+    for attribute, value in (('ifindex', index), ('address', f'02:00:00:00:00:{index:02x}'), ('type', 1),
+                             ('operstate', 'up'), ('carrier', 1), ('tx_queue_len', 1000)):
+        (directory / attribute).write_text(f'{value}\n')
+
+
+def test_interface_inventory_changes(tmp_path, monkeypatch):
+    sysfs, proc = tmp_path / 'net', tmp_path / 'proc'
+    (proc / 'net').mkdir(parents=True)
+    fake_interface(sysfs, 'lo', 1)
+    fake_interface(sysfs, 'eth9', 2, 'e1000e', queues=4)
+    route = 'Iface\tDestination\tGateway\tFlags\tRefCnt\tUse\tMetric\tMask\tMTU\tWindow\tIRTT\n'
+    (proc / 'net' / 'route').write_text(route)
+    full = psutil.NIC_DUPLEX_FULL
+    addresses = {
+        'lo': [psutil._common.snicaddr(socket.AF_INET, '127.0.0.1', '255.0.0.0', None, None)],
+        'eth9': [psutil._common.snicaddr(socket.AF_INET, '10.9.0.2', '255.255.255.0', '10.9.0.255', None)],
+    }
+    stats = {
+        'lo': psutil._common.snicstats(True, psutil.NIC_DUPLEX_UNKNOWN, 0, 65536, 'up,loopback,running'),
+        'eth9': psutil._common.snicstats(True, full, 1000, 1500, 'up,broadcast,running'),
+    }
+    monkeypatch.setattr(psutil, 'net_if_addrs', lambda: dict(addresses))
+    monkeypatch.setattr(psutil, 'net_if_stats', lambda: dict(stats))
+    inventory = InterfaceInventory(str(sysfs), str(proc))
+
+    async def run():
+        inventory.refresh()
+        watch = inventory.watch()
+        first = await watch.__anext__()
+        assert first['event'] == 'snapshot' and first['default'] == 'eth9'
+        eth9 = first['interfaces'][0]
+        assert (eth9['name'], eth9['driver'], eth9['rx_queues'], eth9['speed'], eth9['duplex']) == \
+               ('eth9', 'e1000e', 4, 1000, 'full')
+        assert eth9['addresses'] == [{'family': 'ipv4', 'address': '10.9.0.2', 'netmask': '255.255.255.0',
+                                      'broadcast': '10.9.0.255'}]
+
+        assert inventory.refresh() == [] and inventory.version == 1
+        stats['eth9'] = stats['eth9']._replace(mtu=9000)
+        fake_interface(sysfs, 'wg0', 3)
+        addresses['wg0'] = [psutil._common.snicaddr(socket.AF_INET, '10.8.0.1', '255.255.255.0', None, None)]
+        stats['wg0'] = psutil._common.snicstats(True, psutil.NIC_DUPLEX_UNKNOWN, 0, 1420, 'up,running')
+        (proc / 'net' / 'route').write_text(route + 'wg0\t00000000\t00000000\t0001\t0\t0\t0\t00000000\t0\t0\t0\n')
+        await asyncio.to_thread(inventory.refresh)
+        events = [await asyncio.wait_for(watch.__anext__(), 1) for _ in range(3)]
+        assert [(x['event'], x['interface']) for x in events] == [('changed', 'eth9'), ('added', 'wg0'), ('default', 'wg0')]
+        assert events[0]['changes'] == {'mtu': [1500, 9000]} and {x['version'] for x in events} == {2}
+
+        del addresses['wg0'], stats['wg0']
+        inventory.refresh()
+        events = [await asyncio.wait_for(watch.__anext__(), 1) for _ in range(2)]
+        assert [(x['event'], x['interface'], x.get('previous')) for x in events] == \
+               [('removed', 'wg0', None), ('default', 'eth9', 'wg0')]
+        await watch.aclose()
+        assert inventory._subscribers == []
+
+    asyncio.run(run())
+
+
+def test_interface_inventory_follows_netlink():
+    inventory = get_inventory()
+    if inventory.source != 'netlink':
+        pytest.skip('Netlink notifications are not available')
+
+    async def run():
+        queue = inventory.subscribe()
+        try:
+            subprocess.run(['ip', 'address', 'add', '127.0.0.77/8', 'dev', 'lo'], check=True, capture_output=True)
+        except (OSError, subprocess.CalledProcessError) as error:
+            inventory.unsubscribe(queue)
+            pytest.skip(f'The loopback interface cannot be changed: {error}')
+        try:
+            event = await asyncio.wait_for(queue.get(), 5)
+            assert event['event'] == 'changed' and event['interface'] == 'lo'
+            assert any(x['address'] == '127.0.0.77' for x in event['changes']['addresses'][1])
+        finally:
+            subprocess.run(['ip', 'address', 'del', '127.0.0.77/8', 'dev', 'lo'], capture_output=True)
+        event = await asyncio.wait_for(queue.get(), 5)
+        assert not any(x['address'] == '127.0.0.77' for x in event['info']['addresses'])
+        inventory.unsubscribe(queue)
+
+    asyncio.run(run())
+
+
+def test_interface_inventory_endpoints():
+    from fastapi.testclient import TestClient
+    from main import app
+
+    client = TestClient(app)
+    names = client.get('/about_network/get_interfaces').json()
+    assert 'lo' in names['interfaces'] and names['default'] in names['interfaces']
+    inventory = client.get('/about_network/interfaces', params={'name': 'lo'}).json()
+    assert [x['name'] for x in inventory['interfaces']] == ['lo'] and inventory['interfaces'][0]['up']
+    assert 'error' in client.get('/about_network/interfaces', params={'name': 'no-such-if0'}).json()
+    response = client.get('/about_network/get_traffic')
+    assert response.status_code == 200 and 'error' not in response.json()
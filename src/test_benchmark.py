@@ -0,0 +1,20 @@
+from benchmark.benchmark import compare, run
+
+
+def test_benchmark_run_and_compare():
+    results = run(packets=500, requests=4, concurrency=2, memory_samples=1, endpoints=['flows', 'offline', 'ping'],
+                  startup_repeat=1, capture_seconds=0.5)
+    assert set(results['parse']) == {'pcap_stream', 'decode_pcap', 'packet_filter', 'flow_table', 'tcp_analyzer',
+                                        'ping_output'}
+    assert results['parse']['decode_pcap']['items'] == 500
+    serialize = results['serialize']
+    assert serialize['fast_json']['items'] == 500 and serialize['fast_json_columns']['bytes'] < serialize['fast_json']['bytes']
+    assert all(x['errors'] == 0 and x['rps'] > 0 and x['p99_ms'] >= x['p50_ms'] for x in results['api'].values())
+    startup = results['startup']
+    assert startup['all']['status'] == startup['counters']['status'] == 200
+    assert startup['counters']['modules'] < startup['all']['modules']
+    assert all(x['per_s'] > 0 for x in results['capture'].values())
+
+    slower = {'api': {'ping': dict(results['api']['ping'], rps=results['api']['ping']['rps'] / 2)}}
+    assert compare(results, results) == []
+    assert [x.split(':')[0] for x in compare(results, slower)] == ['api.ping.rps']
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from about_network import sampler as sampler_module
+from collector import client as client_module
+from collector.collector import Collector, start_collector
+from collector.shm import SharedRing, SnapshotPublisher, SnapshotReader
+from eth_dump import engine as engine_module
+from eth_dump.backends import SharedRingBackend
+from eth_dump.flows import FlowSummary, load_flow_table
+from eth_dump.tcp import TcpSummary, load_tcp_analyzer
+
+
+def test_shared_ring_wraps_and_detects_laps():
+    ring = SharedRing.create(capacity=1024)
+    try:
+        reader = SharedRing.attach(ring.name).reader()
+        for i in range(20):
+            ring.write(float(i), bytes([i]) * (10 + i), 100 + i, 1)
+            if i % 3 == 2:
+                assert [x[0] for x in reader.read()] == [float(i - 2), float(i - 1), float(i)]
+        ts, data, wirelen, linktype = reader.read()[0]
+        assert (ts, data, wirelen, linktype) == (18.0, bytes([18]) * 28, 118, 1)
+        assert reader.read() == [] and reader.lost == 0
+
+        for i in range(40):
+            ring.write(float(i), b'x' * 40, 40, 1)
+        assert reader.read() == [] and reader.lost > 0
+        ring.write(99.0, b'y', 1, 101)
+        assert reader.read() == [(99.0, b'y', 1, 101)]
+        assert not ring.write(0.0, b'z' * 300, 300, 1)
+        assert not reader.ring.closed
+    finally:
+        ring.close()
+    assert reader.ring.closed
+
+
+def test_snapshot_versions():
+    publisher = SnapshotPublisher(f'netmon-test-{os.getpid()}')
+    try:
+        reader = SnapshotReader(publisher.name)
+        assert reader.load('empty') == 'empty'
+        publisher.publish({'a': 1})
+        first = reader.load()
+        assert first == {'a': 1} and reader.load() is first
+        for i in range(5):
+            publisher.publish({'a': i})
+        assert reader.load() == {'a': 4} and reader.version == 6
+        reader.close()
+    finally:
+        publisher.close()
+
+
+def test_publisher_survives_errors():
+    collector = Collector('unused', b'', publish_interval=0.01)
+    calls = []
+
+    def broken():
+        calls.append(None)
+        raise OSError('No space left on device')
+
+    collector.sources = {'broken': (lambda: len(calls), broken), 'good': (lambda: 1, lambda: {'a': 1})}
+    publishers = [collector._publisher('broken'), collector._publisher('good')]
+    thread = threading.Thread(target=collector._publish_changes)
+    thread.start()
+    try:
+        for _ in range(200):
+            if collector.publish_errors['broken'] >= 2 and publishers[1].version:
+                break
+            time.sleep(0.01)
+    finally:
+        collector.stop()
+        thread.join()
+        for publisher in publishers:
+            publisher.close()
+    assert collector.publish_errors['broken'] >= 2 and collector.publish_errors['good'] == 0
+    assert publishers[1].version == 1
+
+
+@pytest.fixture
+def collector():
+    os.environ['COLLECTOR_PUBLISH_INTERVAL'] = '0.1'
+    try:
+        process = start_collector()
+    except RuntimeError:
+        pytest.skip('The collector process could not be started')
+    try:
+        yield client_module.get_client()
+    finally:
+        process.terminate()
+        process.join(5)
+        os.environ.pop('COLLECTOR_ADDRESS', None)
+        os.environ.pop('COLLECTOR_AUTHKEY', None)
+        os.environ.pop('COLLECTOR_PUBLISH_INTERVAL', None)
+        client_module._client = None
+        sampler_module._snapshot = None
+
+
+def test_collector_shares_captures(collector):
+    async def capture(port: int):
+        engines = [engine_module.CaptureEngine('lo'), engine_module.CaptureEngine('lo')]
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            subscriptions = [x.subscribe(engine_module.PacketFilter(port=port)) for x in engines]
+            for _ in range(200):
+                if all(x.backend is not None or x.error is not None for x in engines):
+                    break
+                await asyncio.sleep(0.01)
+            for engine in engines:
+                if engine.error is not None:
+                    raise engine.error
+            for _ in range(3):
+                sender.sendto(b'x', ('127.0.0.1', port))
+            received = [[(await asyncio.wait_for(x.get(), 2)).dport for _ in range(3)] for x in subscriptions]
+            backends = [type(x.backend) for x in engines]
+            for engine, subscription in zip(engines, subscriptions):
+                engine.linger = 0
+                engine.unsubscribe(subscription)
+            await asyncio.sleep(0.1)
+            return received, backends
+        finally:
+            sender.close()
+
+    async def flows(port: int):
+        table = await load_flow_table('lo')
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for _ in range(5):
+            sender.sendto(b'x', ('127.0.0.1', port))
+        sender.close()
+        await asyncio.sleep(0.3)
+        return table, await load_flow_table('lo')
+
+    async def tcp_health(port: int):
+        await load_tcp_analyzer('lo')
+        await asyncio.sleep(0.3)
+        server = await asyncio.start_server(lambda reader, writer: writer.close(), '127.0.0.1', port)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await reader.read()
+        writer.close()
+        server.close()
+        await asyncio.sleep(0.3)
+        return await load_tcp_analyzer('lo')
+
+    try:
+        received, backends = asyncio.run(capture(40019))
+    except OSError as error:
+        pytest.skip(f'Capture on the loopback interface is not available: {error}')
+    assert received == [[40019] * 3, [40019] * 3]
+    assert backends == [SharedRingBackend, SharedRingBackend]
+    assert collector.call('stats')['lo']['taps'] == 0
+
+    before, after = asyncio.run(flows(40020))
+    assert isinstance(after, FlowSummary) and after is not before
+    assert any(40020 in (x['sport'], x['dport']) and x['packets'] >= 5 for x in after.top_flows(10))
+    assert collector.call('stop_flows', 'lo')
+
+    analyzer = asyncio.run(tcp_health(40021))
+    assert isinstance(analyzer, TcpSummary)
+    connection = next(x for x in analyzer.top_connections(10, 'last_seen') if x['dport'] == 40021)
+    assert connection['handshake_rtt'] is not None and connection['state'] in ('closed', 'reset')
+    assert collector.call('stop_tcp', 'lo')
+
+    sampler = sampler_module.get_sampler()
+    assert 'lo' in sampler.series and sampler.window('lo') is not None
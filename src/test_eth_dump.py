@@ -0,0 +1,795 @@
+import asyncio
+import json
+import pickle
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from fastapi import WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+from eth_dump import engine as engine_module
+from eth_dump import names as names_module
+from eth_dump.backends import AfPacketBackend, BackendUnavailable, CaptureBackend
+from eth_dump.decoder import Packet, decode_pcap
+from eth_dump.engine import CaptureEngine, PacketFilter, PacketSampler
+from eth_dump.eth_dump import _attach_names
+from eth_dump.filters import FilterCache, compile_filter, normalize
+from eth_dump.flows import FLOW_SORTS, FlowSummary, FlowTable, TopK
+from eth_dump.jobs import CaptureJob, JobScheduler, QuotaExceeded
+from eth_dump.names import ReverseResolver
+from eth_dump.pcap import pcapng_header, pcapng_record
+from eth_dump.recorder import RotatingCaptureWriter, start_recording, stop_recording
+from eth_dump.tcp import CONNECTION_SORTS, HOST_SORTS, TcpAnalyzer, TcpSummary, analyze_pcap
+
+
+def ethernet(payload: bytes, ethertype: int = 0x0800, vlan: int = None) -> bytes:
+    header = b'\x02\x00\x00\x00\x00\x02' + b'\x02\x00\x00\x00\x00\x01'
+    if vlan is not None:
+        header += struct.pack('!HH', 0x8100, vlan)
+    return header + struct.pack('!H', ethertype) + payload
+
+
+def ipv4(src: str, dst: str, proto: int, payload: bytes) -> bytes:
+    return struct.pack(
+        '!BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), 1, 0, 64, proto, 0,
+        socket.inet_aton(src), socket.inet_aton(dst)
+    ) + payload
+
+
+def ipv6(src: str, dst: str, proto: int, payload: bytes) -> bytes:
+    return struct.pack(
+        '!IHBB16s16s', 6 << 28, len(payload), proto, 64,
+        socket.inet_pton(socket.AF_INET6, src), socket.inet_pton(socket.AF_INET6, dst)
+    ) + payload
+
+
+def tcp(sport: int, dport: int, flags: int, payload: bytes = b'', seq: int = 1, ack: int = 1, window: int = 501) -> bytes:
+    return struct.pack('!HHIIBBHHH', sport, dport, seq, ack, 5 << 4, flags, window, 0, 0) + payload
+
+
+def udp(sport: int, dport: int, payload: bytes = b'') -> bytes:
+    return struct.pack('!HHHH', sport, dport, 8 + len(payload), 0) + payload
+
+
+FRAMES = [
+    ethernet(ipv4('10.0.0.1', '10.0.0.2', 6, tcp(443, 51234, 0x18, b'x' * 52))),
+    ethernet(ipv4('10.0.0.2', '10.0.0.1', 6, tcp(51234, 443, 0x10))),
+    ethernet(ipv4('10.0.0.2', '8.8.8.8', 17, udp(40000, 53, b'q' * 29))),
+    ethernet(ipv4('10.0.0.2', '8.8.8.8', 1, b'\x08\x00\x00\x00\x00\x01\x00\x01')),
+    ethernet(ipv6('::1', '::1', 6, tcp(8000, 50000, 0x12)), ethertype=0x86dd),
+    ethernet(b'\x00' * 28, ethertype=0x0806),
+    ethernet(ipv4('10.0.0.3', '10.0.0.4', 17, udp(5000, 5001)), vlan=10),
+]
+
+
+class FakeBackend(CaptureBackend):
+    name = 'fake'
+
+    async def open(self):
+        self.frames = [(time.time(), x, len(x)) for x in FRAMES]
+
+    async def read(self):
+        if self.frames:
+            frames, self.frames = self.frames, []
+            return frames
+        await asyncio.sleep(5)
+        return []
+
+    async def close(self):
+        pass
+
+
+class FakeEngine(CaptureEngine):
+    linger = 0
+
+    async def _open_backend(self):
+        backend = FakeBackend(self.interface)
+        await backend.open()
+        return backend
+
+
+class BrokenEngine(CaptureEngine):
+    async def _open_backend(self):
+        raise OSError('No such device')
+
+
+def pcap(frames, times=None) -> bytes:
+    data = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+    for i, frame in enumerate(frames):
+        ts = 1700000000.5 + i if times is None else 1700000000 + times[i]
+        data += struct.pack('<IIII', int(ts), round(ts % 1 * 1000000), len(frame), len(frame)) + frame
+    return data
+
+
+def test_decode_pcap():
+    packets = list(decode_pcap(pcap(FRAMES)))
+    assert len(packets) == len(FRAMES)
+    first = packets[0].to_dict()
+    assert first['ts'] == 1700000000.5
+    assert first['eth_src'] == '02:00:00:00:00:01'
+    assert (first['family'], first['proto'], first['src'], first['dst']) == ('IP', 'TCP', '10.0.0.1', '10.0.0.2')
+    assert (first['sport'], first['dport'], first['flags'], first['payload_length']) == (443, 51234, 'P.', 52)
+    assert (first['seq'], first['ack'], first['window'], first['ttl']) == (1, 1, 501, 64)
+    assert packets[2].to_dict()['payload_length'] == 29
+    assert (packets[3].icmp_type, packets[3].icmp_code, packets[3].sport) == (8, 0, None)
+    assert (packets[4].family, packets[4].src, packets[4].sport, packets[4].flags) == ('IP6', '::1', 8000, 'S.')
+    assert packets[5].family == 'ARP' and packets[5].src is None
+    assert packets[6].vlan == 10 and packets[6].dport == 5001
+
+
+def test_packet_decodes_lazily():
+    packet = Packet(0.0, FRAMES[0])
+    assert packet._net is None
+    assert packet.dport == 51234
+    assert packet._net == 14
+
+
+def test_packet_filter():
+    packets = [Packet(0.0, x) for x in FRAMES]
+    assert [PacketFilter(type='tcp').match(x) for x in packets] == [True, True, False, False, True, False, False]
+    assert [PacketFilter(type='udp').match(x) for x in packets] == [False, False, True, False, False, False, True]
+    assert [PacketFilter(type='ip', port=443).match(x) for x in packets] == [True, True, False, False, False, False, False]
+    assert [PacketFilter(host='8.8.8.8').match(x) for x in packets] == [False, False, True, True, False, False, False]
+    assert PacketFilter(type='ip6', host='localhost').match(packets[4])
+    assert PacketFilter(type='arp').match(packets[5])
+    assert PacketFilter(type='vlan').match(packets[6])
+    with pytest.raises(ValueError):
+        PacketFilter(type='wlan')
+
+
+def test_capture_engine_fan_out():
+    tapped = []
+
+    def broken_tap(packet):
+        raise ValueError('bad frame')
+
+    async def run():
+        engine = FakeEngine('lo')
+        engine.attach(broken_tap)
+        engine.attach(tapped.append)
+        async with engine.subscribe(PacketFilter(type='tcp')) as tcp, engine.subscribe(PacketFilter(port=53)) as dns:
+            tcp_packets = [await tcp.get() for _ in range(3)]
+            dns_packet = await dns.get()
+            assert engine.stats()['subscribers'] == 2
+        engine.detach(tapped.append)
+        await asyncio.sleep(0.1)
+        return tcp_packets, dns_packet, engine
+
+    tcp_packets, dns_packet, engine = asyncio.run(run())
+    assert [x.sport for x in tcp_packets] == [443, 51234, 8000]
+    assert dns_packet.dport == 53
+    assert engine.packets_seen == len(tapped) == len(FRAMES)
+    assert engine.error is None and engine.tap_error == 'ValueError: bad frame'
+    assert (engine.stats()['subscribers'], engine.stats()['taps'], engine.stats()['tap_errors']) == (0, 0, 1)
+
+
+def test_stream_endpoints(monkeypatch):
+    from main import app
+
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+    client = TestClient(app)
+    response = client.get('/eth_dump/port/stream', params={'interface': 'fake0', 'port': 443, 'count_pkt': 2})
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    assert [json.loads(x)['dport'] for x in response.text.splitlines()] == [51234, 443]
+
+    response = client.get('/eth_dump/stream', params={'interface': 'fake1', 'type': 'udp', 'count_pkt': 2, 'format': 'sse'})
+    events = [x for x in response.text.split('\n\n') if x]
+    assert [json.loads(x[len('data: '):])['dport'] for x in events] == [53, 5001]
+
+    with client.websocket_connect('/eth_dump/ws?interface=fake2&type=ip6&count_pkt=1') as websocket:
+        assert websocket.receive_json()['src'] == '::1'
+
+    monkeypatch.setattr(engine_module, 'CaptureEngine', BrokenEngine)
+    with client.websocket_connect('/eth_dump/ws?interface=broken0') as websocket:
+        assert websocket.receive_json() == {'error': 'No such device'}
+        with pytest.raises(WebSocketDisconnect) as disconnect:
+            websocket.receive_json()
+        assert disconnect.value.code == 1011
+
+
+def test_flow_table():
+    table = FlowTable()
+    for ts, frame in enumerate(FRAMES):
+        table.update(Packet(float(ts), frame))
+    assert table.stats() == {'flows': 5, 'evicted': 0, 'packets': 6}
+    flows = table.top_flows(10, 'packets')
+    assert flows[0]['packets'] == 2 and flows[0]['flags'] == 'P.'
+    assert {flows[0]['sport'], flows[0]['dport']} == {443, 51234}
+    assert table.top_talkers(1) == [{'host': '10.0.0.2', 'bytes': sum(len(x) for x in FRAMES[:4])}]
+    assert table.top_ports(1)[0] == {'proto': 'TCP', 'port': 443, 'bytes': len(FRAMES[0]) + len(FRAMES[1])}
+
+    summary = pickle.loads(pickle.dumps(FlowSummary(table, size=2)))
+    assert len(summary.flows) < 5 and summary.stats() == table.stats()
+    for sort in FLOW_SORTS:
+        assert summary.top_flows(2, sort) == table.top_flows(2, sort)
+    assert summary.top_talkers(5) == table.top_talkers(2) and summary.top_ports(5) == table.top_ports(2)
+
+    # The rows of the sketch collide independently: light keys barely inflate the estimate of a heavy one.
+    sketch = TopK(k=10, width=256)
+    for i in range(5000):
+        sketch.add(i.to_bytes(4, 'big'), 1)
+        sketch.add(b'heavy', 2)
+    assert sketch.top(1)[0][0] == b'heavy' and 10000 <= sketch.top(1)[0][1] < 10050
+
+    table = FlowTable(max_flows=4, idle_timeout=10)
+    for ts, frame in enumerate(FRAMES):
+        table.update(Packet(float(ts), frame))
+    assert table.stats() == {'flows': 4, 'evicted': 1, 'packets': 6}
+    table.expire(13.5)
+    assert [x['dport'] for x in table.top_flows(10, 'last_seen')] == [5001, 50000]
+
+
+def segment(ts: float, client: bool, flags: int, seq: int, ack: int = 0, size: int = 0, window: int = 501,
+            server: str = '93.184.216.34', port: int = 51000):
+    addresses, ports = ('10.0.0.2', server), (port, 443)
+    if not client:
+        addresses, ports = addresses[::-1], ports[::-1]
+    return ts, ethernet(ipv4(*addresses, 6, tcp(*ports, flags, b'x' * size, seq, ack, window)))
+
+
+# A connection whose client sequence numbers wrap around, with a gap filled out of order, a zero window,
+# a retransmission and a FIN close; a reset connection to the same server; an idle connection to another one.
+TCP_SESSION = [
+    segment(0.000, True, 0x02, 0xffffffa0),
+    segment(0.030, False, 0x12, 5000, 0xffffffa1),
+    segment(0.031, True, 0x10, 0xffffffa1, 5001),
+    segment(0.040, True, 0x18, 0xffffffa1, 5001, 100),
+    segment(0.070, False, 0x10, 5001, 5),
+    segment(0.080, False, 0x18, 5001, 5, 100),
+    segment(0.081, False, 0x18, 5201, 5, 100),
+    segment(0.0815, False, 0x18, 5101, 5, 100),
+    segment(0.090, True, 0x10, 5, 5301, window=0),
+    segment(0.300, False, 0x18, 5001, 5, 100),
+    segment(0.400, True, 0x11, 5, 5301),
+    segment(0.430, False, 0x11, 5301, 6),
+    segment(0.431, True, 0x10, 6, 5302),
+    segment(0.500, True, 0x02, 700, port=51001),
+    segment(0.520, False, 0x14, 0, 701, port=51001),
+    segment(0.600, True, 0x18, 9000, 300, 10, server='10.0.0.9'),
+]
+
+
+def test_tcp_analyzer():
+    times, frames = zip(*TCP_SESSION)
+    analyzer = analyze_pcap(pcap(frames, times))
+    assert analyzer.stats() == {'closed': 1, 'reset': 1, 'idle': 0, 'evicted': 0, 'connections': 1, 'hosts': 1,
+                                'packets': 16}
+    first, reset = sorted(analyzer.closed, key=lambda x: x.first_seen)
+    first = first.to_dict()
+    assert (first['src'], first['sport'], first['dst'], first['dport'], first['state']) == \
+        ('10.0.0.2', 51000, '93.184.216.34', 443, 'closed')
+    assert first['handshake_rtt'] == pytest.approx(0.031, abs=1e-5)
+    assert first['rtt_samples'] == 2 and first['rtt_min'] == pytest.approx(0.01, abs=1e-5)
+    assert (first['retransmits'], first['out_of_order'], first['zero_window'], first['resets']) == (1, 1, 1, 0)
+    assert first['bytes'] == 500 and first['packets'] == 13
+    assert reset.state == 'reset' and reset.resets == 1 and reset.handshake_rtt is None
+
+    hosts = {x['host']: x for x in analyzer.top_hosts(10)}
+    assert hosts['93.184.216.34']['connections'] == 2 and hosts['93.184.216.34']['retransmits'] == 1
+    assert hosts['93.184.216.34']['resets'] == 1
+    assert hosts['10.0.0.9']['connections'] == 1 and hosts['10.0.0.9']['rtt'] is None
+    assert [x['dport'] for x in analyzer.top_connections(10, 'last_seen', closed=False)] == [443]
+
+    summary = pickle.loads(pickle.dumps(TcpSummary(analyzer, size=1)))
+    assert summary.stats() == analyzer.stats()
+    for sort in CONNECTION_SORTS:
+        for closed in (False, True):
+            assert summary.top_connections(1, sort, closed) == analyzer.top_connections(1, sort, closed)
+    for sort in HOST_SORTS:
+        assert summary.top_hosts(1, sort) == analyzer.top_hosts(1, sort)
+    analyzer.expire(1700001000.0)
+    assert analyzer.stats()['idle'] == 1 and not analyzer.connections
+
+    analyzer = TcpAnalyzer(max_connections=1)
+    for ts, frame in TCP_SESSION[:3] + TCP_SESSION[15:]:
+        analyzer.update(Packet(ts, frame))
+    assert analyzer.stats()['evicted'] == 1 and analyzer.stats()['connections'] == 1
+    assert analyzer.closed[0].state == 'evicted' and analyzer.closed[0].handshake_rtt == pytest.approx(0.031)
+
+
+def test_tcp_endpoints(monkeypatch, tmp_path):
+    from main import app
+
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+    monkeypatch.setenv('CAPTURE_DIR', str(tmp_path))
+    times, frames = zip(*TCP_SESSION)
+    (tmp_path / 'session.pcap').write_bytes(pcap(frames, times))
+    with TestClient(app) as client:
+        client.get('/eth_dump/tcp', params={'interface': 'fake5'})
+        response = client.get('/eth_dump/tcp', params={'interface': 'fake5', 'sort': 'bytes'}).json()
+        assert response['stats']['connections'] == 2 and response['connections'][0]['bytes'] == 52
+        hosts = client.get('/eth_dump/tcp/hosts', params={'interface': 'fake5'}).json()['hosts']
+        assert {x['host'] for x in hosts} == {'10.0.0.1', '::1'}
+        assert client.delete('/eth_dump/tcp', params={'interface': 'fake5'}).json()['stopped']
+
+        response = client.get('/eth_dump/tcp/offline', params={'file': 'session.pcap', 'limit': 1}).json()
+        assert response['stats']['packets'] == 16 and response['connections'][0]['retransmits'] == 1
+        assert response['hosts'][0]['host'] == '93.184.216.34'
+        assert 'error' in client.get('/eth_dump/tcp/offline', params={'file': 'missing.pcap'}).json()
+
+
+def test_flow_endpoints(monkeypatch):
+    from main import app
+
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+    with TestClient(app) as client:
+        client.get('/eth_dump/flows', params={'interface': 'fake3'})
+        response = client.get('/eth_dump/flows', params={'interface': 'fake3', 'limit': 2}).json()
+        assert response['stats']['flows'] == 5
+        assert len(response['flows']) == 2
+        ports = client.get('/eth_dump/flows/top_ports', params={'interface': 'fake3'}).json()['top_ports']
+        assert ports[0]['port'] == 443
+        assert client.delete('/eth_dump/flows', params={'interface': 'fake3'}).json()['stopped']
+
+
+def test_pcapng_round_trip_and_rotation(tmp_path):
+    data = pcapng_header(1, 65535) + b''.join(pcapng_record(1700000000.123456789, x, len(x) + 4) for x in FRAMES)
+    packets = list(decode_pcap(data))
+    assert [x.length for x in packets] == [len(x) + 4 for x in FRAMES]
+    assert abs(packets[0].ts - 1700000000.123456789) < 1e-6
+    assert packets[0].to_dict() == list(decode_pcap(pcap(FRAMES[:1])))[0].to_dict() | {'ts': packets[0].ts, 'length': packets[0].length}
+    with pytest.raises(ValueError, match='Unknown interface id 0'):
+        list(decode_pcap(pcapng_header()[:28] + pcapng_record(0.0, FRAMES[0], len(FRAMES[0]))))
+
+    writer = RotatingCaptureWriter(str(tmp_path), 'eth9', 'pcap', max_file_size=200, max_files=2)
+    for i in range(10):
+        writer.write(float(i), FRAMES[0], len(FRAMES[0]))
+    writer.close()
+    assert sorted(str(x) for x in tmp_path.iterdir()) == sorted(writer.files) and len(writer.files) == 2
+    kept = [x.ts for path in writer.files for x in decode_pcap(open(path, 'rb').read())]
+    assert 0 < len(kept) < 10 and kept == [float(x) for x in range(10 - len(kept), 10)]
+
+
+def test_record_and_offline_endpoints(monkeypatch, tmp_path):
+    from main import app
+
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+    monkeypatch.setenv('CAPTURE_DIR', str(tmp_path))
+    with TestClient(app) as client:
+        started = client.post('/eth_dump/record/start', params={'interface': 'fake4', 'format': 'pcapng', 'type': 'udp'}).json()
+        assert started['format'] == 'pcapng'
+        for _ in range(100):
+            if client.get('/eth_dump/record').json()['recorders'][0]['packets'] == 2:
+                break
+            time.sleep(0.01)
+        stopped = client.post('/eth_dump/record/stop', params={'interface': 'fake4'}).json()
+        assert stopped['packets'] == 2
+        name = stopped['files'][0]
+        assert list(client.get('/eth_dump/record').json()['files']) == [name]
+
+        records = client.get('/eth_dump/offline', params={'file': name, 'count_pkt': 0}).json()[name]
+        assert [x['dport'] for x in records] == [53, 5001]
+        records = client.get('/eth_dump/offline', params={'file': name, 'port': 5000, 'offset': 0}).json()[name]
+        assert [x['vlan'] for x in records] == [10]
+        assert client.get('/eth_dump/offline', params={'file': name, 'offset': 1, 'count_pkt': 5}).json()[name][0]['dport'] == 5001
+        assert 'error' in client.get('/eth_dump/offline', params={'file': '../etc/passwd'}).json()
+        assert 'error' in client.post('/eth_dump/record/stop', params={'interface': 'fake4'}).json()
+
+
+def test_recorder_write_error(monkeypatch, tmp_path):
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+    monkeypatch.setenv('CAPTURE_DIR', str(tmp_path / 'captures'))
+
+    async def run():
+        recorder = start_recording('fake15')
+        engine = recorder.engine
+        (tmp_path / 'captures').rmdir()
+        (tmp_path / 'captures').write_bytes(b'')
+        for _ in range(100):
+            if recorder.error is not None and recorder.engine is None:
+                break
+            await asyncio.sleep(0.01)
+        assert recorder.status()['error'] and recorder.status()['packets'] == 0
+        assert engine.taps == [] and engine.error is None
+        assert stop_recording('fake15') is recorder
+
+    asyncio.run(run())
+
+
+def test_capture_jobs(monkeypatch):
+    from main import app
+
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+    with TestClient(app) as client:
+        job = client.post('/eth_dump/jobs', params={'interface': 'fake5', 'type': 'udp', 'count_pkt': 2}).json()
+        assert job['status'] in ('queued', 'running')
+        streamed = client.get(f'/eth_dump/jobs/{job["job_id"]}/stream').text.splitlines()
+        assert [json.loads(x)['dport'] for x in streamed] == [53, 5001]
+        result = client.get(f'/eth_dump/jobs/{job["job_id"]}', params={'offset': 1}).json()
+        assert (result['status'], result['packets'], [x['dport'] for x in result['records']]) == ('done', 2, [5001])
+
+        job = client.post('/eth_dump/jobs', params={'interface': 'fake6', 'count_pkt': 0, 'timeout': 0.2}).json()
+        time.sleep(0.4)
+        result = client.get(f'/eth_dump/jobs/{job["job_id"]}').json()
+        assert (result['status'], result['packets']) == ('timeout', len(FRAMES))
+
+        jobs = [client.post('/eth_dump/jobs', params={'interface': 'fake7', 'count_pkt': 0, 'timeout': 30}).json() for _ in range(4)]
+        assert 'error' in client.post('/eth_dump/jobs', params={'interface': 'fake7'}).json()
+        assert [client.delete(f'/eth_dump/jobs/{x["job_id"]}').json()['status'] for x in jobs] == ['cancelled'] * 4
+        assert engine_module._engines['fake7'].subscribers == []
+        assert client.get('/eth_dump/jobs').json()['stats']['cancelled'] == 4
+        assert 'error' in client.get('/eth_dump/jobs/unknown').json()
+
+        assert [x['sport'] for x in client.get('/eth_dump/port', params={'interface': 'fake8', 'count_pkt': 2}).json()['fake8']] == [443, 51234]
+
+
+def test_job_scheduler(monkeypatch):
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+
+    async def run():
+        scheduler = JobScheduler(max_running=1, per_interface=1)
+        running = scheduler.submit('fake12', count_pkt=0, timeout=30)
+        queued = scheduler.submit('fake13', count_pkt=1, timeout=0.2)
+        waited = [scheduler.submit('fake12', count_pkt=1, timeout=0.2, background=False) for _ in range(3)]
+        with pytest.raises(QuotaExceeded):
+            scheduler.submit('fake12')
+        # the timeout runs from the submission, so jobs still waiting for a slot time out too
+        await asyncio.wait_for(queued.wait(), 1)
+        assert (queued.status, queued.started_at) == ('timeout', None)
+        assert [x.status for x in waited] == ['timeout'] * 3
+        running.cancel()
+        await running.wait()
+        cancelled = scheduler.submit('fake12', count_pkt=1)
+        assert cancelled.cancel() and not cancelled.cancel()
+        await cancelled.wait()
+        assert (cancelled.status, cancelled.done) == ('cancelled', True) and cancelled.finished_at is not None
+        assert scheduler.stats()['queued'] == 0
+
+        scheduler = JobScheduler(keep=60, max_jobs=3)
+        jobs = [CaptureJob('fake14', 1, PacketFilter(), False, 1.0) for _ in range(5)]
+        for i, job in enumerate(jobs):
+            job.status, job.finished_at = 'done', time.time() - (120 if i < 2 else 0)
+            scheduler.jobs[job.id] = job
+        scheduler._prune()
+        assert list(scheduler.jobs) == [x.id for x in jobs[2:]]
+        scheduler.max_jobs = 2
+        scheduler._prune()
+        assert list(scheduler.jobs) == [x.id for x in jobs[3:]]
+
+    asyncio.run(run())
+
+
+def test_packet_sampler():
+    packets = [Packet(i * 0.001, FRAMES[0]) for i in range(1000)]
+    sampler = PacketSampler(every=3)
+    assert [i for i, x in enumerate(packets[:9]) if sampler.admit(x)] == [0, 3, 6] and sampler.sampled_out == 6
+
+    sampler = PacketSampler(probability=0.25, seed=1)
+    assert 150 <= sum(sampler.admit(x) is not None for x in packets) <= 350
+
+    sampler = PacketSampler(rate=100, burst=5)
+    kept = sum(sampler.admit(x) is not None for x in packets)
+    assert 100 <= kept <= 106 and sampler.rate_limited == 1000 - kept
+
+    packet = PacketSampler(snaplen=54).admit(packets[0])
+    assert (len(packet.data), packet.length, packet.sport, packet.flags) == (54, len(FRAMES[0]), 443, 'P.')
+    assert PacketSampler().admit(packets[0]) is packets[0]
+    with pytest.raises(ValueError):
+        PacketSampler(every=0)
+
+
+def test_sampling_endpoints(monkeypatch):
+    from main import app
+
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+    with TestClient(app) as client:
+        result = client.get('/eth_dump/', params={'interface': 'fake9', 'type': 'ip', 'every': 2, 'count_pkt': 2}).json()
+        assert [x['sport'] for x in result['fake9']] == [443, 40000]
+        assert result['stats'] == {'kernel_received': 0, 'kernel_dropped': 0, 'matched': 5, 'sampled_out': 2,
+                                   'rate_limited': 0, 'queue_dropped': 0}
+
+        response = client.get('/eth_dump/stream', params={'interface': 'fake10', 'type': 'tcp', 'snaplen': 54, 'count_pkt': 1})
+        record = json.loads(response.text)
+        assert (record['sport'], record['length']) == (443, len(FRAMES[0]))
+
+        job = client.post('/eth_dump/jobs', params={'interface': 'fake11', 'count_pkt': 0, 'timeout': 0.2,
+                                                     'rate': 1, 'burst': 1}).json()
+        time.sleep(0.4)
+        result = client.get(f'/eth_dump/jobs/{job["job_id"]}').json()
+        assert (result['status'], result['packets'], result['stats']['rate_limited']) == ('timeout', 1, len(FRAMES) - 1)
+        assert client.get('/eth_dump/', params={'probability': 0}).status_code == 422
+
+
+def run_bpf(program, frame: bytes) -> int:
+    a = x = pc = 0
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        if code == 0x06:
+            return k
+        if code in (0x20, 0x28, 0x30, 0x48):
+            size = {0x20: 4, 0x28: 2, 0x30: 1, 0x48: 2}[code]
+            offset = k + (x if code == 0x48 else 0)
+            if k >= 0xfffff000:
+                a = 0
+            elif offset + size > len(frame):
+                return 0
+            else:
+                a = int.from_bytes(frame[offset:offset + size], 'big')
+        elif code == 0xb1:
+            x = 4 * (frame[k] & 0xf)
+        elif code == 0x54:
+            a &= k
+        else:
+            taken = {0x15: a == k, 0x25: a > k, 0x35: a >= k, 0x45: bool(a & k)}[code]
+            pc += jt if taken else jf
+
+
+def test_compiled_filter():
+    async def run():
+        cases = [
+            ({'proto': 'tcp'}, [0, 1, 4]),
+            ({'proto': 'ip6'}, [4]),
+            ({'and': [{'proto': 'ip'}, {'not': {'proto': 'tcp'}}]}, [2, 3, 6]),
+            ({'port': 443, 'dir': 'src'}, [0]),
+            ({'port': [50000, 60000]}, [0, 1, 4]),
+            ({'host': '8.8.8.8', 'dir': 'dst'}, [2, 3]),
+            ({'net': '10.0.0.0/31', 'dir': 'src'}, [0]),
+            ({'or': [{'proto': 'arp'}, {'and': [{'host': 'localhost'}, {'port': 8000}]}]}, [4, 5]),
+            ({'proto': 'vlan'}, [6]),
+            ({}, list(range(len(FRAMES)))),
+        ]
+        for expression, expected in cases:
+            compiled = await compile_filter(expression)
+            assert [i for i, x in enumerate(FRAMES) if compiled.match(Packet(0.0, x))] == expected, expression
+            accepted = [i for i, x in enumerate(FRAMES) if run_bpf(compiled.bpf, x)]
+            assert set(expected) <= set(accepted) <= set(expected) | {6}, expression
+        assert (await compile_filter({'proto': 'udp'}, 96)).bpf[-2] == (0x06, 0, 0, 96)
+
+    asyncio.run(run())
+
+
+def test_filter_normalize_and_cache():
+    assert normalize({'and': [{'port': 80}, {'and': [{'proto': 'tcp'}, {'port': 80}]}]}) == \
+        normalize({'and': [{'proto': 'tcp'}, {'port': [80, 80], 'dir': 'any'}]})
+    assert normalize({'not': {'not': {'proto': 'udp'}}}) == ('proto', 'udp')
+    assert normalize({'or': [{'proto': 'udp'}, {}]}) == ('true',)
+    assert normalize({'host': '::0:1'}) == ('host', 'any', '::1')
+    for expression in ({'proto': 'sctp'}, {'port': [90, 80]}, {'port': 70000}, {'net': 'x'}, {'and': []},
+                       {'host': '1.1.1.1', 'port': 1}, {'port': 1, 'dir': 'up'}, {'or': [{'port': 1}], 'dir': 'src'},
+                       {'proto': 'tcp', 'dir': 'dst'}, []):
+        with pytest.raises(ValueError):
+            normalize(expression)
+
+    async def run():
+        cache = FilterCache(maxsize=2)
+        first = await cache.get({'and': [{'proto': 'tcp'}, {'port': 80}]})
+        assert await cache.get({'and': [{'port': 80}, {'proto': 'tcp'}]}) is first
+        await cache.get({'proto': 'udp'})
+        await cache.get({'proto': 'arp'})
+        assert await cache.get({'and': [{'proto': 'tcp'}, {'port': 80}]}) is not first
+        return cache.stats()
+
+    assert asyncio.run(run()) == {'plans': 2, 'hits': 1, 'misses': 4}
+
+
+def test_bpf_filter_loopback():
+    async def run():
+        compiled = await compile_filter({'and': [{'proto': 'udp'}, {'port': 40009, 'dir': 'dst'}]})
+        engine = CaptureEngine('lo', 'af_packet', bpf=compiled.bpf)
+        engine.linger = 0
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            async with engine.subscribe() as subscription:
+                for _ in range(100):
+                    if engine.backend is not None or engine.error is not None:
+                        break
+                    await asyncio.sleep(0.01)
+                if engine.error is not None:
+                    raise engine.error
+                for port in (40008, 40009, 40010, 40009):
+                    sender.sendto(b'x', ('127.0.0.1', port))
+                packets = [await asyncio.wait_for(subscription.get(), 2) for _ in range(2)]
+                await asyncio.sleep(0.1)
+                assert subscription.queue.empty()
+        finally:
+            sender.close()
+        return [x.dport for x in packets]
+
+    try:
+        assert asyncio.run(run()) == [40009, 40009]
+    except (BackendUnavailable, PermissionError):
+        pytest.skip('AF_PACKET capture is not available')
+
+
+def test_af_packet_open_failure_releases_ring():
+    backend = AfPacketBackend('missing0')
+    try:
+        asyncio.run(backend.open())
+    except (BackendUnavailable, PermissionError):
+        pytest.skip('AF_PACKET capture is not available')
+    except OSError:
+        assert backend._ring is None and backend._sock is None
+    else:
+        pytest.fail('Opening a missing interface succeeded')
+
+
+def test_filter_endpoints(monkeypatch, tmp_path):
+    from main import app
+
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+    monkeypatch.setenv('CAPTURE_DIR', str(tmp_path))
+    (tmp_path / 'frames.pcap').write_bytes(pcap(FRAMES))
+    expression = {'or': [{'port': 53, 'dir': 'dst'}, {'net': '::1/128'}]}
+    with TestClient(app) as client:
+        records = client.post('/eth_dump/filter', params={'interface': 'fake9', 'count_pkt': 2}, json=expression).json()['fake9']
+        assert [x['dport'] for x in records] == [53, 50000]
+        streamed = client.post('/eth_dump/filter/stream', params={'interface': 'fake10', 'count_pkt': 1}, json={'proto': 'arp'})
+        assert json.loads(streamed.text)['family'] == 'ARP'
+        records = client.post('/eth_dump/filter/offline', params={'file': 'frames.pcap'}, json=expression).json()['frames.pcap']
+        assert [x['dport'] for x in records] == [53, 50000]
+        compiled = client.post('/eth_dump/filter/compile', json=expression).json()
+        assert compiled['expression'][0] == 'or' and compiled['bpf_text'][0].startswith('(000) ldh')
+        assert compiled['cache']['hits'] >= 2
+        assert 'error' in client.post('/eth_dump/filter', json={'proto': 'sctp'}).json()
+
+
+class StubDnsServer:
+    """
+    A local UDP name server answering PTR queries from a table, NXDOMAIN with a SOA record otherwise.
+    """
+
+    def __init__(self, names: dict, delay: float = 0.0, silent: bool = False):
+        self.names = names
+        self.delay = delay
+        self.silent = silent
+        self.hits = []
+        self.outstanding = self.max_outstanding = 0
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.05)
+        self.address = self.sock.getsockname()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            offset, labels = 12, []
+            while data[offset]:
+                labels.append(data[offset + 1:offset + 1 + data[offset]].decode())
+                offset += 1 + data[offset]
+            question = data[12:offset + 5]
+            name = '.'.join(labels)
+            self.hits.append(name)
+            if self.silent:
+                continue
+            qid = struct.unpack_from('!H', data)[0]
+            if name in self.names:
+                host, ttl = self.names[name]
+                rdata = b''.join(bytes([len(x)]) + x.encode() for x in host.split('.')) + b'\x00'
+                response = struct.pack('!HHHHHH', qid, 0x8180, 1, 1, 0, 0) + question
+                response += struct.pack('!HHHIH', 0xc00c, 12, 1, ttl, len(rdata)) + rdata
+            else:
+                rdata = b'\x02ns\x00\x04host\x00' + struct.pack('!5I', 1, 3600, 600, 86400, 60)
+                response = struct.pack('!HHHHHH', qid, 0x8183, 1, 0, 1, 0) + question
+                response += struct.pack('!HHHIH', 0xc00c, 6, 1, 600, len(rdata)) + rdata
+            with self.lock:
+                self.outstanding += 1
+                self.max_outstanding = max(self.max_outstanding, self.outstanding)
+            threading.Timer(self.delay, self.send, (response, addr)).start()
+
+    def send(self, response, addr):
+        with self.lock:
+            self.outstanding -= 1
+        self.sock.sendto(response, addr)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+DNS_NAMES = {
+    '4.3.2.10.in-addr.arpa': ('four.example', 120),
+    '5.3.2.10.in-addr.arpa': ('five.example', 5),
+    '1.0.0.10.in-addr.arpa': ('one.example', 120),
+    '1.' + '0.' * 31 + 'ip6.arpa': ('six.example', 120),
+}
+
+
+def test_reverse_resolver_cache_and_coalescing():
+    server = StubDnsServer(DNS_NAMES, delay=0.05)
+
+    async def run():
+        resolver = ReverseResolver([server.address], hosts={'10.0.0.7': 'seven'}, maxsize=4, min_ttl=10)
+        coalesced = await asyncio.gather(*(resolver.resolve('10.2.3.4') for _ in range(10)))
+        names = await resolver.resolve_many(['10.2.3.5', '10.9.9.9', '::1', '10.0.0.7', '10.2.3.4'])
+        return resolver, coalesced, names
+
+    try:
+        resolver, coalesced, names = asyncio.run(run())
+    finally:
+        server.close()
+    assert coalesced == ['four.example'] * 10
+    assert names == {'10.2.3.5': 'five.example', '10.9.9.9': None, '::1': 'six.example', '10.0.0.7': 'seven',
+                     '10.2.3.4': 'four.example'}
+    assert len(server.hits) == 4
+    assert resolver.stats() == {'size': 4, 'hits': 1, 'misses': 4, 'coalesced': 9, 'queries': 4, 'failures': 0}
+    now = time.monotonic()
+    assert set(resolver.cache) == {'10.2.3.4', '10.2.3.5', '10.9.9.9', '::1'}
+    assert 115 < resolver.cache['10.2.3.4'][1] - now <= 120 and 55 < resolver.cache['10.9.9.9'][1] - now <= 60
+    assert 5 < resolver.cache['10.2.3.5'][1] - now <= 10
+    assert resolver.cached('10.9.9.9') == (True, None) and resolver.cached('10.0.0.7') == (False, None)
+
+
+def test_reverse_resolver_failover_and_limits():
+    good = StubDnsServer(DNS_NAMES, delay=0.1)
+    silent = StubDnsServer({}, silent=True)
+    closed = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    closed.bind(('127.0.0.1', 0))
+    dead = closed.getsockname()
+    closed.close()
+
+    async def run():
+        resolver = ReverseResolver([dead, silent.address, good.address], hosts={}, timeout=0.2, concurrency=2)
+        names = await resolver.resolve_many(['10.2.3.4', '10.2.3.5', '10.0.0.1', '10.9.9.8'])
+        failing = ReverseResolver([silent.address], hosts={}, timeout=0.05, attempts=2, error_ttl=7)
+        return names, resolver, failing, await failing.resolve('10.2.3.4')
+
+    try:
+        names, resolver, failing, failed = asyncio.run(run())
+    finally:
+        good.close()
+        silent.close()
+    assert names == {'10.2.3.4': 'four.example', '10.2.3.5': 'five.example', '10.0.0.1': 'one.example', '10.9.9.8': None}
+    assert good.max_outstanding <= 2 and resolver.stats()['failures'] == 0
+    assert failed is None and failing.stats()['failures'] == 1 and failing.stats()['queries'] == 2
+    assert 6 < failing.cache['10.2.3.4'][1] - time.monotonic() <= 7
+
+
+def test_names_attached_after_the_fact(monkeypatch):
+    from main import app
+
+    server = StubDnsServer(DNS_NAMES)
+    monkeypatch.setattr(names_module, '_resolver', ReverseResolver([server.address], hosts={}))
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+
+    async def attach():
+        records = [{'src': '10.0.0.1', 'dst': '10.9.9.9'}, {'src': '10.0.0.1', 'dst': None}]
+        _attach_names(records)
+        before = [dict(x) for x in records]
+        await asyncio.sleep(0.2)
+        return before, records
+
+    try:
+        before, after = asyncio.run(attach())
+        assert before[0]['src_name'] is None and before[1]['dst_name'] is None
+        assert after == [{'src': '10.0.0.1', 'dst': '10.9.9.9', 'src_name': 'one.example', 'dst_name': None},
+                         {'src': '10.0.0.1', 'dst': None, 'src_name': 'one.example', 'dst_name': None}]
+        with TestClient(app) as client:
+            client.get('/eth_dump/flows', params={'interface': 'fake8'})
+            flows = client.get('/eth_dump/flows', params={'interface': 'fake8', 'dns': True}).json()['flows']
+            assert {(x['src_name'], x['dst_name']) for x in flows if x['src'] == '10.0.0.1'} == {('one.example', None)}
+            talkers = client.get('/eth_dump/flows/top_talkers', params={'interface': 'fake8', 'dns': True}).json()
+            assert {x['host']: x['host_name'] for x in talkers['top_talkers']}['10.0.0.1'] == 'one.example'
+            assert client.get('/eth_dump/dns/stats').json()['queries'] >= 3
+            client.delete('/eth_dump/flows', params={'interface': 'fake8'})
+    finally:
+        server.close()
+
+
+def test_names_added_to_timed_out_captures(monkeypatch):
+    from main import app
+
+    server = StubDnsServer(DNS_NAMES, delay=0.3)
+    monkeypatch.setattr(names_module, '_resolver', ReverseResolver([server.address], hosts={}))
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+    try:
+        with TestClient(app) as client:
+            params = {'interface': 'fake16', 'count_pkt': 5, 'dns': True, 'timeout': 0.1}
+            response = client.post('/eth_dump/filter', params=params, json={'proto': 'ip6'}).json()
+        assert response['timeout'] and response['fake16'][0]['src_name'] == 'six.example'
+    finally:
+        server.close()
@@ -0,0 +1,95 @@
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+from about_network.sampler import FIELDS
+from history import history as history_module
+from history.history import HistoryStore
+
+T0 = 1700000000
+
+
+def sample(i: int) -> dict:
+    return {x: i * 10 for x in FIELDS}
+
+
+def test_store_tiers_and_range_queries(tmp_path):
+    tiers = ((1, 1e10), (60, 1e10), (3600, 1e10))
+    store = HistoryStore(str(tmp_path), tiers, segment_records=100)
+    for i in range(1000):
+        store.append('traffic', 'eth9', T0 + i, sample(i))
+    store.append('traffic', 'eth9', T0 + 999, sample(0))
+    assert len(os.listdir(tmp_path / 'traffic' / 'eth9' / '1')) == 10
+
+    result = store.query('traffic', 'eth9', T0 + 150, T0 + 249, resolution=1)
+    assert result['segments'] == 2 and len(result['points']) == 100
+    assert result['points'][0] == {'ts': T0 + 150, **{x: 1500.0 for x in FIELDS}}
+
+    minutes = store.query('traffic', 'eth9', T0, T0 + 1000, resolution=60)['points']
+    assert [x['ts'] - T0 for x in minutes] == [39 + 60 * i for i in range(16)] + [999]
+    assert minutes[1]['bytes_sent'] == 990.0
+    assert store.resolution(T0, T0 + 1000, max_points=100, now=T0 + 1000) == 60
+    assert store.query('traffic', 'eth9', T0, T0 + 1000, max_points=10)['resolution'] == 3600
+    assert store.series() == [{'kind': 'traffic', 'name': 'eth9', 'fields': list(FIELDS), 'resolutions': [1, 60]}]
+    store.close()
+
+    with open(tmp_path / 'traffic' / 'eth9' / '1' / f'{T0 + 900}.seg', 'ab') as file:
+        file.write(b'torn')
+    store = HistoryStore(str(tmp_path), tiers, segment_records=100)
+    store.append('traffic', 'eth9', T0 + 999, sample(5))
+    store.append('traffic', 'eth9', T0 + 1000, sample(1000))
+    points = store.query('traffic', 'eth9', T0 + 990, T0 + 2000, resolution=1)['points']
+    assert [(x['ts'] - T0, x['bytes_recv']) for x in points] == [(990 + i, 9900.0 + 10 * i) for i in range(11)]
+    for method, args in (('query', ('traffic', '../etc', 0, 1)), ('append', ('packets', 'eth9', 0, {}))):
+        try:
+            getattr(store, method)(*args)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(method)
+    store.close()
+
+
+def test_store_retention_and_size_limit(tmp_path):
+    now = int(time.time())
+    store = HistoryStore(str(tmp_path), ((1, 300), (60, 1e10)), max_bytes=10 ** 9, segment_records=100)
+    for i in range(-1000, 1, 5):
+        store.append('traffic', 'eth9', now + i, sample(i))
+    kept = sorted(int(x[:-4]) for x in os.listdir(tmp_path / 'traffic' / 'eth9' / '1'))
+    assert kept[0] + 100 >= now - 300 - 100 and kept[-1] <= now
+    assert store.query('traffic', 'eth9', now - 1000, now, resolution=60)['points'][0]['ts'] <= now - 940
+
+    store.max_bytes = 1
+    for i in range(1, 300, 5):
+        store.append('traffic', 'eth9', now + i, sample(i))
+    files = [os.path.join(d, x) for d, _, names in os.walk(tmp_path) for x in names]
+    assert len(files) == 2 and all(store.writers[('traffic', 'eth9', int(os.path.basename(os.path.dirname(x))))].start ==
+                                   int(os.path.basename(x)[:-4]) for x in files)
+    store.close()
+
+
+def test_history_endpoints(monkeypatch, tmp_path):
+    from main import app
+
+    monkeypatch.setenv('HISTORY_DIR', str(tmp_path))
+    try:
+        with TestClient(app) as client:
+            recorder = history_module._recorder
+            assert recorder.store.root == str(tmp_path)
+            recorder.record()
+            assert any(x['name'] == 'lo' for x in client.get('/history/series').json()['series'])
+            store = history_module.get_history()
+            start = int(time.time()) // 60 * 60 - 120
+            for i in range(120):
+                store.append('flows', 'eth9', start + i, {'flows': i, 'packets': 2 * i, 'evicted': 0})
+            params = {'kind': 'flows', 'interface': 'eth9', 'start': start, 'end': start + 59}
+            response = client.get('/history/query', params=params).json()
+            assert response['resolution'] == 1 and len(response['points']) == 60
+            params.update({'end': start + 200, 'resolution': '1m', 'layout': 'columns'})
+            assert client.get('/history/query', params=params).json()['points']['packets'] == [118.0, 238.0]
+            assert 'error' in client.get('/history/query', params={'interface': '..', 'start': T0, 'end': T0 + 1}).json()
+            assert 'error' in client.get('/history/query', params={'start': T0 + 1, 'end': T0}).json()
+    finally:
+        history_module._recorder.stop()
+        history_module._recorder = history_module._store = None
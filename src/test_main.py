@@ -1,6 +1,9 @@
+import socket
+
 from fastapi.testclient import TestClient
 
-from main import app
+from about_network.sampler import get_sampler
+from main import app, create_app
 
 client = TestClient(app)
 
@@ -27,9 +30,20 @@ def test_about_network_get_traffic():
     response = client.get("/about_network/get_traffic",
                           params={"strg_unit": "MB"})
     assert response.status_code == 200
-    for param in ("bytes_sent", "bytes_recv", "begin_time", "end_time"):
+    # The amounts are counted from the first sample, so they may still be zero on the first request
+    for param in ("bytes_sent", "bytes_recv"):
+        assert isinstance(response.json().get(param), float)
+    for param in ("begin_time", "end_time"):
         assert response.json().get(param, None)
 
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(b"x" * 1000, ("127.0.0.1", 9))
+    get_sampler().sample()
+    response = client.get("/about_network/get_traffic",
+                          params={"interface": "lo"})
+    assert response.status_code == 200
+    assert response.json()["bytes_sent"] >= 1000
+
 
 def test_about_network_get_traffic_with_bad_params():
     response = client.get("/about_network/get_traffic",
@@ -50,3 +64,10 @@ def test_eth_dump_extended():
 def test_eth_dump_bad_params():
     response = client.get("/eth_dump/get_traffic", params={"strg_unit": "asB"})
     assert response.status_code == 404
+
+
+def test_create_app_with_subsystems():
+    counters = TestClient(create_app(["counters"]))
+    assert counters.get("/about_network/get_interfaces").status_code == 200
+    assert counters.get("/eth_dump/port").status_code == 404
+    assert counters.post("/ping", params={"res": "localhost"}).status_code == 404
@@ -0,0 +1,38 @@
+import gzip
+
+from fastapi.testclient import TestClient
+
+from about_network.sampler import FIELDS, TrafficSampler, TrafficSeries
+from metrics.metrics import MetricsExporter, render_metric
+
+
+def test_render_metric():
+    lines = render_metric('x_total', 'counter', 'Help.', [({'interface': 'a"b\\'}, 3.0), ({}, 0.5)])
+    assert lines == ['# HELP x_total Help.', '# TYPE x_total counter', 'x_total{interface="a\\"b\\\\"} 3', 'x_total 0.5']
+
+
+def test_exporter_caches_body():
+    sampler = TrafficSampler(capacity=4)
+    sampler.series['eth9'] = TrafficSeries(4)
+    sampler.series['eth9'].append(1000.0, {x: i * 10 for i, x in enumerate(FIELDS)})
+    exporter = MetricsExporter(sampler=sampler)
+    assert exporter.render() == b''
+    body = exporter.collect().decode()
+    assert 'netmon_network_transmit_bytes_total{interface="eth9"} 0\n' in body
+    assert 'netmon_network_receive_drop_total{interface="eth9"} 60\n' in body
+    assert '# TYPE netmon_sockets gauge\n' in body
+    assert exporter.render() is exporter.render()
+    assert gzip.decompress(exporter.render(gzipped=True)).decode() == body
+
+
+def test_metrics_endpoint():
+    from main import app
+
+    with TestClient(app) as client:
+        response = client.get('/metrics')
+        assert response.headers['content-type'] == 'text/plain; version=0.0.4; charset=utf-8'
+        assert response.headers['content-encoding'] == 'gzip'
+        assert '# TYPE netmon_network_receive_bytes_total counter' in response.text
+        plain = client.get('/metrics', headers={'Accept-Encoding': 'identity'})
+        assert 'content-encoding' not in plain.headers
+        assert 'netmon_metrics_collect_seconds' in plain.text
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+from main import app
+from ping.icmp import IcmpProber, checksum
+from ping.ping import parse_ping_output
+from ping.trace import PathProber
+
+client = TestClient(app)
+
+PING_OUTPUT = """PING 8.8.8.8 (8.8.8.8) 56(84) bytes of data.
+64 bytes from 8.8.8.8: icmp_seq=1 ttl=117 time=11.2 ms
+64 bytes from 8.8.8.8: icmp_seq=3 ttl=117 time=12.9 ms
+
+--- 8.8.8.8 ping statistics ---
+3 packets transmitted, 2 received, 33.3333% packet loss, time 2003ms
+rtt min/avg/max/mdev = 11.214/12.057/12.901/0.843 ms
+"""
+
+
+def test_parse_ping_output():
+    assert parse_ping_output(PING_OUTPUT) == {
+        'transmitted': 3, 'received': 2, 'loss': 33.3,
+        'min': 11.214, 'avg': 12.057, 'max': 12.901, 'mdev': 0.843,
+    }
+    assert parse_ping_output('ping: unknown host') == {'error': 'Unable to parse ping output'}
+
+
+def test_checksum():
+    assert checksum(b'\x08\x00\x00\x00\x00\x01\x00\x01') == 0xf7fd
+
+
+def test_icmp_prober_loopback():
+    try:
+        result = asyncio.run(IcmpProber().ping({'localhost': '127.0.0.1'}, count=3, interval=0.01))
+    except PermissionError:
+        pytest.skip('ICMP sockets are not permitted')
+    assert result['localhost']['received'] == 3
+    assert result['localhost']['loss'] == 0.0
+    assert result['localhost']['min'] <= result['localhost']['avg'] <= result['localhost']['max']
+
+
+def test_ping_batch_icmp():
+    response = client.post(
+        '/ping/batch', params={'prober': 'icmp', 'count_pkt': 1},
+        json={'hosts': ['127.0.0.1', 'http://127.0.0.2/path', 'invalid.invalid']}
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert list(result) == ['127.0.0.1', '127.0.0.2', 'invalid.invalid']
+    assert result['invalid.invalid'] == {'error': 'Unable to resolve host'}
+
+
+def test_path_prober_loopback():
+    async def probe():
+        async with PathProber() as prober:
+            return await prober.trace({'v4': '127.0.0.1', 'v6': '::1'}), await prober.path_mtu({'v4': '127.0.0.1'})
+
+    try:
+        traces, mtus = asyncio.run(probe())
+    except OSError as error:
+        pytest.skip(f'UDP probes are not available: {error}')
+    for host, address in (('v4', '127.0.0.1'), ('v6', '::1')):
+        assert traces[host]['reached'] and len(traces[host]['hops']) == 1
+        hop = traces[host]['hops'][0]
+        assert (hop['ttl'], hop['address'], hop['received'], hop['loss']) == (1, address, 3, 0.0)
+    assert mtus['v4']['mtu'] == 65535
+
+
+def test_trace_endpoint():
+    params = {'max_hops': 4, 'queries': 1, 'timeout': 0.5}
+    body = {'hosts': ['127.0.0.3', 'invalid.invalid']}
+    first = client.post('/ping/trace', params=dict(params, refresh=True), json=body).json()
+    assert first['invalid.invalid'] == {'error': 'Unable to resolve host'}
+    assert first['127.0.0.3']['reached'] and not first['127.0.0.3']['cached']
+    second = client.post('/ping/trace', params=params, json=body).json()
+    assert second['127.0.0.3']['cached'] and second['127.0.0.3']['hops'] == first['127.0.0.3']['hops']
+
+
+NAMESPACE_SCRIPT = """
+import asyncio, json, sys
+from ping.trace import PathProber
+
+async def probe():
+    async with PathProber() as prober:
+        targets = {'server': sys.argv[1]}
+        return await prober.trace(targets, max_hops=8), await prober.path_mtu(targets, max_hops=8)
+
+print(json.dumps(asyncio.run(probe())))
+"""
+
+
+@pytest.fixture
+def namespaces():
+    # client (10.77.1.1) -- (10.77.1.2) router (10.77.2.1) -- server (10.77.2.2), with an MTU of 1400 on the second link
+    if os.geteuid() != 0 or shutil.which('ip') is None:
+        pytest.skip('Network namespaces need root and iproute2')
+    names = [f'nm{os.getpid()}{x}' for x in ('c', 'r', 's')]
+    client_ns, router_ns, server_ns = names
+    commands = [
+        *(['ip', 'netns', 'add', x] for x in names),
+        ['ip', 'link', 'add', 'veth-c', 'netns', client_ns, 'type', 'veth', 'peer', 'veth-rc', 'netns', router_ns],
+        ['ip', 'link', 'add', 'veth-s', 'netns', server_ns, 'mtu', '1400', 'type', 'veth',
+         'peer', 'veth-rs', 'netns', router_ns, 'mtu', '1400'],
+        ['ip', '-n', client_ns, 'addr', 'add', '10.77.1.1/24', 'dev', 'veth-c'],
+        ['ip', '-n', router_ns, 'addr', 'add', '10.77.1.2/24', 'dev', 'veth-rc'],
+        ['ip', '-n', router_ns, 'addr', 'add', '10.77.2.1/24', 'dev', 'veth-rs'],
+        ['ip', '-n', server_ns, 'addr', 'add', '10.77.2.2/24', 'dev', 'veth-s'],
+        *(['ip', '-n', x, 'link', 'set', y, 'up'] for x, y in (
+            (client_ns, 'lo'), (client_ns, 'veth-c'), (router_ns, 'lo'), (router_ns, 'veth-rc'),
+            (router_ns, 'veth-rs'), (server_ns, 'lo'), (server_ns, 'veth-s'),
+        )),
+        ['ip', '-n', client_ns, 'route', 'add', 'default', 'via', '10.77.1.2'],
+        ['ip', '-n', server_ns, 'route', 'add', 'default', 'via', '10.77.2.1'],
+        ['ip', 'netns', 'exec', router_ns, 'sysctl', '-qw', 'net.ipv4.ip_forward=1'],
+        *(['ip', 'netns', 'exec', x, 'sysctl', '-qw', 'net.ipv4.icmp_ratelimit=0'] for x in (router_ns, server_ns)),
+    ]
+    try:
+        for command in commands:
+            subprocess.run(command, check=True, capture_output=True)
+    except subprocess.CalledProcessError as error:
+        for name in names:
+            subprocess.run(['ip', 'netns', 'del', name], capture_output=True)
+        pytest.skip(f'Network namespaces are not available: {error.stderr.decode().strip()}')
+    try:
+        yield client_ns
+    finally:
+        for name in names:
+            subprocess.run(['ip', 'netns', 'del', name], capture_output=True)
+
+
+def test_path_prober_namespaces(namespaces):
+    process = subprocess.run(
+        ['ip', 'netns', 'exec', namespaces, sys.executable, '-c', NAMESPACE_SCRIPT, '10.77.2.2'],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    traces, mtus = json.loads(process.stdout)
+    trace = traces['server']
+    assert trace['reached']
+    assert [x['address'] for x in trace['hops']] == ['10.77.1.2', '10.77.2.2']
+    assert all(x['received'] == 3 for x in trace['hops'])
+    assert (mtus['server']['mtu'], mtus['server']['reported'], mtus['server']['reported_by']) == (1400, 1400, '10.77.1.2')
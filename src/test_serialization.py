@@ -0,0 +1,56 @@
+import datetime
+import gzip
+import json
+
+from collections import namedtuple
+
+from fastapi.testclient import TestClient
+
+from eth_dump import engine as engine_module
+from serialization.serialization import FastJSONResponse, accepted_encodings, columnar, compress, dumps
+from test_eth_dump import FRAMES, FakeEngine, pcap
+
+
+def test_dumps_matches_json():
+    Address = namedtuple('Address', 'family address')
+    content = {'a': [1, 2.5, None, True], 'b': {'c': 'é'}, 'when': datetime.datetime(2023, 5, 1, 12, 0), 'addr': Address(2, '::1')}
+    assert json.loads(dumps(content)) == {
+        'a': [1, 2.5, None, True], 'b': {'c': 'é'}, 'when': '2023-05-01T12:00:00', 'addr': [2, '::1'],
+    }
+    assert json.loads(dumps({'big': 2 ** 70})) == {'big': 2 ** 70}
+
+
+def test_columnar_and_compression():
+    content = {'eth0': [{'a': 1, 'b': 2}, {'a': 3, 'c': 4}], 'empty': [], 'n': 1}
+    assert columnar(content) == {'eth0': {'a': [1, 3], 'b': [2, None], 'c': [None, 4]}, 'empty': [], 'n': 1}
+    assert columnar([1, 2]) == [1, 2]
+
+    assert accepted_encodings('gzip;q=0, br, ZSTD ;q=0.5') == ['br', 'zstd']
+    body = dumps(content) * 100
+    assert compress(body, 'gzip', len(body) + 1) == (body, None)
+    assert compress(body, 'br', 0) == (body, None)
+    compressed, encoding = compress(body, 'gzip, deflate', 0)
+    assert encoding == 'gzip' and gzip.decompress(compressed) == body
+
+    response = FastJSONResponse(content, layout='columns', accept_encoding='gzip', min_size=0)
+    assert response.headers['content-encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.body)) == columnar(content)
+
+
+def test_fast_json_routes(monkeypatch, tmp_path):
+    from main import app
+
+    monkeypatch.setattr(engine_module, 'CaptureEngine', FakeEngine)
+    monkeypatch.setenv('CAPTURE_DIR', str(tmp_path))
+    monkeypatch.setenv('RESPONSE_COMPRESS_MIN_SIZE', '64')
+    (tmp_path / 'frames.pcap').write_bytes(pcap(FRAMES))
+    client = TestClient(app)
+    response = client.get('/eth_dump/offline', params={'file': 'frames.pcap', 'type': 'udp', 'layout': 'columns'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.json()['frames.pcap']['dport'] == [53, 5001]
+    plain = client.get('/eth_dump/offline', params={'file': 'frames.pcap', 'type': 'udp'}, headers={'accept-encoding': 'identity'})
+    assert 'content-encoding' not in plain.headers
+    assert [x['dport'] for x in plain.json()['frames.pcap']] == [53, 5001]
+    assert client.get('/eth_dump/offline', params={'file': 'x', 'layout': 'rows'}).status_code == 422
+    assert 'layout' in [x['name'] for x in app.openapi()['paths']['/about_network/connections']['get']['parameters']]
+    assert client.get('/metrics').headers['content-type'].startswith('text/plain')